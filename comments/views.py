@@ -67,9 +67,18 @@ class CommentViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """
-        Crée un nouveau commentaire
+        Crée un nouveau commentaire et prévient le propriétaire du projet, ou
+        l'auteur du commentaire parent pour une réponse
         """
-        serializer.save()
+        from notifications.utils import create_comment_notification, create_reply_notification
+
+        comment = serializer.save()
+        project = comment.project
+        if comment.parent_id:
+            if comment.parent.author_id != comment.author_id:
+                create_reply_notification(comment.parent.author, comment.author, project, comment)
+        elif project.owner_id != comment.author_id:
+            create_comment_notification(project.owner, comment.author, project, comment)
     
     def perform_update(self, serializer):
         """
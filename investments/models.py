@@ -2,6 +2,7 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models, transaction
+from django.db.models import F
 from djmoney.models.fields import MoneyField
 from projects.models import Project
 from users.models import User
@@ -35,6 +36,10 @@ class Investment(models.Model):
     transaction = models.OneToOneField('Transaction', on_delete=models.SET_NULL, null=True, blank=True, related_name='investment_transaction')
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Historique par investisseur et par période (exports)
+            models.Index(fields=['user', 'created_at'], name='investment_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.project.title} - {self.amount}"
@@ -45,9 +50,13 @@ class Investment(models.Model):
             from django.utils import timezone
             self.completed_at = timezone.now()
             
-            # Mettre à jour le montant collecté du projet
-            self.project.amount_raised += self.amount
-            self.project.save()
+            # Mettre à jour le montant collecté du projet par un UPDATE atomique :
+            # une lecture-modification-écriture perdrait les investissements concurrents
+            Project.objects.filter(pk=self.project_id).update(
+                amount_raised=F('amount_raised') + self.amount,
+                updated_at=timezone.now()
+            )
+            self.project.refresh_from_db(fields=['amount_raised', 'updated_at'])
         
         super().save(*args, **kwargs)
 
@@ -81,6 +90,12 @@ class Transaction(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     description = models.TextField(blank=True)
     
+    class Meta:
+        indexes = [
+            # Historique par utilisateur et par période (exports)
+            models.Index(fields=['user', 'created_at'], name='transaction_user_created_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.transaction_type} de {self.amount} pour {self.user.username}"
 
@@ -1,3 +1,102 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db.models import QuerySet
 from django.test import TestCase
+from django.utils import timezone
+from projects.models import Project
+from rest_framework.test import APIClient
+from users.models import User
+
+from .models import Investment, Transaction
+
+
+class HistoryExportTests(TestCase):
+    """
+    Export en flux de l'historique des investissements et des transactions
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='investisseur', email='investisseur@example.com')
+        self.other = User.objects.create(username='autre', email='autre@example.com')
+        owner = User.objects.create(username='porteur', email='porteur@example.com')
+        self.project = Project.objects.create(
+            title='Projet', owner=owner, funding_type='equity', amount_needed=Decimal('1000.00'), status='active'
+        )
+        for day, amount in ((1, '10.00'), (2, '20.00'), (3, '30.00')):
+            self._investment(self.user, amount, day)
+        self._investment(self.other, '99.00', 2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _investment(self, user, amount, day):
+        investment = Investment.objects.create(
+            user=user, project=self.project, amount=Decimal(amount), payment_method='wallet'
+        )
+        Investment.objects.filter(pk=investment.pk).update(
+            created_at=timezone.make_aware(datetime(2026, 3, day, 12))
+        )
+        return investment
+
+    def _content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_export(self):
+        response = self.client.get('/api/investments/export/')
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('investissements.csv', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(self._content(response))))
+        self.assertEqual([row['amount'] for row in rows], ['10.00', '20.00', '30.00'])
+        self.assertEqual(rows[0]['project__title'], 'Projet')
+
+    def test_ndjson_export_with_date_bounds(self):
+        response = self.client.get('/api/investments/export/', {
+            'output': 'ndjson', 'start': '2026-03-02', 'end': '2026-03-02',
+        })
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in self._content(response).splitlines()]
+        self.assertEqual([line['amount'] for line in lines], ['20.00'])
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/investments/export/', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/investments/export/', {'start': '02/03/2026'}).status_code, 400)
+
+    def test_rows_are_streamed_in_chunks_from_an_iterator(self):
+        iterator = QuerySet.iterator
+        chunk_sizes = []
+
+        def spy(queryset, chunk_size=None):
+            chunk_sizes.append(chunk_size)
+            return iterator(queryset, chunk_size=chunk_size)
+
+        with mock.patch('investments.utils.EXPORT_CHUNK_SIZE', 2), mock.patch.object(QuerySet, 'iterator', spy):
+            response = self.client.get('/api/investments/export/')
+            chunks = list(response.streaming_content)
+
+        self.assertEqual(chunk_sizes, [2])
+        # En-tête et deux lignes, puis la dernière ligne
+        self.assertEqual(len(chunks), 2)
+
+    def test_transactions_export(self):
+        Transaction.objects.create(user=self.user, transaction_type='deposit', amount=Decimal('5.00'))
+        Transaction.objects.create(user=self.other, transaction_type='deposit', amount=Decimal('7.00'))
+
+        response = self.client.get('/api/investments/transactions/export/', {'output': 'ndjson'})
+
+        lines = [json.loads(line) for line in self._content(response).splitlines()]
+        self.assertEqual([line['amount'] for line in lines], ['5.00'])
+
+    def test_export_requires_authentication_and_is_scoped_to_the_user(self):
+        self.assertEqual(APIClient().get('/api/investments/export/').status_code, 401)
 
-# Create your tests here.
+        client = APIClient()
+        client.force_authenticate(self.other)
+        rows = list(csv.DictReader(io.StringIO(self._content(client.get('/api/investments/export/')))))
+        self.assertEqual([row['amount'] for row in rows], ['99.00'])
@@ -1,7 +1,20 @@
 # investments/utils.py
+import csv
+import datetime
+import io
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models import Sum, F, Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.response import Response
+
 from .models import Transaction
 
+EXPORT_CHUNK_SIZE = 2000
+
 def calculate_user_balance(user):
     """
     Calcule le solde d'un utilisateur
@@ -109,4 +122,83 @@ def update_project_owner_stats(user):
         user.project_owner_profile.balance = calculate_user_balance(user)
         user.project_owner_profile.save(update_fields=['active_campaigns', 'funded_projects', 'balance'])
     
-    return user
\ No newline at end of file
+    return user
+
+def _iter_csv(rows, columns):
+    """
+    Produit le CSV par blocs de EXPORT_CHUNK_SIZE lignes plutôt que ligne par ligne
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for index, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if index % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _iter_ndjson(rows, columns):
+    encoder = DjangoJSONEncoder()
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(columns, row))))
+        if len(lines) == EXPORT_CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def stream_history_export(request, queryset, columns, filename, date_field='created_at'):
+    """
+    Exporte un historique en CSV ou NDJSON sous forme de flux
+
+    Les lignes sont lues avec values_list().iterator(chunk_size=...) et écrites
+    au fil de l'eau : la mémoire reste constante quelle que soit la taille de
+    l'historique.
+
+    Paramètres de requête:
+        output: 'csv' (défaut) ou 'ndjson'
+        start, end: bornes inclusives au format AAAA-MM-JJ sur `date_field`
+    """
+    output = request.query_params.get('output', 'csv')
+    if output not in ('csv', 'ndjson'):
+        return Response(
+            {"detail": "Le paramètre 'output' doit valoir 'csv' ou 'ndjson'."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    bounds = {}
+    for param in ('start', 'end'):
+        value = request.query_params.get(param)
+        if value:
+            try:
+                parsed = parse_date(value)
+            except ValueError:
+                parsed = None
+            if parsed is None:
+                return Response(
+                    {"detail": f"Le paramètre '{param}' doit être au format AAAA-MM-JJ."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            bounds[param] = parsed
+
+    # Bornes converties en datetimes pour conserver l'usage de l'index sur `date_field`
+    if 'start' in bounds:
+        start = timezone.make_aware(datetime.datetime.combine(bounds['start'], datetime.time.min))
+        queryset = queryset.filter(**{f'{date_field}__gte': start})
+    if 'end' in bounds:
+        end = timezone.make_aware(datetime.datetime.combine(bounds['end'] + datetime.timedelta(days=1), datetime.time.min))
+        queryset = queryset.filter(**{f'{date_field}__lt': end})
+
+    rows = queryset.order_by(date_field, 'id').values_list(*columns).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if output == 'csv':
+        response = StreamingHttpResponse(_iter_csv(rows, columns), content_type='text/csv; charset=utf-8')
+        extension = 'csv'
+    else:
+        response = StreamingHttpResponse(_iter_ndjson(rows, columns), content_type='application/x-ndjson')
+        extension = 'ndjson'
+
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    return response
@@ -12,8 +12,18 @@ from .permissions import IsInvestmentParticipant, IsTransactionOwner
 from .serializers import (DepositSerializer, InvestmentCreateSerializer,
                           InvestmentSerializer, TransactionSerializer,
                           WithdrawalSerializer)
-from .utils import (calculate_user_balance, update_project_amount_raised,
-                    update_project_owner_stats, update_user_investment_stats)
+from .utils import (calculate_user_balance, stream_history_export,
+                    update_project_amount_raised, update_project_owner_stats,
+                    update_user_investment_stats)
+
+INVESTMENT_EXPORT_COLUMNS = (
+    'id', 'created_at', 'completed_at', 'project_id', 'project__title', 'amount',
+    'commission_amount', 'status', 'payment_method', 'payment_intent_id',
+)
+TRANSACTION_EXPORT_COLUMNS = (
+    'id', 'created_at', 'completed_at', 'transaction_type', 'status', 'amount',
+    'reference_id', 'investment_id', 'description',
+)
 
 
 class InvestmentViewSet(viewsets.ModelViewSet):
@@ -191,6 +201,14 @@ class InvestmentViewSet(viewsets.ModelViewSet):
         
         return Response({"status": "Investissement confirmé avec succès."})
     
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Exporte l'historique complet des investissements de l'utilisateur (CSV ou NDJSON)
+        """
+        queryset = Investment.objects.filter(user=request.user)
+        return stream_history_export(request, queryset, INVESTMENT_EXPORT_COLUMNS, 'investissements')
+    
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """
@@ -325,6 +343,14 @@ class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
         
         return Response(TransactionSerializer(transaction, context={'request': request}).data)
     
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Exporte l'historique complet des transactions de l'utilisateur (CSV ou NDJSON)
+        """
+        queryset = Transaction.objects.filter(user=request.user)
+        return stream_history_export(request, queryset, TRANSACTION_EXPORT_COLUMNS, 'transactions')
+    
     @action(detail=False, methods=['get'])
     def balance(self, request):
         """
@@ -0,0 +1,36 @@
+# loadtest/database.py
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection, connections
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+
+@contextmanager
+def throwaway_database(name, keepdb=False):
+    """
+    Crée une base de test jetable pour la durée d'un test de charge
+
+    Avec SQLite, la base est un fichier (partageable entre threads et processus)
+    et les transactions IMMEDIATE attendent le verrou d'écriture au lieu d'échouer.
+    Comme avec le lanceur de tests de Django, DEBUG est désactivé : journal des
+    requêtes SQL et barre de débogage fausseraient les mesures.
+    """
+    setup_test_environment(debug=False)
+    settings_dict = connection.settings_dict
+    if connection.vendor == 'sqlite':
+        settings_dict['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), f'{name}.sqlite3')
+        settings_dict['OPTIONS'].setdefault('timeout', 30)
+        settings_dict['OPTIONS'].setdefault('transaction_mode', 'IMMEDIATE')
+    old_name = settings_dict['NAME']
+    connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb
+    )
+    try:
+        yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
@@ -0,0 +1,60 @@
+# loadtest/mail.py
+import threading
+import time
+
+from django.core.mail.backends.locmem import EmailBackend
+
+
+class SlowEmailBackend(EmailBackend):
+    """
+    Backend email en mémoire qui simule le coût d'un serveur SMTP
+
+    Chaque ouverture de connexion coûte `connect_latency` (connexion et
+    négociation TLS), chaque message `send_latency`. Comme le backend SMTP,
+    send_messages ouvre et referme lui-même la connexion si elle n'est pas
+    déjà ouverte ; les compteurs de classe mesurent connexions et messages.
+    """
+    connect_latency = 0.3
+    send_latency = 0.02
+    opened = 0
+    sent = 0
+    _counter_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._connected = False
+
+    @classmethod
+    def reset(cls, connect_latency=None, send_latency=None):
+        if connect_latency is not None:
+            cls.connect_latency = connect_latency
+        if send_latency is not None:
+            cls.send_latency = send_latency
+        with cls._counter_lock:
+            cls.opened = cls.sent = 0
+
+    def open(self):
+        if self._connected:
+            return False
+        time.sleep(self.connect_latency)
+        with self._counter_lock:
+            SlowEmailBackend.opened += 1
+        self._connected = True
+        return True
+
+    def close(self):
+        self._connected = False
+
+    def send_messages(self, messages):
+        if not messages:
+            return 0
+        new_connection = self.open()
+        try:
+            time.sleep(self.send_latency * len(messages))
+            count = super().send_messages(messages)
+            with self._counter_lock:
+                SlowEmailBackend.sent += count
+            return count
+        finally:
+            if new_connection:
+                self.close()
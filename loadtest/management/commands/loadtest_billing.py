@@ -0,0 +1,142 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from loadtest.database import throwaway_database
+from payments.models import Invoice
+from payments.utils import mark_overdue_invoices
+from subscriptions.models import Subscription, SubscriptionPlan
+from subscriptions.utils import bill_subscription_renewals
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure les jobs de facturation (factures en retard, renouvellements d'abonnements) "
+        "sur une base de test jetable volumineuse : durée, lignes, lots et requêtes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--invoices', type=int, default=300000)
+        parser.add_argument('--subscriptions', type=int, default=50000)
+        parser.add_argument('--overdue-chunk', type=int, default=5000)
+        parser.add_argument('--renewal-chunk', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        with throwaway_database('loadtest_billing', keepdb=options['keepdb']):
+            summary = self._run(options)
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+
+    def _run(self, options):
+        expected = self._seed(options)
+        summary = {'seed': expected, 'jobs': {}}
+        jobs = (
+            ('overdue', lambda: mark_overdue_invoices(chunk_size=options['overdue_chunk'])),
+            ('renewals', lambda: bill_subscription_renewals(chunk_size=options['renewal_chunk'])),
+        )
+        # Deuxième passe : les jobs doivent être rejouables sans effet
+        for run in ('first', 'replay'):
+            for name, job in jobs:
+                self.stdout.write(f"Job {name} ({run})...")
+                with CaptureQueriesContext(connection) as queries:
+                    result = job()
+                result['queries'] = len(queries)
+                result['rows_per_s'] = result['rows'] / result['elapsed_s'] if result['elapsed_s'] else 0.0
+                summary['jobs'][f"{name}.{run}"] = result
+
+        summary['check'] = {
+            'overdue': Invoice.objects.filter(status='overdue').count(),
+            'renewal_invoices': Invoice.objects.filter(related_object_type='subscription_renewal').count(),
+        }
+        return summary
+
+    def _seed(self, options):
+        """
+        Crée des utilisateurs, des factures (un tiers échues) et des abonnements
+        (la moitié à renouveler dans la semaine)
+        """
+        prefix = f"lt{int(time.time())}"
+        password = make_password(None)
+        User.objects.bulk_create([
+            User(
+                username=f"{prefix}_billed_{index}",
+                email=f"{prefix}_billed_{index}@loadtest.local",
+                user_type='investor',
+                password=password
+            )
+            for index in range(options['users'])
+        ])
+        user_ids = list(User.objects.filter(username__startswith=f"{prefix}_billed_").values_list('id', flat=True))
+        plan = SubscriptionPlan.objects.create(
+            name='Premium', plan_type='premium_investor', price=Decimal('19.90'),
+            duration_days=30, description='Test de charge'
+        )
+
+        self.stdout.write(f"Création de {options['invoices']} factures et {options['subscriptions']} abonnements...")
+        started = time.perf_counter()
+        today = timezone.localdate()
+        statuses = ('sent', 'paid', 'sent', 'cancelled', 'sent', 'paid')
+        expected_overdue = 0
+        for offset in range(0, options['invoices'], options['batch_size']):
+            batch = []
+            for index in range(offset, min(offset + options['batch_size'], options['invoices'])):
+                status = statuses[index % len(statuses)]
+                due_date = today + timedelta(days=index % 90 - 45)
+                expected_overdue += status == 'sent' and due_date < today
+                batch.append(Invoice(
+                    user_id=user_ids[index % len(user_ids)],
+                    invoice_number=f"{prefix}-{index}",
+                    amount=Decimal(10 + index % 490),
+                    description='Test de charge',
+                    status=status,
+                    issue_date=due_date - timedelta(days=7),
+                    due_date=due_date
+                ))
+            Invoice.objects.bulk_create(batch)
+
+        now = timezone.now()
+        expected_renewals = 0
+        for offset in range(0, options['subscriptions'], options['batch_size']):
+            batch = []
+            for index in range(offset, min(offset + options['batch_size'], options['subscriptions'])):
+                end_date = now + timedelta(days=index % 14, hours=1)
+                auto_renew = index % 4 != 0
+                expected_renewals += auto_renew and index % 14 < 7
+                batch.append(Subscription(
+                    user_id=user_ids[index % len(user_ids)],
+                    plan=plan,
+                    status='active',
+                    start_date=end_date - timedelta(days=30),
+                    end_date=end_date,
+                    auto_renew=auto_renew
+                ))
+            Subscription.objects.bulk_create(batch)
+        self.stdout.write(f"  données créées en {time.perf_counter() - started:.1f}s")
+        return {'overdue': expected_overdue, 'renewals': expected_renewals}
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        for name, result in summary['jobs'].items():
+            self.stdout.write(
+                f"  {name:<16} {result['rows']:>8} lignes  {result['chunks']:>4} lots  "
+                f"{result['queries']:>5} requêtes  {result['elapsed_s']:7.2f}s  {result['rows_per_s']:10.0f} lignes/s"
+            )
+        self.stdout.write(
+            f"Attendu : {summary['seed']['overdue']} en retard, {summary['seed']['renewals']} renouvellements - "
+            f"constaté : {summary['check']['overdue']} en retard, {summary['check']['renewal_invoices']} factures de renouvellement"
+        )
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import time
+
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from loadtest.database import throwaway_database
+from loadtest.metrics import percentile
+from messaging.models import Conversation, Message
+from messaging.routing import websocket_urlpatterns
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le débit de la messagerie WebSocket dans un seul processus ASGI, avec la couche "
+        "de messages en mémoire : connexions simultanées, messages enregistrés et livrés par "
+        "seconde, latence entre l'envoi et l'accusé (message enregistré puis diffusé)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=100,
+                            help="Conversations à deux participants (deux connexions chacune)")
+        parser.add_argument('--messages', type=int, default=20,
+                            help="Messages envoyés par connexion")
+        parser.add_argument('--timeout', type=float, default=30,
+                            help="Attente maximale d'un événement (secondes)")
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 10000}}}
+        with throwaway_database('loadtest_chat'), override_settings(CHANNEL_LAYERS=layers):
+            pairs = self._seed(options)
+            summary = asyncio.run(self._run(pairs, options))
+            summary['persisted'] = Message.objects.count()
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+        expected = summary['sockets'] * options['messages']
+        if summary['persisted'] != expected:
+            raise CommandError(f"{summary['persisted']} messages enregistrés sur {expected} envoyés.")
+
+    def _seed(self, options):
+        prefix = f"lt{int(time.time())}"
+        password = make_password(None)
+        User.objects.bulk_create([
+            User(
+                username=f"{prefix}_chat_{index}", email=f"{prefix}_chat_{index}@loadtest.local",
+                user_type='investor' if index % 2 else 'project_owner', password=password
+            )
+            for index in range(options['conversations'] * 2)
+        ])
+        users = list(User.objects.filter(username__startswith=f"{prefix}_chat_").order_by('pk'))
+        conversations = Conversation.objects.bulk_create([Conversation() for _ in range(options['conversations'])])
+        pairs = [(conversation, users[2 * index], users[2 * index + 1]) for index, conversation in enumerate(conversations)]
+        Membership = Conversation.participants.through
+        Membership.objects.bulk_create([
+            Membership(conversation=conversation, user=user)
+            for conversation, first, second in pairs for user in (first, second)
+        ])
+        return pairs
+
+    async def _run(self, pairs, options):
+        application = URLRouter(websocket_urlpatterns)
+        timeout = options['timeout']
+
+        self.stdout.write(f"Ouverture de {len(pairs) * 2} connexions...")
+        sockets = []
+        started = time.perf_counter()
+        for conversation, *participants in pairs:
+            for user in participants:
+                communicator = ApplicationCommunicator(application, {
+                    'type': 'websocket', 'path': f"/ws/messaging/{conversation.pk}/",
+                    'headers': [], 'subprotocols': [], 'user': user,
+                })
+                await communicator.send_input({'type': 'websocket.connect'})
+                sockets.append((communicator, user))
+        for communicator, _ in sockets:
+            response = await communicator.receive_output(timeout)
+            if response['type'] != 'websocket.accept':
+                raise CommandError(f"Connexion refusée : {response}")
+        connect_s = time.perf_counter() - started
+
+        self.stdout.write(f"Envoi de {options['messages']} messages par connexion...")
+        latencies = []
+        deliveries = [0]
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            self._chat(communicator, user, options['messages'], latencies, deliveries, timeout)
+            for communicator, user in sockets
+        ])
+        elapsed = time.perf_counter() - started
+
+        for communicator, _ in sockets:
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(timeout)
+
+        latencies.sort()
+        sent = len(latencies)
+        return {
+            'conversations': len(pairs),
+            'sockets': len(sockets),
+            'connect_s': connect_s,
+            'sent': sent,
+            'elapsed_s': elapsed,
+            'messages_per_s': sent / elapsed if elapsed else 0.0,
+            'deliveries': deliveries[0],
+            'deliveries_per_s': deliveries[0] / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        }
+
+    async def _chat(self, communicator, user, count, latencies, deliveries, timeout):
+        """
+        Envoie `count` messages, chacun après l'accusé du précédent, et lit
+        tous les messages de la conversation (les siens et ceux de l'autre
+        participant)
+        """
+        pending = {}
+        expected = count * 2
+
+        async def read():
+            received = 0
+            while received < expected:
+                output = await communicator.receive_output(timeout)
+                event = json.loads(output['text'])
+                if event['type'] != 'message':
+                    raise CommandError(f"Événement inattendu : {event}")
+                received += 1
+                deliveries[0] += 1
+                waiter = pending.pop(event.get('client_id'), None)
+                if waiter is not None:
+                    waiter.set_result(time.perf_counter())
+
+        reader = asyncio.ensure_future(read())
+        loop = asyncio.get_running_loop()
+        for index in range(count):
+            client_id = f"{user.pk}-{index}"
+            pending[client_id] = acknowledged = loop.create_future()
+            sent_at = time.perf_counter()
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({
+                'type': 'message', 'content': f"Message {index} de {user.username}", 'client_id': client_id,
+            })})
+            latencies.append(await asyncio.wait_for(acknowledged, timeout) - sent_at)
+        await asyncio.wait_for(reader, timeout)
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        self.stdout.write(
+            f"{summary['sockets']} connexions ({summary['conversations']} conversations) ouvertes en "
+            f"{summary['connect_s']:.2f}s"
+        )
+        self.stdout.write(
+            f"  {summary['sent']} messages en {summary['elapsed_s']:.2f}s : {summary['messages_per_s']:.0f} messages/s "
+            f"enregistrés, {summary['deliveries_per_s']:.0f} livraisons/s ({summary['deliveries']})"
+        )
+        self.stdout.write(
+            f"  accusé p50={summary['p50_ms']:.1f}ms  p99={summary['p99_ms']:.1f}ms  max={summary['max_ms']:.1f}ms  "
+            f"{summary['persisted']} messages en base"
+        )
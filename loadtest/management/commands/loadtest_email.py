@@ -0,0 +1,96 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from loadtest.database import throwaway_database
+from loadtest.mail import SlowEmailBackend
+from loadtest.metrics import percentile
+from notifications.models import OutgoingEmail
+from notifications.outbox import email_worker
+
+REGISTER_URL = '/api/auth/register/initiate/'
+MODES = ('sync', 'outbox')
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure la latence de l'inscription (email de confirmation) avec envoi immédiat dans "
+        "la requête puis avec la boîte d'envoi, contre un serveur email simulé (coût de connexion "
+        "et d'envoi), et le délai de livraison par le worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--connect-latency', type=float, default=0.3,
+                            help="Coût simulé d'une connexion SMTP (secondes)")
+        parser.add_argument('--send-latency', type=float, default=0.02,
+                            help="Coût simulé d'un envoi (secondes)")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        with throwaway_database('loadtest_email'):
+            summary = self._run(options)
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+
+    def _run(self, options):
+        prefix = f"lt{int(time.time())}"
+        summary = {'requests': options['requests'], 'modes': {}}
+        email_worker.batch_size = options['batch_size']
+
+        for mode in MODES:
+            self.stdout.write(f"Mode {mode}...")
+            SlowEmailBackend.reset(options['connect_latency'], options['send_latency'])
+            # Hachage rapide du mot de passe : la latence mesurée est celle de l'email
+            with override_settings(EMAIL_BACKEND='loadtest.mail.SlowEmailBackend', EMAIL_OUTBOX=mode == 'outbox',
+                                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+                client = Client()
+                latencies = []
+                statuses = {}
+                started = time.perf_counter()
+                for index in range(options['requests']):
+                    request_started = time.perf_counter()
+                    response = client.post(REGISTER_URL, {
+                        'email': f"{prefix}_{mode}_{index}@loadtest.local",
+                        'name': f"{prefix}_{mode}_{index}",
+                        'password': 'Motdepasse-de-test-42',
+                        'userType': 'investor',
+                    }, content_type='application/json')
+                    latencies.append(time.perf_counter() - request_started)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                requests_s = time.perf_counter() - started
+                email_worker.wait_idle()
+                delivered_s = time.perf_counter() - started
+
+            latencies.sort()
+            summary['modes'][mode] = {
+                'statuses': statuses,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+                'requests_s': requests_s,
+                'delivered_s': delivered_s,
+                'connections': SlowEmailBackend.opened,
+                'sent': SlowEmailBackend.sent,
+                'left_in_outbox': OutgoingEmail.objects.count(),
+            }
+        return summary
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        self.stdout.write(f"{summary['requests']} inscriptions par mode")
+        for mode, result in summary['modes'].items():
+            self.stdout.write(
+                f"  {mode:<7} p50={result['p50_ms']:7.1f}ms  p99={result['p99_ms']:7.1f}ms  "
+                f"max={result['max_ms']:7.1f}ms  requêtes {result['requests_s']:6.2f}s  "
+                f"tout livré {result['delivered_s']:6.2f}s  {result['sent']} emails / "
+                f"{result['connections']} connexions  HTTP {result['statuses']}"
+            )
+            if result['left_in_outbox']:
+                self.stdout.write(f"          {result['left_in_outbox']} emails encore dans la boîte d'envoi")
@@ -0,0 +1,136 @@
+import json
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.test import Client
+from djmoney.money import Money
+from loadtest.database import throwaway_database
+from users.models import User
+from wallet.models import Wallet, WalletTransaction
+
+EXPORT_URL = '/api/wallet/wallets/export/'
+TRANSACTIONS_URL = '/api/wallet/wallets/transactions/'
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure l'export en flux d'un historique de portefeuille volumineux "
+        "(CSV et NDJSON) sur une base de test jetable : durée, débit et pic mémoire."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--outputs', default='csv,ndjson',
+                            help="Formats à mesurer, ex. 'csv' ou 'csv,ndjson'")
+        parser.add_argument('--compare-paginated', action='store_true',
+                            help="Mesure aussi la première page de l'API JSON paginée")
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        with throwaway_database('loadtest_export', keepdb=options['keepdb']):
+            summary = self._run(options)
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+
+    def _run(self, options):
+        user = self._seed(options['rows'], options['batch_size'])
+        client = Client()
+        client.force_login(user)
+
+        results = {}
+        for output in [value.strip() for value in options['outputs'].split(',') if value.strip()]:
+            self.stdout.write(f"Export {output}...")
+            results[output] = self._measure(client, f"{EXPORT_URL}?output={output}")
+        if options['compare_paginated']:
+            self.stdout.write("Première page paginée...")
+            results['paginated_page'] = self._measure(client, TRANSACTIONS_URL)
+
+        return {'rows': options['rows'], 'exports': results}
+
+    def _seed(self, rows, batch_size):
+        """
+        Crée un investisseur et un historique de `rows` mouvements sur son portefeuille
+        """
+        prefix = f"lt{int(time.time())}"
+        user = User.objects.create(
+            username=f"{prefix}_exporter",
+            email=f"{prefix}_exporter@loadtest.local",
+            user_type='investor',
+            password=make_password(None)
+        )
+        wallet = Wallet.objects.create(user=user, balance=Money(0, 'EUR'))
+
+        self.stdout.write(f"Création de {rows} mouvements...")
+        started = time.perf_counter()
+        types = ('deposit', 'investment', 'withdraw')
+        created = 0
+        while created < rows:
+            count = min(batch_size, rows - created)
+            WalletTransaction.objects.bulk_create([
+                WalletTransaction(
+                    wallet=wallet,
+                    transaction_type=types[index % 3],
+                    amount=Decimal(10 + index % 490),
+                    reference=f"{prefix}-{index}"
+                )
+                for index in range(created, created + count)
+            ])
+            created += count
+        self.stdout.write(f"  {rows} lignes en {time.perf_counter() - started:.1f}s")
+        return user
+
+    def _measure(self, client, url):
+        """
+        Mesure une requête en deux passes : chronométrage, puis pic mémoire Python
+
+        tracemalloc ralentit fortement l'exécution, d'où la passe séparée.
+        """
+        stats = self._consume(client, url)
+        tracemalloc.start()
+        self._consume(client, url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats['peak_memory_mb'] = peak / (1024 * 1024)
+        return stats
+
+    def _consume(self, client, url):
+        started = time.perf_counter()
+        first_byte = None
+        response = client.get(url)
+        size = 0
+        lines = 0
+        chunks = response.streaming_content if response.streaming else [response.content]
+        for chunk in chunks:
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+            lines += chunk.count(b'\n')
+        elapsed = time.perf_counter() - started
+        return {
+            'status': response.status_code,
+            'streaming': response.streaming,
+            'elapsed_s': elapsed,
+            'first_byte_ms': (first_byte or elapsed) * 1000,
+            'bytes': size,
+            'lines': lines,
+            'rows_per_s': lines / elapsed if elapsed else 0.0,
+        }
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        self.stdout.write(f"Historique : {summary['rows']} mouvements")
+        for name, stats in summary['exports'].items():
+            self.stdout.write(
+                f"  {name:<15} HTTP {stats['status']}  {stats['elapsed_s']:7.2f}s  "
+                f"premier octet={stats['first_byte_ms']:.1f}ms  {stats['rows_per_s']:10.0f} lignes/s  "
+                f"{stats['bytes'] / (1024 * 1024):8.1f} Mo  pic mémoire={stats['peak_memory_mb']:.1f} Mo"
+            )
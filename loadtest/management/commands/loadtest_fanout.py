@@ -0,0 +1,138 @@
+import json
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from loadtest.database import throwaway_database
+from notifications.models import Notification, NotificationFanout
+from notifications.utils import (NotificationTemplate, create_notification, fan_out_notifications,
+                                 fanout_worker, send_notifications)
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure l'envoi groupé de notifications à une large audience : insertions unitaires "
+        "(ancienne méthode, sur un échantillon), envoi par lots en requête et tâche de fond."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=100000)
+        parser.add_argument('--legacy-sample', type=int, default=5000,
+                            help="Destinataires servis par create_notification (extrapolé)")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        with throwaway_database('loadtest_fanout', keepdb=options['keepdb']):
+            summary = self._run(options)
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+
+    def _run(self, options):
+        prefix = self._seed(options)
+        audience = User.objects.filter(username__startswith=f"{prefix}_reader_")
+        summary = {'recipients': options['recipients'], 'runs': {}}
+
+        static = NotificationTemplate(
+            'project_update', 'Mise à jour de projet', "Le projet '{project}' a été mis à jour",
+            context={'project': 'Test de charge'}, related_object_id=1, related_object_type='project'
+        )
+        personal = NotificationTemplate(
+            'project_update', 'Bonjour {first_name}', "{first_name} {last_name}, le projet '{project}' a été mis à jour",
+            context={'project': 'Test de charge'}, related_object_id=1, related_object_type='project'
+        )
+
+        # Ancienne méthode : un INSERT par destinataire
+        sample = list(audience.order_by('pk')[:options['legacy_sample']])
+        self._measure(summary, 'legacy.create_notification', len(sample), lambda: [
+            create_notification(user, 'project_update', 'Mise à jour de projet',
+                                "Le projet 'Test de charge' a été mis à jour", 1, 'project')
+            for user in sample
+        ])
+
+        self._measure(summary, 'inline.static', options['recipients'],
+                      lambda: send_notifications(audience, static, chunk_size=options['chunk_size']))
+        self._measure(summary, 'inline.personalized', options['recipients'],
+                      lambda: send_notifications(audience, personal, chunk_size=options['chunk_size']))
+        ids = list(audience.values_list('pk', flat=True))
+        self._measure(summary, 'inline.id_list', options['recipients'],
+                      lambda: send_notifications(ids, personal, chunk_size=options['chunk_size']))
+
+        # Tâche de fond : coût dans la requête (planification) puis exécution par le worker
+        def background():
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                fanout = fan_out_notifications({'username__startswith': f"{prefix}_reader_"}, personal)
+                summary['request'] = {'ms': (time.perf_counter() - started) * 1000, 'queries': len(queries)}
+            fanout_worker.submit(fanout.pk)
+            fanout_worker.wait_idle()
+            fanout.refresh_from_db()
+            summary['job'] = {'status': fanout.status, 'sent': fanout.sent, 'total': fanout.total}
+
+        self._measure(summary, 'background.job', options['recipients'], background, count_queries=False)
+        summary['stored'] = Notification.objects.count()
+        summary['jobs'] = NotificationFanout.objects.count()
+        return summary
+
+    def _measure(self, summary, name, rows, run, count_queries=True):
+        self.stdout.write(f"{name}...")
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+        summary['runs'][name] = {
+            'rows': rows,
+            'elapsed_s': elapsed,
+            'rows_per_s': rows / elapsed if elapsed else 0.0,
+            'queries': len(queries) if count_queries else None,
+        }
+
+    def _seed(self, options):
+        prefix = f"lt{int(time.time())}"
+        password = make_password(None)
+        self.stdout.write(f"Création de {options['recipients']} destinataires...")
+        started = time.perf_counter()
+        for offset in range(0, options['recipients'], options['batch_size']):
+            User.objects.bulk_create([
+                User(
+                    username=f"{prefix}_reader_{index}",
+                    email=f"{prefix}_reader_{index}@loadtest.local",
+                    first_name=f"Prénom{index}",
+                    last_name=f"Nom{index}",
+                    user_type='investor',
+                    password=password
+                )
+                for index in range(offset, min(offset + options['batch_size'], options['recipients']))
+            ])
+        self.stdout.write(f"  données créées en {time.perf_counter() - started:.1f}s")
+        return prefix
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        legacy = summary['runs']['legacy.create_notification']
+        for name, result in summary['runs'].items():
+            queries = '' if result['queries'] is None else f"{result['queries']:>6} requêtes"
+            self.stdout.write(
+                f"  {name:<28} {result['rows']:>8} lignes  {result['elapsed_s']:7.2f}s  "
+                f"{result['rows_per_s']:9.0f} lignes/s  {queries}"
+            )
+        if legacy['rows_per_s']:
+            self.stdout.write(
+                f"Ancienne méthode extrapolée à {summary['recipients']} destinataires : "
+                f"{summary['recipients'] / legacy['rows_per_s']:.1f}s"
+            )
+        self.stdout.write(
+            f"Planification dans la requête : {summary['request']['ms']:.1f}ms, "
+            f"{summary['request']['queries']} requêtes ; tâche {summary['job']['status']} "
+            f"{summary['job']['sent']}/{summary['job']['total']}"
+        )
+        self.stdout.write(f"Notifications en base : {summary['stored']}")
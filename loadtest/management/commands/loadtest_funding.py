@@ -0,0 +1,181 @@
+import json
+import multiprocessing
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from loadtest.database import throwaway_database
+from loadtest.metrics import RunReport
+from loadtest.scenarios import (FLOWS, build_tasks, check_consistency,
+                                seed_funding_rush, worker_loop)
+from payments.utils import process_pending_webhook_events, webhook_pool
+
+WEBHOOK_SECRET = 'whsec_loadtest'
+
+
+class Command(BaseCommand):
+    help = (
+        "Simule une ruée d'investisseurs sur un projet (sérialiseur, portefeuille, "
+        "dépôts, webhooks Stripe) sur une base de test jetable et mesure débit, latences, "
+        "attentes de verrous et cohérence de amount_raised."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--investors', type=int, default=1000)
+        parser.add_argument('--operations', type=int, default=None,
+                            help="Nombre d'investissements tentés (défaut : un par investisseur)")
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--mix', default='card:1,wallet:1',
+                            help="Poids des flux, ex. 'card:3,wallet:1'")
+        parser.add_argument('--duplicate-webhooks', type=float, default=0.0,
+                            help="Proportion d'événements livrés deux fois")
+        parser.add_argument('--amount-min', type=float, default=10)
+        parser.add_argument('--amount-max', type=float, default=500)
+        parser.add_argument('--wallet-balance', type=int, default=10000)
+        parser.add_argument('--amount-needed', type=int, default=10**9)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+        parser.add_argument('--strict', action='store_true',
+                            help="Échoue si l'état final est incohérent")
+
+    def handle(self, *args, **options):
+        mix = self._parse_mix(options['mix'])
+
+        settings.STRIPE_WEBHOOK_SECRET = WEBHOOK_SECRET
+        with throwaway_database('loadtest_funding', keepdb=options['keepdb']):
+            summary = self._run(mix, options)
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+
+        if options['strict'] and not summary['consistency']['consistent']:
+            raise CommandError("État final incohérent après le test de charge.")
+
+    def _parse_mix(self, value):
+        mix = {}
+        for part in value.split(','):
+            flow, _, weight = part.partition(':')
+            flow = flow.strip()
+            if flow not in FLOWS:
+                raise CommandError(f"Flux inconnu '{flow}'. Flux disponibles : {', '.join(FLOWS)}.")
+            mix[flow] = float(weight or 1)
+        return mix
+
+    def _run(self, mix, options):
+        prefix = f"lt{int(time.time())}"
+        self.stdout.write(f"Création de {options['investors']} investisseurs...")
+        project_id, investor_ids = seed_funding_rush(
+            prefix,
+            options['investors'],
+            options['wallet_balance'],
+            options['amount_needed'],
+            options['amount_min']
+        )
+        tasks = build_tasks(
+            investor_ids,
+            options['operations'] or options['investors'],
+            mix,
+            options['amount_min'],
+            options['amount_max'],
+            options['seed']
+        )
+
+        if options['mode'] == 'process':
+            # Les connexions ne doivent pas être partagées avec les processus enfants
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            task_queue, result_queue = context.Queue(), context.Queue()
+            worker_class = context.Process
+        else:
+            task_queue, result_queue = queue.Queue(), queue.Queue()
+            worker_class = threading.Thread
+
+        for task in tasks:
+            task_queue.put(task)
+        for _ in range(options['concurrency']):
+            task_queue.put(None)
+
+        self.stdout.write(
+            f"{len(tasks)} opérations sur {options['concurrency']} workers ({options['mode']})..."
+        )
+        report = RunReport()
+        workers = [
+            worker_class(target=worker_loop, args=(
+                task_queue, result_queue, project_id, WEBHOOK_SECRET,
+                options['duplicate_webhooks'], options['seed'] + index
+            ))
+            for index in range(options['concurrency'])
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+
+        finished = 0
+        while finished < len(workers):
+            kind, payload = result_queue.get()
+            if kind == 'locks':
+                report.add_lock_stats(payload)
+                finished += 1
+            else:
+                report.add_result(*payload)
+        report.wall_time = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+
+        # Reprend les événements restés en attente (nouvelles tentatives, processus terminés)
+        webhook_pool.wait_idle()
+        drained = process_pending_webhook_events(include_scheduled=True)
+
+        summary = report.summary()
+        summary['consistency'] = check_consistency(project_id, investor_ids, options['wallet_balance'])
+        summary['webhook_drain'] = drained
+        summary['database'] = connection.vendor
+        return summary
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        self.stdout.write(
+            f"Durée : {summary['wall_time_s']:.2f}s - {summary['operations']} étapes - "
+            f"{summary['throughput']:.1f} étapes/s ({summary['database']})"
+        )
+        for flow, stats in sorted(summary['flows'].items()):
+            outcomes = ', '.join(f"{key}={value}" for key, value in sorted(stats['outcomes'].items()))
+            self.stdout.write(
+                f"  {flow:<14} {stats['throughput']:8.1f}/s  p50={stats['p50_ms']:.1f}ms  "
+                f"p99={stats['p99_ms']:.1f}ms  max={stats['max_ms']:.1f}ms  [{outcomes}]"
+            )
+            for error in stats['errors']:
+                self.stdout.write(f"      {error}")
+
+        locks = summary['lock_waits']
+        self.stdout.write(
+            f"Verrous : {locks['count']} attentes, total={locks['total_ms']:.1f}ms, "
+            f"p50={locks['p50_ms']:.1f}ms, p99={locks['p99_ms']:.1f}ms, erreurs={locks['lock_errors']}"
+        )
+
+        consistency = summary['consistency']
+        self.stdout.write(
+            f"amount_raised={consistency['amount_raised']} / investissements complétés="
+            f"{consistency['completed_total']} (écart {consistency['amount_raised_drift']})"
+        )
+        self.stdout.write(
+            f"PaymentIntents dupliqués={consistency['duplicate_payment_intents']}, "
+            f"portefeuilles incohérents={consistency['drifted_wallets']}, "
+            f"investissements portefeuille={consistency['wallet_investments']} / "
+            f"débits={consistency['wallet_debits']}, dépôts complétés="
+            f"{consistency['completed_deposits']} / crédits={consistency['wallet_credits']}"
+        )
+        events = ', '.join(f"{key}={value}" for key, value in sorted(consistency['webhook_events'].items()))
+        self.stdout.write(
+            f"Webhooks : {events or 'aucun'} (repris après le test : {summary['webhook_drain']['processed']})"
+        )
+        style = self.style.SUCCESS if consistency['consistent'] else self.style.ERROR
+        self.stdout.write(style("Cohérent" if consistency['consistent'] else "Incohérent"))
@@ -0,0 +1,127 @@
+import json
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from loadtest.database import throwaway_database
+from messaging.models import Conversation, Message
+from messaging.serializers import ConversationSerializer
+from messaging.utils import INBOX_QUERY_BUDGET
+from rest_framework.test import APIClient, APIRequestFactory
+from users.models import User
+
+INBOX_URL = '/api/messaging/conversations/'
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure plusieurs pages de la liste des conversations (boîte de réception) et échoue si "
+        "une page dépasse INBOX_QUERY_BUDGET requêtes ; compare au sérialiseur sans préchargement "
+        "(une série de requêtes par conversation)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=20,
+                            help="Messages par conversation")
+        parser.add_argument('--pages', default='1,2,10',
+                            help="Numéros de page mesurés (pages de PAGE_SIZE conversations)")
+        parser.add_argument('--budget', type=int, default=INBOX_QUERY_BUDGET)
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        with throwaway_database('loadtest_inbox'):
+            summary = self._run(options)
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+        over = [page for page, result in summary['pages'].items() if result['queries'] > options['budget']]
+        if over:
+            raise CommandError(f"Budget de {options['budget']} requêtes dépassé pour les pages {', '.join(over)}.")
+
+    def _run(self, options):
+        user = self._seed(options)
+        client = APIClient()
+        client.force_authenticate(user)
+        summary = {'budget': options['budget'], 'pages': {}, 'legacy': {}}
+
+        for page in [int(page) for page in options['pages'].split(',') if page.strip()]:
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(f"{INBOX_URL}?page={page}")
+                elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f"HTTP {response.status_code} sur {INBOX_URL}?page={page}")
+            rows = len(response.json()['results'])
+            summary['pages'][str(page)] = {
+                'rows': rows,
+                'queries': len(queries),
+                'ms': elapsed * 1000,
+            }
+
+            # Sérialiseur seul sur des conversations non préchargées : comportement précédent
+            request = APIRequestFactory().get(INBOX_URL)
+            request.user = user
+            offset = (page - 1) * rows
+            conversations = list(Conversation.objects.filter(participants=user).order_by('-updated_at')[offset:offset + rows])
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                ConversationSerializer(conversations, many=True, context={'request': request}).data
+                elapsed = time.perf_counter() - started
+            # + la requête des conversations et le COUNT de pagination
+            summary['legacy'][str(page)] = {'queries': len(queries) + 2, 'ms': elapsed * 1000}
+        return summary
+
+    def _seed(self, options):
+        prefix = f"lt{int(time.time())}"
+        password = make_password(None)
+        owner = User.objects.create(
+            username=f"{prefix}_inbox", email=f"{prefix}_inbox@loadtest.local",
+            user_type='project_owner', password=password
+        )
+        User.objects.bulk_create([
+            User(
+                username=f"{prefix}_contact_{index}",
+                email=f"{prefix}_contact_{index}@loadtest.local",
+                first_name=f"Prénom{index}",
+                last_name=f"Nom{index}",
+                user_type='investor',
+                password=password
+            )
+            for index in range(options['conversations'])
+        ])
+        contacts = list(User.objects.filter(username__startswith=f"{prefix}_contact_").order_by('pk'))
+
+        self.stdout.write(f"Création de {options['conversations']} conversations...")
+        conversations = Conversation.objects.bulk_create([Conversation() for _ in contacts])
+        Membership = Conversation.participants.through
+        Membership.objects.bulk_create(
+            [Membership(conversation=conversation, user=owner) for conversation in conversations]
+            + [Membership(conversation=conversation, user=contact) for conversation, contact in zip(conversations, contacts)]
+        )
+        Message.objects.bulk_create([
+            Message(
+                conversation=conversation,
+                sender=contact if index % 2 else owner,
+                content=f"Message {index}",
+                is_read=index < options['messages'] - 3
+            )
+            for conversation, contact in zip(conversations, contacts)
+            for index in range(options['messages'])
+        ], batch_size=5000)
+        return owner
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        self.stdout.write(f"Budget : {summary['budget']} requêtes par page")
+        for page, result in summary['pages'].items():
+            legacy = summary['legacy'][page]
+            self.stdout.write(
+                f"  page {page:>4}  {result['rows']:>4} conversations  {result['queries']:>3} requêtes  "
+                f"{result['ms']:7.1f}ms   sans préchargement : {legacy['queries']:>4} requêtes  {legacy['ms']:7.1f}ms"
+            )
@@ -0,0 +1,167 @@
+import json
+import multiprocessing
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from loadtest.database import throwaway_database
+from loadtest.metrics import LockWaitMonitor
+from payments.models import Invoice, InvoiceSequence
+from payments.utils import InvoiceNumberAllocator
+from users.models import User
+
+
+class _Rollback(Exception):
+    pass
+
+
+def allocation_worker(user_id, transactions, per_transaction, rollback_rate, block_size, seed, result_queue):
+    """
+    Crée des factures par transactions de `per_transaction`, dont une part est annulée
+    """
+    from django.db import connection
+
+    allocator = InvoiceNumberAllocator(block_size=block_size)
+    rng = random.Random(seed)
+    monitor = LockWaitMonitor()
+    stats = Counter()
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(monitor):
+            for _ in range(transactions):
+                rollback = rng.random() < rollback_rate
+                try:
+                    with transaction.atomic():
+                        today = timezone.localdate()
+                        for number in allocator.allocate(per_transaction):
+                            Invoice.objects.create(
+                                user_id=user_id, invoice_number=number, amount=Decimal('10'),
+                                description='Test de charge', status='sent',
+                                issue_date=today, due_date=today
+                            )
+                        if rollback:
+                            raise _Rollback()
+                    stats['committed'] += per_transaction
+                except _Rollback:
+                    stats['rolled_back'] += per_transaction
+                except IntegrityError:
+                    stats['integrity_errors'] += 1
+    finally:
+        stats['elapsed'] = time.perf_counter() - started
+        result_queue.put((dict(stats), monitor.snapshot()))
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Crée des factures en parallèle avec l'allocateur de numéros par blocs (threads ou "
+        "processus, avec rollbacks) et vérifie l'absence de doublons ; compare au tirage "
+        "aléatoire de l'ancien générateur."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--transactions', type=int, default=200,
+                            help="Transactions par worker")
+        parser.add_argument('--per-transaction', type=int, default=5,
+                            help="Factures créées par transaction")
+        parser.add_argument('--rollback-rate', type=float, default=0.1)
+        parser.add_argument('--block-size', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        with throwaway_database('loadtest_invoice_numbers'):
+            summary = self._run(options)
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+
+    def _run(self, options):
+        user = User.objects.create(
+            username=f"lt{int(time.time())}_billing",
+            email=f"lt{int(time.time())}_billing@loadtest.local",
+            user_type='investor',
+            password=make_password(None)
+        )
+
+        if options['mode'] == 'process':
+            # Les connexions ne doivent pas être partagées avec les processus enfants
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            result_queue, worker_class = context.Queue(), context.Process
+        else:
+            result_queue, worker_class = queue.Queue(), threading.Thread
+
+        workers = [
+            worker_class(target=allocation_worker, args=(
+                user.pk, options['transactions'], options['per_transaction'], options['rollback_rate'],
+                options['block_size'], options['seed'] + index, result_queue
+            ))
+            for index in range(options['workers'])
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        totals, lock_waits = Counter(), []
+        for _ in workers:
+            stats, locks = result_queue.get()
+            totals.update(stats)
+            lock_waits.append(locks)
+        wall_time = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+
+        invoices = Invoice.objects.filter(user=user)
+        duplicates = invoices.values('invoice_number').annotate(rows=Count('id')).filter(rows__gt=1).count()
+        numbers = [int(number.rsplit('-', 1)[1]) for number in invoices.values_list('invoice_number', flat=True)]
+        reserved = sum(InvoiceSequence.objects.values_list('last_value', flat=True))
+
+        # Ancien générateur : 6 chiffres d'un uuid4, même volume sur une journée
+        legacy = Counter(str(uuid.uuid4().int)[:6] for _ in range(int(totals['committed'])))
+        return {
+            'mode': options['mode'],
+            'workers': options['workers'],
+            'block_size': options['block_size'],
+            'wall_time_s': wall_time,
+            'committed': int(totals['committed']),
+            'rolled_back': int(totals['rolled_back']),
+            'integrity_errors': int(totals['integrity_errors']),
+            'invoices_per_s': totals['committed'] / wall_time if wall_time else 0.0,
+            'stored': len(numbers),
+            'duplicates': duplicates,
+            'reserved': reserved,
+            'gaps': reserved - len(numbers),
+            'lock_errors': sum(locks['errors'] for locks in lock_waits),
+            'legacy_collisions': sum(count - 1 for count in legacy.values() if count > 1),
+        }
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        self.stdout.write(
+            f"{summary['workers']} workers ({summary['mode']}), blocs de {summary['block_size']} : "
+            f"{summary['committed']} factures validées, {summary['rolled_back']} annulées en "
+            f"{summary['wall_time_s']:.2f}s ({summary['invoices_per_s']:.0f} factures/s)"
+        )
+        self.stdout.write(
+            f"Numéros réservés : {summary['reserved']} - en base : {summary['stored']} - "
+            f"trous : {summary['gaps']} - doublons : {summary['duplicates']} - "
+            f"IntegrityError : {summary['integrity_errors']}"
+        )
+        self.stdout.write(f"Erreurs de verrouillage : {summary['lock_errors']}")
+        self.stdout.write(
+            f"Ancien générateur sur le même volume : {summary['legacy_collisions']} collisions"
+        )
@@ -0,0 +1,186 @@
+import json
+import queue
+import random
+import threading
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from loadtest.database import throwaway_database
+from loadtest.metrics import RunReport
+from payments.provider import build_payment_provider, set_payment_provider
+from users.models import User
+
+FLOWS = ('intent', 'checkout', 'methods')
+
+
+class Command(BaseCommand):
+    help = (
+        "Exerce les vues de paiement contre l'émulateur du prestataire (latence et erreurs "
+        "injectées) et mesure débit, latences, nouvelles tentatives et effet du disjoncteur."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--operations', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--mix', default='intent:3,checkout:1,methods:1',
+                            help="Poids des flux, ex. 'intent:3,checkout:1'")
+        parser.add_argument('--latency', type=float, default=0.02,
+                            help="Latence injectée par appel au prestataire (secondes)")
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help="Proportion d'appels en erreur réseau")
+        parser.add_argument('--read-timeout', type=float, default=None)
+        parser.add_argument('--write-timeout', type=float, default=None)
+        parser.add_argument('--max-retries', type=int, default=None)
+        parser.add_argument('--circuit-reset', type=float, default=None)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        mix = {}
+        for part in options['mix'].split(','):
+            flow, _, weight = part.partition(':')
+            if flow.strip() not in FLOWS:
+                raise CommandError(f"Flux inconnu '{flow}'. Flux disponibles : {', '.join(FLOWS)}.")
+            mix[flow.strip()] = float(weight or 1)
+
+        overrides = {
+            'BACKEND': 'emulator',
+            'EMULATOR_LATENCY': options['latency'],
+            'EMULATOR_FAILURE_RATE': options['failure_rate'],
+            'EMULATOR_SEED': options['seed'],
+        }
+        for option, key in (('read_timeout', 'READ_TIMEOUT'), ('write_timeout', 'WRITE_TIMEOUT'),
+                            ('max_retries', 'MAX_RETRIES'), ('circuit_reset', 'CIRCUIT_RESET')):
+            if options[option] is not None:
+                overrides[key] = options[option]
+        provider = build_payment_provider(**overrides)
+        set_payment_provider(provider)
+
+        try:
+            with throwaway_database('loadtest_payments'):
+                summary = self._run(mix, options)
+        finally:
+            set_payment_provider(None)
+
+        summary['provider_calls'] = provider.backend.calls
+        summary['circuit'] = provider.breaker.state
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+
+    def _run(self, mix, options):
+        prefix = f"lt{int(time.time())}"
+        password = make_password(None)
+        User.objects.bulk_create([
+            User(
+                username=f"{prefix}_payer_{index}",
+                email=f"{prefix}_payer_{index}@loadtest.local",
+                user_type='investor',
+                password=password
+            )
+            for index in range(options['users'])
+        ])
+        user_ids = list(User.objects.filter(username__startswith=f"{prefix}_payer_").values_list('id', flat=True))
+
+        # Sessions ouvertes avant la mesure : le test porte sur le prestataire, pas sur la connexion.
+        # Chaque utilisateur est servi par un seul worker, qui possède son client HTTP.
+        concurrency = options['concurrency']
+        clients = {}
+        for user in User.objects.filter(pk__in=user_ids):
+            clients[user.pk] = Client()
+            clients[user.pk].force_login(user)
+
+        rng = random.Random(options['seed'])
+        lanes = [queue.Queue() for _ in range(concurrency)]
+        for index in range(options['operations']):
+            flow = rng.choices(list(mix), list(mix.values()))[0]
+            lanes[index % len(user_ids) % concurrency].put((flow, user_ids[index % len(user_ids)]))
+
+        report = RunReport()
+        lock = threading.Lock()
+
+        def worker(lane):
+            try:
+                while True:
+                    try:
+                        flow, user_id = lane.get_nowait()
+                    except queue.Empty:
+                        return
+                    for step, outcome, latency in getattr(self, f"_flow_{flow}")(clients[user_id]):
+                        with lock:
+                            report.add_result(step, outcome, latency)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(lane,)) for lane in lanes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report.wall_time = time.perf_counter() - started
+        return report.summary()
+
+    def _request(self, client, step, method, url, data=None):
+        started = time.perf_counter()
+        if method == 'post':
+            response = client.post(url, data=data or {}, content_type='application/json')
+        else:
+            response = getattr(client, method)(url)
+        latency = time.perf_counter() - started
+        if response.status_code == 200:
+            outcome = 'ok'
+        elif response.status_code == 503:
+            outcome = 'circuit_open'
+        else:
+            outcome = f"http_{response.status_code}"
+        body = response.json() if outcome == 'ok' else {}
+        return (step, outcome, latency), body.get('data', {})
+
+    def _flow_intent(self, client):
+        result, intent = self._request(client, 'intent.create', 'post', '/api/payments/create-intent/',
+                                       {'amount': 5000, 'currency': 'eur'})
+        results = [result]
+        if intent:
+            for step, method, url in (
+                ('intent.confirm', 'post', f"/api/payments/confirm/{intent['id']}/"),
+                ('intent.status', 'get', f"/api/payments/status/{intent['id']}/"),
+            ):
+                results.append(self._request(client, step, method, url)[0])
+        return results
+
+    def _flow_checkout(self, client):
+        result, session = self._request(client, 'checkout.create', 'post', '/api/payments/create-checkout-session/', {
+            'amount': 5000, 'currency': 'eur',
+            'success_url': 'https://example.com/ok', 'cancel_url': 'https://example.com/cancel',
+        })
+        results = [result]
+        if session:
+            results.append(self._request(client, 'checkout.status', 'get',
+                                         f"/api/payments/session-status/{session['id']}/")[0])
+        return results
+
+    def _flow_methods(self, client):
+        result, _ = self._request(client, 'methods.save', 'post', '/api/payments/methods/save/',
+                                  {'payment_method_id': f"pm_{random.getrandbits(48):012x}"})
+        return [result, self._request(client, 'methods.list', 'get', '/api/payments/methods/')[0]]
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        self.stdout.write(
+            f"Durée : {summary['wall_time_s']:.2f}s - {summary['operations']} requêtes - "
+            f"{summary['throughput']:.1f} requêtes/s - {summary['provider_calls']} appels au prestataire"
+        )
+        for step, stats in sorted(summary['flows'].items()):
+            outcomes = ', '.join(f"{key}={value}" for key, value in sorted(stats['outcomes'].items()))
+            self.stdout.write(
+                f"  {step:<16} p50={stats['p50_ms']:.1f}ms  p99={stats['p99_ms']:.1f}ms  "
+                f"max={stats['max_ms']:.1f}ms  [{outcomes}]"
+            )
+        self.stdout.write(f"Disjoncteur : {summary['circuit']}")
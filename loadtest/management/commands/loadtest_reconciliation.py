@@ -0,0 +1,182 @@
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from djmoney.money import Money
+from investments.models import Investment, Transaction
+from loadtest.database import throwaway_database
+from payments.reconciliation import Reconciler, load_provider_export
+from projects.models import Project
+from users.models import User
+from wallet.models import Wallet
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le rapprochement hors ligne sur une base jetable volumineuse : export NDJSON "
+        "généré avec des écarts connus, rapport, corrections en masse puis second passage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--investments', type=int, default=200000)
+        parser.add_argument('--deposits', type=int, default=50000)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        handle, export_path = tempfile.mkstemp(prefix='reconciliation_', suffix='.ndjson')
+        os.close(handle)
+        try:
+            with throwaway_database('loadtest_reconciliation', keepdb=options['keepdb']):
+                summary = self._run(options, export_path)
+        finally:
+            os.unlink(export_path)
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+
+    def _run(self, options, export_path):
+        expected = self._seed(options, export_path)
+        summary = {'seed': expected, 'passes': {}}
+
+        started = time.perf_counter()
+        payments, stats = load_provider_export(export_path)
+        summary['load'] = {'records': stats['records'], 'keys': len(payments),
+                           'elapsed_s': time.perf_counter() - started}
+
+        # Rapport, correction, puis passage de contrôle : plus aucun écart corrigeable
+        for name, fix in (('report', False), ('fix', True), ('verify', False)):
+            self.stdout.write(f"Passage {name}...")
+            with CaptureQueriesContext(connection) as queries:
+                result = Reconciler(payments, chunk_size=options['chunk_size']).run(fix=fix)
+            rows = sum(result['scanned'].values())
+            summary['passes'][name] = {
+                'scanned': rows,
+                'queries': len(queries),
+                'scan_s': result['timings']['scan_s'],
+                'fix_s': result['timings'].get('fix_s', 0.0),
+                'rows_per_s': rows / result['timings']['scan_s'] if result['timings']['scan_s'] else 0.0,
+                'mismatches': {kind: (entry['count'], entry['fixed']) for kind, entry in result['mismatches'].items()},
+            }
+        return summary
+
+    def _seed(self, options, export_path):
+        """
+        Crée les lignes locales et écrit l'export du prestataire, avec des écarts
+        à intervalles fixes : 1/50 investissements restés en attente, 1/71 en attente
+        mais échoués, 1/97 de montant différent, 1/1000 absents en local ;
+        1/40 dépôts non crédités
+        """
+        prefix = f"lt{int(time.time())}"
+        password = make_password(None)
+        owner = User.objects.create(
+            username=f"{prefix}_owner", email=f"{prefix}_owner@loadtest.local",
+            user_type='project_owner', password=password
+        )
+        project = Project.objects.create(
+            title=f"Reconciliation {prefix}", owner=owner, funding_type='equity',
+            amount_needed=Decimal('1000000000'), minimum_investment=Decimal('1'), status='active'
+        )
+        User.objects.bulk_create([
+            User(
+                username=f"{prefix}_payer_{index}",
+                email=f"{prefix}_payer_{index}@loadtest.local",
+                user_type='investor',
+                password=password
+            )
+            for index in range(options['users'])
+        ])
+        user_ids = list(User.objects.filter(username__startswith=f"{prefix}_payer_").values_list('id', flat=True))
+        Wallet.objects.bulk_create([Wallet(user_id=user_id, balance=Money(0, 'EUR')) for user_id in user_ids])
+
+        self.stdout.write(
+            f"Création de {options['investments']} investissements et {options['deposits']} dépôts..."
+        )
+        started = time.perf_counter()
+        created = int(time.time()) - options['investments'] - options['deposits']
+        expected = dict.fromkeys((
+            'investment_not_completed', 'investment_not_failed', 'investment_amount_mismatch',
+            'investment_missing', 'deposit_not_completed'
+        ), 0)
+        batch_size = options['batch_size']
+
+        with open(export_path, 'w') as export:
+            def write(intent_id, status, cents, metadata):
+                export.write(json.dumps({
+                    'id': intent_id, 'object': 'payment_intent', 'status': status, 'amount': cents,
+                    'amount_received': cents if status == 'succeeded' else 0, 'currency': 'eur',
+                    'created': created, 'metadata': metadata,
+                    'last_payment_error': {'code': 'card_declined'} if status == 'requires_payment_method' else None,
+                }) + '\n')
+
+            for offset in range(0, options['investments'], batch_size):
+                batch = []
+                for index in range(offset, min(offset + batch_size, options['investments'])):
+                    user_id = user_ids[index % len(user_ids)]
+                    cents = 1000 + index % 500 * 100
+                    metadata = {'user_id': user_id, 'project_id': project.pk}
+                    if index % 1000 == 999:
+                        write(f"pi_inv_{index}", 'succeeded', cents, metadata)
+                        expected['investment_missing'] += 1
+                        continue
+                    status, provider_status, provider_cents = 'completed', 'succeeded', cents
+                    if index % 50 == 0:
+                        status = 'pending'
+                        expected['investment_not_completed'] += 1
+                    elif index % 71 == 0:
+                        status, provider_status = 'pending', 'requires_payment_method'
+                        expected['investment_not_failed'] += 1
+                    elif index % 97 == 0:
+                        provider_cents = cents + 100
+                        expected['investment_amount_mismatch'] += 1
+                    write(f"pi_inv_{index}", provider_status, provider_cents, metadata)
+                    batch.append(Investment(
+                        user_id=user_id, project=project, amount=Decimal(cents) / 100, status=status,
+                        payment_method='card', payment_intent_id=f"pi_inv_{index}"
+                    ))
+                Investment.objects.bulk_create(batch)
+
+            for offset in range(0, options['deposits'], batch_size):
+                batch = []
+                for index in range(offset, min(offset + batch_size, options['deposits'])):
+                    user_id = user_ids[index % len(user_ids)]
+                    status = 'pending' if index % 40 == 0 else 'completed'
+                    expected['deposit_not_completed'] += status == 'pending'
+                    write(f"pi_dep_{index}", 'succeeded', 5000,
+                          {'user_id': user_id, 'transaction_type': 'deposit'})
+                    batch.append(Transaction(
+                        user_id=user_id, transaction_type='deposit', amount=Decimal('50.00'),
+                        status=status, reference_id=f"pi_dep_{index}", description='Test de charge'
+                    ))
+                Transaction.objects.bulk_create(batch)
+
+        self.stdout.write(f"  données créées en {time.perf_counter() - started:.1f}s")
+        return expected
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        self.stdout.write(
+            f"Export : {summary['load']['records']} enregistrements, {summary['load']['keys']} clés "
+            f"indexées en {summary['load']['elapsed_s']:.2f}s"
+        )
+        for name, result in summary['passes'].items():
+            self.stdout.write(
+                f"  {name:<7} {result['scanned']:>9} lignes  {result['queries']:>5} requêtes  "
+                f"parcours {result['scan_s']:6.2f}s ({result['rows_per_s']:8.0f} lignes/s)  "
+                f"corrections {result['fix_s']:6.2f}s"
+            )
+            for kind, (count, fixed) in result['mismatches'].items():
+                self.stdout.write(f"      {kind:<30} {count:>7}  corrigés {fixed}")
+        self.stdout.write(f"Écarts injectés : {summary['seed']}")
@@ -0,0 +1,194 @@
+import json
+import statistics
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from loadtest.database import throwaway_database
+from payments.models import Invoice
+from payments.serializers import TransactionSerializer
+from payments.utils import get_user_transactions
+from payments.views import TransactionPagination
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from users.models import User
+
+URL = '/api/payments/process/transactions/'
+
+
+class LegacyTransactionSerializer(serializers.Serializer):
+    """
+    Sérialiseur de l'ancienne implémentation (dicts construits en Python)
+    """
+    id = serializers.CharField(read_only=True)
+    type = serializers.CharField(read_only=True)
+    amount = serializers.DecimalField(read_only=True, max_digits=15, decimal_places=2)
+    date = serializers.DateField(read_only=True)
+    status = serializers.CharField(read_only=True)
+    description = serializers.CharField(read_only=True)
+    invoice_id = serializers.IntegerField(read_only=True, source='invoice.id')
+    invoice_number = serializers.CharField(read_only=True, source='invoice.invoice_number')
+    payment_method = serializers.CharField(read_only=True)
+
+
+def legacy_transactions_page(user, page, page_size):
+    """
+    Ancienne implémentation : tout l'historique en liste, puis découpage
+    """
+    transactions = [
+        {
+            'id': str(uuid.uuid4()),
+            'type': 'payment',
+            'amount': invoice.amount,
+            'date': invoice.paid_date if invoice.status == 'paid' else invoice.issue_date,
+            'status': invoice.status,
+            'description': invoice.description,
+            'invoice': invoice,
+            'payment_method': 'Non spécifié'
+        }
+        for invoice in Invoice.objects.filter(user=user).order_by('-issue_date')
+    ]
+    start_idx = (page - 1) * page_size
+    return {
+        'count': len(transactions),
+        'results': LegacyTransactionSerializer(transactions[start_idx:start_idx + page_size], many=True).data
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare l'historique des transactions de paiement paginé en Python (ancienne "
+        "implémentation) et par clé en base, sur des utilisateurs à gros historique."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2)
+        parser.add_argument('--invoices', type=int, default=50000,
+                            help="Factures par utilisateur")
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--legacy-samples', type=int, default=3,
+                            help="Pages mesurées sur l'ancienne implémentation (début, milieu, fin)")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le rapport complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        with throwaway_database('loadtest_transactions', keepdb=options['keepdb']):
+            summary = self._run(options)
+
+        self._print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
+
+    def _run(self, options):
+        users = self._seed(options['users'], options['invoices'], options['batch_size'])
+        page_size = options['page_size']
+        last_page = max(1, -(-options['invoices'] // page_size))
+        samples = options['legacy_samples']
+        legacy_pages = sorted({1 + (last_page - 1) * index // max(1, samples - 1) for index in range(samples)})
+
+        summary = {'users': len(users), 'invoices_per_user': options['invoices'],
+                   'page_size': page_size, 'legacy': [], 'keyset': []}
+        factory = APIRequestFactory()
+        for user in users:
+            for page in legacy_pages:
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    legacy_transactions_page(user, page, page_size)
+                    elapsed = time.perf_counter() - started
+                summary['legacy'].append({'user': user.pk, 'page': page, 'ms': elapsed * 1000,
+                                          'queries': len(queries)})
+
+            self.stdout.write(f"Parcours complet par clé pour l'utilisateur {user.pk}...")
+            url = f"{URL}?page_size={page_size}"
+            timings, query_counts, rows = [], [], 0
+            while url:
+                request = Request(factory.get(url))
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    paginator = TransactionPagination()
+                    page = paginator.paginate_queryset(get_user_transactions(user), request)
+                    data = paginator.get_paginated_response(TransactionSerializer(page, many=True).data).data
+                    timings.append(time.perf_counter() - started)
+                query_counts.append(len(queries))
+                rows += len(data['results'])
+                url = data['next']
+            summary['keyset'].append({
+                'user': user.pk,
+                'pages': len(timings),
+                'rows': rows,
+                'first_ms': timings[0] * 1000,
+                'last_ms': timings[-1] * 1000,
+                'p50_ms': statistics.median(timings) * 1000,
+                'max_ms': max(timings) * 1000,
+                'queries_per_page': sorted(set(query_counts)),
+            })
+        return summary
+
+    def _seed(self, users, invoices, batch_size):
+        """
+        Crée `users` utilisateurs et `invoices` factures chacun (plusieurs par jour)
+        """
+        prefix = f"lt{int(time.time())}"
+        password = make_password(None)
+        User.objects.bulk_create([
+            User(
+                username=f"{prefix}_payer_{index}",
+                email=f"{prefix}_payer_{index}@loadtest.local",
+                user_type='investor',
+                password=password
+            )
+            for index in range(users)
+        ])
+        created_users = list(User.objects.filter(username__startswith=f"{prefix}_payer_").order_by('pk'))
+
+        self.stdout.write(f"Création de {users * invoices} factures...")
+        started = time.perf_counter()
+        start_date = date.today() - timedelta(days=invoices // 20)
+        statuses = ('paid', 'sent', 'overdue', 'paid')
+        for user in created_users:
+            for offset in range(0, invoices, batch_size):
+                Invoice.objects.bulk_create([
+                    Invoice(
+                        user=user,
+                        invoice_number=f"{prefix}-{user.pk}-{index}",
+                        amount=Decimal(10 + index % 990),
+                        description=f"Facture de test {index}",
+                        status=statuses[index % 4],
+                        issue_date=start_date + timedelta(days=index // 20),
+                        due_date=start_date + timedelta(days=index // 20 + 7),
+                        paid_date=start_date + timedelta(days=index // 20 + 1) if index % 4 in (0, 3) else None
+                    )
+                    for index in range(offset, min(offset + batch_size, invoices))
+                ])
+        self.stdout.write(f"  {users * invoices} lignes en {time.perf_counter() - started:.1f}s")
+        return created_users
+
+    def _print_summary(self, summary):
+        self.stdout.write("")
+        self.stdout.write(
+            f"{summary['users']} utilisateurs x {summary['invoices_per_user']} factures, "
+            f"pages de {summary['page_size']}"
+        )
+        self.stdout.write("Ancienne implémentation (liste Python) :")
+        for sample in summary['legacy']:
+            self.stdout.write(
+                f"  utilisateur {sample['user']} page {sample['page']:<6} "
+                f"{sample['ms']:9.1f}ms  {sample['queries']} requêtes"
+            )
+        self.stdout.write("Pagination par clé :")
+        for walk in summary['keyset']:
+            self.stdout.write(
+                f"  utilisateur {walk['user']} {walk['pages']} pages / {walk['rows']} lignes  "
+                f"première={walk['first_ms']:.1f}ms  dernière={walk['last_ms']:.1f}ms  "
+                f"p50={walk['p50_ms']:.1f}ms  max={walk['max_ms']:.1f}ms  "
+                f"requêtes/page={walk['queries_per_page']}"
+            )
@@ -0,0 +1,109 @@
+# loadtest/metrics.py
+import math
+import time
+from collections import defaultdict
+
+from django.db import OperationalError
+
+LOCK_ERROR_MARKERS = ('locked', 'deadlock', 'could not obtain lock', 'lock timeout')
+
+
+def percentile(sorted_values, pct):
+    """
+    Percentile par rang le plus proche sur une liste déjà triée
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def is_lock_error(exc):
+    return isinstance(exc, OperationalError) and any(
+        marker in str(exc).lower() for marker in LOCK_ERROR_MARKERS
+    )
+
+
+class LockWaitMonitor:
+    """
+    Wrapper d'exécution SQL qui mesure l'attente des verrous
+
+    Le temps passé dans les requêtes SELECT ... FOR UPDATE correspond au temps
+    d'acquisition des verrous de ligne ; les erreurs de verrouillage (base
+    verrouillée, deadlock) sont comptées à part. SQLite n'émet pas de
+    FOR UPDATE : seules les erreurs de verrouillage y sont visibles.
+    """
+
+    def __init__(self):
+        self.waits = []
+        self.errors = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if is_lock_error(exc):
+                self.errors += 1
+            raise
+        finally:
+            if 'FOR UPDATE' in sql.upper():
+                self.waits.append(time.perf_counter() - started)
+
+    def snapshot(self):
+        return {'waits': list(self.waits), 'errors': self.errors}
+
+
+class RunReport:
+    """
+    Agrège les résultats des opérations d'un test de charge
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self.error_samples = defaultdict(set)
+        self.lock_waits = []
+        self.lock_errors = 0
+        self.wall_time = 0.0
+
+    def add_result(self, flow, outcome, latency, error=None):
+        self.latencies[flow].append(latency)
+        self.outcomes[flow][outcome] += 1
+        if error and len(self.error_samples[flow]) < 5:
+            self.error_samples[flow].add(error)
+
+    def add_lock_stats(self, stats):
+        self.lock_waits.extend(stats['waits'])
+        self.lock_errors += stats['errors']
+
+    def summary(self):
+        flows = {}
+        total_ops = 0
+        for flow, values in self.latencies.items():
+            ordered = sorted(values)
+            total_ops += len(ordered)
+            flows[flow] = {
+                'operations': len(ordered),
+                'outcomes': dict(self.outcomes[flow]),
+                'throughput': len(ordered) / self.wall_time if self.wall_time else 0.0,
+                'p50_ms': percentile(ordered, 50) * 1000,
+                'p99_ms': percentile(ordered, 99) * 1000,
+                'max_ms': (ordered[-1] if ordered else 0.0) * 1000,
+                'errors': sorted(self.error_samples[flow]),
+            }
+
+        waits = sorted(self.lock_waits)
+        return {
+            'wall_time_s': self.wall_time,
+            'operations': total_ops,
+            'throughput': total_ops / self.wall_time if self.wall_time else 0.0,
+            'flows': flows,
+            'lock_waits': {
+                'count': len(waits),
+                'total_ms': sum(waits) * 1000,
+                'p50_ms': percentile(waits, 50) * 1000,
+                'p99_ms': percentile(waits, 99) * 1000,
+                'lock_errors': self.lock_errors,
+            },
+        }
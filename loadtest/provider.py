@@ -0,0 +1,83 @@
+# loadtest/provider.py
+import hashlib
+import hmac
+import itertools
+import json
+import threading
+import time
+import uuid
+
+
+class FakePaymentProvider:
+    """
+    Faux fournisseur de paiement local pour les tests de charge
+
+    Génère des identifiants de PaymentIntent au format Stripe et des événements
+    de webhook signés avec le même schéma que Stripe (en-tête Stripe-Signature),
+    afin que les vues de webhook soient exercées sans mock ni accès réseau.
+    """
+
+    def __init__(self, webhook_secret):
+        self.webhook_secret = webhook_secret
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.payment_intents = {}
+
+    def _next_id(self, prefix):
+        with self._lock:
+            number = next(self._counter)
+        return f"{prefix}_{uuid.uuid4().hex[:16]}{number:08d}"
+
+    def create_payment_intent(self, amount, currency='eur', metadata=None):
+        """
+        Crée une intention de paiement locale (montant en unités, pas en centimes)
+        """
+        intent = {
+            'id': self._next_id('pi'),
+            'object': 'payment_intent',
+            'amount': int(amount * 100),
+            'currency': currency,
+            'status': 'requires_payment_method',
+            'metadata': {key: str(value) for key, value in (metadata or {}).items()},
+        }
+        with self._lock:
+            self.payment_intents[intent['id']] = intent
+        return intent
+
+    def succeed_payment_intent(self, payment_intent_id):
+        """
+        Marque l'intention comme réussie et retourne l'événement de webhook associé
+        """
+        with self._lock:
+            intent = self.payment_intents[payment_intent_id]
+            intent['status'] = 'succeeded'
+            intent = dict(intent)
+        return self.build_event('payment_intent.succeeded', intent)
+
+    def build_event(self, event_type, data_object):
+        return {
+            'id': self._next_id('evt'),
+            'object': 'event',
+            'type': event_type,
+            'created': int(time.time()),
+            'livemode': False,
+            'data': {'object': data_object},
+        }
+
+    def sign(self, payload, timestamp=None):
+        """
+        Calcule l'en-tête Stripe-Signature pour un payload brut
+        """
+        timestamp = int(timestamp or time.time())
+        signed_payload = f"{timestamp}.{payload}".encode('utf-8')
+        signature = hmac.new(
+            self.webhook_secret.encode('utf-8'), signed_payload, hashlib.sha256
+        ).hexdigest()
+        return f"t={timestamp},v1={signature}"
+
+    def encode_event(self, event):
+        """
+        Retourne le payload JSON et l'en-tête de signature d'un événement
+        """
+        payload = json.dumps(event)
+        return payload, self.sign(payload)
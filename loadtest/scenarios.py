@@ -0,0 +1,280 @@
+# loadtest/scenarios.py
+import random
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.test import Client
+from djmoney.money import Money
+from investments.models import Investment, Transaction
+from investments.serializers import InvestmentCreateSerializer
+from payments.models import WebhookEvent
+from payments.utils import webhook_pool
+from projects.models import Project
+from users.models import User
+from wallet.models import Wallet, WalletTransaction
+
+from .metrics import LockWaitMonitor, is_lock_error
+from .provider import FakePaymentProvider
+
+PAYMENTS_WEBHOOK_URL = '/api/payments/webhook/'
+WALLET_WEBHOOK_URL = '/api/wallet/webhook/'
+FLOWS = ('card', 'wallet', 'deposit')
+
+
+def seed_funding_rush(prefix, investors, wallet_balance, amount_needed, minimum_investment):
+    """
+    Crée un porteur de projet, un projet actif et des investisseurs avec portefeuille
+    """
+    password = make_password(None)
+    owner = User.objects.create(
+        username=f"{prefix}_owner",
+        email=f"{prefix}_owner@loadtest.local",
+        user_type='project_owner',
+        password=password
+    )
+    project = Project.objects.create(
+        title=f"Funding rush {prefix}",
+        owner=owner,
+        funding_type='equity',
+        amount_needed=amount_needed,
+        minimum_investment=minimum_investment,
+        status='active'
+    )
+
+    User.objects.bulk_create([
+        User(
+            username=f"{prefix}_investor_{index}",
+            email=f"{prefix}_investor_{index}@loadtest.local",
+            user_type='investor',
+            password=password
+        )
+        for index in range(investors)
+    ], batch_size=500)
+    investor_ids = list(
+        User.objects.filter(username__startswith=f"{prefix}_investor_").values_list('id', flat=True)
+    )
+
+    Wallet.objects.bulk_create([
+        Wallet(user_id=user_id, balance=Money(wallet_balance, 'EUR'))
+        for user_id in investor_ids
+    ], batch_size=500)
+
+    return project.id, investor_ids
+
+
+def build_tasks(investor_ids, operations, mix, amount_min, amount_max, seed):
+    """
+    Prépare la liste des opérations (flux, investisseur, montant) de façon reproductible
+    """
+    rng = random.Random(seed)
+    flows = list(mix.keys())
+    weights = list(mix.values())
+    tasks = []
+    for index in range(operations):
+        amount = Decimal(rng.randint(int(amount_min * 100), int(amount_max * 100))) / 100
+        tasks.append((
+            rng.choices(flows, weights)[0],
+            investor_ids[index % len(investor_ids)],
+            amount.quantize(Decimal('0.01'))
+        ))
+    return tasks
+
+
+class FlowRunner:
+    """
+    Exécute les flux d'investissement pour un worker (thread ou processus)
+    """
+
+    def __init__(self, project_id, webhook_secret, duplicate_ratio, seed):
+        self.project_id = project_id
+        self.provider = FakePaymentProvider(webhook_secret)
+        self.client = Client()
+        self.duplicate_ratio = duplicate_ratio
+        self.rng = random.Random(seed)
+
+    def run(self, flow, user_id, amount):
+        return getattr(self, f"run_{flow}")(user_id, amount)
+
+    def _timed(self, step, func, *args):
+        started = time.perf_counter()
+        try:
+            outcome, error = func(*args)
+        except Exception as exc:
+            outcome = 'lock_error' if is_lock_error(exc) else 'error'
+            error = f"{type(exc).__name__}: {str(exc)[:160]}"
+        return (step, outcome, time.perf_counter() - started, error)
+
+    def run_card(self, user_id, amount):
+        """
+        Investissement par carte : sérialiseur puis webhook payment_intent.succeeded
+        """
+        intent = self.provider.create_payment_intent(amount, metadata={
+            'user_id': user_id,
+            'project_id': self.project_id,
+        })
+        results = [self._timed('card.create', self._create_investment, user_id, amount, intent['id'])]
+        if results[0][1] != 'ok':
+            return results
+
+        event = self.provider.succeed_payment_intent(intent['id'])
+        results.extend(self._deliver(event, 'card.webhook', PAYMENTS_WEBHOOK_URL))
+        return results
+
+    def run_deposit(self, user_id, amount):
+        """
+        Dépôt sur le portefeuille confirmé par le webhook du portefeuille
+        """
+        intent = self.provider.create_payment_intent(amount, metadata={
+            'user_id': user_id,
+            'transaction_type': 'deposit',
+        })
+        Transaction.objects.create(
+            user_id=user_id,
+            transaction_type='deposit',
+            amount=amount,
+            status='pending',
+            reference_id=intent['id']
+        )
+        event = self.provider.succeed_payment_intent(intent['id'])
+        return self._deliver(event, 'deposit.webhook', WALLET_WEBHOOK_URL)
+
+    def _deliver(self, event, step, url):
+        deliveries = 2 if self.rng.random() < self.duplicate_ratio else 1
+        return [self._timed(step, self._deliver_webhook, event, url) for _ in range(deliveries)]
+
+    def run_wallet(self, user_id, amount):
+        """
+        Investissement direct depuis le portefeuille
+        """
+        return [self._timed('wallet.invest', self._invest_with_wallet, user_id, amount)]
+
+    def _create_investment(self, user_id, amount, payment_intent_id):
+        user = User.objects.get(pk=user_id)
+        serializer = InvestmentCreateSerializer(
+            data={
+                'project_id': self.project_id,
+                'amount': str(amount),
+                'payment_method': 'card',
+                'payment_intent_id': payment_intent_id,
+            },
+            context={'request': SimpleNamespace(user=user)}
+        )
+        if not serializer.is_valid():
+            return 'rejected', str(serializer.errors)[:160]
+        serializer.save()
+        return 'ok', None
+
+    def _deliver_webhook(self, event, url):
+        payload, signature = self.provider.encode_event(event)
+        response = self.client.post(
+            url,
+            data=payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature
+        )
+        if response.status_code != 200:
+            return 'error', f"HTTP {response.status_code}: {response.content[:160]!r}"
+        return 'ok', None
+
+    def _invest_with_wallet(self, user_id, amount):
+        user = User.objects.select_related('wallet').get(pk=user_id)
+        project = Project.objects.get(pk=self.project_id)
+        try:
+            Wallet.invest_with_wallet(user, project, amount)
+        except ValueError as exc:
+            return 'rejected', str(exc)
+        return 'ok', None
+
+
+def worker_loop(task_queue, result_queue, project_id, webhook_secret, duplicate_ratio, seed):
+    """
+    Boucle d'un worker : consomme les tâches jusqu'à la sentinelle None
+    """
+    monitor = LockWaitMonitor()
+    runner = FlowRunner(project_id, webhook_secret, duplicate_ratio, seed)
+    try:
+        with connection.execute_wrapper(monitor):
+            while True:
+                task = task_queue.get()
+                if task is None:
+                    break
+                for result in runner.run(*task):
+                    result_queue.put(('result', result))
+    finally:
+        # Les webhooks acquittés sont traités en arrière-plan : attendre la fin du pool
+        webhook_pool.wait_idle()
+        result_queue.put(('locks', monitor.snapshot()))
+        connections.close_all()
+
+
+def check_consistency(project_id, investor_ids, wallet_balance):
+    """
+    Compare les compteurs dénormalisés aux lignes sources après le test
+    """
+    project = Project.objects.get(pk=project_id)
+    completed = Investment.objects.filter(project_id=project_id, status='completed')
+    cents = Decimal('0.01')
+    completed_total = (completed.aggregate(total=Sum('amount'))['total'] or Decimal('0')).quantize(cents)
+    amount_raised = project.amount_raised.quantize(cents)
+
+    duplicate_intents = Investment.objects.filter(
+        project_id=project_id, payment_intent_id__isnull=False
+    ).values('payment_intent_id').annotate(rows=Count('id')).filter(rows__gt=1).count()
+
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    wallets = Wallet.objects.filter(user_id__in=investor_ids).annotate(
+        credited=Coalesce(
+            Sum('transactions__amount', filter=Q(transactions__transaction_type='deposit')),
+            zero
+        ),
+        debited=Coalesce(
+            Sum('transactions__amount', filter=~Q(transactions__transaction_type='deposit')),
+            zero
+        )
+    )
+    initial = Decimal(wallet_balance)
+    drifted_wallets = sum(
+        1 for wallet in wallets
+        if wallet.balance.amount != initial + wallet.credited - wallet.debited
+    )
+    wallet_investments = completed.filter(payment_method='wallet').count()
+    wallet_debits = WalletTransaction.objects.filter(
+        wallet__user_id__in=investor_ids, transaction_type='investment'
+    ).count()
+    completed_deposits = Transaction.objects.filter(
+        user_id__in=investor_ids, transaction_type='deposit', status='completed'
+    ).count()
+    wallet_credits = WalletTransaction.objects.filter(
+        wallet__user_id__in=investor_ids, transaction_type='deposit'
+    ).count()
+    webhook_events = dict(
+        WebhookEvent.objects.values_list('status').annotate(rows=Count('id')).order_by()
+    )
+
+    return {
+        'amount_raised': amount_raised,
+        'completed_total': completed_total,
+        'amount_raised_drift': amount_raised - completed_total,
+        'completed_investments': completed.count(),
+        'duplicate_payment_intents': duplicate_intents,
+        'drifted_wallets': drifted_wallets,
+        'wallet_investments': wallet_investments,
+        'wallet_debits': wallet_debits,
+        'completed_deposits': completed_deposits,
+        'wallet_credits': wallet_credits,
+        'webhook_events': webhook_events,
+        'consistent': (
+            amount_raised == completed_total
+            and duplicate_intents == 0
+            and drifted_wallets == 0
+            and wallet_investments == wallet_debits
+            and completed_deposits == wallet_credits
+            and not webhook_events.get('pending')
+            and not webhook_events.get('failed')
+        ),
+    }
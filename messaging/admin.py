@@ -2,8 +2,9 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Message, Conversation
+from .models import Message, Conversation, MessageCounter
 
 admin.site.register(Message)
 admin.site.register(Conversation)
 
+admin.site.register(MessageCounter)
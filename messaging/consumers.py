@@ -0,0 +1,106 @@
+# messaging/consumers.py
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .utils import conversation_group, create_message, is_participant, mark_conversation_read, message_event
+
+# Longueur maximale d'un message reçu par WebSocket
+MAX_MESSAGE_LENGTH = 10000
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    /ws/messaging/<conversation_id>/ : messagerie en temps réel d'une conversation
+
+    Le client envoie :
+    - {"type": "message", "content": "...", "client_id": "..."} : message
+      enregistré comme par POST /api/messaging/messages/ ; `client_id`
+      (facultatif) est renvoyé à l'expéditeur pour rapprocher l'accusé
+    - {"type": "typing", "is_typing": true} : indicateur de saisie
+    - {"type": "read"} : marque la conversation comme lue
+
+    Il reçoit {"type": "message", "message": {...}, "client_id": ...},
+    {"type": "typing", "user_id": n, "is_typing": bool} (pas pour ses propres
+    saisies), {"type": "read", "user_id": n, "count": n} et
+    {"type": "error", "detail": "..."}. Les messages envoyés par l'API REST
+    sont diffusés de la même façon.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        self.user = user
+        self.conversation_id = int(self.scope['url_route']['kwargs']['conversation_id'])
+        if not await self._is_participant():
+            await self.close(code=4404)
+            return
+
+        self.group_name = conversation_group(self.conversation_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if getattr(self, 'group_name', None):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        event_type = content.get('type') if isinstance(content, dict) else None
+        if event_type == 'message':
+            text = content.get('content')
+            if not isinstance(text, str) or not text.strip():
+                await self._error("Le contenu du message est requis.")
+                return
+            if len(text) > MAX_MESSAGE_LENGTH:
+                await self._error(f"Le message dépasse {MAX_MESSAGE_LENGTH} caractères.")
+                return
+            event = await self._create_message(text, content.get('client_id'))
+            await self.channel_layer.group_send(self.group_name, event)
+        elif event_type == 'typing':
+            await self.channel_layer.group_send(self.group_name, {
+                'type': 'chat.typing', 'user_id': self.user.pk, 'is_typing': bool(content.get('is_typing', True)),
+            })
+        elif event_type == 'read':
+            count = await self._mark_read()
+            if count:
+                await self.channel_layer.group_send(self.group_name, {
+                    'type': 'chat.read', 'user_id': self.user.pk, 'count': count,
+                })
+        else:
+            await self._error("Type d'événement inconnu.")
+
+    async def chat_message(self, event):
+        message = {'type': 'message', 'message': event['message']}
+        # L'identifiant client ne concerne que l'expéditeur
+        if event.get('client_id') is not None and event['message']['sender']['id'] == self.user.pk:
+            message['client_id'] = event['client_id']
+        await self.send_json(message)
+
+    async def chat_typing(self, event):
+        if event['user_id'] != self.user.pk:
+            await self.send_json({'type': 'typing', 'user_id': event['user_id'], 'is_typing': event['is_typing']})
+
+    async def chat_read(self, event):
+        payload = {'type': 'read', 'user_id': event['user_id'], 'count': event['count']}
+        if 'message_id' in event:
+            payload['message_id'] = event['message_id']
+        await self.send_json(payload)
+
+    async def _error(self, detail):
+        await self.send_json({'type': 'error', 'detail': detail})
+
+    @database_sync_to_async
+    def _is_participant(self):
+        return is_participant(self.conversation_id, self.user.pk)
+
+    @database_sync_to_async
+    def _create_message(self, content, client_id):
+        # Diffusé par le consommateur une fois l'enregistrement terminé (commit)
+        message = create_message(self.conversation_id, self.user, content, broadcast=False)
+        return message_event(message, client_id)
+
+    @database_sync_to_async
+    def _mark_read(self):
+        return mark_conversation_read(self.conversation_id, self.user, broadcast=False)
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-19 01:54
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def fill_pair_keys(apps, schema_editor):
+    # Conversations à deux participants ; en cas de doublons, la plus ancienne
+    # reçoit la clé (les autres restent consultables mais ne sont plus choisies)
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Membership = Conversation.participants.through
+    pairs = (
+        Membership.objects.values('conversation_id')
+        .annotate(members=Count('user_id'), low=Min('user_id'), high=Max('user_id'))
+        .filter(members=2)
+        .order_by('conversation_id')
+    )
+    seen = set()
+    for pair in pairs.iterator():
+        key = f"{pair['low']}:{pair['high']}"
+        if key in seen:
+            continue
+        seen.add(key)
+        Conversation.objects.filter(pk=pair['conversation_id']).update(pair_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0004_message_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='pair_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_pair_keys, migrations.RunPython.noop),
+    ]
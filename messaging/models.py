@@ -6,6 +6,9 @@ class Conversation(models.Model):
     Conversation entre deux utilisateurs
     """
     participants = models.ManyToManyField(User, related_name='conversations')
+    # Conversation directe : « <plus petit ID>:<plus grand ID> » des deux
+    # participants, unique (voir messaging.utils.direct_conversation)
+    pair_key = models.CharField(max_length=41, unique=True, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -24,7 +27,26 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Historique d'une conversation par curseur (voir MessageHistoryPagination)
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_conv_created_idx'),
+        ]
     
     def __str__(self):
         return f"Message de {self.sender.username} dans {self.conversation}"
 
+
+class MessageCounter(models.Model):
+    """
+    Nombre de messages non lus d'un utilisateur, toutes conversations
+    confondues (dénormalisé)
+
+    Tenu à jour dans la même transaction que les envois, lectures et
+    suppressions (voir messaging.utils.unread_messages.adjust) ; une ligne
+    absente est initialisée par un COUNT à la première lecture.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='message_counter')
+    unread = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.user_id} : {self.unread} messages non lus"
@@ -1,13 +1,15 @@
 # messaging/permissions.py
 from rest_framework import permissions
 
+from .utils import is_participant
+
 class IsConversationParticipant(permissions.BasePermission):
     """
     Permission pour autoriser uniquement les participants d'une conversation à y accéder
     """
     def has_object_permission(self, request, view, obj):
-        # Vérifier si l'utilisateur est un participant de la conversation
-        return request.user in obj.participants.all()
+        # Vérifier si l'utilisateur est un participant de la conversation (recherche indexée)
+        return is_participant(obj.pk, request.user.pk)
 
 class IsMessageSenderOrConversationParticipant(permissions.BasePermission):
     """
@@ -20,4 +22,4 @@ class IsMessageSenderOrConversationParticipant(permissions.BasePermission):
             return obj.sender == request.user
         
         # Pour les méthodes de lecture, tous les participants de la conversation peuvent voir le message
-        return request.user in obj.conversation.participants.all()
\ No newline at end of file
+        return is_participant(obj.conversation_id, request.user.pk)
\ No newline at end of file
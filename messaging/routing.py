@@ -0,0 +1,8 @@
+# messaging/routing.py
+from django.urls import re_path
+
+from .consumers import ChatConsumer
+
+websocket_urlpatterns = [
+    re_path(r'^ws/messaging/(?P<conversation_id>\d+)/$', ChatConsumer.as_asgi()),
+]
@@ -1,6 +1,8 @@
 # messaging/serializers.py
 from rest_framework import serializers
+from django.db import transaction
 from .models import Conversation, Message
+from .utils import create_message, direct_conversation
 from users.serializers import UserProfileSerializer
 from django.contrib.auth import get_user_model
 
@@ -33,9 +35,13 @@ class ConversationSerializer(serializers.ModelSerializer):
     
     def get_last_message(self, obj):
         """
-        Récupère le dernier message de la conversation
+        Récupère le dernier message de la conversation (préchargé par
+        inbox_queryset, sinon une requête)
         """
-        last_message = obj.messages.order_by('-created_at').first()
+        if hasattr(obj, 'latest_messages'):
+            last_message = obj.latest_messages[0] if obj.latest_messages else None
+        else:
+            last_message = obj.messages.select_related('sender').order_by('-created_at', '-id').first()
         if last_message:
             return {
                 'id': last_message.id,
@@ -49,8 +55,11 @@ class ConversationSerializer(serializers.ModelSerializer):
     
     def get_unread_count(self, obj):
         """
-        Compte le nombre de messages non lus dans la conversation
+        Compte le nombre de messages non lus dans la conversation (annoté par
+        inbox_queryset, sinon un COUNT)
         """
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
@@ -61,8 +70,12 @@ class ConversationSerializer(serializers.ModelSerializer):
         Récupère l'autre participant de la conversation (dans le cas d'une conversation à deux)
         """
         request = self.context.get('request')
-        if request and request.user.is_authenticated and obj.participants.count() == 2:
-            other = obj.participants.exclude(id=request.user.id).first()
+        if not (request and request.user.is_authenticated):
+            return None
+        # Lus dans les participants préchargés (même liste que le champ `participants`)
+        participants = obj.participants.all()
+        if len(participants) == 2:
+            other = next((user for user in participants if user.pk != request.user.pk), None)
             if other:
                 return {
                     'id': other.id,
@@ -84,9 +97,7 @@ class ConversationCreateSerializer(serializers.Serializer):
         """
         Vérifie que le destinataire existe
         """
-        try:
-            User.objects.get(id=value)
-        except User.DoesNotExist:
+        if not User.objects.filter(id=value).exists():
             raise serializers.ValidationError("Le destinataire spécifié n'existe pas.")
         
         # Vérifier que le destinataire n'est pas l'expéditeur
@@ -100,29 +111,12 @@ class ConversationCreateSerializer(serializers.Serializer):
         Crée une nouvelle conversation avec un premier message
         """
         sender = self.context['request'].user
-        recipient_id = validated_data['recipient_id']
-        recipient = User.objects.get(id=recipient_id)
-        message_content = validated_data['message']
-        
-        # Vérifier si une conversation existe déjà entre ces deux utilisateurs
-        conversations = Conversation.objects.filter(participants=sender).filter(participants=recipient)
-        
-        if conversations.exists():
-            # Utiliser la conversation existante
-            conversation = conversations.first()
-        else:
-            # Créer une nouvelle conversation
-            conversation = Conversation.objects.create()
-            conversation.participants.add(sender, recipient)
-        
-        # Créer le message
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=sender,
-            content=message_content
-        )
         
-        # Mettre à jour la date de la conversation
-        conversation.save()  # updated_at sera mis à jour automatiquement
+        with transaction.atomic():
+            # Conversation existante entre ces deux utilisateurs, ou nouvelle (voir direct_conversation)
+            conversation, _ = direct_conversation(sender.pk, validated_data['recipient_id'])
+            
+            # Créer le message (compteurs, date de la conversation, diffusion WebSocket)
+            create_message(conversation.pk, sender, validated_data['message'])
         
         return conversation
\ No newline at end of file
@@ -1,3 +1,352 @@
+import base64
+import json
+from importlib import import_module
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from django.apps import apps
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db.models import QuerySet
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from src.websocket import JWTAuthMiddlewareStack
+from users.models import User
+
+from .consumers import MAX_MESSAGE_LENGTH
+from .models import Conversation, Message, MessageCounter
+from .routing import websocket_urlpatterns
+from .serializers import MessageSerializer
+from .utils import (
+    INBOX_QUERY_BUDGET, create_message, direct_conversation, mark_conversation_read, pair_key, unread_messages
+)
+from .views import MessageViewSet
+
+fill_pair_keys = import_module('messaging.migrations.0005_conversation_pair_key').fill_pair_keys
+
+
+class MessagingTestCase(TestCase):
+    """
+    Deux utilisateurs et leur conversation directe
+    """
+
+    def setUp(self):
+        self.alice = User.objects.create(username='alice', email='alice@example.com')
+        self.bob = User.objects.create(username='bob', email='bob@example.com')
+        self.conversation = self._conversation(self.alice, self.bob)
+
+    def _conversation(self, *participants):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(*participants)
+        return conversation
+
+    def _client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class UnreadCounterTests(MessagingTestCase):
+    """
+    Compteurs dénormalisés de messages non lus
+    """
+
+    def test_counter_follows_sends_and_reads(self):
+        self.assertEqual(unread_messages.get(self.bob.pk), 0)
+        for content in ('un', 'deux'):
+            self._client(self.alice).post('/api/messaging/messages/', {
+                'conversation': self.conversation.pk, 'content': content,
+            }, format='json')
+        self.assertEqual(unread_messages.get(self.bob.pk), 2)
+        self.assertEqual(unread_messages.get(self.alice.pk), 0)
+
+        response = self._client(self.bob).post(f'/api/messaging/conversations/{self.conversation.pk}/mark_as_read/')
+
+        self.assertEqual(response.json()['marked_as_read'], 2)
+        self.assertEqual(unread_messages.get(self.bob.pk), 0)
+        self.assertEqual(unread_messages.repair([self.alice.pk, self.bob.pk]), 0)
+
+    def test_concurrent_conversation_reads_decrement_once(self):
+        other = self._conversation(self.bob, User.objects.create(username='carol', email='carol@example.com'))
+        for _ in range(3):
+            create_message(self.conversation.pk, self.alice, 'message', broadcast=False)
+        for _ in range(2):
+            create_message(other.pk, other.participants.exclude(pk=self.bob.pk).get(), 'autre', broadcast=False)
+        self.assertEqual(unread_messages.get(self.bob.pk), 5)
+
+        # Un second marquage (WebSocket) s'intercale avant le premier UPDATE de celui-ci
+        original_update = QuerySet.update
+        raced = {}
+
+        def racing_update(queryset, **kwargs):
+            if not raced:
+                raced['count'] = None
+                raced['count'] = mark_conversation_read(self.conversation.pk, self.bob, broadcast=False)
+            return original_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            count = mark_conversation_read(self.conversation.pk, self.bob, broadcast=False)
+
+        self.assertEqual((raced['count'], count), (3, 0))
+        self.assertEqual(unread_messages.get(self.bob.pk), 2)
+        self.assertFalse(Message.objects.filter(conversation=self.conversation, is_read=False).exists())
+
+    def test_stale_updates_flip_read_state_once(self):
+        message = create_message(self.conversation.pk, self.alice, 'message', broadcast=False)
+        create_message(self.conversation.pk, self.alice, 'autre', broadcast=False)
+        self.assertEqual(unread_messages.get(self.bob.pk), 2)
+        # Deux requêtes PATCH chargées avant que l'une d'elles n'enregistre
+        stale = [Message.objects.get(pk=message.pk) for _ in range(2)]
+        for instance in stale:
+            serializer = MessageSerializer(instance, data={'is_read': True}, partial=True)
+            serializer.is_valid(raise_exception=True)
+            MessageViewSet().perform_update(serializer)
+
+        self.assertEqual(unread_messages.get(self.bob.pk), 1)
+        self.assertEqual(unread_messages.repair([self.bob.pk]), 0)
+
+
+class DirectConversationTests(MessagingTestCase):
+    """
+    Conversation directe unique par paire d'utilisateurs (`pair_key`)
+    """
+
+    def test_pair_key_is_order_independent(self):
+        self.assertEqual(pair_key(12, 3), '3:12')
+        self.assertEqual(pair_key('3', 12), pair_key(12, 3))
+
+    def test_repeated_calls_return_the_same_conversation(self):
+        carol = User.objects.create(username='carol', email='carol@example.com')
+
+        first, created = direct_conversation(self.alice.pk, carol.pk)
+        again, created_again = direct_conversation(carol.pk, self.alice.pk)
+
+        self.assertEqual((created, created_again), (True, False))
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(set(first.participants.values_list('pk', flat=True)), {self.alice.pk, carol.pk})
+
+    def test_concurrent_creation_rereads_the_winner(self):
+        carol = User.objects.create(username='carol', email='carol@example.com')
+        winner, _ = direct_conversation(self.alice.pk, carol.pk)
+        count = Conversation.objects.count()
+
+        # La recherche ne voit pas encore la conversation créée par l'autre requête
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            conversation, created = direct_conversation(carol.pk, self.alice.pk)
+
+        self.assertFalse(created)
+        self.assertEqual(conversation.pk, winner.pk)
+        self.assertEqual(Conversation.objects.count(), count)
+
+    def test_migration_backfills_two_participant_conversations(self):
+        carol = User.objects.create(username='carol', email='carol@example.com')
+        duplicate = self._conversation(self.bob, self.alice)
+        group = self._conversation(self.alice, self.bob, carol)
+        alone = self._conversation(carol)
+        Conversation.objects.update(pair_key=None)
+
+        fill_pair_keys(apps, None)
+
+        keys = dict(Conversation.objects.values_list('pk', 'pair_key'))
+        self.assertEqual(keys[self.conversation.pk], pair_key(self.alice.pk, self.bob.pk))
+        # La plus ancienne des deux conversations de la paire garde la clé
+        self.assertIsNone(keys[duplicate.pk])
+        self.assertIsNone(keys[group.pk])
+        self.assertIsNone(keys[alone.pk])
+        self.assertEqual(direct_conversation(self.bob.pk, self.alice.pk), (self.conversation, False))
+
+
+class InboxQueryBudgetTests(MessagingTestCase):
+    """
+    Boîte de réception en un nombre fixe de requêtes, quel que soit le
+    nombre de conversations et de messages
+    """
+
+    def setUp(self):
+        super().setUp()
+        for index in range(6):
+            contact = User.objects.create(username=f'contact{index}', email=f'contact{index}@example.com')
+            conversation = self._conversation(self.alice, contact)
+            for number in range(3):
+                create_message(conversation.pk, contact, f'message {number}', broadcast=False)
+        create_message(self.conversation.pk, self.bob, 'bonjour', broadcast=False)
+
+    def test_list_stays_within_budget(self):
+        client = self._client(self.alice)
+        with self.assertNumQueries(INBOX_QUERY_BUDGET):
+            response = client.get('/api/messaging/conversations/')
+
+        conversations = response.json()['results']
+        self.assertEqual(len(conversations), 7)
+        self.assertEqual(conversations[0]['last_message']['content'], 'bonjour')
+        self.assertEqual(sum(conversation['unread_count'] for conversation in conversations), 19)
+
+    def test_retrieve_stays_within_budget(self):
+        client = self._client(self.alice)
+        # Pas de COUNT de pagination, mais la vérification de participation
+        with self.assertNumQueries(INBOX_QUERY_BUDGET):
+            response = client.get(f'/api/messaging/conversations/{self.conversation.pk}/')
+
+        self.assertEqual(response.json()['unread_count'], 1)
+        self.assertEqual(len(response.json()['participants']), 2)
+
+
+class MessageHistoryPaginationTests(MessagingTestCase):
+    """
+    Historique d'une conversation par curseur
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [
+            create_message(self.conversation.pk, self.alice, f'message {number}', broadcast=False).pk
+            for number in range(7)
+        ]
+        # Égalités sur la date : l'ID départage
+        Message.objects.filter(pk__in=self.ids[2:5]).update(created_at=timezone.now())
+        self.url = f'/api/messaging/conversations/{self.conversation.pk}/messages/'
+
+    def _page(self, url):
+        response = self._client(self.bob).get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _cursor(self, values):
+        payload = json.dumps({'v': values, 'r': 0}).encode('utf-8')
+        return base64.urlsafe_b64encode(payload).decode('ascii')
+
+    def test_next_links_walk_back_through_history(self):
+        expected = [
+            message.pk for message in Message.objects.filter(conversation=self.conversation).order_by('created_at', 'id')
+        ]
+        page = self._page(f'{self.url}?page_size=3')
+        pages = [[message['id'] for message in page['results']]]
+        while page['next']:
+            page = self._page(page['next'])
+            pages.append([message['id'] for message in page['results']])
+
+        self.assertEqual([len(ids) for ids in pages], [3, 3, 1])
+        self.assertEqual([pk for ids in reversed(pages) for pk in ids], expected)
+
+        # `previous` revient vers les messages plus récents
+        newer = self._page(page['previous'])
+        self.assertEqual([message['id'] for message in newer['results']], pages[-2])
+
+    def test_previous_on_first_page_catches_up_new_messages(self):
+        first = self._page(f'{self.url}?page_size=3')
+        self.assertEqual(self._page(first['previous'])['results'], [])
+
+        latest = create_message(self.conversation.pk, self.alice, 'nouveau', broadcast=False)
+        self.assertEqual([message['id'] for message in self._page(first['previous'])['results']], [latest.pk])
+
+    def test_invalid_cursor_is_not_found(self):
+        client = self._client(self.bob)
+        for cursor in ('pas-un-curseur', self._cursor(['hier', 1]), self._cursor([None, 1]), self._cursor([1])):
+            response = client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+
+class ChatConsumerTests(MessagingTestCase):
+    """
+    WebSocket /ws/messaging/<id>/ : participation, messages, saisie et lecture
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        self.url = f'/ws/messaging/{self.conversation.pk}/'
+        self.assertEqual(unread_messages.get(self.bob.pk), 0)
+
+    async def _connect(self, user, token=None):
+        token = token or str(AccessToken.for_user(user))
+        communicator = WebsocketCommunicator(self.application, f'{self.url}?token={token}')
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    async def _participants(self):
+        alice, connected, _ = await self._connect(self.alice)
+        self.assertTrue(connected)
+        bob, connected, _ = await self._connect(self.bob)
+        self.assertTrue(connected)
+        return alice, bob
+
+    @database_sync_to_async
+    def _messages(self):
+        return list(Message.objects.filter(conversation=self.conversation).values_list('sender_id', 'content'))
+
+    @database_sync_to_async
+    def _unread(self, user):
+        return MessageCounter.objects.get(user=user).unread
+
+    async def test_outsiders_are_refused(self):
+        carol = await database_sync_to_async(User.objects.create)(username='carol', email='carol@example.com')
+        _, connected, code = await self._connect(carol)
+        self.assertEqual((connected, code), (False, 4404))
+
+        _, connected, code = await self._connect(self.alice, token='pas-un-jeton')
+        self.assertEqual((connected, code), (False, 4401))
+
+    async def test_message_is_persisted_and_broadcast(self):
+        alice, bob = await self._participants()
+        try:
+            await alice.send_json_to({'type': 'message', 'content': 'bonjour', 'client_id': 'c-1'})
+
+            echo, received = await alice.receive_json_from(), await bob.receive_json_from()
+            self.assertEqual(echo['client_id'], 'c-1')
+            self.assertNotIn('client_id', received)
+            self.assertEqual(received['message']['content'], 'bonjour')
+            self.assertEqual(received['message']['id'], echo['message']['id'])
+            self.assertEqual(await self._messages(), [(self.alice.pk, 'bonjour')])
+            self.assertEqual(await self._unread(self.bob), 1)
+        finally:
+            await alice.disconnect()
+            await bob.disconnect()
+
+    async def test_typing_is_relayed_but_not_persisted(self):
+        alice, bob = await self._participants()
+        try:
+            await alice.send_json_to({'type': 'typing', 'is_typing': True})
+
+            self.assertEqual(
+                await bob.receive_json_from(), {'type': 'typing', 'user_id': self.alice.pk, 'is_typing': True}
+            )
+            self.assertTrue(await alice.receive_nothing())
+            self.assertEqual(await self._messages(), [])
+        finally:
+            await alice.disconnect()
+            await bob.disconnect()
+
+    async def test_read_event_updates_the_counter(self):
+        for content in ('un', 'deux'):
+            await database_sync_to_async(create_message)(self.conversation.pk, self.alice, content, broadcast=False)
+        self.assertEqual(await self._unread(self.bob), 2)
+        alice, bob = await self._participants()
+        try:
+            await bob.send_json_to({'type': 'read'})
+
+            expected = {'type': 'read', 'user_id': self.bob.pk, 'count': 2}
+            self.assertEqual(await alice.receive_json_from(), expected)
+            self.assertEqual(await bob.receive_json_from(), expected)
+            self.assertEqual(await self._unread(self.bob), 0)
+
+            # Rien de plus à lire : aucune diffusion
+            await bob.send_json_to({'type': 'read'})
+            self.assertTrue(await alice.receive_nothing())
+        finally:
+            await alice.disconnect()
+            await bob.disconnect()
 
-# Create your tests here.
+    async def test_invalid_messages_are_rejected(self):
+        alice, connected, _ = await self._connect(self.alice)
+        self.assertTrue(connected)
+        try:
+            for content in ('x' * (MAX_MESSAGE_LENGTH + 1), '   '):
+                await alice.send_json_to({'type': 'message', 'content': content})
+                self.assertEqual((await alice.receive_json_from())['type'], 'error')
+            await alice.send_json_to({'type': 'inconnu'})
+            self.assertEqual((await alice.receive_json_from())['type'], 'error')
+            self.assertEqual(await self._messages(), [])
+        finally:
+            await alice.disconnect()
@@ -0,0 +1,212 @@
+# messaging/utils.py
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Prefetch, Q
+from django.utils import timezone
+from src.counters import UnreadCounter
+
+from .models import Conversation, Message, MessageCounter
+
+logger = logging.getLogger(__name__)
+
+# Requêtes d'une page de la boîte de réception, quelle que soit sa taille :
+# COUNT de pagination, conversations annotées, participants, derniers messages
+INBOX_QUERY_BUDGET = 4
+
+
+def _unread_per_participant(participants):
+    """
+    Messages non lus par participant : messages de ses conversations non
+    envoyés par lui (une requête groupée sur la table des participants)
+    """
+    return dict(
+        participants.values('user_id')
+        .annotate(unread=Count(
+            'conversation__messages',
+            filter=Q(conversation__messages__is_read=False) & ~Q(conversation__messages__sender_id=F('user_id'))
+        ))
+        .values_list('user_id', 'unread')
+    )
+
+
+def _count_unread_messages(user_ids):
+    return _unread_per_participant(Conversation.participants.through.objects.filter(user_id__in=user_ids))
+
+# Compteurs de messages non lus (voir MessageCounter)
+unread_messages = UnreadCounter(MessageCounter, _count_unread_messages)
+
+
+def unread_in_conversation(conversation_id):
+    """
+    Messages non lus d'une conversation par participant ({ID: nombre})
+    """
+    return _unread_per_participant(
+        Conversation.participants.through.objects.filter(conversation_id=conversation_id)
+    )
+
+
+def message_recipient_ids(conversation_id, sender_id):
+    """
+    IDs des participants d'une conversation autres que l'expéditeur
+    """
+    return list(
+        Conversation.participants.through.objects.filter(conversation_id=conversation_id)
+        .exclude(user_id=sender_id).values_list('user_id', flat=True)
+    )
+
+
+def inbox_queryset(user):
+    """
+    Conversations de `user`, les plus récentes d'abord, avec tout ce
+    qu'affiche ConversationSerializer en un nombre fixe de requêtes
+
+    Date du dernier message et messages non lus (reçus par `user`) sont
+    annotés ; participants et dernier message (avec son expéditeur, attribut
+    `latest_messages`) sont préchargés en une requête chacun pour toute la page.
+    """
+    return Conversation.objects.filter(participants=user).annotate(
+        last_message_time=Max('messages__created_at'),
+        unread_count=Count('messages', filter=Q(messages__is_read=False) & ~Q(messages__sender_id=user.pk)),
+    ).prefetch_related(
+        'participants',
+        Prefetch(
+            'messages',
+            queryset=Message.objects.select_related('sender').order_by('-created_at', '-id')[:1],
+            to_attr='latest_messages'
+        ),
+    ).order_by('-last_message_time')
+
+
+def is_participant(conversation_id, user_id):
+    """
+    Vrai si l'utilisateur participe à la conversation (une recherche dans
+    l'index unique (conversation, utilisateur) de la table des participants)
+    """
+    return Conversation.participants.through.objects.filter(
+        conversation_id=conversation_id, user_id=user_id
+    ).exists()
+
+
+def pair_key(user_id, other_id):
+    """
+    Clé canonique d'une conversation directe entre deux utilisateurs
+    """
+    low, high = sorted((int(user_id), int(other_id)))
+    return f"{low}:{high}"
+
+
+def direct_conversation(user_id, other_id):
+    """
+    Conversation directe entre deux utilisateurs, créée si elle n'existe pas
+
+    Recherche par `pair_key` (index unique) ; deux créations simultanées ne
+    produisent qu'une conversation, la seconde relisant celle de la première.
+
+    Returns:
+        Tuple (conversation, créée)
+    """
+    key = pair_key(user_id, other_id)
+    conversation = Conversation.objects.filter(pair_key=key).first()
+    if conversation is not None:
+        return conversation, False
+    try:
+        with transaction.atomic():
+            conversation = Conversation.objects.create(pair_key=key)
+            conversation.participants.add(user_id, other_id)
+    except IntegrityError:
+        return Conversation.objects.get(pair_key=key), False
+    return conversation, True
+
+
+def conversation_group(conversation_id):
+    """
+    Groupe du channel layer des connexions WebSocket d'une conversation
+    """
+    return f"messaging.conversation.{conversation_id}"
+
+
+def broadcast_to_conversation(conversation_id, event):
+    """
+    Envoie un événement aux connexions WebSocket de la conversation après le
+    commit (voir messaging.consumers) ; envoi au mieux, les clients se
+    resynchronisent par l'API à la reconnexion
+    """
+    def send():
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            async_to_sync(channel_layer.group_send)(conversation_group(conversation_id), event)
+        except Exception:
+            logger.warning("Événement %s non diffusé à la conversation %s", event['type'], conversation_id,
+                           exc_info=True)
+
+    transaction.on_commit(send)
+
+
+def message_event(message, client_id=None):
+    """
+    Événement « chat.message » d'un message enregistré (sérialisé comme par l'API)
+    """
+    from .serializers import MessageSerializer
+
+    return {'type': 'chat.message', 'message': dict(MessageSerializer(message).data), 'client_id': client_id}
+
+
+def create_message(conversation_id, sender, content, broadcast=True):
+    """
+    Enregistre un message : insertion, compteurs de non-lus des autres
+    participants et date de la conversation, dans une transaction
+
+    Point d'entrée commun à l'API et au WebSocket. Avec `broadcast`, le
+    message est diffusé aux connexions de la conversation après le commit ;
+    le consommateur WebSocket le diffuse lui-même.
+
+    Returns:
+        Le message créé
+    """
+    with transaction.atomic():
+        message = Message.objects.create(conversation_id=conversation_id, sender=sender, content=content)
+        unread_messages.adjust(message_recipient_ids(conversation_id, sender.pk), 1)
+        Conversation.objects.filter(pk=conversation_id).update(updated_at=timezone.now())
+        if broadcast:
+            broadcast_to_conversation(conversation_id, message_event(message))
+    return message
+
+
+def mark_conversation_read(conversation_id, user, broadcast=True):
+    """
+    Marque comme lus les messages de la conversation reçus par `user`
+
+    Chaque participant perd, dans son compteur, les messages lus qu'il n'a
+    pas envoyés lui-même. Un UPDATE conditionnel par expéditeur donne le
+    nombre de lignes réellement passées à « lu » par cet appel : deux
+    marquages simultanés (API et WebSocket) ne décomptent qu'une fois. Avec
+    `broadcast`, un événement « chat.read » est diffusé aux connexions de la
+    conversation.
+
+    Returns:
+        Nombre de messages marqués comme lus
+    """
+    unread = Message.objects.filter(conversation_id=conversation_id, is_read=False).exclude(sender=user)
+    with transaction.atomic():
+        sender_ids = list(unread.order_by().values_list('sender_id', flat=True).distinct())
+        by_sender = {}
+        for sender_id in sender_ids:
+            updated = unread.filter(sender_id=sender_id).update(is_read=True)
+            if updated:
+                by_sender[sender_id] = updated
+        count = sum(by_sender.values())
+        participant_ids = Conversation.participants.through.objects.filter(
+            conversation_id=conversation_id
+        ).values_list('user_id', flat=True)
+        unread_messages.adjust_many({
+            participant_id: -(count - by_sender.get(participant_id, 0)) for participant_id in participant_ids
+        })
+        if broadcast and count:
+            broadcast_to_conversation(conversation_id, {'type': 'chat.read', 'user_id': user.pk, 'count': count})
+    return count
@@ -1,13 +1,35 @@
 # messaging/views.py
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
-from django.db.models import Q, Max, F, Count
+from django.db import transaction
 from .models import Conversation, Message
 from .serializers import (
     ConversationSerializer, MessageSerializer, ConversationCreateSerializer
 )
+from src.pagination import KeysetPagination
 from .permissions import IsConversationParticipant, IsMessageSenderOrConversationParticipant
+from .utils import (
+    broadcast_to_conversation, create_message, inbox_queryset, is_participant, mark_conversation_read, message_recipient_ids,
+    unread_in_conversation, unread_messages
+)
+
+class MessageHistoryPagination(KeysetPagination):
+    """
+    Historique d'une conversation par curseur, depuis les messages les plus récents
+
+    Chaque page est servie dans l'ordre chronologique. `next` charge les
+    messages plus anciens ; `previous` les messages plus récents que la
+    page (y compris sur la première page, pour rattraper ceux arrivés
+    depuis : la réponse est vide s'il n'y en a pas).
+    """
+    ordering = ('-created_at', '-id')
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = super().paginate_queryset(queryset, request, view)
+        self.has_previous = bool(rows)
+        return rows[::-1]
 
 class ConversationViewSet(viewsets.ModelViewSet):
     """
@@ -18,12 +40,13 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """
-        Retourne les conversations de l'utilisateur connecté
+        Retourne les conversations de l'utilisateur connecté ; liste et détail
+        sont annotés et préchargés (voir inbox_queryset)
         """
         user = self.request.user
-        return Conversation.objects.filter(participants=user).annotate(
-            last_message_time=Max('messages__created_at')
-        ).order_by('-last_message_time')
+        if self.action in ('list', 'retrieve'):
+            return inbox_queryset(user)
+        return Conversation.objects.filter(participants=user)
     
     def get_permissions(self):
         """
@@ -50,19 +73,14 @@ class ConversationViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
         """
-        Récupère les messages d'une conversation
+        Récupère les messages d'une conversation, par curseur (voir MessageHistoryPagination)
         """
         conversation = self.get_object()
-        messages = conversation.messages.all().order_by('created_at')
-        
-        # Pagination
-        page = self.paginate_queryset(messages)
-        if page is not None:
-            serializer = MessageSerializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
+        paginator = MessageHistoryPagination()
+        page = paginator.paginate_queryset(conversation.messages.select_related('sender'), request, view=self)
+        serializer = MessageSerializer(page, many=True, context={'request': request})
         
-        serializer = MessageSerializer(messages, many=True, context={'request': request})
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
     
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
@@ -70,14 +88,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
         Marque tous les messages non lus d'une conversation comme lus
         """
         conversation = self.get_object()
-        unread_messages = conversation.messages.filter(
-            is_read=False
-        ).exclude(
-            sender=request.user
-        )
-        
-        unread_count = unread_messages.count()
-        unread_messages.update(is_read=True)
+        unread_count = mark_conversation_read(conversation.pk, request.user)
         
         return Response({
             'status': 'success',
@@ -89,17 +100,15 @@ class ConversationViewSet(viewsets.ModelViewSet):
         """
         Récupère le nombre total de messages non lus pour l'utilisateur
         """
-        user = request.user
-        count = Message.objects.filter(
-            conversation__participants=user,
-            is_read=False
-        ).exclude(
-            sender=user
-        ).count()
-        
         return Response({
-            'unread_count': count
+            'unread_count': unread_messages.get(request.user.pk)
         })
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            unread = unread_in_conversation(instance.pk)
+            instance.delete()
+            unread_messages.adjust_many({user_id: -count for user_id, count in unread.items() if count})
 
 class MessageViewSet(viewsets.ModelViewSet):
     """
@@ -120,17 +129,36 @@ class MessageViewSet(viewsets.ModelViewSet):
         Crée un nouveau message
         """
         conversation_id = self.request.data.get('conversation')
-        conversation = Conversation.objects.get(id=conversation_id)
         
-        # Vérifier que l'utilisateur est un participant de la conversation
-        if self.request.user not in conversation.participants.all():
-            raise permissions.PermissionDenied("Vous n'êtes pas autorisé à envoyer des messages dans cette conversation.")
+        # Vérifier que l'utilisateur est un participant de la conversation (recherche indexée)
+        if not str(conversation_id).isdigit() or not is_participant(conversation_id, self.request.user.pk):
+            raise PermissionDenied("Vous n'êtes pas autorisé à envoyer des messages dans cette conversation.")
         
-        # Créer le message
-        serializer.save(sender=self.request.user, conversation=conversation)
-        
-        # Mettre à jour la date de la conversation
-        conversation.save()  # updated_at sera mis à jour automatiquement
+        # Enregistré et diffusé aux connexions WebSocket de la conversation
+        serializer.instance = create_message(int(conversation_id), self.request.user, serializer.validated_data['content'])
+    
+    def perform_update(self, serializer):
+        was_read = serializer.instance.is_read
+        is_read = serializer.validated_data.get('is_read', was_read)
+        with transaction.atomic():
+            # Bascule conditionnelle : seule la requête qui change effectivement
+            # l'état de lecture ajuste les compteurs
+            flipped = 0
+            if is_read != was_read:
+                flipped = Message.objects.filter(pk=serializer.instance.pk, is_read=was_read).update(is_read=is_read)
+            message = serializer.save()
+            if flipped:
+                unread_messages.adjust(
+                    message_recipient_ids(message.conversation_id, message.sender_id), -1 if is_read else 1
+                )
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            deleted, _ = Message.objects.filter(pk=instance.pk, is_read=False).delete()
+            if deleted:
+                unread_messages.adjust(message_recipient_ids(instance.conversation_id, instance.sender_id), -1)
+            else:
+                instance.delete()
     
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
@@ -146,8 +174,13 @@ class MessageViewSet(viewsets.ModelViewSet):
                 'detail': "Vous ne pouvez pas marquer vos propres messages comme lus."
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        message.is_read = True
-        message.save(update_fields=['is_read'])
+        with transaction.atomic():
+            # UPDATE conditionnel : deux lectures simultanées ne décomptent qu'une fois
+            if Message.objects.filter(pk=message.pk, is_read=False).update(is_read=True):
+                unread_messages.adjust(message_recipient_ids(message.conversation_id, message.sender_id), -1)
+                broadcast_to_conversation(message.conversation_id, {
+                    'type': 'chat.read', 'user_id': request.user.pk, 'count': 1, 'message_id': message.pk
+                })
         
         return Response({
             'status': 'success',
@@ -1,6 +1,10 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Notification
+from .models import Notification, NotificationArchive, NotificationCounter, NotificationFanout, OutgoingEmail
 
-admin.site .register(Notification)
\ No newline at end of file
+admin.site .register(Notification)
+admin.site.register(NotificationFanout)
+admin.site.register(NotificationCounter)
+admin.site.register(NotificationArchive)
+admin.site.register(OutgoingEmail)
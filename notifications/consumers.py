@@ -0,0 +1,51 @@
+# notifications/consumers.py
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .utils import notification_group, unread_notifications
+
+
+class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    """
+    /ws/notifications/ : notifications de l'utilisateur connecté en temps réel
+
+    À la connexion : {"type": "unread_count", "count": n}. Ensuite, à chaque
+    notification créée : {"type": "notification", "notification": {...},
+    "unread_delta": 1} ; à chaque regroupement dans une notification non lue
+    existante, le même message avec "unread_delta": 0 (remplacer la
+    notification de même "id") ; à chaque lecture ou suppression :
+    {"type": "unread_count", "delta": -n}.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        self.group_name = notification_group(user.pk)
+        # Abonnement avant le comptage : aucune variation ne peut passer entre les deux
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.send_json({'type': 'unread_count', 'count': await self._unread_count(user.pk)})
+
+    async def disconnect(self, code):
+        if getattr(self, 'group_name', None):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        # Canal en lecture seule : la lecture passe par l'API REST
+        pass
+
+    async def notification_created(self, event):
+        await self.send_json({'type': 'notification', 'notification': event['notification'], 'unread_delta': 1})
+
+    async def notification_updated(self, event):
+        await self.send_json({'type': 'notification', 'notification': event['notification'], 'unread_delta': 0})
+
+    async def notification_unread(self, event):
+        await self.send_json({'type': 'unread_count', 'delta': event['delta']})
+
+    @database_sync_to_async
+    def _unread_count(self, user_id):
+        return unread_notifications.get(user_id)
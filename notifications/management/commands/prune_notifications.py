@@ -0,0 +1,56 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from notifications.retention import RETENTION_CHUNK_SIZE, RETENTION_PAUSE, NotificationRetention
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive (ou supprime) les notifications lues anciennes puis purge les archives expirées, "
+        "par plages d'identifiants avec pause entre les lots (à planifier quotidiennement)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=float, default=None,
+                            help="Âge minimal des notifications lues (NOTIFICATION_RETENTION_DAYS par défaut)")
+        parser.add_argument('--archive-older-than-days', type=float, default=None,
+                            help="Âge des archives purgées (NOTIFICATION_ARCHIVE_RETENTION_DAYS par défaut)")
+        parser.add_argument('--delete', action='store_true',
+                            help="Supprime sans archiver")
+        parser.add_argument('--chunk-size', type=int, default=RETENTION_CHUNK_SIZE,
+                            help="Identifiants couverts par lot")
+        parser.add_argument('--pause', type=float, default=RETENTION_PAUSE,
+                            help="Secondes d'attente après chaque lot non vide")
+        parser.add_argument('--max-rate', type=float, default=None,
+                            help="Débit maximal en lignes par seconde")
+        parser.add_argument('--max-seconds', type=float, default=None,
+                            help="Durée maximale de l'exécution (reprise à la suivante)")
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit les métriques dans ce fichier")
+
+    def handle(self, *args, **options):
+        def days(value):
+            return None if value is None else timedelta(days=value)
+
+        metrics = NotificationRetention(
+            older_than=days(options['older_than_days']),
+            archive_older_than=days(options['archive_older_than_days']),
+            archive=not options['delete'],
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            max_rate=options['max_rate'],
+            max_seconds=options['max_seconds'],
+        ).run()
+
+        self.stdout.write(
+            f"{metrics['archived']} archivées, {metrics['deleted']} supprimées, {metrics['purged']} archives "
+            f"purgées en {metrics['chunks']} lots ({metrics['empty_chunks']} vides), {metrics['elapsed_s']:.2f}s, "
+            f"{metrics['rows_per_s']:.0f} lignes/s, plus long lot {metrics['max_chunk_ms']:.1f}ms, "
+            f"pauses {metrics['throttled_s']:.2f}s"
+        )
+        if not metrics['completed']:
+            self.stdout.write(self.style.WARNING("Durée maximale atteinte : la suite sera traitée à la prochaine exécution."))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(metrics, handle, indent=2)
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcule les compteurs dénormalisés de notifications et de messages non lus, "
+        "par lots d'utilisateurs (après un import, une migration ou une dérive constatée)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=['notifications', 'messages'], default=None)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Secondes d'attente entre deux lots")
+
+    def handle(self, *args, **options):
+        from messaging.utils import unread_messages
+        from notifications.utils import unread_notifications
+
+        counters = {'notifications': unread_notifications, 'messages': unread_messages}
+        if options['only']:
+            counters = {options['only']: counters[options['only']]}
+
+        started = time.perf_counter()
+        users = 0
+        drifted_by_name = dict.fromkeys(counters, 0)
+        after = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(pk__gt=after).order_by('pk').values_list('pk', flat=True)[:options['chunk_size']]
+            )
+            if not user_ids:
+                break
+            with transaction.atomic():
+                for name, counter in counters.items():
+                    drifted_by_name[name] += counter.repair(user_ids)
+            users += len(user_ids)
+            after = user_ids[-1]
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        drifted = sum(drifted_by_name.values())
+        details = ', '.join(f"{name} : {count}" for name, count in drifted_by_name.items())
+        self.stdout.write(
+            f"{users} utilisateurs recalculés en {time.perf_counter() - started:.2f}s, "
+            f"{drifted} compteurs corrigés ou créés ({details})"
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from notifications.utils import run_pending_notification_fanouts
+
+
+class Command(BaseCommand):
+    help = (
+        "Exécute les envois groupés de notifications en attente ou interrompus "
+        "(déploiement sans worker en processus, reprise après arrêt)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help="Reprend aussi les envois échoués, là où ils se sont arrêtés")
+
+    def handle(self, *args, **options):
+        jobs, created = run_pending_notification_fanouts(retry_failed=options['retry_failed'])
+        self.stdout.write(f"{jobs} envois groupés traités, {created} notifications créées")
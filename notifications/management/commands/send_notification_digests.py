@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from notifications.utils import DIGEST_CHUNK_SIZE, DIGEST_MIN_ROWS, build_notification_digests
+
+
+class Command(BaseCommand):
+    help = (
+        "Remplace les notifications non lues anciennes (commentaires, réponses, investissements, "
+        "mises à jour de projet) par un résumé par utilisateur ; à planifier (cron), par exemple "
+        "une fois par jour."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-hours', type=float, default=24,
+                            help="Âge minimal (dernière mise à jour) des notifications résumées")
+        parser.add_argument('--min-rows', type=int, default=DIGEST_MIN_ROWS,
+                            help="Nombre minimal de notifications remplacées par utilisateur")
+        parser.add_argument('--chunk-size', type=int, default=DIGEST_CHUNK_SIZE,
+                            help="Utilisateurs traités par transaction")
+
+    def handle(self, *args, **options):
+        digests, folded = build_notification_digests(
+            timedelta(hours=options['older_than_hours']),
+            min_rows=options['min_rows'],
+            chunk_size=options['chunk_size']
+        )
+        self.stdout.write(f"{digests} résumés créés, {folded} notifications remplacées")
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notifications.outbox import EMAIL_BATCH_SIZE, send_queued_emails
+
+
+class Command(BaseCommand):
+    help = (
+        "Envoie les emails en attente de la boîte d'envoi, par lots sur une même connexion "
+        "(déploiement sans worker en processus, reprise après arrêt, nouvelles tentatives)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Emails envoyés par connexion (EMAIL_OUTBOX_BATCH_SIZE par défaut)")
+        parser.add_argument('--include-scheduled', action='store_true',
+                            help="Envoie aussi les nouvelles tentatives planifiées plus tard")
+        parser.add_argument('--retry-failed', action='store_true',
+                            help="Remet en attente les emails abandonnés")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', EMAIL_BATCH_SIZE)
+        result = send_queued_emails(
+            batch_size=batch_size,
+            include_scheduled=options['include_scheduled'],
+            retry_failed=options['retry_failed']
+        )
+        self.stdout.write(
+            f"{result['sent']} emails envoyés en {result['batches']} lots, "
+            f"{result['retry']} replanifiés, {result['failed']} abandonnés"
+        )
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.7 on 2026-10-19 01:38
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at(apps, schema_editor):
+    Notification = apps.get_model('notifications', 'Notification')
+    Notification.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_unread_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='notification',
+            options={'ordering': ['-updated_at']},
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='group_key',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('comment', 'Nouveau commentaire'), ('reply', 'Réponse à un commentaire'), ('message', 'Nouveau message'), ('investment', 'Nouvel investissement'), ('project_update', 'Mise à jour de projet'), ('system', 'Notification système'), ('digest', 'Résumé')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='notificationfanout',
+            name='notification_type',
+            field=models.CharField(choices=[('comment', 'Nouveau commentaire'), ('reply', 'Réponse à un commentaire'), ('message', 'Nouveau message'), ('investment', 'Nouvel investissement'), ('project_update', 'Mise à jour de projet'), ('system', 'Notification système'), ('digest', 'Résumé')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-updated_at'], name='notification_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'notification_type', 'group_key', '-updated_at'], name='notification_coalesce_idx'),
+        ),
+    ]
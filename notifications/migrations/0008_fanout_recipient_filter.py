@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:03
+
+from django.db import migrations, models
+
+
+def fail_pickled_fanouts(apps, schema_editor):
+    # Les requêtes sérialisées ne sont plus relues : les envois non terminés
+    # qui en dépendent sont marqués en échec, à relancer explicitement
+    NotificationFanout = apps.get_model('notifications', 'NotificationFanout')
+    NotificationFanout.objects.filter(
+        recipient_query__isnull=False, status__in=('pending', 'running', 'failed')
+    ).update(status='failed', locked_at=None, last_error="Audience sérialisée abandonnée : relancer l'envoi.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0007_email_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_pickled_fanouts, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='notificationfanout',
+            name='recipient_query',
+        ),
+        migrations.AddField(
+            model_name='notificationfanout',
+            name='recipient_filter',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
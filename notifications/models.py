@@ -1,9 +1,15 @@
 from django.db import models
+from django.utils import timezone
 from users.models import User
 
 class Notification(models.Model):
     """
     Notifications pour les utilisateurs
+
+    Les notifications fréquentes d'un même type sur un même objet
+    (`group_key`, par exemple « project:12 ») sont regroupées tant qu'elles
+    ne sont pas lues : `count` compte les événements fusionnés et
+    `updated_at` date le dernier (voir notifications.utils.coalesce_notification).
     """
     NOTIFICATION_TYPES = (
         ('comment', 'Nouveau commentaire'),
@@ -12,6 +18,7 @@ class Notification(models.Model):
         ('investment', 'Nouvel investissement'),
         ('project_update', 'Mise à jour de projet'),
         ('system', 'Notification système'),
+        ('digest', 'Résumé'),
     )
     
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
@@ -20,12 +27,147 @@ class Notification(models.Model):
     message = models.TextField()
     related_object_id = models.PositiveIntegerField(null=True, blank=True)
     related_object_type = models.CharField(max_length=50, blank=True)
+    group_key = models.CharField(max_length=100, blank=True)
+    count = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now)
     is_read = models.BooleanField(default=False)
     
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['recipient', '-updated_at'], name='notification_feed_idx'),
+            models.Index(fields=['recipient', 'notification_type', 'group_key', '-updated_at'],
+                         name='notification_coalesce_idx'),
+        ]
     
     def __str__(self):
         return f"{self.notification_type} pour {self.recipient.username}"
 
+
+
+class NotificationFanout(models.Model):
+    """
+    Envoi d'une même notification à toute une audience (tâche de fond)
+
+    Les destinataires (filtre déclaratif sur User ou liste d'IDs) sont
+    parcourus par ID croissant ; `last_recipient_id` avance dans la même
+    transaction que chaque lot inséré, si bien qu'une reprise après
+    interruption ne crée aucun doublon.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminé'),
+        ('failed', 'Échoué'),
+    )
+    
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    title = models.CharField(max_length=255)
+    message = models.TextField()
+    context = models.JSONField(default=dict, blank=True)
+    related_object_id = models.PositiveIntegerField(null=True, blank=True)
+    related_object_type = models.CharField(max_length=50, blank=True)
+    # {'filter': {recherche: valeur}, 'exclude': {...}} réévalué à l'exécution
+    recipient_filter = models.JSONField(null=True, blank=True)
+    recipient_ids = models.JSONField(null=True, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    last_recipient_id = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='fanout_status_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.notification_type} : {self.sent}/{self.total} ({self.status})"
+
+
+class NotificationCounter(models.Model):
+    """
+    Nombre de notifications non lues d'un utilisateur (dénormalisé)
+
+    Tenu à jour dans la même transaction que les créations, lectures et
+    suppressions (voir notifications.utils.unread_notifications.adjust). Une
+    ligne absente signifie « inconnu » : elle est initialisée par un COUNT à
+    la première lecture ; la commande repair_unread_counters recalcule tout.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.user_id} : {self.unread} non lues"
+
+
+class NotificationArchive(models.Model):
+    """
+    Notifications lues anciennes, déplacées hors de la table Notification
+
+    Même identifiant et mêmes colonnes que la notification d'origine ;
+    alimentée par lots par notifications.retention (commande
+    prune_notifications), qui purge aussi les archives au-delà de leur durée
+    de conservation, et par les résumés (build_notification_digests) qui y
+    déplacent les notifications non lues qu'ils remplacent.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notifications')
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    title = models.CharField(max_length=100)
+    message = models.TextField()
+    related_object_id = models.PositiveIntegerField(null=True, blank=True)
+    related_object_type = models.CharField(max_length=50, blank=True)
+    group_key = models.CharField(max_length=100, blank=True)
+    count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', '-created_at'], name='notif_archive_recipient_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.notification_type} archivée pour {self.recipient_id}"
+
+
+class OutgoingEmail(models.Model):
+    """
+    Boîte d'envoi des emails
+
+    Les vues enregistrent le message puis répondent ; un worker l'envoie
+    après le commit, par lots sur une même connexion SMTP, avec nouvelles
+    tentatives espacées (voir notifications.outbox). Un email envoyé est
+    supprimé de la table (les liens qu'il contient ne sont pas conservés).
+    """
+    STATUS_CHOICES = (
+        ('pending', 'En attente'),
+        ('sending', 'En cours'),
+        ('failed', 'Échoué'),
+    )
+    
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='email_status_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.subject} pour {', '.join(self.to)} ({self.status})"
@@ -0,0 +1,283 @@
+# notifications/outbox.py
+import logging
+import queue
+import smtplib
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection, send_mail
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+# Emails envoyés par connexion SMTP
+EMAIL_BATCH_SIZE = 50
+# Nombre maximal d'essais avant abandon
+EMAIL_MAX_ATTEMPTS = 6
+# Délai avant un nouvel essai : doublé à chaque échec, plafonné
+EMAIL_RETRY_BASE_SECONDS = 30
+EMAIL_RETRY_MAX_SECONDS = 3600
+# Un lot resté « en cours » plus longtemps est considéré abandonné (processus tué)
+EMAIL_SENDING_TIMEOUT = timedelta(minutes=10)
+# Durée (secondes) pendant laquelle un worker inactif garde sa connexion ouverte
+EMAIL_KEEPALIVE_SECONDS = 5
+# Erreurs de connexion (coupure par le serveur, socket fermée) : le message n'a
+# pas été transmis et peut être renvoyé aussitôt sur une nouvelle connexion
+EMAIL_RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+
+def queue_email(subject, message, recipient_list, from_email=None):
+    """
+    Enregistre un email dans la boîte d'envoi ; il part après le commit, par
+    le worker du processus (ou la commande send_queued_emails)
+
+    Mêmes arguments que send_mail. Avec EMAIL_OUTBOX = False, l'email est
+    envoyé immédiatement, comme avant la boîte d'envoi.
+
+    Returns:
+        L'email enregistré, ou None s'il a été envoyé directement
+    """
+    from_email = from_email or settings.DEFAULT_FROM_EMAIL
+    if not getattr(settings, 'EMAIL_OUTBOX', True):
+        send_mail(subject, message, from_email, recipient_list, fail_silently=False)
+        return None
+
+    email = OutgoingEmail.objects.create(
+        subject=subject, body=message, from_email=from_email, to=list(recipient_list)
+    )
+    transaction.on_commit(email_worker.submit)
+    return email
+
+
+def _claim_emails(batch_size, now):
+    """
+    Réserve jusqu'à `batch_size` emails dus (un UPDATE) et les retourne
+    """
+    due = list(
+        OutgoingEmail.objects.filter(status='pending', next_attempt_at__lte=now)
+        .order_by('pk').values_list('pk', flat=True)[:batch_size]
+    )
+    if not due:
+        return []
+    OutgoingEmail.objects.filter(pk__in=due, status='pending').update(
+        status='sending', attempts=F('attempts') + 1, locked_at=now
+    )
+    # `locked_at` distingue les lignes réservées ici de celles prises par un autre worker
+    return list(OutgoingEmail.objects.filter(pk__in=due, status='sending', locked_at=now).order_by('pk'))
+
+
+def _record_failures(emails, errors):
+    """
+    Replanifie les emails en échec (délai exponentiel) ou les abandonne
+
+    Returns:
+        Tuple (replanifiés, abandonnés, plus court délai en secondes ou None)
+    """
+    retried = failed = 0
+    next_delay = None
+    for email in emails:
+        error = errors[email.pk]
+        if email.attempts >= EMAIL_MAX_ATTEMPTS:
+            logger.error("Email %s abandonné : %s", email.pk, error)
+            OutgoingEmail.objects.filter(pk=email.pk).update(status='failed', locked_at=None, last_error=error)
+            failed += 1
+            continue
+        delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (email.attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+        logger.warning("Email %s en échec, nouvel essai dans %ss : %s", email.pk, delay, error)
+        OutgoingEmail.objects.filter(pk=email.pk).update(
+            status='pending', locked_at=None, last_error=error,
+            next_attempt_at=timezone.now() + timedelta(seconds=delay)
+        )
+        retried += 1
+        next_delay = delay if next_delay is None else min(next_delay, delay)
+    return retried, failed, next_delay
+
+
+def _send_message(connection, message):
+    """
+    Envoie un message sur la connexion ouverte ; si la connexion est perdue
+    (fermée par le serveur après inactivité, par exemple), un second essai
+    sur une nouvelle connexion
+
+    Les autres erreurs (destinataire refusé, erreur du serveur) sont levées :
+    l'email suit le délai exponentiel de _record_failures.
+    """
+    try:
+        connection.send_messages([message])
+    except EMAIL_RECONNECT_ERRORS:
+        connection.close()
+        connection.open()
+        connection.send_messages([message])
+
+
+def send_email_batch(batch_size=EMAIL_BATCH_SIZE, connection=None):
+    """
+    Envoie un lot d'emails dus sur une seule connexion
+
+    `connection` est une connexion à réutiliser, laissée ouverte (worker) ;
+    sans elle, une connexion est ouverte pour le lot puis fermée. Les emails
+    envoyés sont supprimés en une requête, les autres replanifiés.
+
+    Returns:
+        Dict {'claimed', 'sent', 'retry', 'failed', 'next_retry_in'}
+    """
+    emails = _claim_emails(batch_size, timezone.now())
+    result = {'claimed': len(emails), 'sent': 0, 'retry': 0, 'failed': 0, 'next_retry_in': None}
+    if not emails:
+        return result
+
+    sent = []
+    errors = {}
+    owned = connection is None
+    if owned:
+        connection = get_connection(fail_silently=False)
+    try:
+        # Sans effet sur une connexion déjà ouverte
+        connection.open()
+    except Exception as exc:
+        errors = dict.fromkeys((email.pk for email in emails), f"{type(exc).__name__}: {exc}")
+    else:
+        try:
+            for email in emails:
+                message = EmailMessage(email.subject, email.body, email.from_email, email.to, connection=connection)
+                try:
+                    _send_message(connection, message)
+                    sent.append(email.pk)
+                except Exception as exc:
+                    errors[email.pk] = f"{type(exc).__name__}: {exc}"
+        finally:
+            if owned:
+                connection.close()
+
+    if sent:
+        OutgoingEmail.objects.filter(pk__in=sent).delete()
+    result['sent'] = len(sent)
+    result['retry'], result['failed'], result['next_retry_in'] = _record_failures(
+        [email for email in emails if email.pk in errors], errors
+    )
+    return result
+
+
+def reclaim_stale_emails():
+    """
+    Remet en attente les emails bloqués « en cours » (worker interrompu)
+    """
+    return OutgoingEmail.objects.filter(
+        status='sending', locked_at__lt=timezone.now() - EMAIL_SENDING_TIMEOUT
+    ).update(status='pending', locked_at=None)
+
+
+def send_queued_emails(batch_size=EMAIL_BATCH_SIZE, include_scheduled=False, retry_failed=False):
+    """
+    Envoie tous les emails dus, lot après lot ; utilisé par la commande
+    send_queued_emails (reprise après arrêt, déploiement sans worker)
+
+    Returns:
+        Dict {'batches', 'sent', 'retry', 'failed'}
+    """
+    reclaim_stale_emails()
+    if retry_failed:
+        OutgoingEmail.objects.filter(status='failed').update(status='pending', attempts=0)
+    if include_scheduled:
+        OutgoingEmail.objects.filter(status='pending').update(next_attempt_at=timezone.now())
+
+    totals = {'batches': 0, 'sent': 0, 'retry': 0, 'failed': 0}
+    while True:
+        result = send_email_batch(batch_size)
+        if not result['claimed']:
+            return totals
+        totals['batches'] += 1
+        for key in ('sent', 'retry', 'failed'):
+            totals[key] += result[key]
+
+
+class EmailOutboxWorker:
+    """
+    Threads de fond qui vident la boîte d'envoi après chaque enregistrement
+
+    Un réveil vide toute la file due. Chaque thread garde sa connexion
+    ouverte EMAIL_OUTBOX_KEEPALIVE secondes après le dernier envoi : les
+    emails suivants ne paient pas une nouvelle connexion. Les nouvelles
+    tentatives sont replanifiées par minuterie. Sans worker configuré
+    (EMAIL_OUTBOX_WORKERS = 0), la commande send_queued_emails s'en charge.
+    """
+
+    def __init__(self, workers=None, batch_size=None, keepalive=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.keepalive = keepalive
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _worker_count(self):
+        if self.workers is not None:
+            return self.workers
+        return getattr(settings, 'EMAIL_OUTBOX_WORKERS', 1)
+
+    def _keepalive(self):
+        if self.keepalive is not None:
+            return self.keepalive
+        return getattr(settings, 'EMAIL_OUTBOX_KEEPALIVE', EMAIL_KEEPALIVE_SECONDS)
+
+    def submit(self):
+        if not self._worker_count():
+            return
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue()
+                for index in range(self._worker_count()):
+                    threading.Thread(target=self._run, name=f"email-outbox-{index}", daemon=True).start()
+        self._queue.put(None)
+
+    def wait_idle(self):
+        """
+        Attend que les réveils en cours soient traités (hors nouvelles tentatives planifiées)
+        """
+        if self._queue is not None:
+            self._queue.join()
+
+    def _run(self):
+        connection = None
+        while True:
+            try:
+                self._queue.get(timeout=self._keepalive() if connection is not None else None)
+            except queue.Empty:
+                # Inactif : la connexion est rendue au serveur
+                connection = self._close(connection)
+                continue
+            try:
+                if connection is None:
+                    connection = get_connection(fail_silently=False)
+                self._drain(connection)
+            except Exception:
+                logger.exception("Erreur du worker d'envoi d'emails")
+                connection = self._close(connection)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                logger.warning("Fermeture de la connexion email impossible", exc_info=True)
+        return None
+
+    def _drain(self, connection):
+        batch_size = self.batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', EMAIL_BATCH_SIZE)
+        while True:
+            result = send_email_batch(batch_size, connection)
+            if result['next_retry_in'] is not None:
+                timer = threading.Timer(result['next_retry_in'], self.submit)
+                timer.daemon = True
+                timer.start()
+            if not result['claimed']:
+                return
+
+email_worker = EmailOutboxWorker()
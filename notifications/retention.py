@@ -0,0 +1,170 @@
+# notifications/retention.py
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Notification, NotificationArchive
+
+logger = logging.getLogger(__name__)
+
+# Durées de conservation par défaut (jours), voir NOTIFICATION_RETENTION_DAYS et
+# NOTIFICATION_ARCHIVE_RETENTION_DAYS
+RETENTION_DAYS = 90
+ARCHIVE_RETENTION_DAYS = 365
+# Étendue d'identifiants traitée par transaction
+RETENTION_CHUNK_SIZE = 5000
+# Pause (secondes) après chaque lot non vide
+RETENTION_PAUSE = 0.05
+# Colonnes copiées dans l'archive
+ARCHIVED_FIELDS = (
+    'id', 'recipient_id', 'notification_type', 'title', 'message', 'related_object_id',
+    'related_object_type', 'group_key', 'count', 'created_at', 'updated_at'
+)
+
+
+def archive_notifications(rows):
+    """
+    Copie les notifications de `rows` dans NotificationArchive puis les
+    supprime (dans la transaction de l'appelant)
+
+    Le DELETE reprend les conditions de `rows` en plus des identifiants lus :
+    une notification modifiée entre la lecture et la suppression (marquée
+    non lue, regroupée avec un nouvel événement) reste en place et sa copie
+    est retirée de l'archive.
+
+    Returns:
+        Les colonnes (ARCHIVED_FIELDS) des notifications effectivement archivées
+    """
+    values = list(rows.values(*ARCHIVED_FIELDS))
+    if not values:
+        return []
+    NotificationArchive.objects.bulk_create(
+        [NotificationArchive(**value) for value in values], ignore_conflicts=True
+    )
+    ids = [value['id'] for value in values]
+    deleted, _ = rows.filter(pk__in=ids).delete()
+    if deleted < len(values):
+        kept = set(Notification.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        NotificationArchive.objects.filter(pk__in=kept).delete()
+        values = [value for value in values if value['id'] not in kept]
+    return values
+
+
+def retention_days():
+    return getattr(settings, 'NOTIFICATION_RETENTION_DAYS', RETENTION_DAYS)
+
+
+def archive_retention_days():
+    return getattr(settings, 'NOTIFICATION_ARCHIVE_RETENTION_DAYS', ARCHIVE_RETENTION_DAYS)
+
+
+class NotificationRetention:
+    """
+    Archivage (ou suppression) des notifications lues anciennes, puis purge
+    des archives expirées, par plages d'identifiants
+
+    Les identifiants croissant avec la date de création, la dernière ligne
+    créée avant la date limite borne le parcours ; chaque plage de
+    `chunk_size` identifiants est une transaction courte (copie dans
+    NotificationArchive puis DELETE par clé primaire), suivie d'une pause.
+    Le débit peut être plafonné (`max_rate`, lignes/s) et la durée bornée
+    (`max_seconds`) : une exécution interrompue reprend d'elle-même, les
+    lignes traitées ayant quitté la table. Les notifications non lues ne
+    sont jamais touchées (les compteurs de non-lus restent exacts).
+    """
+
+    def __init__(self, older_than=None, archive_older_than=None, archive=True, chunk_size=RETENTION_CHUNK_SIZE,
+                 pause=RETENTION_PAUSE, max_rate=None, max_seconds=None):
+        self.older_than = timedelta(days=retention_days()) if older_than is None else older_than
+        if archive_older_than is None and archive_retention_days():
+            archive_older_than = timedelta(days=archive_retention_days())
+        self.archive_older_than = archive_older_than
+        self.archive = archive
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.max_rate = max_rate
+        self.max_seconds = max_seconds
+
+    def run(self):
+        """
+        Returns:
+            Dict de métriques : lignes par phase ('archived' ou 'deleted',
+            'purged'), lots, durée, débit (lignes/s), plus long lot (ms,
+            durée maximale des verrous), temps de pause et 'completed' (False
+            si `max_seconds` a interrompu le parcours)
+        """
+        now = timezone.now()
+        self._started = time.perf_counter()
+        self._deadline = self._started + self.max_seconds if self.max_seconds else None
+        self._metrics = {
+            'archived': 0, 'deleted': 0, 'purged': 0, 'chunks': 0, 'empty_chunks': 0,
+            'max_chunk_ms': 0.0, 'throttled_s': 0.0, 'completed': True,
+        }
+        self._rows = 0
+
+        cutoff = now - self.older_than
+        phase = 'archived' if self.archive else 'deleted'
+        completed = self._walk(
+            Notification, Notification.objects.filter(is_read=True, updated_at__lt=cutoff), cutoff,
+            self._archive_rows if self.archive else self._delete_rows, phase
+        )
+        if completed and self.archive_older_than:
+            cutoff = now - self.archive_older_than
+            completed = self._walk(
+                NotificationArchive, NotificationArchive.objects.filter(created_at__lt=cutoff), cutoff,
+                self._delete_rows, 'purged'
+            )
+
+        metrics = self._metrics
+        metrics['completed'] = completed
+        metrics['elapsed_s'] = time.perf_counter() - self._started
+        metrics['rows_per_s'] = self._rows / metrics['elapsed_s'] if metrics['elapsed_s'] else 0.0
+        logger.info(
+            "Rétention des notifications : %s archivées, %s supprimées, %s archives purgées "
+            "en %s lots (%.2fs, %.0f lignes/s)", metrics['archived'], metrics['deleted'], metrics['purged'],
+            metrics['chunks'], metrics['elapsed_s'], metrics['rows_per_s']
+        )
+        return metrics
+
+    def _walk(self, model, eligible, cutoff, handle, phase):
+        upper = model.objects.filter(created_at__lt=cutoff).order_by('-pk').values_list('pk', flat=True).first()
+        if upper is None:
+            return True
+        lower = model.objects.order_by('pk').values_list('pk', flat=True).first()
+
+        for start in range(lower, upper + 1, self.chunk_size):
+            if self._deadline is not None and time.perf_counter() >= self._deadline:
+                return False
+            chunk_started = time.perf_counter()
+            with transaction.atomic():
+                rows = handle(eligible.filter(pk__gte=start, pk__lt=min(start + self.chunk_size, upper + 1)))
+            chunk_ms = (time.perf_counter() - chunk_started) * 1000
+            self._metrics['chunks'] += 1
+            self._metrics['max_chunk_ms'] = max(self._metrics['max_chunk_ms'], chunk_ms)
+            if not rows:
+                self._metrics['empty_chunks'] += 1
+                continue
+            self._metrics[phase] += rows
+            self._rows += rows
+            self._throttle()
+        return True
+
+    def _throttle(self):
+        delay = self.pause
+        if self.max_rate:
+            # Rattrape l'avance prise sur le débit maximal
+            delay = max(delay, self._rows / self.max_rate - (time.perf_counter() - self._started))
+        if delay > 0:
+            time.sleep(delay)
+            self._metrics['throttled_s'] += delay
+
+    def _archive_rows(self, rows):
+        return len(archive_notifications(rows))
+
+    def _delete_rows(self, rows):
+        deleted, _ = rows.delete()
+        return deleted
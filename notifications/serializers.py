@@ -10,9 +10,9 @@ class NotificationSerializer(serializers.ModelSerializer):
         model = Notification
         fields = [
             'id', 'recipient', 'notification_type', 'title', 'message',
-            'related_object_id', 'related_object_type', 'created_at', 'is_read'
+            'related_object_id', 'related_object_type', 'count', 'created_at', 'updated_at', 'is_read'
         ]
         read_only_fields = [
             'id', 'recipient', 'notification_type', 'title', 'message',
-            'related_object_id', 'related_object_type', 'created_at'
+            'related_object_id', 'related_object_type', 'count', 'created_at', 'updated_at'
         ]
\ No newline at end of file
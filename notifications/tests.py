@@ -1,3 +1,397 @@
+import io
+import smtplib
+from datetime import timedelta
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from src.websocket import JWTAuthMiddlewareStack
+from users.models import User
+
+from .models import Notification, NotificationArchive, NotificationFanout, OutgoingEmail
+from .outbox import send_email_batch
+from .retention import NotificationRetention
+from .routing import websocket_urlpatterns
+from .serializers import NotificationSerializer
+from .utils import (
+    FANOUT_INLINE_LIMIT, FANOUT_PROCESSING_TIMEOUT_SECONDS, NotificationTemplate, build_notification_digests,
+    create_notification, fan_out_notifications, fanout_worker, run_notification_fanout,
+    run_pending_notification_fanouts, send_notifications, unread_notifications
+)
+from .views import NotificationViewSet
+
+
+class UnreadNotificationCounterTests(TestCase):
+    """
+    Compteur dénormalisé de notifications non lues
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='lecteur', email='lecteur@example.com')
+
+    def _notify(self, title):
+        return create_notification(self.user, 'system', title, 'Contenu', related_object_type='')
+
+    def _update(self, notification, **data):
+        serializer = NotificationSerializer(notification, data=data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        NotificationViewSet().perform_update(serializer)
+
+    def test_stale_updates_flip_read_state_once(self):
+        notification = self._notify('Première')
+        self._notify('Seconde')
+        self.assertEqual(unread_notifications.get(self.user.pk), 2)
+
+        # Deux requêtes PATCH chargées avant que l'une d'elles n'enregistre
+        stale = [Notification.objects.get(pk=notification.pk) for _ in range(2)]
+        for instance in stale:
+            self._update(instance, is_read=True)
+
+        self.assertEqual(unread_notifications.get(self.user.pk), 1)
+        self.assertEqual(unread_notifications.repair([self.user.pk]), 0)
+
+    def test_mark_unread_restores_counter(self):
+        notification = self._notify('Première')
+        self._update(notification, is_read=True)
+        self._update(Notification.objects.get(pk=notification.pk), is_read=False)
+
+        self.assertEqual(unread_notifications.get(self.user.pk), 1)
+        self.assertEqual(unread_notifications.repair([self.user.pk]), 0)
+
+
+class FakeConnection:
+    """
+    Connexion email dont chaque envoi lève l'erreur suivante de `errors`
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.opened = 0
+        self.sent = []
+
+    def open(self):
+        self.opened += 1
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.extend(messages)
+        return len(messages)
+
+
+class EmailOutboxTests(TestCase):
+    """
+    Envoi par lots de la boîte d'envoi et nouvelles tentatives
+    """
+
+    def setUp(self):
+        self.email = OutgoingEmail.objects.create(
+            subject='Sujet', body='Corps', from_email='noreply@example.com', to=['destinataire@example.com']
+        )
+
+    def test_lost_connection_is_retried_on_a_new_one(self):
+        connection = FakeConnection(smtplib.SMTPServerDisconnected('Connexion fermée'))
+        result = send_email_batch(connection=connection)
+
+        self.assertEqual((result['sent'], result['retry']), (1, 0))
+        self.assertEqual(connection.opened, 2)
+        self.assertEqual(len(connection.sent), 1)
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+    def test_other_errors_use_backoff_without_resending(self):
+        connection = FakeConnection(smtplib.SMTPRecipientsRefused({'destinataire@example.com': (550, b'Inconnu')}))
+        result = send_email_batch(connection=connection)
+
+        self.assertEqual((result['sent'], result['retry'], result['next_retry_in']), (0, 1, 30))
+        self.assertEqual(connection.opened, 1)
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), ('pending', 1))
+        self.assertIn('SMTPRecipientsRefused', self.email.last_error)
+
+
+class NotificationRetentionTests(TestCase):
+    """
+    Archivage des notifications lues anciennes
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='archiviste', email='archiviste@example.com')
+
+    def _notification(self, title, is_read, age_days):
+        notification = Notification.objects.create(
+            recipient=self.user, notification_type='system', title=title, message='Contenu', is_read=is_read
+        )
+        moment = timezone.now() - timedelta(days=age_days)
+        Notification.objects.filter(pk=notification.pk).update(created_at=moment, updated_at=moment)
+        return notification
+
+    def _run(self):
+        return NotificationRetention(older_than=timedelta(days=30), archive_older_than=None, pause=0).run()
+
+    def test_archives_only_old_read_notifications(self):
+        old_read = self._notification('Ancienne lue', True, 60)
+        old_unread = self._notification('Ancienne non lue', False, 60)
+        recent_read = self._notification('Récente lue', True, 1)
+
+        metrics = self._run()
+
+        self.assertEqual(metrics['archived'], 1)
+        self.assertEqual(list(NotificationArchive.objects.values_list('pk', flat=True)), [old_read.pk])
+        self.assertEqual(
+            set(Notification.objects.values_list('pk', flat=True)), {old_unread.pk, recent_read.pk}
+        )
+
+    def test_notification_marked_unread_meanwhile_is_kept(self):
+        notification = self._notification('Ancienne lue', True, 60)
+        bulk_create = NotificationArchive.objects.bulk_create
+
+        def mark_unread_then_archive(*args, **kwargs):
+            # L'utilisateur la marque non lue entre la lecture du lot et le DELETE
+            Notification.objects.filter(pk=notification.pk).update(is_read=False)
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(NotificationArchive.objects, 'bulk_create', mark_unread_then_archive):
+            metrics = self._run()
+
+        self.assertEqual(metrics['archived'], 0)
+        self.assertTrue(Notification.objects.filter(pk=notification.pk, is_read=False).exists())
+        self.assertFalse(NotificationArchive.objects.exists())
+
+
+class NotificationDigestTests(TestCase):
+    """
+    Remplacement des notifications non lues anciennes par un résumé
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='resume', email='resume@example.com')
+        self.old = [
+            Notification.objects.create(
+                recipient=self.user, notification_type=notification_type, title='Ancienne', message='Contenu',
+                count=count
+            ) for notification_type, count in (('comment', 2), ('comment', 1), ('investment', 1))
+        ]
+        Notification.objects.filter(pk__in=[notification.pk for notification in self.old]).update(
+            updated_at=timezone.now() - timedelta(days=2)
+        )
+        self.recent = create_notification(self.user, 'comment', 'Récente', 'Contenu', related_object_type='')
+        self.assertEqual(unread_notifications.get(self.user.pk), 4)
+
+    def test_folds_and_archives_old_notifications(self):
+        self.assertEqual(build_notification_digests(timedelta(days=1)), (1, 3))
+
+        digest = Notification.objects.get(notification_type='digest')
+        self.assertEqual(digest.count, 4)
+        self.assertIn('3 nouveaux commentaires', digest.message)
+        self.assertEqual(
+            set(NotificationArchive.objects.values_list('pk', flat=True)), {notification.pk for notification in self.old}
+        )
+        self.assertEqual(set(Notification.objects.values_list('pk', flat=True)), {digest.pk, self.recent.pk})
+        self.assertEqual(unread_notifications.get(self.user.pk), 2)
+        self.assertEqual(unread_notifications.repair([self.user.pk]), 0)
+
+    def test_notification_read_meanwhile_is_not_folded(self):
+        read = self.old[0]
+        bulk_create = NotificationArchive.objects.bulk_create
+
+        def read_then_archive(*args, **kwargs):
+            # Lue entre le comptage et le DELETE : ni archivée, ni résumée
+            Notification.objects.filter(pk=read.pk).update(is_read=True)
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(NotificationArchive.objects, 'bulk_create', read_then_archive):
+            self.assertEqual(build_notification_digests(timedelta(days=1)), (1, 2))
+
+        digest = Notification.objects.get(notification_type='digest')
+        self.assertEqual(digest.count, 2)
+        self.assertTrue(Notification.objects.filter(pk=read.pk, is_read=True).exists())
+        self.assertFalse(NotificationArchive.objects.filter(pk=read.pk).exists())
+
+
+class NotificationFanoutTests(TestCase):
+    """
+    Envois groupés : parcours par clé, reprise sans doublon et seuil d'envoi
+    immédiat
+    """
+
+    def setUp(self):
+        self.users = [
+            User.objects.create(username=f'membre{index}', email=f'membre{index}@example.com', first_name=f'Prénom{index}')
+            for index in range(5)
+        ]
+        self.ids = [user.pk for user in self.users]
+        self.template = NotificationTemplate('system', 'Annonce', 'Bonjour {first_name}', related_object_type='')
+
+    def _user_selects(self, queries):
+        return [query['sql'] for query in queries if 'FROM "users_user"' in query['sql']]
+
+    def _assert_notified_once(self):
+        self.assertEqual(
+            sorted(Notification.objects.values_list('recipient_id', flat=True)), sorted(self.ids)
+        )
+
+    def test_filter_audience_is_walked_by_key(self):
+        with CaptureQueriesContext(connection) as queries:
+            created = send_notifications({'username__startswith': 'membre'}, self.template, chunk_size=2)
+
+        self.assertEqual(created, 5)
+        self._assert_notified_once()
+        selects = self._user_selects(queries)
+        # Trois lots et la lecture vide qui clôt le parcours, sans OFFSET
+        self.assertEqual(len(selects), 4)
+        self.assertFalse(any('OFFSET' in sql for sql in selects))
+        self.assertTrue(all('"users_user"."id" >' in sql for sql in selects))
+
+    def test_id_list_audience_is_deduplicated_and_chunked(self):
+        with CaptureQueriesContext(connection) as queries:
+            created = send_notifications(self.ids + self.users[:2] + [999999], self.template, chunk_size=2)
+
+        self.assertEqual(created, 5)
+        self._assert_notified_once()
+        self.assertEqual(len(self._user_selects(queries)), 3)
+
+    def test_template_reads_only_referenced_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            send_notifications(self.ids, self.template)
+        select = self._user_selects(queries)[0]
+        self.assertIn('"first_name"', select)
+        self.assertNotIn('"email"', select)
+        self.assertEqual(
+            Notification.objects.get(recipient=self.users[1]).message, 'Bonjour Prénom1'
+        )
+
+        # Sans champ du destinataire : rendu une fois, seuls les IDs sont lus
+        static = NotificationTemplate('system', 'Annonce', 'Bonjour {name}', context={'name': 'à tous'})
+        with CaptureQueriesContext(connection) as queries:
+            send_notifications(self.ids, static)
+        self.assertNotIn('"first_name"', self._user_selects(queries)[0])
+        self.assertEqual(Notification.objects.filter(message='Bonjour à tous').count(), 5)
+
+        with self.assertRaises(ValueError):
+            NotificationTemplate('system', 'Annonce', '{password}')
+
+    def test_inline_limit_decides_between_inline_and_deferred(self):
+        with mock.patch.object(fanout_worker, 'submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            inline = fan_out_notifications(self.ids, self.template, inline_limit=5)
+        self.assertEqual((inline.status, inline.sent), ('done', 5))
+        submit.assert_not_called()
+
+        with mock.patch.object(fanout_worker, 'submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            deferred = fan_out_notifications({'username__startswith': 'membre'}, self.template, inline_limit=4)
+        self.assertEqual((deferred.status, deferred.sent, deferred.total), ('pending', 0, 5))
+        submit.assert_called_once_with(deferred.pk)
+        self.assertEqual(Notification.objects.count(), 5)
+
+        # Seuil par défaut : FANOUT_INLINE_LIMIT destinataires (le total compte les IDs fournis)
+        with mock.patch.object(fanout_worker, 'submit'):
+            at_limit = fan_out_notifications(list(range(1, FANOUT_INLINE_LIMIT + 1)), self.template)
+            above = fan_out_notifications(list(range(1, FANOUT_INLINE_LIMIT + 2)), self.template)
+        self.assertEqual((at_limit.status, above.status), ('done', 'pending'))
+
+    def test_interrupted_fanout_resumes_without_duplicates(self):
+        for user_id in self.ids:
+            unread_notifications.get(user_id)
+        with mock.patch.object(fanout_worker, 'submit'):
+            fanout = fan_out_notifications(
+                {'username__startswith': 'membre'}, self.template, inline_limit=0, exclude={'pk': self.ids[0]}
+            )
+
+        pushes = []
+
+        def failing_push(notifications):
+            pushes.append(len(notifications))
+            if len(pushes) == 2:
+                raise RuntimeError("channel layer indisponible")
+
+        with mock.patch('notifications.utils.push_notifications', failing_push):
+            self.assertEqual(run_notification_fanout(fanout.pk, chunk_size=2), 2)
+        fanout.refresh_from_db()
+        self.assertEqual((fanout.status, fanout.sent, fanout.last_recipient_id), ('failed', 2, self.ids[2]))
+        self.assertIn('RuntimeError', fanout.last_error)
+        self.assertEqual(Notification.objects.count(), 2)
+
+        # Échouée : ignorée sans --retry-failed, puis reprise après le dernier destinataire servi
+        self.assertEqual(run_pending_notification_fanouts(), (0, 0))
+        self.assertEqual(run_pending_notification_fanouts(retry_failed=True), (1, 2))
+        fanout.refresh_from_db()
+        self.assertEqual((fanout.status, fanout.sent, fanout.attempts), ('done', 4, 2))
+        self.assertEqual(sorted(Notification.objects.values_list('recipient_id', flat=True)), self.ids[1:])
+        self.assertEqual(unread_notifications.repair(self.ids), 0)
+
+    def test_stale_running_fanout_is_reclaimed(self):
+        with mock.patch.object(fanout_worker, 'submit'):
+            fanout = fan_out_notifications(self.ids, self.template, inline_limit=0)
+        NotificationFanout.objects.filter(pk=fanout.pk).update(
+            status='running', last_recipient_id=self.ids[1], sent=2,
+            locked_at=timezone.now() - timedelta(seconds=FANOUT_PROCESSING_TIMEOUT_SECONDS + 1)
+        )
+        out = io.StringIO()
+
+        call_command('run_notification_fanouts', stdout=out)
+
+        self.assertIn('1 envois groupés traités, 3 notifications créées', out.getvalue())
+        self.assertEqual(sorted(Notification.objects.values_list('recipient_id', flat=True)), self.ids[2:])
+
+
+class NotificationConsumerTests(TestCase):
+    """
+    WebSocket /ws/notifications/ : authentification, compteur initial et poussées
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='abonne', email='abonne@example.com')
+        self.application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        create_notification(self.user, 'system', 'Existante', 'Contenu', related_object_type='')
+
+    async def _connect(self, token):
+        communicator = WebsocketCommunicator(self.application, f'/ws/notifications/?token={token}')
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    @database_sync_to_async
+    def _committed(self, action):
+        # Les poussées partent au commit : exécuter les callbacks on_commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return action()
+
+    async def test_invalid_token_is_refused(self):
+        _, connected, code = await self._connect('pas-un-jeton')
+
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_unread_count_then_pushes(self):
+        token = str(AccessToken.for_user(self.user))
+        communicator, connected, _ = await self._connect(token)
+        self.assertTrue(connected)
+        try:
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'unread_count', 'count': 1})
+
+            notification = await self._committed(
+                lambda: create_notification(self.user, 'system', 'Nouvelle', 'Contenu', related_object_type='')
+            )
+            pushed = await communicator.receive_json_from()
+            self.assertEqual((pushed['type'], pushed['unread_delta']), ('notification', 1))
+            self.assertEqual(pushed['notification']['id'], notification.pk)
 
-# Create your tests here.
+            client = APIClient()
+            client.force_authenticate(self.user)
+            response = await self._committed(
+                lambda: client.post(f'/api/notifications/notifications/{notification.pk}/mark_as_read/')
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'unread_count', 'delta': -1})
+            self.assertTrue(await communicator.receive_nothing())
+        finally:
+            await communicator.disconnect()
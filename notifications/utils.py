@@ -1,8 +1,54 @@
 # notifications/utils.py
-from .models import Notification
+import asyncio
+import logging
+import queue
+import threading
+from bisect import bisect_right
+from datetime import timedelta
+from string import Formatter
 
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, QuerySet
+from django.utils import timezone
+from src.counters import UnreadCounter
 
-def create_notification(recipient, notification_type, title, message, related_object_id=None, related_object_type=None):
+from .models import Notification, NotificationCounter, NotificationFanout
+from .retention import archive_notifications
+
+logger = logging.getLogger(__name__)
+
+# Notifications insérées par requête lors d'un envoi groupé
+FANOUT_CHUNK_SIZE = 2000
+# Au-delà, un envoi groupé est confié au worker de fond au lieu de la requête
+FANOUT_INLINE_LIMIT = 200
+# Un envoi resté « en cours » plus longtemps est considéré abandonné (processus tué)
+FANOUT_PROCESSING_TIMEOUT_SECONDS = 600
+# Champs du destinataire utilisables dans un gabarit
+TEMPLATE_RECIPIENT_FIELDS = ('username', 'first_name', 'last_name', 'email')
+# Fenêtre de regroupement par défaut (secondes), voir NOTIFICATION_COALESCE_WINDOW_SECONDS
+COALESCE_WINDOW_SECONDS = 3600
+# Titre et message d'une notification regroupée, par type ({count} : événements fusionnés)
+COALESCED_TEXTS = {
+    'comment': ('Nouveaux commentaires', "{count} nouveaux commentaires sur votre projet '{project}'"),
+    'reply': ('Réponses à votre commentaire', "{count} réponses à votre commentaire sur le projet '{project}'"),
+    'investment': ('Nouveaux investissements', "{count} nouveaux investissements dans votre projet '{project}'"),
+}
+# Types repris dans les résumés périodiques, avec leurs libellés (singulier, pluriel)
+DIGEST_LABELS = {
+    'comment': ('nouveau commentaire', 'nouveaux commentaires'),
+    'reply': ('réponse à vos commentaires', 'réponses à vos commentaires'),
+    'investment': ('nouvel investissement', 'nouveaux investissements'),
+    'project_update': ('mise à jour de projet', 'mises à jour de projet'),
+}
+# Nombre minimal de notifications non lues remplacées par un résumé
+DIGEST_MIN_ROWS = 3
+# Utilisateurs traités par transaction lors de la génération des résumés
+DIGEST_CHUNK_SIZE = 500
+
+
+def create_notification(recipient, notification_type, title, message, related_object_id=None, related_object_type=None,
+                        group_key=''):
     """
     Crée une nouvelle notification
     
@@ -13,56 +59,182 @@ def create_notification(recipient, notification_type, title, message, related_ob
         message: Le message de la notification
         related_object_id: L'ID de l'objet lié (optionnel)
         related_object_type: Le type de l'objet lié (optionnel)
+        group_key: Clé de regroupement (optionnel, voir coalesce_notification)
     
     Returns:
         La notification créée
     """
-    notification = Notification.objects.create(
-        recipient=recipient,
-        notification_type=notification_type,
-        title=title,
-        message=message,
-        related_object_id=related_object_id,
-        related_object_type=related_object_type
-    )
+    with transaction.atomic():
+        notification = Notification.objects.create(
+            recipient=recipient,
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            related_object_id=related_object_id,
+            related_object_type=related_object_type,
+            group_key=group_key
+        )
+        unread_notifications.adjust([notification.recipient_id], 1)
+        push_notifications([notification])
     
     return notification
 
+def coalesce_window():
+    """
+    Fenêtre de regroupement des notifications (timedelta nul : désactivé)
+    """
+    return timedelta(seconds=getattr(settings, 'NOTIFICATION_COALESCE_WINDOW_SECONDS', COALESCE_WINDOW_SECONDS))
+
+def coalesce_notification(recipient, notification_type, group_key, title, message, context,
+                          related_object_id=None, related_object_type='', window=None):
+    """
+    Crée une notification, ou la fusionne dans la notification non lue du
+    même type et de la même clé `group_key` mise à jour dans la fenêtre
+    `window` (par défaut coalesce_window())
+
+    La notification fusionnée prend le titre et le message regroupés de
+    COALESCED_TEXTS, rendus avec `context` et le nouveau `count`, pointe vers
+    le dernier objet lié et remonte en tête de liste ; elle est déjà non lue,
+    le compteur de non-lus ne change pas. La fusion est un UPDATE conditionnel
+    sur `count` : si une autre requête l'a devancée ou si la notification
+    vient d'être lue, une nouvelle notification est créée.
+
+    Returns:
+        La notification créée ou fusionnée
+    """
+    window = coalesce_window() if window is None else window
+    now = timezone.now()
+    with transaction.atomic():
+        latest = None
+        if window:
+            latest = Notification.objects.filter(
+                recipient=recipient, notification_type=notification_type, group_key=group_key,
+                is_read=False, updated_at__gte=now - window
+            ).order_by('-updated_at').values_list('pk', 'count').first()
+        if latest is not None:
+            pk, count = latest
+            coalesced_title, coalesced_message = COALESCED_TEXTS[notification_type]
+            values = {**context, 'count': count + 1}
+            merged = Notification.objects.filter(pk=pk, is_read=False, count=count).update(
+                count=count + 1,
+                title=coalesced_title.format(**values),
+                message=coalesced_message.format(**values),
+                related_object_id=related_object_id,
+                related_object_type=related_object_type,
+                updated_at=now
+            )
+            if merged:
+                notification = Notification.objects.get(pk=pk)
+                push_notifications([notification], 'notification.updated')
+                return notification
+
+        return create_notification(
+            recipient, notification_type, title, message, related_object_id, related_object_type, group_key
+        )
+
+def _count_unread_notifications(user_ids):
+    return dict(
+        Notification.objects.filter(recipient_id__in=user_ids, is_read=False)
+        .values('recipient_id').annotate(unread=Count('id')).values_list('recipient_id', 'unread')
+    )
+
+# Compteurs de notifications non lues (voir NotificationCounter)
+unread_notifications = UnreadCounter(NotificationCounter, _count_unread_notifications)
+
+def notification_group(user_id):
+    """
+    Groupe du channel layer des connexions WebSocket d'un utilisateur
+    """
+    return f"notifications.user.{user_id}"
+
+def _group_send_many(messages):
+    """
+    Envoie des messages (groupe, message) au channel layer en un seul passage
+    par la boucle asynchrone ; envoi au mieux, les clients se resynchronisent
+    à la reconnexion
+    """
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not messages:
+        return
+
+    async def send_all():
+        await asyncio.gather(*(channel_layer.group_send(group, message) for group, message in messages))
+
+    try:
+        async_to_sync(send_all)()
+    except Exception:
+        logger.warning("%s notifications non diffusées", len(messages), exc_info=True)
+
+def push_notifications(notifications, message_type='notification.created'):
+    """
+    Pousse des notifications créées (ou fusionnées : 'notification.updated')
+    aux connexions WebSocket de leurs destinataires, après le commit (voir
+    notifications.consumers)
+    """
+    from .serializers import NotificationSerializer
+
+    messages = [
+        (notification_group(data['recipient']), {'type': message_type, 'notification': dict(data)})
+        for data in NotificationSerializer(notifications, many=True).data
+    ]
+    transaction.on_commit(lambda: _group_send_many(messages))
+
+def push_unread_delta(user_id, delta):
+    """
+    Pousse la variation du nombre de notifications non lues d'un utilisateur
+    (lecture, suppression), après le commit
+    """
+    if delta:
+        message = {'type': 'notification.unread', 'delta': delta}
+        transaction.on_commit(lambda: _group_send_many([(notification_group(user_id), message)]))
+
 def create_comment_notification(project_owner, commenter, project, comment):
     """
-    Crée une notification pour un nouveau commentaire
+    Crée une notification pour un nouveau commentaire, regroupée avec les
+    commentaires récents non lus du même projet
     """
-    return create_notification(
+    return coalesce_notification(
         recipient=project_owner,
         notification_type='comment',
+        group_key=f"project:{project.id}",
         title='Nouveau commentaire',
         message=f"{commenter.first_name} {commenter.last_name} a commenté votre projet '{project.title}'",
+        context={'project': project.title},
         related_object_id=comment.id,
         related_object_type='comment'
     )
 
 def create_reply_notification(comment_author, replier, project, reply):
     """
-    Crée une notification pour une réponse à un commentaire
+    Crée une notification pour une réponse à un commentaire, regroupée avec
+    les réponses récentes non lues au même commentaire
     """
-    return create_notification(
+    return coalesce_notification(
         recipient=comment_author,
         notification_type='reply',
+        group_key=f"comment:{reply.parent_id}",
         title='Réponse à votre commentaire',
         message=f"{replier.first_name} {replier.last_name} a répondu à votre commentaire sur le projet '{project.title}'",
+        context={'project': project.title},
         related_object_id=reply.id,
         related_object_type='comment'
     )
 
 def create_investment_notification(project_owner, investor, project, investment):
     """
-    Crée une notification pour un nouvel investissement
+    Crée une notification pour un nouvel investissement, regroupée avec les
+    investissements récents non lus du même projet
     """
-    return create_notification(
+    return coalesce_notification(
         recipient=project_owner,
         notification_type='investment',
+        group_key=f"project:{project.id}",
         title='Nouvel investissement',
         message=f"{investor.first_name} {investor.last_name} a investi {investment.amount} dans votre projet '{project.title}'",
+        context={'project': project.title},
         related_object_id=investment.id,
         related_object_type='investment'
     )
@@ -90,4 +262,410 @@ def create_system_notification(recipient, title, message,related_object):
         title=title,
         message=message,
         related_object_type=related_object
-    )
\ No newline at end of file
+    )
+
+def create_project_update_notifications(project, project_owner):
+    """
+    Notifie tous les investisseurs d'un projet de sa mise à jour (envoi groupé)
+    """
+    investors = {'investments__project_id': project.pk, 'investments__status': 'completed'}
+    template = NotificationTemplate(
+        notification_type='project_update',
+        title='Mise à jour de projet',
+        message="{owner} a mis à jour le projet '{project}'",
+        context={'owner': f"{project_owner.first_name} {project_owner.last_name}", 'project': project.title},
+        related_object_id=project.id,
+        related_object_type='project'
+    )
+    return fan_out_notifications(investors, template, exclude={'pk': project_owner.pk})
+
+
+def _digest_notification(user_id, events, since):
+    """
+    Notification « digest » (non enregistrée) résumant des événements
+    ({type: nombre}) antérieurs à `since`
+    """
+    parts = []
+    for notification_type, (singular, plural) in DIGEST_LABELS.items():
+        count = events.get(notification_type)
+        if count:
+            parts.append(f"{count} {singular if count == 1 else plural}")
+    return Notification(
+        recipient_id=user_id,
+        notification_type='digest',
+        title='Résumé de vos notifications',
+        message=f"Non lues au {timezone.localtime(since):%d/%m/%Y %H:%M} : {', '.join(parts)}",
+        related_object_type='digest',
+        count=sum(events.values())
+    )
+
+
+def build_notification_digests(older_than, min_rows=DIGEST_MIN_ROWS, chunk_size=DIGEST_CHUNK_SIZE):
+    """
+    Remplace les notifications non lues de DIGEST_LABELS plus anciennes que
+    `older_than` (timedelta) par une notification « digest » par utilisateur
+
+    Seuls les utilisateurs qui en ont au moins `min_rows` sont concernés.
+    Les utilisateurs sont parcourus par ID croissant, `chunk_size` par
+    transaction (archivage, insertion groupée des résumés et compteurs de
+    non-lus) ; utilisé par la commande send_notification_digests. Les
+    notifications remplacées sont déplacées dans NotificationArchive et les
+    résumés ne comptent que celles effectivement déplacées : une
+    notification lue ou regroupée entre-temps reste en place, hors résumé.
+
+    Returns:
+        Tuple (résumés créés, notifications remplacées)
+    """
+    before = timezone.now() - older_than
+    pending = Notification.objects.filter(
+        is_read=False, notification_type__in=list(DIGEST_LABELS), updated_at__lt=before
+    )
+    digests = folded = 0
+    after = 0
+    while True:
+        user_ids = list(
+            pending.filter(recipient_id__gt=after).order_by('recipient_id')
+            .values_list('recipient_id', flat=True).distinct()[:chunk_size]
+        )
+        if not user_ids:
+            return digests, folded
+        after = user_ids[-1]
+
+        with transaction.atomic():
+            eligible = [
+                user_id for user_id, notifications in (
+                    pending.filter(recipient_id__in=user_ids).order_by()
+                    .values('recipient_id').annotate(notifications=Count('id'))
+                    .values_list('recipient_id', 'notifications')
+                ) if notifications >= min_rows
+            ]
+            if not eligible:
+                continue
+
+            rows = {}
+            events = {}
+            for value in archive_notifications(pending.filter(recipient_id__in=eligible)):
+                user_id, notification_type = value['recipient_id'], value['notification_type']
+                rows[user_id] = rows.get(user_id, 0) + 1
+                user_events = events.setdefault(user_id, {})
+                user_events[notification_type] = user_events.get(notification_type, 0) + value['count']
+            if not rows:
+                continue
+
+            created = Notification.objects.bulk_create(
+                [_digest_notification(user_id, events[user_id], before) for user_id in rows]
+            )
+            unread_notifications.adjust_many({user_id: 1 - count for user_id, count in rows.items()})
+            push_notifications(created)
+            for user_id, count in rows.items():
+                push_unread_delta(user_id, -count)
+        digests += len(created)
+        folded += sum(rows.values())
+
+
+class NotificationTemplate:
+    """
+    Gabarit d'une notification envoyée à de nombreux destinataires
+
+    `title` et `message` sont des chaînes str.format. Les champs absents de
+    `context` sont lus sur le destinataire (TEMPLATE_RECIPIENT_FIELDS), et
+    seulement s'ils sont utilisés ; sans champ propre au destinataire, le
+    texte est rendu une seule fois pour toute l'audience.
+    """
+
+    def __init__(self, notification_type, title, message, context=None, related_object_id=None,
+                 related_object_type=''):
+        self.notification_type = notification_type
+        self.title = title
+        self.message = message
+        self.context = context or {}
+        self.related_object_id = related_object_id
+        self.related_object_type = related_object_type or ''
+
+        names = {
+            field.split('.')[0].split('[')[0]
+            for text in (title, message)
+            for _, field, _, _ in Formatter().parse(text) if field
+        }
+        self.recipient_fields = tuple(sorted(names - set(self.context)))
+        unknown = set(self.recipient_fields) - set(TEMPLATE_RECIPIENT_FIELDS)
+        if unknown:
+            raise ValueError(f"Champs de gabarit inconnus : {', '.join(sorted(unknown))}")
+        self._rendered = None if self.recipient_fields else self._render({})
+
+    @classmethod
+    def from_fanout(cls, fanout):
+        return cls(
+            fanout.notification_type, fanout.title, fanout.message, fanout.context,
+            fanout.related_object_id, fanout.related_object_type
+        )
+
+    def _render(self, values):
+        values = {**values, **self.context}
+        title = self.title.format(**values)
+        return title[:Notification._meta.get_field('title').max_length], self.message.format(**values)
+
+    def build(self, recipient_id, values=()):
+        """
+        Notification (non enregistrée) pour un destinataire ; `values` suit
+        l'ordre de `recipient_fields`
+        """
+        title, message = self._rendered or self._render(dict(zip(self.recipient_fields, values)))
+        return Notification(
+            recipient_id=recipient_id,
+            notification_type=self.notification_type,
+            title=title,
+            message=message,
+            related_object_id=self.related_object_id,
+            related_object_type=self.related_object_type
+        )
+
+
+def _recipient_chunks(recipients, fields, chunk_size, after=0):
+    """
+    Lots de lignes (ID, *champs) des destinataires, par ID croissant après `after`
+
+    `recipients` est une requête d'utilisateurs (parcours par clé, sans
+    OFFSET) ou une liste triée d'IDs.
+    """
+    from users.models import User
+
+    if isinstance(recipients, QuerySet):
+        while True:
+            rows = list(
+                recipients.filter(pk__gt=after).order_by('pk').values_list('pk', *fields)[:chunk_size]
+            )
+            if not rows:
+                return
+            yield rows
+            after = rows[-1][0]
+
+    start = bisect_right(recipients, after)
+    for index in range(start, len(recipients), chunk_size):
+        ids = recipients[index:index + chunk_size]
+        if fields:
+            rows = User.objects.filter(pk__in=ids).order_by('pk').values_list('pk', *fields)
+        else:
+            rows = User.objects.filter(pk__in=ids).order_by('pk').values_list('pk')
+        rows = list(rows)
+        if rows:
+            yield rows
+
+
+def recipients_from_filter(lookups, exclude=None):
+    """
+    Requête des utilisateurs correspondant à un filtre déclaratif (recherches
+    de User.objects.filter et, facultatif, de exclude ; valeurs JSON), sans
+    doublon
+    """
+    from users.models import User
+
+    queryset = User.objects.filter(**lookups)
+    if exclude:
+        queryset = queryset.exclude(**exclude)
+    return queryset.distinct()
+
+
+def _normalize_recipients(recipients):
+    """
+    Requête d'utilisateurs telle quelle (un filtre déclaratif est converti en
+    requête), ou liste triée et dédoublonnée d'IDs
+    """
+    if isinstance(recipients, dict):
+        return recipients_from_filter(recipients)
+    if isinstance(recipients, QuerySet):
+        return recipients
+    return sorted({int(getattr(recipient, 'pk', recipient)) for recipient in recipients})
+
+
+def send_notifications(recipients, template, chunk_size=FANOUT_CHUNK_SIZE):
+    """
+    Crée immédiatement la notification `template` pour chaque destinataire,
+    par lots de bulk_create (une requête de lecture et une d'insertion par lot)
+
+    Args:
+        recipients: requête d'utilisateurs, filtre déclaratif (dict de
+            recherches sur User), ou itérable d'utilisateurs ou d'IDs
+        template: NotificationTemplate
+
+    Returns:
+        Nombre de notifications créées
+    """
+    created = 0
+    for rows in _recipient_chunks(_normalize_recipients(recipients), template.recipient_fields, chunk_size):
+        notifications = [template.build(row[0], row[1:]) for row in rows]
+        with transaction.atomic():
+            Notification.objects.bulk_create(notifications, batch_size=chunk_size)
+            unread_notifications.adjust([row[0] for row in rows], 1)
+            push_notifications(notifications)
+        created += len(notifications)
+    return created
+
+
+def fan_out_notifications(recipients, template, inline_limit=FANOUT_INLINE_LIMIT, exclude=None):
+    """
+    Envoi groupé d'une notification, enregistré comme tâche NotificationFanout
+
+    Une petite audience est servie dans la requête ; au-delà de
+    `inline_limit`, l'envoi est confié au worker de fond après le commit (ou
+    à la commande run_notification_fanouts).
+
+    L'audience est enregistrée sous forme déclarative : un filtre (dict de
+    recherches sur User, par exemple {'investments__project_id': 3}) est
+    stocké tel quel avec `exclude` (recherches exclues) et réévalué à
+    l'exécution ; une requête ou un itérable est enregistré comme liste
+    d'IDs.
+
+    Returns:
+        La tâche, terminée ou en attente
+    """
+    fanout = NotificationFanout(
+        notification_type=template.notification_type,
+        title=template.title,
+        message=template.message,
+        context=template.context,
+        related_object_id=template.related_object_id,
+        related_object_type=template.related_object_type,
+    )
+    if isinstance(recipients, dict):
+        # Évalué une première fois : une recherche invalide échoue ici, pas dans le worker
+        fanout.total = recipients_from_filter(recipients, exclude).count()
+        fanout.recipient_filter = {'filter': recipients, 'exclude': exclude or {}}
+    else:
+        if isinstance(recipients, QuerySet):
+            recipients = list(recipients.order_by('pk').values_list('pk', flat=True).distinct())
+        fanout.recipient_ids = _normalize_recipients(recipients)
+        fanout.total = len(fanout.recipient_ids)
+    fanout.save()
+
+    if fanout.total <= inline_limit:
+        run_notification_fanout(fanout.pk)
+        fanout.refresh_from_db()
+    else:
+        transaction.on_commit(lambda: fanout_worker.submit(fanout.pk))
+    return fanout
+
+
+def _fanout_recipients(fanout):
+    if fanout.recipient_ids is not None:
+        return fanout.recipient_ids
+    if not fanout.recipient_filter:
+        raise ValueError("Envoi groupé sans audience enregistrée")
+    return recipients_from_filter(fanout.recipient_filter['filter'], fanout.recipient_filter.get('exclude'))
+
+
+def run_notification_fanout(fanout_pk, chunk_size=FANOUT_CHUNK_SIZE):
+    """
+    Exécute (ou reprend) un envoi groupé
+
+    Chaque lot est inséré dans la même transaction que l'avancée du curseur
+    `last_recipient_id`.
+
+    Returns:
+        Nombre de notifications créées par cet appel, ou None si la tâche
+        n'était pas en attente
+    """
+    now = timezone.now()
+    claimed = NotificationFanout.objects.filter(pk=fanout_pk, status='pending').update(
+        status='running', attempts=F('attempts') + 1, locked_at=now
+    )
+    if not claimed:
+        return None
+
+    fanout = NotificationFanout.objects.get(pk=fanout_pk)
+    template = NotificationTemplate.from_fanout(fanout)
+    created = 0
+    try:
+        chunks = _recipient_chunks(
+            _fanout_recipients(fanout), template.recipient_fields, chunk_size, after=fanout.last_recipient_id
+        )
+        for rows in chunks:
+            with transaction.atomic():
+                notifications = [template.build(row[0], row[1:]) for row in rows]
+                Notification.objects.bulk_create(notifications, batch_size=chunk_size)
+                unread_notifications.adjust([row[0] for row in rows], 1)
+                push_notifications(notifications)
+                NotificationFanout.objects.filter(pk=fanout_pk).update(
+                    sent=F('sent') + len(rows), last_recipient_id=rows[-1][0], locked_at=timezone.now()
+                )
+            created += len(rows)
+    except Exception as exc:
+        logger.exception("Envoi groupé %s interrompu", fanout_pk)
+        NotificationFanout.objects.filter(pk=fanout_pk).update(
+            status='failed', locked_at=None, last_error=f"{type(exc).__name__}: {exc}"
+        )
+        return created
+
+    NotificationFanout.objects.filter(pk=fanout_pk).update(
+        status='done', locked_at=None, finished_at=timezone.now(), last_error=''
+    )
+    return created
+
+
+def run_pending_notification_fanouts(retry_failed=False):
+    """
+    Reprend les envois en attente, abandonnés (processus tué) et, sur
+    demande, échoués ; utilisé par la commande run_notification_fanouts
+
+    Returns:
+        Tuple (tâches traitées, notifications créées)
+    """
+    stale = timezone.now() - timedelta(seconds=FANOUT_PROCESSING_TIMEOUT_SECONDS)
+    NotificationFanout.objects.filter(status='running', locked_at__lt=stale).update(status='pending', locked_at=None)
+    if retry_failed:
+        NotificationFanout.objects.filter(status='failed').update(status='pending')
+
+    jobs = created = 0
+    for fanout_pk in list(NotificationFanout.objects.filter(status='pending').order_by('created_at', 'pk')
+                          .values_list('pk', flat=True)):
+        result = run_notification_fanout(fanout_pk)
+        if result is not None:
+            jobs += 1
+            created += result
+    return jobs, created
+
+
+class NotificationFanoutWorker:
+    """
+    Threads de fond qui exécutent les envois groupés planifiés par ce processus
+
+    Sans worker configuré (NOTIFICATION_FANOUT_WORKERS = 0), la commande
+    run_notification_fanouts s'en charge.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _worker_count(self):
+        if self.workers is not None:
+            return self.workers
+        return getattr(settings, 'NOTIFICATION_FANOUT_WORKERS', 1)
+
+    def submit(self, fanout_pk):
+        if not self._worker_count():
+            return
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue()
+                for index in range(self._worker_count()):
+                    threading.Thread(target=self._run, name=f"notification-fanout-{index}", daemon=True).start()
+        self._queue.put(fanout_pk)
+
+    def wait_idle(self):
+        if self._queue is not None:
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            fanout_pk = self._queue.get()
+            try:
+                run_notification_fanout(fanout_pk)
+            except Exception:
+                logger.exception("Erreur du worker d'envois groupés")
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+fanout_worker = NotificationFanoutWorker()
@@ -2,10 +2,12 @@
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import transaction
 from django.db.models import Q
 from .models import Notification
 from .serializers import NotificationSerializer
 from .permissions import IsRecipient
+from .utils import push_notifications, push_unread_delta, unread_notifications
 
 class NotificationViewSet(viewsets.ModelViewSet):
     """
@@ -14,8 +16,8 @@ class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated, IsRecipient]
     filter_backends = [filters.OrderingFilter]
-    ordering_fields = ['created_at', 'is_read']
-    ordering = ['-created_at']
+    ordering_fields = ['created_at', 'updated_at', 'is_read']
+    ordering = ['-updated_at']
     
     def get_queryset(self):
         """
@@ -41,7 +43,35 @@ class NotificationViewSet(viewsets.ModelViewSet):
         """
         Crée une nouvelle notification
         """
-        serializer.save(recipient=self.request.user)
+        with transaction.atomic():
+            notification = serializer.save(recipient=self.request.user)
+            unread_notifications.adjust([notification.recipient_id], 1)
+            push_notifications([notification])
+    
+    def perform_update(self, serializer):
+        was_read = serializer.instance.is_read
+        is_read = serializer.validated_data.get('is_read', was_read)
+        with transaction.atomic():
+            # Bascule conditionnelle : seule la requête qui change effectivement
+            # l'état de lecture ajuste le compteur
+            flipped = 0
+            if is_read != was_read:
+                flipped = Notification.objects.filter(pk=serializer.instance.pk, is_read=was_read).update(is_read=is_read)
+            notification = serializer.save()
+            if flipped:
+                delta = -1 if is_read else 1
+                unread_notifications.adjust([notification.recipient_id], delta)
+                push_unread_delta(notification.recipient_id, delta)
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # Suppression conditionnelle : le compteur ne baisse que pour une notification encore non lue
+            deleted, _ = Notification.objects.filter(pk=instance.pk, is_read=False).delete()
+            if deleted:
+                unread_notifications.adjust([instance.recipient_id], -1)
+                push_unread_delta(instance.recipient_id, -1)
+            else:
+                instance.delete()
     
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
@@ -49,8 +79,11 @@ class NotificationViewSet(viewsets.ModelViewSet):
         Marque une notification comme lue
         """
         notification = self.get_object()
-        notification.is_read = True
-        notification.save(update_fields=['is_read'])
+        with transaction.atomic():
+            # UPDATE conditionnel : deux lectures simultanées ne décomptent qu'une fois
+            if Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True):
+                unread_notifications.adjust([notification.recipient_id], -1)
+                push_unread_delta(notification.recipient_id, -1)
         
         return Response({
             'status': 'success',
@@ -63,8 +96,10 @@ class NotificationViewSet(viewsets.ModelViewSet):
         Marque toutes les notifications de l'utilisateur comme lues
         """
         user = request.user
-        count = Notification.objects.filter(recipient=user, is_read=False).count()
-        Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+        with transaction.atomic():
+            count = Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+            unread_notifications.adjust([user.pk], -count)
+            push_unread_delta(user.pk, -count)
         
         return Response({
             'status': 'success',
@@ -76,11 +111,8 @@ class NotificationViewSet(viewsets.ModelViewSet):
         """
         Récupère le nombre de notifications non lues
         """
-        user = request.user
-        count = Notification.objects.filter(recipient=user, is_read=False).count()
-        
         return Response({
-            'unread_count': count
+            'unread_count': unread_notifications.get(request.user.pk)
         })
     
     @action(detail=False, methods=['delete'])
@@ -88,9 +120,8 @@ class NotificationViewSet(viewsets.ModelViewSet):
         """
         Supprime toutes les notifications lues
         """
-        user = request.user
-        count = Notification.objects.filter(recipient=user, is_read=True).count()
-        Notification.objects.filter(recipient=user, is_read=True).delete()
+        # Un seul DELETE, dont le nombre de lignes sert de réponse
+        count, _ = Notification.objects.filter(recipient=request.user, is_read=True).delete()
         
         return Response({
             'status': 'success',
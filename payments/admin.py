@@ -4,4 +4,9 @@ from django.contrib import admin
 from .models import *
 
 admin.site.register(PaymentMethod)
-admin.site.register(Invoice)
\ No newline at end of file
+admin.site.register(StripePaymentMethod)
+admin.site.register(Invoice)
+admin.site.register(Receipt)
+admin.site.register(InvoiceSequence)
+admin.site.register(PaymentStatus)
+admin.site.register(WebhookEvent)
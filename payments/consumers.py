@@ -0,0 +1,52 @@
+# payments/consumers.py
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .models import PaymentStatus
+from .utils import payment_status_group
+
+
+class PaymentStatusConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pousse les changements de statut d'un paiement à l'utilisateur qui l'attend
+
+    /ws/payments/<id>/ (PaymentIntent ou session Checkout) : l'état connu est
+    envoyé dès la connexion, puis chaque mise à jour reçue par la boîte de
+    réception des webhooks (voir payments.utils.record_payment_status).
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        self.object_id = self.scope['url_route']['kwargs']['object_id']
+        self.group_name = payment_status_group(self.object_id)
+        # Abonnement avant la lecture : aucune mise à jour ne peut passer entre les deux
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        payment = await self._get_payment()
+        if payment is not None and payment.user_id != user.pk:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            self.group_name = None
+            await self.close(code=4404)
+            return
+
+        await self.accept()
+        if payment is not None:
+            await self.send_json({'type': 'payment.status', 'data': payment.data})
+
+    async def disconnect(self, code):
+        if getattr(self, 'group_name', None):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        # Canal en lecture seule
+        pass
+
+    async def payment_status(self, event):
+        await self.send_json({'type': 'payment.status', 'data': event['data']})
+
+    @database_sync_to_async
+    def _get_payment(self):
+        return PaymentStatus.objects.filter(pk=self.object_id).first()
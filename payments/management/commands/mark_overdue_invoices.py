@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from payments.utils import mark_overdue_invoices
+
+
+class Command(BaseCommand):
+    help = (
+        "Passe à « en retard » les factures envoyées dont l'échéance est dépassée, "
+        "par lots d'UPDATE ensemblistes (à planifier quotidiennement)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', default=None,
+                            help="Date de référence AAAA-MM-JJ (aujourd'hui par défaut)")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Secondes d'attente entre deux lots")
+
+    def handle(self, *args, **options):
+        as_of = None
+        if options['date']:
+            try:
+                as_of = parse_date(options['date'])
+            except ValueError:
+                as_of = None
+            if as_of is None:
+                raise CommandError("Date invalide, format attendu : AAAA-MM-JJ.")
+
+        result = mark_overdue_invoices(as_of=as_of, chunk_size=options['chunk_size'], pause=options['pause'])
+        self.stdout.write(
+            f"{result['rows']} factures en retard en {result['chunks']} lots ({result['elapsed_s']:.2f}s)"
+        )
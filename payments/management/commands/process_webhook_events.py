@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from payments.models import WebhookEvent
+from payments.utils import process_pending_webhook_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Traite les événements Stripe en attente dans la boîte de réception : reprise après "
+        "arrêt, nouvelles tentatives échues et déploiements sans pool en processus."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Nombre maximal d'événements traités par passe")
+        parser.add_argument('--all', action='store_true', dest='include_scheduled',
+                            help="Traite aussi les nouvelles tentatives planifiées non échues")
+        parser.add_argument('--loop', action='store_true',
+                            help="Continue à interroger la boîte de réception")
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help="Secondes entre deux passes avec --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            outcomes = process_pending_webhook_events(
+                limit=options['limit'], include_scheduled=options['include_scheduled']
+            )
+            if any(outcomes.values()) or not options['loop']:
+                summary = ', '.join(f"{key}={value}" for key, value in outcomes.items())
+                self.stdout.write(f"{summary} en {time.perf_counter() - started:.2f}s")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        failed = WebhookEvent.objects.filter(status='failed').count()
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{failed} événements abandonnés (statut 'failed')"))
@@ -0,0 +1,72 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from payments.reconciliation import MISMATCH_KINDS, Reconciler, load_provider_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Rapproche un export du prestataire (JSON / NDJSON d'objets ou d'événements Stripe, "
+        "CSV du tableau de bord, éventuellement .gz) des investissements, dépôts et factures "
+        "locaux ; rapport seul par défaut, corrections en masse avec --fix."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Fichier exporté du prestataire")
+        parser.add_argument('--fix', action='store_true',
+                            help="Applique les corrections sûres (sinon rapport seul)")
+        parser.add_argument('--report', default=None,
+                            help="Écrit chaque écart (une ligne JSON par écart) dans ce fichier")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--samples', type=int, default=10,
+                            help="Identifiants d'exemple affichés par type d'écart")
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help="Écrit le résumé complet dans ce fichier")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            payments, stats = load_provider_export(options['path'])
+        except OSError as e:
+            raise CommandError(f"Export illisible : {e}")
+        except ValueError as e:
+            raise CommandError(f"Export invalide : {e}")
+        load_s = time.perf_counter() - started
+        self.stdout.write(
+            f"{stats['records']} enregistrements lus ({stats['ignored']} ignorés), "
+            f"{len(payments)} clés indexées en {load_s:.2f}s"
+        )
+
+        report = open(options['report'], 'w') if options['report'] else None
+        try:
+            summary = Reconciler(
+                payments, chunk_size=options['chunk_size'], sample_size=options['samples'], report=report
+            ).run(fix=options['fix'])
+        finally:
+            if report is not None:
+                report.close()
+        summary['load'] = dict(stats, elapsed_s=load_s)
+
+        scanned = summary['scanned']
+        self.stdout.write(
+            f"Parcourus : {scanned['investments']} investissements, {scanned['deposits']} dépôts, "
+            f"{scanned['invoices']} factures en {summary['timings']['scan_s']:.2f}s"
+        )
+        if not summary['mismatches']:
+            self.stdout.write(self.style.SUCCESS("Aucun écart."))
+        for kind, result in summary['mismatches'].items():
+            label, fixable = MISMATCH_KINDS[kind]
+            status = f"{result['fixed']} corrigés" if options['fix'] and fixable else (
+                "corrigeable" if fixable else "à traiter manuellement")
+            if result['unfixable']:
+                status += f", {result['unfixable']} non corrigeables"
+            self.stdout.write(f"  {kind:<30} {result['count']:>8}  {status} - {label}")
+            if result['samples']:
+                self.stdout.write(f"    ex. {', '.join(str(sample) for sample in result['samples'])}")
+        if 'fix_s' in summary['timings']:
+            self.stdout.write(f"Corrections appliquées en {summary['timings']['fix_s']:.2f}s")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(summary, handle, indent=2, default=str)
@@ -0,0 +1,62 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from payments.utils import (receipt_template_version, render_receipts, save_receipts,
+                            stale_receipt_invoice_ids)
+
+
+def _render_chunk(invoice_ids):
+    """
+    Rendu d'un lot dans un processus du pool ; l'écriture reste au processus
+    parent (un seul écrivain, pas de contention sur les verrous)
+    """
+    try:
+        return render_receipts(invoice_ids)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Régénère les reçus des factures payées (gabarit ou format modifié, reçus manquants) "
+        "par lots répartis sur un pool de processus."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Processus de rendu (1 ou moins : dans le processus courant)")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true', dest='force',
+                            help="Régénère tous les reçus, même à jour")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        invoice_ids = stale_receipt_invoice_ids(force=options['force'])
+        chunk_size = options['chunk_size']
+        chunks = [invoice_ids[index:index + chunk_size] for index in range(0, len(invoice_ids), chunk_size)]
+        self.stdout.write(
+            f"{len(invoice_ids)} reçus à rendre (gabarit {receipt_template_version()[:12]}) "
+            f"en {len(chunks)} lots"
+        )
+
+        rendered = 0
+        if options['workers'] <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                rendered += save_receipts(render_receipts(chunk))
+        else:
+            # Les connexions ne doivent pas être partagées avec les processus enfants
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('fork')
+            ) as pool:
+                for future in as_completed([pool.submit(_render_chunk, chunk) for chunk in chunks]):
+                    rendered += save_receipts(future.result())
+
+        elapsed = time.perf_counter() - started
+        rate = rendered / elapsed if elapsed else 0.0
+        self.stdout.write(f"{rendered} reçus rendus en {elapsed:.2f}s ({rate:.0f} reçus/s)")
@@ -0,0 +1,39 @@
+import time
+
+import stripe
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from payments.utils import sync_customer_payment_methods
+
+
+class Command(BaseCommand):
+    help = (
+        "Réaligne la copie locale des cartes enregistrées sur Stripe : reprise des "
+        "cartes antérieures à la copie locale et rattrapage de webhooks perdus."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help="Limite la synchronisation à cet utilisateur (répétable)")
+        parser.add_argument('--type', default='card', dest='method_type')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(stripe_customer_id__isnull=False).order_by('pk')
+        if options['user_ids']:
+            users = users.filter(pk__in=options['user_ids'])
+
+        started = time.perf_counter()
+        totals = {'customers': 0, 'synced': 0, 'removed': 0, 'errors': 0}
+        for user in users.iterator():
+            try:
+                synced, removed = sync_customer_payment_methods(user, method_type=options['method_type'])
+            except stripe.error.StripeError as e:
+                totals['errors'] += 1
+                self.stderr.write(f"Utilisateur {user.pk} ({user.stripe_customer_id}) : {e}")
+                continue
+            totals['customers'] += 1
+            totals['synced'] += synced
+            totals['removed'] += removed
+
+        summary = ', '.join(f"{key}={value}" for key, value in totals.items())
+        self.stdout.write(f"{summary} en {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-19 01:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_stripepaymentmethod'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', '-issue_date', '-id'], name='invoice_user_issue_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 01:13
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_invoice_invoice_status_due_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Receipt',
+            fields=[
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='receipt', serialize=False, to='payments.invoice')),
+                ('receipt_number', models.CharField(max_length=60, unique=True)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('document', models.TextField()),
+                ('template_version', models.CharField(db_index=True, max_length=40)),
+                ('rendered_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
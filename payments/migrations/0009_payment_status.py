@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-19 01:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_receipt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentStatus',
+            fields=[
+                ('object_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('object_type', models.CharField(choices=[('payment_intent', 'PaymentIntent'), ('checkout_session', 'Session Checkout')], max_length=20)),
+                ('status', models.CharField(max_length=50)),
+                ('data', models.JSONField()),
+                ('event_created', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payment_statuses', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
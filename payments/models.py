@@ -1,4 +1,6 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from users.models import User
 
 class PaymentMethod(models.Model):
@@ -27,6 +29,30 @@ class PaymentMethod(models.Model):
     def __str__(self):
         return f"{self.method_type} de {self.user.username}"
 
+class StripePaymentMethod(models.Model):
+    """
+    Copie locale des PaymentMethod Stripe attachées aux clients
+
+    Alimentée à l'enregistrement et à la suppression d'une carte, par les
+    webhooks payment_method.* et par la commande sync_stripe_payment_methods ;
+    `data` conserve l'objet Stripe tel que renvoyé par l'API.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stripe_payment_methods')
+    stripe_id = models.CharField(max_length=255, unique=True)
+    customer_id = models.CharField(max_length=255, db_index=True)
+    method_type = models.CharField(max_length=50, default='card')
+    data = models.JSONField()
+    created = models.PositiveBigIntegerField(default=0)  # Horodatage Stripe (secondes)
+    synced_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'method_type', '-created'], name='stripe_pm_user_type_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.stripe_id} de {self.user.username}"
+
 class Invoice(models.Model):
     """
     Factures pour les paiements
@@ -50,6 +76,107 @@ class Invoice(models.Model):
     related_object_id = models.PositiveIntegerField(null=True, blank=True)
     related_object_type = models.CharField(max_length=50, blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-issue_date', '-id'], name='invoice_user_issue_idx'),
+            models.Index(fields=['status', 'due_date'], name='invoice_status_due_idx'),
+        ]
+    
     def __str__(self):
         return f"Facture {self.invoice_number} pour {self.user.username}"
 
+
+class Receipt(models.Model):
+    """
+    Reçu d'une facture payée, rendu une fois puis servi tel quel
+
+    `data` est la version JSON du reçu, `document` sa version imprimable
+    (HTML). `template_version` identifie le gabarit utilisé : les reçus d'une
+    version antérieure sont régénérés par la commande regenerate_receipts.
+    """
+    invoice = models.OneToOneField(Invoice, on_delete=models.CASCADE, primary_key=True, related_name='receipt')
+    receipt_number = models.CharField(max_length=60, unique=True)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    document = models.TextField()
+    template_version = models.CharField(max_length=40, db_index=True)
+    rendered_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Reçu {self.receipt_number}"
+
+
+class InvoiceSequence(models.Model):
+    """
+    Compteur quotidien des numéros de facture
+
+    `last_value` est le dernier numéro réservé du jour ; les processus
+    l'avancent par blocs (voir payments.utils.InvoiceNumberAllocator).
+    """
+    day = models.DateField(primary_key=True)
+    last_value = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Séquence du {self.day} : {self.last_value}"
+
+
+class PaymentStatus(models.Model):
+    """
+    Dernier état connu d'un PaymentIntent ou d'une session Checkout
+
+    Enregistré à la création puis tenu à jour par la boîte de réception des
+    webhooks ; les vues de statut et les clients WebSocket le lisent au lieu
+    d'interroger le prestataire. `event_created` (horodatage Stripe) écarte
+    les événements reçus dans le désordre.
+    """
+    OBJECT_TYPES = (
+        ('payment_intent', 'PaymentIntent'),
+        ('checkout_session', 'Session Checkout'),
+    )
+
+    object_id = models.CharField(max_length=255, primary_key=True)
+    object_type = models.CharField(max_length=20, choices=OBJECT_TYPES)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='payment_statuses')
+    status = models.CharField(max_length=50)
+    data = models.JSONField()
+    event_created = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.object_id} : {self.status}"
+
+
+class WebhookEvent(models.Model):
+    """
+    Boîte de réception des événements Stripe
+
+    Chaque événement vérifié est enregistré une seule fois (contrainte unique
+    sur l'ID Stripe) puis traité de façon asynchrone ; les événements d'un même
+    PaymentIntent (`ordering_key`) sont traités dans l'ordre de réception.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'En attente'),
+        ('processing', 'En cours'),
+        ('processed', 'Traité'),
+        ('failed', 'Échoué'),
+    )
+    
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    ordering_key = models.CharField(max_length=255, blank=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_status_due_idx'),
+            models.Index(fields=['ordering_key', 'status'], name='webhook_key_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
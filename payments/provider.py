@@ -0,0 +1,456 @@
+# payments/provider.py
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+
+import requests
+import stripe
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'BACKEND': 'stripe',         # 'stripe' ou 'emulator'
+    'POOL_SIZE': 10,             # Connexions HTTP conservées vers le prestataire
+    'READ_TIMEOUT': 10,          # Secondes, lectures (retrieve, list)
+    'WRITE_TIMEOUT': 20,         # Secondes, écritures (create, confirm, attach...)
+    'MAX_RETRIES': 2,            # Nouvelles tentatives par appel
+    'RETRY_BACKOFF': 0.25,       # Secondes, doublées à chaque tentative
+    'RETRY_BUDGET_RATIO': 0.2,   # Nouvelles tentatives autorisées par appel réussi
+    'RETRY_BUDGET_MINIMUM': 10,  # Nouvelles tentatives par seconde toujours autorisées (faible trafic)
+    'RETRY_BUDGET_MAX_TOKENS': 100,  # Plafond des tentatives accumulées par les appels réussis
+    'CIRCUIT_FAILURES': 5,       # Échecs consécutifs avant ouverture du circuit
+    'CIRCUIT_RESET': 30,         # Secondes avant un appel d'essai (semi-ouvert)
+    'EMULATOR_LATENCY': 0,       # Secondes ajoutées à chaque appel émulé
+    'EMULATOR_FAILURE_RATE': 0,  # Proportion d'appels émulés en erreur réseau
+    'EMULATOR_SEED': None,       # Graine du tirage des erreurs émulées
+}
+
+
+class ProviderUnavailable(stripe.error.StripeError):
+    """
+    Le circuit est ouvert : le prestataire n'est pas appelé
+    """
+
+
+def is_transient_error(exc):
+    """
+    Erreurs pour lesquelles une nouvelle tentative a un sens et qui comptent
+    pour le disjoncteur (réseau, délai dépassé, limitation de débit, 5xx)
+    """
+    if isinstance(exc, (stripe.error.APIConnectionError, stripe.error.RateLimitError)):
+        return True
+    return isinstance(exc, stripe.error.APIError) and (exc.http_status or 500) >= 500
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur : après `failure_threshold` échecs consécutifs, les appels sont
+    refusés immédiatement pendant `reset_timeout` secondes, puis un seul appel
+    d'essai est autorisé ; son succès referme le circuit.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return 'closed'
+        if now - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def before_call(self):
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == 'open' or (state == 'half_open' and self._trial_in_flight):
+                raise ProviderUnavailable("Le prestataire de paiement est temporairement indisponible.")
+            if state == 'half_open':
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            trial_failed = self._trial_in_flight
+            self._trial_in_flight = False
+            if trial_failed or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Circuit du prestataire de paiement ouvert après %s échecs", self._failures)
+                self._opened_at = time.monotonic()
+
+    def record_neutral(self):
+        # Erreur métier (carte refusée, requête invalide) : le prestataire a répondu
+        self.record_success()
+
+
+class RetryBudget:
+    """
+    Limite les nouvelles tentatives à une fraction du trafic réussi afin qu'une
+    panne du prestataire ne soit pas amplifiée par les tentatives
+
+    Chaque appel réussi crédite `ratio` tentative, dans la limite de
+    `max_tokens`. En plus, une réserve de `minimum` tentatives par seconde
+    reste toujours disponible, quel que soit le trafic : elle se reconstitue
+    avec le temps, même après une rafale d'échecs.
+    """
+
+    def __init__(self, ratio, minimum, max_tokens):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.max_tokens = max_tokens
+        self._tokens = 0.0
+        self._reserve = float(minimum)
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_reserve(self):
+        now = time.monotonic()
+        self._reserve = min(self.minimum, self._reserve + (now - self._refilled_at) * self.minimum)
+        self._refilled_at = now
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self._refill_reserve()
+            if self._reserve >= 1:
+                self._reserve -= 1
+                return True
+            return False
+
+
+class StripeBackend:
+    """
+    Appels Stripe via StripeClient sur une session HTTP partagée (pool de
+    connexions), avec un délai propre à chaque appel
+    """
+
+    def __init__(self, api_key, pool_size):
+        self.api_key = api_key
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, timeout):
+        with self._lock:
+            client = self._clients.get(timeout)
+            if client is None:
+                # Les nouvelles tentatives sont gérées par PaymentProvider (budget, disjoncteur)
+                client = stripe.StripeClient(
+                    self.api_key,
+                    http_client=stripe.RequestsClient(timeout=timeout, session=self._session),
+                    max_network_retries=0
+                )
+                self._clients[timeout] = client
+            return client
+
+    def call(self, operation, timeout, idempotency_key, *args, **params):
+        client = self._client(timeout)
+        options = {'idempotency_key': idempotency_key} if idempotency_key else {}
+        service = {
+            'payment_intent': client.payment_intents,
+            'checkout_session': client.checkout.sessions,
+            'customer': client.customers,
+            'payment_method': client.payment_methods,
+        }[operation[0]]
+        return getattr(service, operation[1])(*args, params=params, options=options)
+
+
+class EmulatorBackend:
+    """
+    Émulateur en mémoire des appels PaymentIntent, Checkout Session, Customer et
+    PaymentMethod, pour les tests et les bancs d'essai hors ligne
+
+    Les objets renvoyés ont la forme des objets Stripe (StripeObject). Une
+    latence et un taux d'erreurs réseau peuvent être injectés ; une latence
+    supérieure au délai de l'appel produit une erreur de délai dépassé.
+    """
+
+    def __init__(self, latency=0, failure_rate=0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self.objects = {}
+        self.idempotent_results = {}
+        self.calls = 0
+
+    def _id(self, prefix):
+        return f"{prefix}_{uuid.uuid4().hex[:14]}{next(self._counter):010d}"
+
+    def _get(self, object_id, kind):
+        obj = self.objects.get(object_id)
+        if obj is None or obj['object'] != kind:
+            raise stripe.error.InvalidRequestError(
+                f"No such {kind}: '{object_id}'", 'id', code='resource_missing', http_status=404
+            )
+        return obj
+
+    def _simulate_network(self, timeout):
+        if self.latency:
+            time.sleep(min(self.latency, timeout))
+            if self.latency > timeout:
+                raise stripe.error.APIConnectionError("Request timed out (emulator)")
+        with self._lock:
+            failed = self.failure_rate and self._rng.random() < self.failure_rate
+        if failed:
+            raise stripe.error.APIConnectionError("Network error (emulator)")
+
+    def call(self, operation, timeout, idempotency_key, *args, **params):
+        with self._lock:
+            self.calls += 1
+        self._simulate_network(timeout)
+        with self._lock:
+            if idempotency_key and idempotency_key in self.idempotent_results:
+                result = self.idempotent_results[idempotency_key]
+            else:
+                result = getattr(self, f"_{operation[0]}_{operation[1]}")(*args, **params)
+                if idempotency_key:
+                    self.idempotent_results[idempotency_key] = result
+        if result.get('object') == 'list':
+            return stripe.ListObject.construct_from(result, 'sk_emulator')
+        return stripe.StripeObject.construct_from(result, 'sk_emulator')
+
+    def _store(self, obj):
+        self.objects[obj['id']] = obj
+        return dict(obj)
+
+    def _payment_intent_create(self, amount, currency, metadata=None, payment_method_types=None, customer=None, **params):
+        intent_id = self._id('pi')
+        return self._store({
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': int(amount),
+            'currency': currency,
+            'status': 'requires_payment_method',
+            'client_secret': f"{intent_id}_secret_{uuid.uuid4().hex[:16]}",
+            'metadata': {key: str(value) for key, value in (metadata or {}).items()},
+            'payment_method_types': payment_method_types or ['card'],
+            'customer': customer,
+            'created': int(time.time()),
+        })
+
+    def _payment_intent_retrieve(self, intent_id, **params):
+        return dict(self._get(intent_id, 'payment_intent'))
+
+    def _payment_intent_confirm(self, intent_id, **params):
+        intent = self._get(intent_id, 'payment_intent')
+        if intent['status'] not in ('requires_payment_method', 'requires_confirmation'):
+            raise stripe.error.InvalidRequestError(
+                f"This PaymentIntent's status is {intent['status']}.", 'intent',
+                code='payment_intent_unexpected_state', http_status=400
+            )
+        intent['status'] = 'succeeded'
+        return dict(intent)
+
+    def _checkout_session_create(self, line_items, mode, success_url, cancel_url, metadata=None, customer=None, **params):
+        amount = sum(item['price_data']['unit_amount'] * item.get('quantity', 1) for item in line_items)
+        currency = line_items[0]['price_data']['currency']
+        intent = self._payment_intent_create(amount, currency, metadata=metadata, customer=customer)
+        session_id = self._id('cs_test')
+        return self._store({
+            'id': session_id,
+            'object': 'checkout.session',
+            'url': f"https://checkout.emulator.local/pay/{session_id}",
+            'mode': mode,
+            'payment_intent': intent['id'],
+            'amount_total': amount,
+            'currency': currency,
+            'status': 'open',
+            'payment_status': 'unpaid',
+            'customer': customer,
+            'metadata': intent['metadata'],
+            'success_url': success_url,
+            'cancel_url': cancel_url,
+        })
+
+    def _checkout_session_retrieve(self, session_id, **params):
+        return dict(self._get(session_id, 'checkout.session'))
+
+    def _customer_create(self, email=None, name=None, metadata=None, **params):
+        return self._store({
+            'id': self._id('cus'),
+            'object': 'customer',
+            'email': email,
+            'name': name,
+            'metadata': {key: str(value) for key, value in (metadata or {}).items()},
+            'created': int(time.time()),
+        })
+
+    def _customer_retrieve(self, customer_id, **params):
+        return dict(self._get(customer_id, 'customer'))
+
+    def _payment_method_attach(self, payment_method_id, customer, **params):
+        self._get(customer, 'customer')
+        payment_method = self.objects.get(payment_method_id)
+        if payment_method is None:
+            # Les PaymentMethod sont créées côté navigateur : on en fabrique une carte de test
+            payment_method = {
+                'id': payment_method_id,
+                'object': 'payment_method',
+                'type': 'card',
+                'card': {'brand': 'visa', 'last4': '4242', 'exp_month': 12, 'exp_year': 2030},
+                'customer': None,
+                'created': int(time.time()),
+            }
+        payment_method['customer'] = customer
+        return self._store(payment_method)
+
+    def _payment_method_detach(self, payment_method_id, **params):
+        payment_method = self._get(payment_method_id, 'payment_method')
+        payment_method['customer'] = None
+        return dict(payment_method)
+
+    def _payment_method_list(self, customer, type='card', **params):
+        data = [
+            dict(obj) for obj in self.objects.values()
+            if obj['object'] == 'payment_method' and obj['customer'] == customer and obj['type'] == type
+        ]
+        return {'object': 'list', 'data': data, 'has_more': False, 'url': '/v1/payment_methods'}
+
+
+class PaymentProvider:
+    """
+    Client du prestataire de paiement utilisé par les vues
+
+    Chaque appel passe par le disjoncteur, reçoit un délai (lecture ou
+    écriture) et peut être retenté sur erreur transitoire, dans la limite du
+    budget de nouvelles tentatives. Les écritures sont retentées avec la même
+    clé d'idempotence, donc sans risque de double création.
+    """
+
+    def __init__(self, backend, options):
+        self.backend = backend
+        self.options = options
+        self.breaker = CircuitBreaker(options['CIRCUIT_FAILURES'], options['CIRCUIT_RESET'])
+        self.retry_budget = RetryBudget(
+            options['RETRY_BUDGET_RATIO'], options['RETRY_BUDGET_MINIMUM'], options['RETRY_BUDGET_MAX_TOKENS']
+        )
+
+    def _call(self, operation, *args, **params):
+        write = operation[1] not in ('retrieve', 'list')
+        timeout = self.options['WRITE_TIMEOUT'] if write else self.options['READ_TIMEOUT']
+        idempotency_key = str(uuid.uuid4()) if write else None
+
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = self.backend.call(operation, timeout, idempotency_key, *args, **params)
+            except stripe.error.StripeError as exc:
+                if not is_transient_error(exc):
+                    self.breaker.record_neutral()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.options['MAX_RETRIES'] or not self.retry_budget.withdraw():
+                    raise
+                attempt += 1
+                delay = self.options['RETRY_BACKOFF'] * 2 ** (attempt - 1)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                continue
+            except Exception:
+                # Erreur hors client Stripe (réseau non enveloppé, émulateur, bogue) :
+                # l'appel n'a pas abouti, et un appel d'essai doit libérer le circuit
+                self.breaker.record_failure()
+                raise
+
+            self.breaker.record_success()
+            self.retry_budget.deposit()
+            return result
+
+    def create_payment_intent(self, **params):
+        return self._call(('payment_intent', 'create'), **params)
+
+    def retrieve_payment_intent(self, intent_id):
+        return self._call(('payment_intent', 'retrieve'), intent_id)
+
+    def confirm_payment_intent(self, intent_id, **params):
+        return self._call(('payment_intent', 'confirm'), intent_id, **params)
+
+    def create_checkout_session(self, **params):
+        return self._call(('checkout_session', 'create'), **params)
+
+    def retrieve_checkout_session(self, session_id):
+        return self._call(('checkout_session', 'retrieve'), session_id)
+
+    def create_customer(self, **params):
+        return self._call(('customer', 'create'), **params)
+
+    def retrieve_customer(self, customer_id):
+        return self._call(('customer', 'retrieve'), customer_id)
+
+    def list_payment_methods(self, **params):
+        return self._call(('payment_method', 'list'), **params)
+
+    def attach_payment_method(self, payment_method_id, **params):
+        return self._call(('payment_method', 'attach'), payment_method_id, **params)
+
+    def detach_payment_method(self, payment_method_id):
+        return self._call(('payment_method', 'detach'), payment_method_id)
+
+
+def build_payment_provider(**overrides):
+    """
+    Construit un client selon settings.PAYMENT_PROVIDER (et les valeurs surchargées)
+    """
+    options = {**DEFAULT_OPTIONS, **getattr(settings, 'PAYMENT_PROVIDER', {}), **overrides}
+    if options['BACKEND'] == 'emulator':
+        backend = EmulatorBackend(
+            options['EMULATOR_LATENCY'], options['EMULATOR_FAILURE_RATE'], options['EMULATOR_SEED']
+        )
+    elif options['BACKEND'] == 'stripe':
+        backend = StripeBackend(settings.STRIPE_SECRET_KEY, options['POOL_SIZE'])
+    else:
+        raise ValueError(f"Prestataire de paiement inconnu : {options['BACKEND']}")
+    return PaymentProvider(backend, options)
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_payment_provider():
+    """
+    Client partagé par le processus (pool de connexions et disjoncteur communs)
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = build_payment_provider()
+        return _provider
+
+
+def set_payment_provider(provider):
+    """
+    Remplace le client partagé (bancs d'essai, émulateur) ; None le réinitialise
+    """
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,513 @@
+# payments/reconciliation.py
+"""
+Rapprochement hors ligne entre un export du prestataire et les paiements locaux
+
+L'export (objets ou événements Stripe en JSON / NDJSON, ou export CSV du
+tableau de bord) est chargé une fois dans une table de hachage indexée par ID
+de PaymentIntent et de session Checkout. Les investissements, dépôts et
+factures locaux sont ensuite parcourus une seule fois et sondés dans cette
+table : le coût est linéaire en nombre de lignes des deux côtés, sans requête
+par ligne. Les écarts corrigibles sont appliqués à la fin, par lots.
+"""
+import csv
+import gzip
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
+from django.utils import timezone
+
+# Clés de métadonnées conservées (les autres sont ignorées pour limiter la mémoire)
+METADATA_KEYS = ('user_id', 'project_id', 'transaction_type', 'invoice_number')
+
+# Écarts détectés : (libellé, corrigible)
+MISMATCH_KINDS = {
+    'investment_not_completed': ("Investissement payé chez le prestataire mais non complété", True),
+    'investment_not_failed': ("Investissement en attente dont le paiement a échoué", True),
+    'investment_missing': ("Paiement d'investissement réussi sans investissement local", True),
+    'investment_amount_mismatch': ("Montant d'investissement différent du montant payé", False),
+    'investment_completed_unpaid': ("Investissement complété sans paiement réussi", False),
+    'deposit_not_completed': ("Dépôt payé chez le prestataire mais non crédité", True),
+    'deposit_not_failed': ("Dépôt en attente dont le paiement a échoué", True),
+    'deposit_missing': ("Paiement de dépôt réussi sans dépôt local", False),
+    'deposit_amount_mismatch': ("Montant de dépôt différent du montant payé", False),
+    'invoice_not_paid': ("Facture payée chez le prestataire mais non soldée", True),
+    'invoice_missing': ("Paiement de facture sans facture locale", False),
+    'unknown_to_provider': ("Paiement local absent de l'export (dans sa période)", False),
+}
+
+ProviderPayment = namedtuple(
+    'ProviderPayment', 'intent_id session_id state amount currency created metadata'
+)
+
+
+def _units(cents):
+    """
+    Montant du prestataire (centimes) en unités, comme handle_payment_success
+    """
+    return (Decimal(cents or 0) / 100).quantize(Decimal('0.01'))
+
+
+def _intent_state(obj):
+    status = obj.get('status')
+    if status == 'succeeded':
+        return 'succeeded'
+    if status == 'canceled' or (status == 'requires_payment_method' and obj.get('last_payment_error')):
+        return 'failed'
+    return 'open'
+
+
+def _session_state(obj):
+    if obj.get('status') == 'complete' and obj.get('payment_status') in ('paid', 'no_payment_required'):
+        return 'succeeded'
+    if obj.get('status') == 'expired':
+        return 'failed'
+    return 'open'
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _metadata(metadata):
+    return {key: str(metadata[key]) for key in METADATA_KEYS if metadata and metadata.get(key)}
+
+
+def _from_object(obj):
+    """
+    Convertit un objet Stripe (PaymentIntent ou session Checkout) ; None sinon
+    """
+    kind = obj.get('object')
+    if kind == 'payment_intent':
+        return ProviderPayment(
+            obj['id'], None, _intent_state(obj), _units(obj.get('amount_received') or obj.get('amount')),
+            (obj.get('currency') or '').lower(), obj.get('created') or 0, _metadata(obj.get('metadata'))
+        )
+    if kind == 'checkout.session':
+        return ProviderPayment(
+            obj.get('payment_intent'), obj['id'], _session_state(obj), _units(obj.get('amount_total')),
+            (obj.get('currency') or '').lower(), obj.get('created') or 0, _metadata(obj.get('metadata'))
+        )
+    return None
+
+
+def _csv_payments(handle):
+    """
+    Lignes d'un export CSV des paiements du tableau de bord Stripe (montants en unités)
+    """
+    states = {'paid': 'succeeded', 'succeeded': 'succeeded', 'failed': 'failed', 'canceled': 'failed'}
+    for row in csv.DictReader(handle):
+        intent_id = row.get('PaymentIntent ID') or row.get('id')
+        if not intent_id:
+            continue
+        try:
+            amount = Decimal((row.get('Amount') or '0').replace(',', '')).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            amount = Decimal('0.00')
+        created = 0
+        if row.get('Created date (UTC)'):
+            try:
+                created = int(datetime.fromisoformat(row['Created date (UTC)']).replace(
+                    tzinfo=dt_timezone.utc).timestamp())
+            except ValueError:
+                pass
+        metadata = {
+            key: row[f"{key} (metadata)"] for key in METADATA_KEYS if row.get(f"{key} (metadata)")
+        }
+        yield ProviderPayment(
+            intent_id, None, states.get((row.get('Status') or '').lower(), 'open'), amount,
+            (row.get('Currency') or '').lower(), created, metadata
+        )
+
+
+def _json_objects(handle):
+    """
+    Objets d'un fichier NDJSON (un objet par ligne) ou JSON (liste ou {"data": [...]})
+    """
+    first = handle.read(1)
+    while first and first.isspace():
+        first = handle.read(1)
+    if first == '[' or first == '{':
+        rest = handle.read()
+        text = first + rest
+        # Un fichier NDJSON commence aussi par « { » : on tente d'abord le JSON complet
+        try:
+            document = json.loads(text)
+        except ValueError:
+            for line in text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+            return
+        if isinstance(document, dict):
+            document = document.get('data', [document])
+        yield from document
+
+
+def load_provider_export(path):
+    """
+    Charge l'export du prestataire dans un index {ID PaymentIntent ou session: ProviderPayment}
+
+    Pour les événements, seul l'état le plus récent de chaque objet est gardé.
+
+    Returns:
+        Tuple (index, statistiques de chargement)
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    payments = {}
+    stats = {'records': 0, 'ignored': 0, 'first_created': None, 'last_created': None}
+
+    def add(payment, created):
+        stats['records'] += 1
+        if payment is None:
+            stats['ignored'] += 1
+            return
+        for key in (payment.intent_id, payment.session_id):
+            if not key:
+                continue
+            current = payments.get(key)
+            if current is not None and current[1] > created:
+                if payment.session_id and current[0].session_id is None:
+                    # État plus ancien, mais qui relie le PaymentIntent à sa session
+                    payments[key] = (current[0]._replace(session_id=payment.session_id), current[1])
+                continue
+            if current is not None and payment.session_id is None and current[0].session_id:
+                # Un PaymentIntent complète la session déjà connue sans en perdre l'ID
+                payment = payment._replace(session_id=current[0].session_id)
+            payments[key] = (payment, created)
+        if payment.created:
+            stats['first_created'] = min(stats['first_created'] or payment.created, payment.created)
+            stats['last_created'] = max(stats['last_created'] or payment.created, payment.created)
+
+    with opener(path, 'rt', encoding='utf-8', newline='') as handle:
+        name = path[:-3] if path.endswith('.gz') else path
+        if name.endswith('.csv'):
+            for payment in _csv_payments(handle):
+                add(payment, payment.created)
+        else:
+            for obj in _json_objects(handle):
+                if obj.get('object') == 'event':
+                    add(_from_object(obj.get('data', {}).get('object', {})), obj.get('created') or 0)
+                else:
+                    payment = _from_object(obj)
+                    add(payment, payment.created if payment else 0)
+
+    return {key: value[0] for key, value in payments.items()}, stats
+
+
+class Reconciler:
+    """
+    Compare l'index du prestataire aux investissements, dépôts et factures locaux
+
+    Les lignes locales sont lues en flux (`values_list().iterator()`), jamais
+    chargées en modèles ; seules les lignes en écart sont conservées jusqu'à
+    la correction.
+    """
+
+    def __init__(self, payments, chunk_size=2000, sample_size=10, report=None):
+        self.payments = payments
+        self.chunk_size = chunk_size
+        self.sample_size = sample_size
+        self.report = report
+        self.mismatches = {kind: [] for kind in MISMATCH_KINDS}
+        self.counts = dict.fromkeys(MISMATCH_KINDS, 0)
+        # Écarts corrigibles que --fix a dû laisser (références locales introuvables)
+        self.unfixable = dict.fromkeys(MISMATCH_KINDS, 0)
+        self.scanned = {'investments': 0, 'deposits': 0, 'invoices': 0}
+        created = [payment.created for payment in payments.values() if payment.created]
+        self.window = (min(created), max(created)) if created else None
+
+    def _record(self, kind, payload, entry):
+        self.counts[kind] += 1
+        if MISMATCH_KINDS[kind][1] or len(self.mismatches[kind]) < self.sample_size:
+            self.mismatches[kind].append(payload)
+        if self.report is not None:
+            self.report.write(json.dumps({'kind': kind, **entry}, default=str) + '\n')
+
+    def _in_window(self, created_at):
+        if self.window is None:
+            return False
+        return self.window[0] <= created_at.timestamp() <= self.window[1]
+
+    def run(self, fix=False):
+        """
+        Returns:
+            Dict {'scanned', 'mismatches': {type: {'count', 'fixed', 'unfixable', 'samples'}}, 'timings'}
+        """
+        timings = {}
+        started = time.perf_counter()
+        matched = set()
+        self._scan_investments(matched)
+        self._scan_deposits(matched)
+        self._scan_invoices(matched)
+        self._scan_unmatched(matched)
+        timings['scan_s'] = time.perf_counter() - started
+
+        fixed = dict.fromkeys(MISMATCH_KINDS, 0)
+        if fix:
+            started = time.perf_counter()
+            fixed.update(self._apply_fixes())
+            timings['fix_s'] = time.perf_counter() - started
+
+        return {
+            'scanned': self.scanned,
+            'mismatches': {
+                kind: {
+                    'count': self.counts[kind],
+                    'fixed': fixed[kind],
+                    'unfixable': self.unfixable[kind],
+                    'samples': [self._sample(kind, payload) for payload in self.mismatches[kind][:self.sample_size]],
+                }
+                for kind in MISMATCH_KINDS if self.counts[kind]
+            },
+            'timings': timings,
+        }
+
+    def _sample(self, kind, payload):
+        if isinstance(payload, ProviderPayment):
+            return payload.intent_id or payload.session_id
+        return payload[0]
+
+    def _scan_investments(self, matched):
+        from investments.models import Investment
+
+        rows = Investment.objects.filter(
+            Q(payment_intent_id__gt='') | Q(payment_session_id__gt='')
+        ).order_by().values_list(
+            'pk', 'payment_intent_id', 'payment_session_id', 'status', 'amount', 'project_id', 'created_at'
+        ).iterator(chunk_size=self.chunk_size)
+        for pk, intent_id, session_id, status, amount, project_id, created_at in rows:
+            self.scanned['investments'] += 1
+            payment = self.payments.get(intent_id) if intent_id else None
+            if payment is None and session_id:
+                payment = self.payments.get(session_id)
+            entry = {'investment_id': pk, 'payment_intent_id': intent_id, 'local_status': status,
+                     'local_amount': amount}
+            if payment is None:
+                if status in ('pending', 'completed') and self._in_window(created_at):
+                    self._record('unknown_to_provider', (pk,), entry)
+                continue
+
+            matched.update(key for key in (payment.intent_id, payment.session_id) if key)
+            entry.update(provider_state=payment.state, provider_amount=payment.amount)
+            if payment.state == 'succeeded':
+                if status in ('pending', 'failed'):
+                    self._record('investment_not_completed', (pk, project_id, amount), entry)
+                elif status == 'completed' and payment.amount != amount:
+                    self._record('investment_amount_mismatch', (pk,), entry)
+            elif status == 'completed':
+                self._record('investment_completed_unpaid', (pk,), entry)
+            elif payment.state == 'failed' and status == 'pending':
+                self._record('investment_not_failed', (pk,), entry)
+
+    def _scan_deposits(self, matched):
+        from investments.models import Transaction
+
+        rows = Transaction.objects.filter(
+            transaction_type='deposit', reference_id__gt=''
+        ).order_by().values_list(
+            'pk', 'reference_id', 'status', 'amount', 'user_id', 'created_at'
+        ).iterator(chunk_size=self.chunk_size)
+        for pk, reference_id, status, amount, user_id, created_at in rows:
+            self.scanned['deposits'] += 1
+            payment = self.payments.get(reference_id)
+            entry = {'transaction_id': pk, 'payment_intent_id': reference_id, 'local_status': status,
+                     'local_amount': amount}
+            if payment is None:
+                if status in ('pending', 'completed') and self._in_window(created_at):
+                    self._record('unknown_to_provider', (pk,), entry)
+                continue
+
+            matched.add(reference_id)
+            entry.update(provider_state=payment.state, provider_amount=payment.amount)
+            if payment.state == 'succeeded':
+                if status != 'completed':
+                    self._record('deposit_not_completed', (pk, reference_id, user_id), entry)
+                elif payment.amount != amount:
+                    self._record('deposit_amount_mismatch', (pk,), entry)
+            elif payment.state == 'failed' and status == 'pending':
+                self._record('deposit_not_failed', (pk,), entry)
+
+    def _scan_invoices(self, matched):
+        from .models import Invoice
+
+        by_number = {}
+        for payment in self.payments.values():
+            number = payment.metadata.get('invoice_number')
+            if number and payment.state == 'succeeded':
+                by_number[number] = payment
+        if not by_number:
+            return
+
+        rows = Invoice.objects.order_by().values_list(
+            'pk', 'invoice_number', 'status', 'amount'
+        ).iterator(chunk_size=self.chunk_size)
+        for pk, invoice_number, status, amount in rows:
+            self.scanned['invoices'] += 1
+            payment = by_number.pop(invoice_number, None)
+            if payment is None:
+                continue
+            matched.update(key for key in (payment.intent_id, payment.session_id) if key)
+            if status != 'paid':
+                self._record('invoice_not_paid', (pk, payment.created), {
+                    'invoice_id': pk, 'invoice_number': invoice_number, 'local_status': status,
+                    'local_amount': amount, 'payment_intent_id': payment.intent_id,
+                    'provider_amount': payment.amount,
+                })
+        for invoice_number, payment in by_number.items():
+            matched.update(key for key in (payment.intent_id, payment.session_id) if key)
+            self._record('invoice_missing', payment, {
+                'invoice_number': invoice_number, 'payment_intent_id': payment.intent_id,
+                'provider_amount': payment.amount,
+            })
+
+    def _scan_unmatched(self, matched):
+        """
+        Paiements réussis du prestataire qu'aucune ligne locale n'a revendiqués
+        """
+        seen = set()
+        for payment in self.payments.values():
+            key = payment.intent_id or payment.session_id
+            if key in seen or key in matched or payment.session_id in matched or payment.state != 'succeeded':
+                continue
+            seen.add(key)
+            metadata = payment.metadata
+            entry = {'payment_intent_id': payment.intent_id, 'session_id': payment.session_id,
+                     'provider_amount': payment.amount, 'metadata': metadata}
+            if metadata.get('transaction_type') == 'deposit':
+                self._record('deposit_missing', payment, entry)
+            elif metadata.get('project_id') and metadata.get('user_id'):
+                self._record('investment_missing', payment, entry)
+
+    def _chunks(self, rows):
+        for index in range(0, len(rows), self.chunk_size):
+            yield rows[index:index + self.chunk_size]
+
+    def _apply_fixes(self):
+        from investments.models import Investment, Transaction
+        from projects.models import Project
+        from users.models import User
+        from wallet.utils import complete_deposit
+
+        from .models import Invoice
+        from .utils import render_receipts, save_receipts
+
+        fixed = {}
+        now = timezone.now()
+
+        # Investissements payés : statut complété et montant collecté, par lot
+        count = 0
+        for chunk in self._chunks(self.mismatches['investment_not_completed']):
+            with transaction.atomic():
+                rows = list(Investment.objects.select_for_update().filter(
+                    pk__in=[row[0] for row in chunk], status__in=['pending', 'failed']
+                ).values_list('pk', 'project_id', 'amount'))
+                Investment.objects.filter(pk__in=[row[0] for row in rows]).update(
+                    status='completed', completed_at=now, updated_at=now
+                )
+                count += len(rows)
+                self._raise_projects(Project, rows, now)
+        fixed['investment_not_completed'] = count
+
+        count = 0
+        for chunk in self._chunks(self.mismatches['investment_not_failed']):
+            count += Investment.objects.filter(
+                pk__in=[row[0] for row in chunk], status='pending'
+            ).update(status='failed', updated_at=now)
+        fixed['investment_not_failed'] = count
+
+        # Investissements manquants : créés en masse, comme handle_payment_success ; les
+        # paiements dont l'utilisateur ou le projet n'existe pas (ou plus) sont écartés
+        # avant l'INSERT, pour qu'une seule ligne ne fasse pas échouer tout le lot
+        count = 0
+        for chunk in self._chunks(self.mismatches['investment_missing']):
+            with transaction.atomic():
+                known = set(Investment.objects.filter(
+                    payment_intent_id__in=[payment.intent_id for payment in chunk if payment.intent_id]
+                ).values_list('payment_intent_id', flat=True))
+                pending = [
+                    (payment, _int_or_none(payment.metadata['user_id']), _int_or_none(payment.metadata['project_id']))
+                    for payment in chunk if payment.intent_id not in known
+                ]
+                user_ids = set(User.objects.filter(
+                    pk__in=[user_id for _, user_id, _ in pending if user_id is not None]
+                ).values_list('pk', flat=True))
+                project_ids = set(Project.objects.filter(
+                    pk__in=[project_id for _, _, project_id in pending if project_id is not None]
+                ).values_list('pk', flat=True))
+                investments = [
+                    Investment(
+                        user_id=user_id,
+                        project_id=project_id,
+                        amount=payment.amount,
+                        status='completed',
+                        payment_method='card',
+                        payment_intent_id=payment.intent_id,
+                        payment_session_id=payment.session_id,
+                        completed_at=now
+                    )
+                    for payment, user_id, project_id in pending
+                    if user_id in user_ids and project_id in project_ids
+                ]
+                Investment.objects.bulk_create(investments, batch_size=self.chunk_size)
+                count += len(investments)
+                self.unfixable['investment_missing'] += len(pending) - len(investments)
+                self._raise_projects(Project, [(None, row.project_id, row.amount) for row in investments], now)
+        fixed['investment_missing'] = count
+
+        # Dépôts payés : crédit idempotent du portefeuille, dépôt par dépôt
+        count = 0
+        for _, reference_id, user_id in self.mismatches['deposit_not_completed']:
+            try:
+                count += complete_deposit(reference_id, user_id)
+            except Transaction.DoesNotExist:
+                pass
+        fixed['deposit_not_completed'] = count
+
+        count = 0
+        for chunk in self._chunks(self.mismatches['deposit_not_failed']):
+            count += Transaction.objects.filter(
+                pk__in=[row[0] for row in chunk], status='pending'
+            ).update(status='failed')
+        fixed['deposit_not_failed'] = count
+
+        # Factures payées : soldées par date de paiement, puis reçus rendus
+        count = 0
+        by_day = {}
+        for pk, created in self.mismatches['invoice_not_paid']:
+            paid_date = datetime.fromtimestamp(created, dt_timezone.utc).date() if created else now.date()
+            by_day.setdefault(paid_date, []).append(pk)
+        for paid_date, invoice_ids in by_day.items():
+            for chunk in self._chunks(invoice_ids):
+                with transaction.atomic():
+                    updated = list(Invoice.objects.filter(pk__in=chunk).exclude(
+                        status='paid').values_list('pk', flat=True))
+                    Invoice.objects.filter(pk__in=updated).update(status='paid', paid_date=paid_date)
+                    save_receipts(render_receipts(updated))
+                count += len(updated)
+        fixed['invoice_not_paid'] = count
+
+        return fixed
+
+    def _raise_projects(self, Project, rows, now):
+        """
+        Ajoute au montant collecté de chaque projet la somme de ses lignes (un UPDATE)
+        """
+        totals = {}
+        for _, project_id, amount in rows:
+            totals[project_id] = totals.get(project_id, Decimal('0')) + amount
+        if not totals:
+            return
+        Project.objects.filter(pk__in=totals).update(
+            amount_raised=F('amount_raised') + Case(
+                *[When(pk=project_id, then=Value(amount)) for project_id, amount in totals.items()],
+                output_field=DecimalField(max_digits=15, decimal_places=2)
+            ),
+            updated_at=now
+        )
@@ -0,0 +1,8 @@
+# payments/routing.py
+from django.urls import re_path
+
+from .consumers import PaymentStatusConsumer
+
+websocket_urlpatterns = [
+    re_path(r'^ws/payments/(?P<object_id>[\w-]+)/$', PaymentStatusConsumer.as_asgi()),
+]
@@ -159,11 +159,16 @@ class PaymentProcessSerializer(serializers.Serializer):
         invoice.paid_date = timezone.now().date()
         invoice.save(update_fields=['status', 'paid_date'])
         
+        # Une facture payée ne change plus : son reçu est rendu une fois pour toutes
+        from .utils import store_receipt
+        store_receipt(invoice)
+        
         # Créer une notification
         create_system_notification(
             recipient=self.context['request'].user,
             title="Paiement effectué",
-            message=f"Votre paiement de {invoice.amount} MGA pour la facture {invoice.invoice_number} a été effectué avec succès."
+            message=f"Votre paiement de {invoice.amount} MGA pour la facture {invoice.invoice_number} a été effectué avec succès.",
+            related_object='invoice'
         )
         
         # Mettre à jour l'objet lié si nécessaire
@@ -175,6 +180,17 @@ class PaymentProcessSerializer(serializers.Serializer):
                 subscription.save(update_fields=['status'])
             except Subscription.DoesNotExist:
                 pass
+        elif invoice.related_object_type == 'subscription_renewal':
+            from subscriptions.models import Subscription
+            try:
+                # Prolonger l'abonnement d'une période à partir de l'échéance facturée
+                subscription = Subscription.objects.select_related('plan').get(id=invoice.related_object_id)
+                if subscription.renewal_invoiced_until and subscription.end_date <= subscription.renewal_invoiced_until:
+                    subscription.end_date = subscription.end_date + datetime.timedelta(days=subscription.plan.duration_days)
+                    subscription.status = 'active'
+                    subscription.save(update_fields=['end_date', 'status'])
+            except Subscription.DoesNotExist:
+                pass
         elif invoice.related_object_type == 'project_boost':
             from subscriptions.models import ProjectBoost
             try:
@@ -192,14 +208,14 @@ class PaymentProcessSerializer(serializers.Serializer):
 
 class TransactionSerializer(serializers.Serializer):
     """
-    Sérialiseur pour les transactions (non stockées en base de données)
+    Sérialiseur pour les transactions (factures annotées par get_user_transactions)
     """
-    id = serializers.CharField(read_only=True)
-    type = serializers.CharField(read_only=True)
+    id = serializers.CharField(read_only=True, source='transaction_id')
+    type = serializers.CharField(read_only=True, source='transaction_type')
     amount = serializers.DecimalField(read_only=True, max_digits=15, decimal_places=2)
-    date = serializers.DateTimeField(read_only=True)
+    date = serializers.DateField(read_only=True)
     status = serializers.CharField(read_only=True)
     description = serializers.CharField(read_only=True)
-    invoice_id = serializers.IntegerField(read_only=True, source='invoice.id')
-    invoice_number = serializers.CharField(read_only=True, source='invoice.invoice_number')
+    invoice_id = serializers.IntegerField(read_only=True, source='id')
+    invoice_number = serializers.CharField(read_only=True)
     payment_method = serializers.CharField(read_only=True)
\ No newline at end of file
@@ -1,3 +1,822 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from channels.layers import get_channel_layer
+from rest_framework.test import APIClient
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from investments.models import Investment, Transaction
+from notifications.models import Notification
+from projects.models import Project
+from users.models import User
+from wallet.models import Wallet
+
+from .models import Invoice, InvoiceSequence, PaymentMethod, PaymentStatus, Receipt, StripePaymentMethod, WebhookEvent
+from .reconciliation import Reconciler, load_provider_export
+from .provider import (
+    CircuitBreaker, EmulatorBackend, ProviderUnavailable, RetryBudget, build_payment_provider, get_payment_provider,
+    set_payment_provider
+)
+from .utils import (
+    WEBHOOK_MAX_ATTEMPTS, InvoiceNumberAllocator, get_or_create_stripe_customer, ingest_webhook_event,
+    list_saved_payment_methods, mark_overdue_invoices, payment_status_group, process_webhook_event,
+    receipt_template_version, stale_receipt_invoice_ids, store_receipt
+)
+
+
+class RetryBudgetTests(SimpleTestCase):
+    """
+    Budget de nouvelles tentatives : réserve minimale par seconde et plafond
+    des tentatives gagnées par les appels réussis
+    """
+
+    def test_minimum_is_a_floor_restored_over_time(self):
+        with mock.patch('payments.provider.time.monotonic', return_value=100.0) as clock:
+            budget = RetryBudget(ratio=0.5, minimum=2, max_tokens=10)
+            self.assertTrue(budget.withdraw())
+            self.assertTrue(budget.withdraw())
+            self.assertFalse(budget.withdraw())
+
+            clock.return_value = 101.0
+            self.assertTrue(budget.withdraw())
+            self.assertTrue(budget.withdraw())
+            self.assertFalse(budget.withdraw())
+
+    def test_successes_add_retries_up_to_max_tokens(self):
+        with mock.patch('payments.provider.time.monotonic', return_value=100.0):
+            budget = RetryBudget(ratio=1, minimum=0, max_tokens=3)
+            for _ in range(10):
+                budget.deposit()
+            granted = sum(budget.withdraw() for _ in range(10))
+        self.assertEqual(granted, 3)
+
+
+class FlakyBackend(EmulatorBackend):
+    """
+    Émulateur dont les appels lèvent d'abord les erreurs de `errors`, et qui
+    note la clé d'idempotence de chaque appel
+    """
+
+    def __init__(self, *errors):
+        super().__init__(seed=0)
+        self.errors = list(errors)
+        self.keys = []
+
+    def call(self, operation, timeout, idempotency_key, *args, **params):
+        self.keys.append(idempotency_key)
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().call(operation, timeout, idempotency_key, *args, **params)
+
+
+class PaymentProviderTests(SimpleTestCase):
+    """
+    Disjoncteur, budget de nouvelles tentatives et émulateur du prestataire
+    """
+
+    def _provider(self, backend, **options):
+        provider = build_payment_provider(**{
+            'BACKEND': 'emulator', 'RETRY_BACKOFF': 0, 'CIRCUIT_FAILURES': 3, 'CIRCUIT_RESET': 30, **options,
+        })
+        provider.backend = backend
+        return provider
+
+    def _network_error(self):
+        return stripe.error.APIConnectionError("Network error")
+
+    def test_circuit_opens_after_consecutive_transient_failures(self):
+        backend = FlakyBackend(*[self._network_error() for _ in range(3)])
+        provider = self._provider(backend, MAX_RETRIES=0)
+
+        for _ in range(3):
+            with self.assertRaises(stripe.error.APIConnectionError):
+                provider.create_customer(email='client@example.com')
+        self.assertEqual(provider.breaker.state, 'open')
+        with self.assertRaises(ProviderUnavailable):
+            provider.create_customer(email='client@example.com')
+        self.assertEqual(len(backend.keys), 3)
+
+    def test_business_errors_do_not_open_the_circuit(self):
+        provider = self._provider(EmulatorBackend(), MAX_RETRIES=0)
+        for _ in range(5):
+            with self.assertRaises(stripe.error.InvalidRequestError):
+                provider.retrieve_payment_intent('pi_inconnu')
+        self.assertEqual(provider.breaker.state, 'closed')
+
+    def test_single_half_open_trial_then_close_on_success(self):
+        with mock.patch('payments.provider.time.monotonic', return_value=100.0) as clock:
+            breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+            breaker.before_call()
+            breaker.record_failure()
+            self.assertEqual(breaker.state, 'open')
+
+            clock.return_value = 131.0
+            breaker.before_call()
+            # Un seul appel d'essai à la fois
+            with self.assertRaises(ProviderUnavailable):
+                breaker.before_call()
+            breaker.record_success()
+
+            self.assertEqual(breaker.state, 'closed')
+            breaker.before_call()
+            breaker.before_call()
+
+    def test_failed_trial_reopens_the_circuit(self):
+        with mock.patch('payments.provider.time.monotonic', return_value=100.0) as clock:
+            backend = FlakyBackend(self._network_error(), TypeError('argument inattendu'), self._network_error())
+            provider = self._provider(backend, MAX_RETRIES=0, CIRCUIT_FAILURES=1)
+            with self.assertRaises(stripe.error.APIConnectionError):
+                provider.create_customer()
+
+            # Erreur hors client Stripe pendant l'essai : le circuit n'est pas bloqué
+            clock.return_value = 131.0
+            with self.assertRaises(TypeError):
+                provider.create_customer()
+            self.assertEqual(provider.breaker.state, 'open')
+
+            clock.return_value = 162.0
+            with self.assertRaises(stripe.error.APIConnectionError):
+                provider.create_customer()
+            clock.return_value = 193.0
+            customer = provider.create_customer(email='client@example.com')
+
+        self.assertEqual(customer['email'], 'client@example.com')
+        self.assertEqual(provider.breaker.state, 'closed')
+
+    def test_retries_reuse_the_idempotency_key(self):
+        backend = FlakyBackend(self._network_error(), stripe.error.APIError("Erreur", http_status=503))
+        provider = self._provider(backend, MAX_RETRIES=2)
+
+        intent = provider.create_payment_intent(amount=1000, currency='eur')
+        provider.retrieve_payment_intent(intent['id'])
+
+        write_keys, read_key = backend.keys[:3], backend.keys[3]
+        self.assertIsNotNone(write_keys[0])
+        self.assertEqual(len(set(write_keys)), 1)
+        self.assertIsNone(read_key)
+        # Le résultat est rejoué pour la même clé : un seul PaymentIntent
+        self.assertEqual(backend.call(('payment_intent', 'create'), 1, write_keys[0], amount=1, currency='eur')['id'],
+                         intent['id'])
+        self.assertEqual(len([obj for obj in backend.objects.values() if obj['object'] == 'payment_intent']), 1)
+
+    def test_exhausted_retry_budget_stops_retries(self):
+        with mock.patch('payments.provider.time.monotonic', return_value=100.0):
+            backend = FlakyBackend(*[self._network_error() for _ in range(10)])
+            provider = self._provider(
+                backend, MAX_RETRIES=5, CIRCUIT_FAILURES=100, RETRY_BUDGET_RATIO=0, RETRY_BUDGET_MINIMUM=1
+            )
+            with self.assertRaises(stripe.error.APIConnectionError):
+                provider.create_customer()
+            # Un appel et la seule nouvelle tentative de la réserve
+            self.assertEqual(len(backend.keys), 2)
+
+    def test_emulator_network_failures_and_timeouts(self):
+        with self.assertRaises(stripe.error.APIConnectionError):
+            EmulatorBackend(failure_rate=1).call(('customer', 'create'), 1, None)
+        with mock.patch('payments.provider.time.sleep'), self.assertRaises(stripe.error.APIConnectionError):
+            EmulatorBackend(latency=5).call(('customer', 'create'), 1, None)
+
+
+class InvoiceNumberAllocatorTests(TestCase):
+    """
+    Numéros de facture par blocs sur le compteur quotidien
+    """
+    day = date(2026, 3, 14)
+
+    def test_blocks_of_two_processes_never_overlap(self):
+        first = InvoiceNumberAllocator(block_size=5)
+        second = InvoiceNumberAllocator(block_size=5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            numbers = first.allocate(3, on_date=self.day) + second.allocate(3, on_date=self.day)
+        numbers += first.allocate(2, on_date=self.day)
+
+        self.assertEqual(numbers, [
+            'INV-20260314-00000001', 'INV-20260314-00000002', 'INV-20260314-00000003',
+            'INV-20260314-00000006', 'INV-20260314-00000007', 'INV-20260314-00000008',
+            'INV-20260314-00000004', 'INV-20260314-00000005',
+        ])
+        self.assertEqual(InvoiceSequence.objects.get(day=self.day).last_value, 10)
+
+    def test_one_counter_write_per_block(self):
+        InvoiceSequence.objects.create(day=self.day, last_value=7)
+        allocator = InvoiceNumberAllocator(block_size=50)
+        numbers = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(50):
+                # Une transaction par facture, comme generate_invoice_number
+                with self.captureOnCommitCallbacks(execute=True):
+                    numbers += allocator.allocate(on_date=self.day)
+
+        # Un UPDATE du compteur et la relecture de sa valeur pour 50 numéros
+        self.assertEqual(len([query for query in queries if 'invoicesequence' in query['sql']]), 2)
+        self.assertEqual(numbers[0], 'INV-20260314-00000008')
+        self.assertEqual(len(set(numbers)), 50)
+
+    def test_block_reserved_in_rolled_back_transaction_is_abandoned(self):
+        allocator = InvoiceNumberAllocator(block_size=5)
+        other = InvoiceNumberAllocator(block_size=5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                rolled_back = allocator.allocate(on_date=self.day)
+                raise RuntimeError
+            # La réservation est annulée en base : le bloc 2-5 ne doit plus servir
+            numbers = allocator.allocate(on_date=self.day) + other.allocate(on_date=self.day)
+        numbers += allocator.allocate(on_date=self.day)
+
+        self.assertEqual(rolled_back, ['INV-20260314-00000001'])
+        self.assertEqual(numbers, [
+            'INV-20260314-00000001', 'INV-20260314-00000006', 'INV-20260314-00000002',
+        ])
+        self.assertEqual(InvoiceSequence.objects.get(day=self.day).last_value, 10)
+
+    def test_large_request_and_new_day(self):
+        allocator = InvoiceNumberAllocator(block_size=5)
+        numbers = allocator.allocate(12, on_date=self.day)
+        next_day = allocator.allocate(on_date=date(2026, 3, 15))
+
+        self.assertEqual(numbers[-1], 'INV-20260314-00000012')
+        self.assertEqual(next_day, ['INV-20260315-00000001'])
+
+
+class OverdueInvoiceTests(TestCase):
+    """
+    Passage en retard des factures par lots
+    """
+
+    def test_only_sent_invoices_past_due_become_overdue(self):
+        user = User.objects.create(username='client', email='client@example.com')
+        as_of = date(2026, 3, 14)
+        cases = {
+            'sent-past': ('sent', as_of - timedelta(days=1)),
+            'sent-today': ('sent', as_of),
+            'draft-past': ('draft', as_of - timedelta(days=1)),
+            'paid-past': ('paid', as_of - timedelta(days=1)),
+            'sent-old': ('sent', as_of - timedelta(days=30)),
+        }
+        for number, (status, due_date) in cases.items():
+            Invoice.objects.create(
+                user=user, invoice_number=number, amount=10, description='Facture', status=status,
+                issue_date=as_of - timedelta(days=40), due_date=due_date
+            )
+
+        result = mark_overdue_invoices(as_of=as_of, chunk_size=1)
+
+        self.assertEqual((result['rows'], result['chunks']), (2, 2))
+        self.assertEqual(
+            dict(Invoice.objects.values_list('invoice_number', 'status')),
+            {'sent-past': 'overdue', 'sent-today': 'sent', 'draft-past': 'draft', 'paid-past': 'paid', 'sent-old': 'overdue'}
+        )
+        self.assertEqual(mark_overdue_invoices(as_of=as_of)['rows'], 0)
+
+
+class ReceiptTests(TestCase):
+    """
+    Reçus rendus au paiement, servis tels quels et régénérés au changement de gabarit
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='payeur', email='payeur@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _invoice(self, number, status='paid'):
+        return Invoice.objects.create(
+            user=self.user, invoice_number=f'INV-20260314-{number:08d}', amount=Decimal('25.00'),
+            description='Facture', status=status, issue_date=date(2026, 3, 14), due_date=date(2026, 3, 28),
+            paid_date=date(2026, 3, 15) if status == 'paid' else None
+        )
+
+    def _receipt_url(self, invoice):
+        return f'/api/payments/invoices/{invoice.pk}/receipt/'
+
+    def test_paying_stores_the_receipt(self):
+        invoice = self._invoice(1, status='sent')
+        method = PaymentMethod.objects.create(user=self.user, method_type='mobile_money', account_number='***42')
+
+        response = self.client.post('/api/payments/process/process_payment/', {
+            'payment_method_id': method.pk, 'invoice_id': invoice.pk,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        receipt = Receipt.objects.get(invoice=invoice)
+        self.assertEqual(receipt.receipt_number, 'REC-20260314-00000001')
+        self.assertEqual(receipt.data['amount'], '25.00')
+        self.assertEqual(receipt.template_version, receipt_template_version())
+        # La notification de paiement porte le type d'objet lié
+        self.assertTrue(Notification.objects.filter(recipient=self.user, related_object_type='invoice').exists())
+
+    def test_stored_receipt_is_served_as_is(self):
+        invoice = self._invoice(1)
+        store_receipt(invoice)
+        Receipt.objects.filter(invoice=invoice).update(document='<p>stocké</p>', data={'stocké': True})
+
+        html = self.client.get(self._receipt_url(invoice), {'output': 'html'})
+        self.assertEqual(html['Content-Type'], 'text/html; charset=utf-8')
+        self.assertEqual(html.content.decode('utf-8'), '<p>stocké</p>')
+        self.assertEqual(self.client.get(self._receipt_url(invoice)).json(), {'stocké': True})
+
+    def test_receipt_is_rendered_on_first_request_for_older_invoices(self):
+        invoice = self._invoice(1)
+
+        first = self.client.get(self._receipt_url(invoice))
+        receipt = Receipt.objects.get(invoice=invoice)
+        second = self.client.get(self._receipt_url(invoice))
+
+        self.assertEqual(first.json(), receipt.data)
+        self.assertEqual(second.json(), receipt.data)
+        self.assertIn('REC-20260314-00000001', receipt.document)
+        self.assertEqual(Receipt.objects.count(), 1)
+        unpaid = self._invoice(2, status='sent')
+        self.assertEqual(self.client.get(self._receipt_url(unpaid)).status_code, 400)
+
+    def test_regenerate_receipts_renders_stale_and_missing_ones_only(self):
+        current, stale, missing = self._invoice(1), self._invoice(2), self._invoice(3)
+        self._invoice(4, status='sent')
+        for invoice in (current, stale):
+            store_receipt(invoice)
+        Receipt.objects.filter(invoice=current).update(document='à jour')
+        Receipt.objects.filter(invoice=stale).update(document='ancien', template_version='ancienne')
+
+        call_command('regenerate_receipts', workers=1, stdout=io.StringIO())
+
+        documents = dict(Receipt.objects.values_list('invoice_id', 'document'))
+        self.assertEqual(set(documents), {current.pk, stale.pk, missing.pk})
+        self.assertEqual(documents[current.pk], 'à jour')
+        self.assertIn('REC-20260314-00000002', documents[stale.pk])
+        self.assertEqual(set(Receipt.objects.values_list('template_version', flat=True)), {receipt_template_version()})
+        self.assertEqual(stale_receipt_invoice_ids(), [])
+
+
+class ReconciliationTests(TestCase):
+    """
+    Rapprochement d'un export du prestataire avec les paiements locaux
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.user = User.objects.create(username='investisseur', email='investisseur@example.com')
+        owner = User.objects.create(username='porteur', email='porteur@example.com')
+        self.project = Project.objects.create(
+            title='Projet', owner=owner, funding_type='equity', amount_needed=Decimal('1000.00'), status='active'
+        )
+        Wallet.objects.create(user=self.user, balance=0)
+
+    def _intent(self, intent_id, status='succeeded', amount=1000, created=1700000000, **metadata):
+        return {
+            'object': 'payment_intent', 'id': intent_id, 'status': status, 'amount': amount,
+            'amount_received': amount if status == 'succeeded' else 0, 'currency': 'eur',
+            'created': created, 'metadata': metadata,
+        }
+
+    def _event(self, obj, created):
+        return {'object': 'event', 'created': created, 'data': {'object': obj}}
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+
+    def _investment(self, intent_id, status='pending', amount='10.00'):
+        return Investment.objects.create(
+            user=self.user, project=self.project, amount=Decimal(amount), status=status,
+            payment_method='card', payment_intent_id=intent_id
+        )
+
+    def test_loaders_index_the_same_payments(self):
+        objects = [self._intent('pi_1', project_id=1, user_id=2), self._intent('pi_2', status='canceled')]
+        paths = [
+            self._write('export.json', json.dumps(objects)),
+            self._write('export-data.json', json.dumps({'data': objects})),
+            self._write('export.ndjson', '\n'.join(json.dumps(obj) for obj in objects) + '\n'),
+            self._write('export.ndjson.gz', '\n'.join(json.dumps(obj) for obj in objects)),
+            self._write('export.csv', (
+                'PaymentIntent ID,Amount,Currency,Status,Created date (UTC),project_id (metadata),user_id (metadata)\n'
+                'pi_1,10.00,EUR,Paid,2023-11-14 22:13:20,1,2\n'
+                'pi_2,"1,000.00",eur,Canceled,,,\n'
+            )),
+        ]
+
+        for path in paths:
+            payments, stats = load_provider_export(path)
+            self.assertEqual(stats['records'], 2, path)
+            self.assertEqual(
+                (payments['pi_1'].state, payments['pi_1'].amount, payments['pi_1'].created),
+                ('succeeded', Decimal('10.00'), 1700000000), path
+            )
+            self.assertEqual(payments['pi_1'].metadata, {'project_id': '1', 'user_id': '2'}, path)
+            self.assertEqual(payments['pi_2'].state, 'failed', path)
+
+    def test_latest_event_wins(self):
+        session = {
+            'object': 'checkout.session', 'id': 'cs_1', 'payment_intent': 'pi_1', 'status': 'open',
+            'payment_status': 'unpaid', 'amount_total': 1000, 'currency': 'eur', 'created': 100,
+        }
+        events = [
+            self._event(self._intent('pi_1', created=100), created=300),
+            self._event(self._intent('pi_1', status='processing', created=100), created=200),
+            self._event(session, created=150),
+            {'object': 'customer', 'id': 'cus_1'},
+        ]
+        payments, stats = load_provider_export(self._write('events.ndjson', '\n'.join(map(json.dumps, events))))
+
+        self.assertEqual(stats['ignored'], 1)
+        self.assertEqual(payments['pi_1'].state, 'succeeded')
+        # La session, plus ancienne, relie tout de même le PaymentIntent à son ID
+        self.assertEqual(payments['pi_1'].session_id, 'cs_1')
+        self.assertEqual(payments['cs_1'].state, 'open')
+
+    def test_scan_reports_each_mismatch_kind(self):
+        self._investment('pi_paid')
+        self._investment('pi_failed')
+        self._investment('pi_amount', status='completed', amount='5.00')
+        self._investment('pi_unpaid', status='completed')
+        self._investment('pi_unknown')
+        Transaction.objects.create(user=self.user, transaction_type='deposit', amount=Decimal('10.00'),
+                                   reference_id='pi_deposit')
+        invoice = Invoice.objects.create(
+            user=self.user, invoice_number='INV-20260314-00000001', amount=Decimal('10.00'),
+            description='Facture', status='sent', issue_date=date(2026, 3, 14), due_date=date(2026, 3, 28)
+        )
+        export = [
+            self._intent('pi_paid'), self._intent('pi_failed', status='canceled'), self._intent('pi_amount'),
+            self._intent('pi_unpaid', status='processing'), self._intent('pi_deposit'),
+            self._intent('pi_invoice', invoice_number=invoice.invoice_number),
+            self._intent('pi_missing', project_id=self.project.pk, user_id=self.user.pk),
+            self._intent('pi_lost_deposit', transaction_type='deposit'),
+        ]
+        # La période de l'export couvre les lignes locales : pi_unknown y manque
+        now = int(timezone.now().timestamp())
+        export[0]['created'], export[-1]['created'] = now - 3600, now + 3600
+        payments, _ = load_provider_export(self._write('export.json', json.dumps(export)))
+        report = io.StringIO()
+
+        summary = Reconciler(payments, report=report).run()
+
+        self.assertEqual({kind: result['count'] for kind, result in summary['mismatches'].items()}, {
+            'investment_not_completed': 1, 'investment_not_failed': 1, 'investment_amount_mismatch': 1,
+            'investment_completed_unpaid': 1, 'unknown_to_provider': 1, 'deposit_not_completed': 1,
+            'invoice_not_paid': 1, 'investment_missing': 1, 'deposit_missing': 1,
+        })
+        self.assertEqual(summary['scanned'], {'investments': 5, 'deposits': 1, 'invoices': 1})
+        self.assertEqual(len(report.getvalue().splitlines()), 9)
+        # Rapport seul : rien n'est modifié
+        self.assertEqual(Investment.objects.filter(status='pending').count(), 3)
+
+    def test_fix_is_idempotent_and_skips_unknown_references(self):
+        self._investment('pi_paid')
+        export = [
+            self._intent('pi_paid'),
+            self._intent('pi_missing', amount=2500, project_id=self.project.pk, user_id=self.user.pk),
+            self._intent('pi_no_user', project_id=self.project.pk, user_id=999999),
+            self._intent('pi_bad_project', project_id='abc', user_id=self.user.pk),
+        ]
+        path = self._write('export.json', json.dumps(export))
+
+        first, second = io.StringIO(), io.StringIO()
+        call_command('reconcile_payments', path, '--fix', '--chunk-size', '10', stdout=first)
+        call_command('reconcile_payments', path, '--fix', '--chunk-size', '10', stdout=second)
+
+        self.assertIn('investment_not_completed', first.getvalue())
+        self.assertRegex(first.getvalue(), r'investment_missing +3 +1 corrigés, 2 non corrigeables')
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.amount_raised, Decimal('35.00'))
+        self.assertEqual(
+            set(Investment.objects.values_list('payment_intent_id', 'status')),
+            {('pi_paid', 'completed'), ('pi_missing', 'completed')}
+        )
+        # Second passage : seuls restent les paiements sans références locales, rien n'est recréé
+        self.assertNotIn('investment_not_completed', second.getvalue())
+        self.assertRegex(second.getvalue(), r'investment_missing +2 +0 corrigés, 2 non corrigeables')
+        self.assertEqual(Investment.objects.count(), 2)
+
+
+class PaymentStatusLongPollTests(TestCase):
+    """
+    Attente longue du statut d'un paiement sur le channel layer
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='payeur', email='payeur@example.com')
+        PaymentStatus.objects.create(
+            object_id='pi_test', object_type='payment_intent', user=self.user, status='processing',
+            data={'id': 'pi_test', 'status': 'processing'}
+        )
+
+    async def test_returns_as_soon_as_the_status_is_broadcast(self):
+        await self.async_client.aforce_login(self.user)
+
+        async def broadcast():
+            await asyncio.sleep(0.2)
+            await get_channel_layer().group_send(payment_status_group('pi_test'), {
+                'type': 'payment.status', 'data': {'id': 'pi_test', 'status': 'succeeded'},
+            })
+
+        started = time.monotonic()
+        response, _ = await asyncio.gather(
+            self.async_client.get('/api/payments/status/pi_test/?since=processing&wait=10'), broadcast()
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['status'], 'succeeded')
+        self.assertLess(time.monotonic() - started, 5)
+
+    async def test_times_out_with_unchanged_status(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/api/payments/status/pi_test/?since=processing&wait=0.3')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['status'], 'processing')
+
+    def test_requires_authentication_and_ownership(self):
+        other = User.objects.create(username='autre', email='autre@example.com')
+        self.assertEqual(self.client.get('/api/payments/status/pi_test/').status_code, 401)
+        self.client.force_login(other)
+        self.assertEqual(self.client.get('/api/payments/status/pi_test/').status_code, 404)
+        # Même ID sous l'autre type d'objet
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/payments/session-status/pi_test/').status_code, 404)
+
+    def test_payment_without_user_is_returned_to_nobody(self):
+        PaymentStatus.objects.create(
+            object_id='cs_orphan', object_type='checkout_session', status='open', data={'id': 'cs_orphan'}
+        )
+        for user in (self.user, User.objects.create(username='autre', email='autre@example.com')):
+            self.client.force_login(user)
+            self.assertEqual(self.client.get('/api/payments/session-status/cs_orphan/').status_code, 404)
+
+    def test_unknown_payment_is_looked_up_through_the_provider(self):
+        set_payment_provider(build_payment_provider(BACKEND='emulator'))
+        self.addCleanup(set_payment_provider, None)
+        provider = get_payment_provider()
+        mine = provider.create_payment_intent(amount=1000, currency='eur', metadata={'user_id': self.user.pk})
+        anonymous = provider.create_payment_intent(amount=1000, currency='eur')
+        self.client.force_login(self.user)
+
+        response = self.client.get(f'/api/payments/status/{mine.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['status'], 'requires_payment_method')
+        # Inconnu du prestataire ou sans utilisateur : introuvable, sans erreur 400/500
+        self.assertEqual(self.client.get('/api/payments/status/pi_inconnu/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/payments/status/{anonymous.id}/').status_code, 404)
+
+
+class WebhookInboxTests(TestCase):
+    """
+    Boîte de réception durable des événements Stripe
+    """
+
+    def _event(self, event_id, event_type='payment_intent.processing', intent='pi_1'):
+        return {
+            'id': event_id, 'type': event_type, 'created': 1700000000,
+            'data': {'object': {'id': intent, 'object': 'payment_intent', 'status': 'processing'}},
+        }
+
+    def _store(self, event_id, **kwargs):
+        event = self._event(event_id, **kwargs)
+        return WebhookEvent.objects.create(
+            event_id=event['id'], event_type=event['type'], ordering_key=event['data']['object']['id'], payload=event
+        )
+
+    def _failing_handler(self):
+        return mock.patch.dict('payments.utils.WEBHOOK_HANDLERS', {
+            'test.failing': mock.Mock(side_effect=RuntimeError('indisponible')),
+        })
+
+    @mock.patch('payments.utils.stripe.Webhook.construct_event')
+    def test_duplicate_event_id_is_dropped(self, construct_event):
+        payload = json.dumps(self._event('evt_1')).encode('utf-8')
+        with self.captureOnCommitCallbacks() as callbacks:
+            first = ingest_webhook_event(payload, 'signature')
+            second = ingest_webhook_event(payload, 'signature')
+
+        self.assertEqual((first.ordering_key, second), ('pi_1', None))
+        self.assertEqual(WebhookEvent.objects.filter(event_id='evt_1').count(), 1)
+        # Un seul traitement planifié après le commit
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(construct_event.call_count, 2)
+
+    def test_claim_waits_for_earlier_event_of_the_same_payment(self):
+        first = self._store('evt_1')
+        second = self._store('evt_2')
+        other = self._store('evt_3', intent='pi_2')
+
+        self.assertEqual(process_webhook_event(second.pk), ('skipped', None))
+        self.assertEqual(process_webhook_event(other.pk), ('processed', None))
+        self.assertEqual(process_webhook_event(first.pk), ('processed', None))
+        self.assertEqual(process_webhook_event(second.pk), ('processed', None))
+        self.assertEqual(WebhookEvent.objects.get(pk=second.pk).attempts, 1)
+
+    def test_failures_back_off_then_give_up(self):
+        event = self._store('evt_1', event_type='test.failing')
+        with self._failing_handler():
+            started = timezone.now()
+            self.assertEqual(process_webhook_event(event.pk), ('retry', 5))
+
+            event.refresh_from_db()
+            self.assertEqual((event.status, event.attempts), ('pending', 1))
+            self.assertIn('RuntimeError: indisponible', event.last_error)
+            self.assertGreaterEqual(event.next_attempt_at, started + timedelta(seconds=5))
+            # Pas encore dû
+            self.assertEqual(process_webhook_event(event.pk), ('skipped', None))
+
+            WebhookEvent.objects.filter(pk=event.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(process_webhook_event(event.pk), ('retry', 10))
+
+            WebhookEvent.objects.filter(pk=event.pk).update(
+                attempts=WEBHOOK_MAX_ATTEMPTS - 1, next_attempt_at=timezone.now()
+            )
+            self.assertEqual(process_webhook_event(event.pk), ('failed', None))
+
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('failed', WEBHOOK_MAX_ATTEMPTS))
+        # Un événement abandonné ne bloque plus les suivants du même paiement
+        self.assertEqual(process_webhook_event(self._store('evt_2').pk), ('processed', None))
+
+    def test_command_reclaims_stale_processing_events(self):
+        stale = self._store('evt_1')
+        recent = self._store('evt_2', intent='pi_2')
+        WebhookEvent.objects.filter(pk=stale.pk).update(
+            status='processing', attempts=1, locked_at=timezone.now() - timedelta(minutes=10)
+        )
+        WebhookEvent.objects.filter(pk=recent.pk).update(status='processing', attempts=1, locked_at=timezone.now())
+
+        call_command('process_webhook_events', stdout=io.StringIO())
+
+        stale.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual((stale.status, stale.attempts), ('processed', 2))
+        self.assertEqual(recent.status, 'processing')
+        self.assertTrue(PaymentStatus.objects.filter(pk='pi_1', status='processing').exists())
+
+
+class EmulatedProviderTestCase(TestCase):
+    """
+    Prestataire de paiement émulé, partagé par le processus le temps du test
+    """
+
+    def setUp(self):
+        self.provider = build_payment_provider(BACKEND='emulator', RETRY_BACKOFF=0)
+        set_payment_provider(self.provider)
+        self.addCleanup(set_payment_provider, None)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def _client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class SavedPaymentMethodTests(EmulatedProviderTestCase):
+    """
+    Client Stripe et copie locale des cartes enregistrées
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='carte', email='carte@example.com')
+        self.client = self._client(self.user)
+
+    def _save(self, payment_method_id, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = (client or self.client).post('/api/payments/methods/save/', {
+                'payment_method_id': payment_method_id
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def _cards(self, client=None):
+        return [card['id'] for card in (client or self.client).get('/api/payments/methods/').json()['data']]
+
+    def _cached(self):
+        return cache.get(f"stripe_payment_methods:{self.user.pk}:card")
+
+    def _webhook(self, event_type, data_object):
+        event = WebhookEvent.objects.create(
+            event_id=f"evt_{event_type}", event_type=event_type, ordering_key=data_object['id'],
+            payload={'id': f"evt_{event_type}", 'type': event_type, 'data': {'object': data_object}}
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_webhook_event(event.pk), ('processed', None))
+
+    def test_customer_is_created_once(self):
+        customer_id = get_or_create_stripe_customer(self.user)
+        calls = self.provider.backend.calls
+
+        self.assertEqual(get_or_create_stripe_customer(User.objects.get(pk=self.user.pk)), customer_id)
+        self.assertEqual(self.provider.backend.calls, calls)
+        self.assertTrue(customer_id.startswith('cus_'))
+
+    def test_cards_are_listed_from_the_mirror_without_provider_call(self):
+        self._save('pm_visa')
+        calls = self.provider.backend.calls
+
+        self.assertEqual(self._cards(), ['pm_visa'])
+        with self.assertNumQueries(0):
+            self.assertEqual(list_saved_payment_methods(self.user), self._cached())
+        self.assertEqual(self.provider.backend.calls, calls)
+
+    def test_attach_and_detach_invalidate_the_cached_list(self):
+        self.assertEqual(self._cards(), [])
+        self._save('pm_visa')
+        self.assertEqual(self._cards(), ['pm_visa'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/payments/methods/pm_visa/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._cards(), [])
+        self.assertFalse(StripePaymentMethod.objects.exists())
+
+    def test_detaching_another_users_card_is_not_found(self):
+        self._save('pm_visa')
+        calls = self.provider.backend.calls
+        other = self._client(User.objects.create(username='autre', email='autre@example.com'))
+
+        self.assertEqual(other.delete('/api/payments/methods/pm_visa/').status_code, 404)
+        self.assertEqual(self.provider.backend.calls, calls)
+        self.assertEqual(self._cards(), ['pm_visa'])
+
+    def test_webhooks_update_the_mirror(self):
+        self._save('pm_visa')
+        self._save('pm_master')
+        self.assertEqual(sorted(self._cards()), ['pm_master', 'pm_visa'])
+
+        self._webhook('payment_method.detached', dict(self.provider.backend.objects['pm_visa'], customer=None))
+        self.assertEqual(self._cards(), ['pm_master'])
+
+        customer_id = User.objects.get(pk=self.user.pk).stripe_customer_id
+        self._webhook('customer.deleted', {'id': customer_id, 'object': 'customer'})
+        self.assertEqual(self._cards(), [])
+        self.assertIsNone(User.objects.get(pk=self.user.pk).stripe_customer_id)
+
+
+class TransactionHistoryTests(TestCase):
+    """
+    Historique des transactions paginé par curseur sur (issue_date, id)
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='historique', email='historique@example.com')
+        other = User.objects.create(username='autre', email='autre@example.com')
+        self.invoices = [
+            Invoice.objects.create(
+                user=other if day == 0 else self.user, invoice_number=f"INV-TEST-{index:04d}", amount=10 + index,
+                description='Facture', status='sent', issue_date=date(2026, 3, day or 5), due_date=date(2026, 4, 1)
+            )
+            # Égalités sur la date d'émission
+            for index, day in enumerate((1, 2, 2, 2, 0, 3, 3, 4))
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_through_ties_once_each(self):
+        expected = [
+            f"invoice-{invoice.pk}" for invoice in sorted(
+                (invoice for invoice in self.invoices if invoice.user_id == self.user.pk),
+                key=lambda invoice: (invoice.issue_date, invoice.pk), reverse=True
+            )
+        ]
+        url = '/api/payments/process/transactions/?page_size=3'
+        seen = []
+        while url:
+            with self.assertNumQueries(1):
+                body = self.client.get(url).json()
+            self.assertNotIn('count', body)
+            seen.extend(row['id'] for row in body['results'])
+            url = body['next']
+
+        self.assertEqual(seen, expected)
+
+    def test_ids_are_stable_and_previous_returns_to_the_first_page(self):
+        first = self.client.get('/api/payments/process/transactions/', {'page_size': 3}).json()
+        again = self.client.get('/api/payments/process/transactions/', {'page_size': 3}).json()
+        second = self.client.get(first['next']).json()
+
+        self.assertIsNone(first['previous'])
+        self.assertEqual([row['id'] for row in first['results']], [row['id'] for row in again['results']])
+        self.assertEqual([row['id'] for row in first['results']],
+                         [f"invoice-{row['invoice_id']}" for row in first['results']])
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+        self.assertEqual(
+            self.client.get('/api/payments/process/transactions/', {'cursor': 'invalide'}).status_code, 404
+        )
@@ -1,16 +1,160 @@
 # payments/utils.py
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Case, CharField, Exists, F, OuterRef, Value, When
+from django.db.models.functions import Cast, Concat
+from django.template.loader import get_template, render_to_string
 from django.utils import timezone
-from .models import Invoice
-import uuid
+
+from .models import (Invoice, InvoiceSequence, PaymentStatus, Receipt, StripePaymentMethod,
+                     WebhookEvent)
+
+logger = logging.getLogger(__name__)
+
+# Politique de nouvelle tentative des événements de webhook
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_RETRY_BASE_SECONDS = 5
+WEBHOOK_RETRY_MAX_SECONDS = 3600
+# Un événement resté « en cours » plus longtemps est considéré abandonné (processus tué)
+WEBHOOK_PROCESSING_TIMEOUT = timedelta(minutes=5)
+
+# Clé de cache de la liste des moyens de paiement enregistrés d'un utilisateur
+PAYMENT_METHODS_CACHE_KEY = 'stripe_payment_methods:{user_id}:{method_type}'
+
+# Gabarit du document imprimable des reçus
+RECEIPT_TEMPLATE = 'payments/receipt.html'
+# À incrémenter quand la structure JSON des reçus change (les reçus seront régénérés)
+RECEIPT_FORMAT_VERSION = 1
+
+# Attente longue des vues de statut de paiement : durée maximale (secondes)
+PAYMENT_STATUS_MAX_WAIT = 25
+# Types d'objets Stripe suivis par PaymentStatus
+PAYMENT_STATUS_OBJECTS = {'payment_intent': 'payment_intent', 'checkout.session': 'checkout_session'}
+
+class _NumberBlock:
+    """
+    Plage [next_value, end) de numéros réservés pour un jour
+    """
+    __slots__ = ('day', 'next_value', 'end')
+
+    def __init__(self, day, start, end):
+        self.day = day
+        self.next_value = start
+        self.end = end
+
+    def take(self, count):
+        values = range(self.next_value, min(self.next_value + count, self.end))
+        self.next_value = values.stop
+        return values
+
+
+class InvoiceNumberAllocator:
+    """
+    Allocateur de numéros de facture par blocs, sur une séquence quotidienne
+
+    Le compteur du jour (InvoiceSequence) est avancé d'un bloc entier en une
+    écriture ; les numéros du bloc sont ensuite distribués en mémoire, sans
+    aller-retour en base. Les numéros croissent au sein d'un processus et ne
+    sont jamais attribués deux fois ; un bloc entamé à l'arrêt du processus ou
+    au changement de jour laisse un trou dans la séquence.
+
+    Un bloc réservé dans une transaction n'est partagé qu'au commit, par son
+    propre callback on_commit : en cas de rollback (transaction ou point de
+    sauvegarde), Django abandonne le callback avec la réservation annulée en
+    base, et le reste du bloc n'est jamais distribué. Chaque appel réservant
+    dans une transaction prend son propre bloc ; allouer plusieurs numéros
+    d'un coup (`count`) n'en réserve qu'un.
+    """
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size
+        self._reset()
+        # Un processus enfant (fork) ne doit pas hériter des blocs de son parent
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._blocks = {}
+
+    def allocate(self, count=1, on_date=None):
+        """
+        Réserve `count` numéros de facture pour la date donnée (aujourd'hui par défaut)
+
+        Returns:
+            La liste des numéros, dans l'ordre croissant
+        """
+        day = on_date or timezone.localdate()
+        values = []
+        while len(values) < count:
+            values.extend(self._take(day, count - len(values)))
+        prefix = f"INV-{day:%Y%m%d}-"
+        return [f"{prefix}{value:08d}" for value in values]
+
+    def _take(self, day, count):
+        with self._lock:
+            for stale_day in [key for key in self._blocks if key != day]:
+                del self._blocks[stale_day]
+            blocks = self._blocks.get(day, [])
+            while blocks:
+                values = blocks[0].take(count)
+                if blocks[0].next_value >= blocks[0].end:
+                    blocks.pop(0)
+                if values:
+                    return values
+
+        block_size = self.block_size or getattr(settings, 'INVOICE_NUMBER_BLOCK_SIZE', 100)
+        block = self._reserve(day, max(count, block_size))
+        values = block.take(count)
+        if transaction.get_connection().in_atomic_block:
+            # Le callback détient seul le bloc jusqu'au commit
+            transaction.on_commit(lambda: self._publish(block))
+        else:
+            self._publish(block)
+        return values
+
+    def _publish(self, block):
+        with self._lock:
+            if block.next_value < block.end:
+                self._blocks.setdefault(block.day, []).append(block)
+
+    def _reserve(self, day, size):
+        """
+        Avance le compteur du jour de `size` et retourne le bloc correspondant
+        """
+        with transaction.atomic():
+            if not InvoiceSequence.objects.filter(day=day).update(last_value=F('last_value') + size):
+                try:
+                    with transaction.atomic():
+                        InvoiceSequence.objects.create(day=day, last_value=size)
+                    return _NumberBlock(day, 1, size + 1)
+                except IntegrityError:
+                    # Ligne du jour créée entre-temps par un autre processus
+                    InvoiceSequence.objects.filter(day=day).update(last_value=F('last_value') + size)
+            end = InvoiceSequence.objects.values_list('last_value', flat=True).get(day=day)
+        return _NumberBlock(day, end - size + 1, end + 1)
+
+
+invoice_numbers = InvoiceNumberAllocator()
 
 def generate_invoice_number():
     """
-    Génère un numéro de facture unique
+    Génère un numéro de facture unique (INV-AAAAMMJJ-NNNNNNNN)
     """
-    prefix = "INV"
-    date_part = timezone.now().strftime("%Y%m%d")
-    random_part = str(uuid.uuid4().int)[:6]
-    return f"{prefix}-{date_part}-{random_part}"
+    return invoice_numbers.allocate()[0]
 
 def create_invoice(user, amount, description, related_object=None, related_object_type=None):
     """
@@ -38,30 +182,55 @@ def create_invoice(user, amount, description, related_object=None, related_objec
     
     return invoice
 
+def mark_overdue_invoices(as_of=None, chunk_size=5000, pause=0):
+    """
+    Passe à « en retard » les factures envoyées dont l'échéance est dépassée
+
+    Chaque lot est un seul UPDATE ensembliste (`id IN (SELECT ... LIMIT n)`)
+    validé séparément : les verrous restent courts et une interruption ne
+    perd que le lot en cours. Les lignes traitées sortant du filtre, aucune
+    position n'est à mémoriser entre deux lots.
+
+    Returns:
+        Dict {'rows', 'chunks', 'elapsed_s'}
+    """
+    as_of = as_of or timezone.localdate()
+    started = time.perf_counter()
+    due = Invoice.objects.filter(status='sent', due_date__lt=as_of)
+    rows = chunks = 0
+    while True:
+        with transaction.atomic():
+            updated = Invoice.objects.filter(
+                pk__in=due.order_by().values('pk')[:chunk_size]
+            ).update(status='overdue')
+        if not updated:
+            break
+        rows += updated
+        chunks += 1
+        if pause:
+            time.sleep(pause)
+
+    elapsed = time.perf_counter() - started
+    logger.info("Factures en retard : %s lignes en %s lots (%.2fs)", rows, chunks, elapsed)
+    return {'rows': rows, 'chunks': chunks, 'elapsed_s': elapsed}
+
 def get_user_transactions(user):
     """
-    Récupère toutes les transactions d'un utilisateur
+    Queryset des transactions d'un utilisateur (une par facture)
+
+    Les champs de transaction sont calculés en base ; l'identifiant est stable
+    d'une requête à l'autre, ce qui permet la pagination par clé.
     """
-    # Récupérer toutes les factures de l'utilisateur
-    invoices = Invoice.objects.filter(user=user).order_by('-issue_date')
-    
-    transactions = []
-    
-    for invoice in invoices:
-        transaction = {
-            'id': str(uuid.uuid4()),
-            'type': 'payment',
-            'amount': invoice.amount,
-            'date': invoice.paid_date if invoice.status == 'paid' else invoice.issue_date,
-            'status': invoice.status,
-            'description': invoice.description,
-            'invoice': invoice,
-            'payment_method': 'Non spécifié'  # Dans un système réel, vous récupéreriez la méthode de paiement utilisée
-        }
-        
-        transactions.append(transaction)
-    
-    return transactions
+    return Invoice.objects.filter(user=user).annotate(
+        transaction_id=Concat(Value('invoice-'), Cast('id', CharField())),
+        transaction_type=Value('payment'),
+        date=Case(
+            When(status='paid', paid_date__isnull=False, then=F('paid_date')),
+            default=F('issue_date')
+        ),
+        # Dans un système réel, vous récupéreriez la méthode de paiement utilisée
+        payment_method=Value('Non spécifié')
+    )
 
 def generate_receipt_data(invoice):
     """
@@ -84,4 +253,757 @@ def generate_receipt_data(invoice):
         'payment_method': 'Non spécifié'  # Dans un système réel, vous récupéreriez la méthode de paiement utilisée
     }
     
-    return receipt_data
\ No newline at end of file
+    return receipt_data
+
+def receipt_template_version():
+    """
+    Empreinte du gabarit des reçus et du format JSON : change dès que l'un ou
+    l'autre est modifié
+    """
+    source = get_template(RECEIPT_TEMPLATE).template.source
+    return hashlib.sha1(f"{RECEIPT_FORMAT_VERSION}:{source}".encode('utf-8')).hexdigest()
+
+def render_receipt(invoice, version=None):
+    """
+    Rend le reçu d'une facture payée (JSON et document imprimable), sans l'enregistrer
+    """
+    receipt_data = generate_receipt_data(invoice)
+    return Receipt(
+        invoice=invoice,
+        receipt_number=receipt_data['receipt_number'],
+        # Forme JSON stockée (montants en chaîne décimale), identique à chaque lecture
+        data=json.loads(json.dumps(receipt_data, cls=DjangoJSONEncoder)),
+        document=render_to_string(RECEIPT_TEMPLATE, {'receipt': receipt_data}),
+        template_version=version or receipt_template_version(),
+        rendered_at=timezone.now()
+    )
+
+def store_receipt(invoice):
+    """
+    Rend et enregistre le reçu d'une facture qui vient d'être payée
+    """
+    receipt = render_receipt(invoice)
+    receipt.save()
+    return receipt
+
+def get_receipt(invoice):
+    """
+    Reçu enregistré d'une facture payée ; rendu à la première demande pour les
+    factures payées avant l'enregistrement des reçus
+    """
+    receipt = Receipt.objects.filter(invoice=invoice).first()
+    if receipt is None:
+        try:
+            with transaction.atomic():
+                receipt = store_receipt(invoice)
+        except IntegrityError:
+            receipt = Receipt.objects.get(invoice=invoice)
+    return receipt
+
+def stale_receipt_invoice_ids(force=False):
+    """
+    IDs des factures payées sans reçu ou dont le reçu provient d'un autre gabarit
+    """
+    invoices = Invoice.objects.filter(status='paid')
+    if not force:
+        invoices = invoices.exclude(receipt__template_version=receipt_template_version())
+    return list(invoices.order_by('pk').values_list('pk', flat=True))
+
+def render_receipts(invoice_ids):
+    """
+    Rend les reçus d'un lot de factures payées, sans les enregistrer (exécutable
+    dans un processus du pool : seule la lecture touche la base)
+
+    Returns:
+        Liste de tuples (invoice_id, receipt_number, data, document, template_version)
+    """
+    version = receipt_template_version()
+    rows = []
+    for invoice in Invoice.objects.filter(pk__in=invoice_ids, status='paid').select_related('user'):
+        receipt = render_receipt(invoice, version)
+        rows.append((invoice.pk, receipt.receipt_number, receipt.data, receipt.document, version))
+    return rows
+
+def save_receipts(rows):
+    """
+    Enregistre (ou remplace) les reçus rendus par render_receipts, en INSERT ... ON CONFLICT
+
+    Returns:
+        Le nombre de reçus enregistrés
+    """
+    now = timezone.now()
+    Receipt.objects.bulk_create(
+        [
+            Receipt(invoice_id=invoice_id, receipt_number=receipt_number, data=data,
+                    document=document, template_version=version, rendered_at=now)
+            for invoice_id, receipt_number, data, document, version in rows
+        ],
+        update_conflicts=True,
+        unique_fields=['invoice'],
+        update_fields=['receipt_number', 'data', 'document', 'template_version', 'rendered_at']
+    )
+    return len(rows)
+
+def handle_payment_success(payment_intent):
+    """
+    Gérer un paiement réussi : crédit d'un dépôt ou finalisation d'un investissement
+    """
+    from django.contrib.auth import get_user_model
+    from investments.models import Investment
+    from projects.models import Project
+    from wallet.utils import complete_deposit
+
+    metadata = payment_intent.get('metadata', {})
+    user_id = metadata.get('user_id')
+
+    if metadata.get('transaction_type') == 'deposit':
+        if user_id:
+            # Crédit idempotent sur l'ID du PaymentIntent
+            from investments.models import Transaction
+            try:
+                complete_deposit(payment_intent['id'], user_id)
+            except Transaction.DoesNotExist:
+                logger.warning("Dépôt introuvable pour %s", payment_intent['id'])
+        return
+
+    project_id = metadata.get('project_id')
+    if not (project_id and user_id):
+        return
+
+    User = get_user_model()
+    user = User.objects.get(id=user_id)
+    project = Project.objects.get(id=project_id)
+
+    # Créer ou mettre à jour l'investissement
+    investment, created = Investment.objects.get_or_create(
+        payment_intent_id=payment_intent['id'],
+        defaults={
+            'user': user,
+            'project': project,
+            'amount': Decimal(payment_intent['amount']) / 100,  # Convertir les centimes en unités
+            'status': 'completed',
+        }
+    )
+
+    completed = created
+    if not created and investment.status != 'completed':
+        investment.status = 'completed'
+        investment.save()
+        completed = True
+
+    if completed:
+        _notify_project_owner(investment, user, project)
+
+def handle_payment_failure(payment_intent):
+    """
+    Gérer un paiement échoué : marquer l'investissement comme échoué
+    """
+    from investments.models import Investment
+
+    investment = Investment.objects.filter(payment_intent_id=payment_intent['id']).first()
+    if investment and investment.status == 'pending':
+        investment.status = 'failed'
+        investment.save()
+
+def handle_checkout_success(session):
+    """
+    Gérer une session de paiement Stripe Checkout réussie
+    """
+    from django.contrib.auth import get_user_model
+    from investments.models import Investment
+    from projects.models import Project
+
+    metadata = session.get('metadata', {})
+    project_id = metadata.get('project_id')
+    user_id = metadata.get('user_id')
+    if not (project_id and user_id):
+        return
+
+    User = get_user_model()
+    user = User.objects.get(id=user_id)
+    project = Project.objects.get(id=project_id)
+
+    # Créer ou mettre à jour l'investissement
+    investment, created = Investment.objects.get_or_create(
+        payment_session_id=session['id'],
+        defaults={
+            'user': user,
+            'project': project,
+            'amount': Decimal(session['amount_total']) / 100,
+            'status': 'completed',
+            'payment_intent_id': session.get('payment_intent'),
+        }
+    )
+
+    completed = created
+    if not created and investment.status != 'completed':
+        investment.status = 'completed'
+        investment.payment_intent_id = session.get('payment_intent')
+        investment.save()
+        completed = True
+
+    if completed:
+        _notify_project_owner(investment, user, project)
+
+def _notify_project_owner(investment, investor, project):
+    """
+    Prévient le propriétaire du projet d'un investissement finalisé
+    (notifications regroupées par projet)
+    """
+    from notifications.utils import create_investment_notification
+
+    if project.owner_id != investor.pk:
+        create_investment_notification(project.owner, investor, project, investment)
+
+def _stripe_dict(obj):
+    """
+    Convertit un objet Stripe (ou un dict de payload) en dict JSON simple
+    """
+    return json.loads(json.dumps(obj))
+
+def get_or_create_stripe_customer(user):
+    """
+    Retourne l'ID du client Stripe de l'utilisateur, en le créant au besoin
+
+    L'ID est lu sur le modèle utilisateur, sans appel au prestataire. À la
+    création, l'enregistrement est conditionnel : si une autre requête a
+    enregistré un client entre-temps, c'est le sien qui est conservé.
+    """
+    from django.contrib.auth import get_user_model
+    from .provider import get_payment_provider
+
+    if user.stripe_customer_id:
+        return user.stripe_customer_id
+
+    customer = get_payment_provider().create_customer(
+        email=user.email,
+        name=f"{user.first_name} {user.last_name}",
+        metadata={
+            'user_id': str(user.id)
+        }
+    )
+    User = get_user_model()
+    if not User.objects.filter(pk=user.pk, stripe_customer_id__isnull=True).update(stripe_customer_id=customer.id):
+        logger.warning("Client Stripe %s inutilisé : l'utilisateur %s en a déjà un", customer.id, user.pk)
+    user.stripe_customer_id = User.objects.values_list('stripe_customer_id', flat=True).get(pk=user.pk)
+    return user.stripe_customer_id
+
+def invalidate_saved_payment_methods(user_id, method_type='card'):
+    """
+    Invalide la liste en cache après le commit (sinon une lecture concurrente
+    pourrait remettre en cache l'état antérieur)
+    """
+    key = PAYMENT_METHODS_CACHE_KEY.format(user_id=user_id, method_type=method_type)
+    transaction.on_commit(lambda: cache.delete(key))
+
+def list_saved_payment_methods(user, method_type='card'):
+    """
+    Moyens de paiement enregistrés de l'utilisateur, lus sur la copie locale
+
+    La liste (objets Stripe, du plus récent au plus ancien) est gardée en
+    cache STRIPE_PAYMENT_METHODS_CACHE_TTL secondes et invalidée à chaque
+    modification de la copie locale.
+    """
+    key = PAYMENT_METHODS_CACHE_KEY.format(user_id=user.pk, method_type=method_type)
+    payment_methods = cache.get(key)
+    if payment_methods is None:
+        payment_methods = list(
+            StripePaymentMethod.objects.filter(user=user, method_type=method_type)
+            .order_by('-created', '-id').values_list('data', flat=True)
+        )
+        cache.set(key, payment_methods, getattr(settings, 'STRIPE_PAYMENT_METHODS_CACHE_TTL', 60))
+    return payment_methods
+
+def mirror_payment_method(payment_method, user=None):
+    """
+    Enregistre l'état d'une PaymentMethod Stripe dans la copie locale
+
+    Sans `user`, le propriétaire est retrouvé par l'ID client Stripe. Une
+    PaymentMethod détachée, ou dont le client n'est pas connu ici, est retirée.
+
+    Returns:
+        La ligne StripePaymentMethod, ou None si la méthode a été retirée
+    """
+    from django.contrib.auth import get_user_model
+
+    data = _stripe_dict(payment_method)
+    customer_id = data.get('customer')
+    if user is None and customer_id:
+        user = get_user_model().objects.filter(stripe_customer_id=customer_id).first()
+    if not customer_id or user is None:
+        remove_payment_method_mirror(data['id'])
+        return None
+
+    previous_user_id = StripePaymentMethod.objects.filter(
+        stripe_id=data['id']
+    ).values_list('user_id', flat=True).first()
+    mirror, _ = StripePaymentMethod.objects.update_or_create(
+        stripe_id=data['id'],
+        defaults={
+            'user': user,
+            'customer_id': customer_id,
+            'method_type': data.get('type', 'card'),
+            'data': data,
+            'created': data.get('created') or 0,
+        }
+    )
+    for user_id in {user.pk, previous_user_id} - {None}:
+        invalidate_saved_payment_methods(user_id, mirror.method_type)
+    return mirror
+
+def remove_payment_method_mirror(payment_method_id):
+    """
+    Retire une PaymentMethod de la copie locale
+    """
+    for user_id, method_type in StripePaymentMethod.objects.filter(
+        stripe_id=payment_method_id
+    ).values_list('user_id', 'method_type'):
+        invalidate_saved_payment_methods(user_id, method_type)
+    StripePaymentMethod.objects.filter(stripe_id=payment_method_id).delete()
+
+def sync_customer_payment_methods(user, method_type='card'):
+    """
+    Réaligne la copie locale sur la liste complète des PaymentMethod du client
+
+    Sert au rattrapage (cartes enregistrées avant la copie locale, webhooks
+    perdus) ; le chemin de lecture n'appelle jamais le prestataire.
+
+    Returns:
+        Tuple (méthodes enregistrées, méthodes retirées)
+    """
+    from .provider import get_payment_provider
+
+    if not user.stripe_customer_id:
+        return 0, 0
+
+    provider = get_payment_provider()
+    remote = []
+    params = {'customer': user.stripe_customer_id, 'type': method_type, 'limit': 100}
+    while True:
+        page = provider.list_payment_methods(**params)
+        remote.extend(page.data)
+        if not page.has_more or not page.data:
+            break
+        params['starting_after'] = page.data[-1].id
+
+    for payment_method in remote:
+        mirror_payment_method(payment_method, user=user)
+    stale = StripePaymentMethod.objects.filter(
+        user=user, method_type=method_type
+    ).exclude(stripe_id__in=[payment_method.id for payment_method in remote])
+    removed, _ = stale.delete()
+    invalidate_saved_payment_methods(user.pk, method_type)
+    return len(remote), removed
+
+def handle_customer_deleted(customer):
+    """
+    Gérer la suppression d'un client Stripe : oubli du client et de ses cartes
+    """
+    from django.contrib.auth import get_user_model
+
+    for user_id, method_type in StripePaymentMethod.objects.filter(
+        customer_id=customer['id']
+    ).values_list('user_id', 'method_type'):
+        invalidate_saved_payment_methods(user_id, method_type)
+    StripePaymentMethod.objects.filter(customer_id=customer['id']).delete()
+    get_user_model().objects.filter(stripe_customer_id=customer['id']).update(stripe_customer_id=None)
+
+def handle_payment_method_detached(payment_method):
+    """
+    Gérer le détachement d'une PaymentMethod
+    """
+    remove_payment_method_mirror(payment_method['id'])
+
+WEBHOOK_HANDLERS = {
+    'payment_intent.succeeded': handle_payment_success,
+    'payment_intent.payment_failed': handle_payment_failure,
+    'checkout.session.completed': handle_checkout_success,
+    'payment_method.attached': mirror_payment_method,
+    'payment_method.updated': mirror_payment_method,
+    'payment_method.automatically_updated': mirror_payment_method,
+    'payment_method.detached': handle_payment_method_detached,
+    'customer.deleted': handle_customer_deleted,
+}
+
+def payment_status_group(object_id):
+    """
+    Groupe du channel layer des clients qui suivent un paiement
+    """
+    return f"payment_status.{object_id}"
+
+def payment_status_data(obj):
+    """
+    Représentation d'un PaymentIntent ou d'une session servie aux clients
+    """
+    if obj.get('object') == 'checkout.session':
+        return {
+            'id': obj['id'],
+            'payment_intent': obj.get('payment_intent'),
+            'amount': obj.get('amount_total'),
+            'currency': obj.get('currency'),
+            'status': obj.get('status'),
+            'customer': obj.get('customer'),
+            'metadata': obj.get('metadata') or {},
+        }
+    return {
+        'id': obj['id'],
+        'amount': obj.get('amount'),
+        'currency': obj.get('currency'),
+        'status': obj.get('status'),
+        'payment_method_types': obj.get('payment_method_types') or [],
+    }
+
+def record_payment_status(obj, event_created=0):
+    """
+    Enregistre l'état d'un PaymentIntent ou d'une session et le pousse aux
+    clients abonnés après le commit
+
+    Un état plus ancien que celui déjà connu (`event_created` inférieur) est
+    ignoré.
+
+    Returns:
+        True si l'état a été enregistré
+    """
+    obj = _stripe_dict(obj)
+    object_type = PAYMENT_STATUS_OBJECTS.get(obj.get('object'))
+    if object_type is None:
+        return False
+
+    data = payment_status_data(obj)
+    fields = {
+        'object_type': object_type,
+        'status': data['status'] or '',
+        'data': data,
+        'event_created': event_created,
+        'updated_at': timezone.now(),
+    }
+    user_id = str((obj.get('metadata') or {}).get('user_id', ''))
+    if user_id.isdigit():
+        fields['user_id'] = int(user_id)
+
+    if not PaymentStatus.objects.filter(pk=obj['id'], event_created__lte=event_created).update(**fields):
+        try:
+            with transaction.atomic():
+                PaymentStatus.objects.create(object_id=obj['id'], **fields)
+        except IntegrityError:
+            # Un état plus récent est déjà enregistré
+            return False
+
+    transaction.on_commit(lambda: broadcast_payment_status(obj['id'], data))
+    return True
+
+def broadcast_payment_status(object_id, data):
+    """
+    Envoie l'état d'un paiement aux consommateurs WebSocket qui le suivent
+
+    Envoi au mieux : les clients qui le manquent le relisent à la reconnexion
+    ou par la vue de statut.
+    """
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            payment_status_group(object_id), {'type': 'payment.status', 'data': data}
+        )
+    except Exception:
+        logger.warning("Statut du paiement %s non diffusé", object_id, exc_info=True)
+
+def get_payment_status(object_id, object_type, user):
+    """
+    Dernier état connu d'un paiement de l'utilisateur
+
+    Le prestataire n'est interrogé que pour un paiement encore inconnu
+    localement (créé avant la mise en place du suivi). Un paiement sans
+    utilisateur (métadonnée user_id absente) n'est rendu à personne.
+
+    Raises:
+        PaymentStatus.DoesNotExist: paiement inconnu du prestataire, sans
+            utilisateur ou d'un autre utilisateur
+        ProviderUnavailable: circuit ouvert vers le prestataire
+    """
+    payment = PaymentStatus.objects.filter(pk=object_id).first()
+    if payment is None:
+        from .provider import get_payment_provider
+
+        provider = get_payment_provider()
+        try:
+            if object_type == 'checkout_session':
+                obj = provider.retrieve_checkout_session(object_id)
+            else:
+                obj = provider.retrieve_payment_intent(object_id)
+        except stripe.error.InvalidRequestError:
+            raise PaymentStatus.DoesNotExist()
+        record_payment_status(obj, event_created=int(time.time()))
+        payment = PaymentStatus.objects.get(pk=object_id)
+
+    if payment.object_type != object_type or payment.user_id is None or payment.user_id != user.pk:
+        raise PaymentStatus.DoesNotExist()
+    return payment
+
+async def wait_for_payment_status(object_id, object_type, user, since=None, timeout=0):
+    """
+    Attente longue : rend l'état du paiement dès qu'il diffère de `since`,
+    au plus tard après `timeout` secondes
+
+    Sans relecture périodique : la coroutine s'abonne au groupe du paiement
+    sur le channel layer (le même que le WebSocket, alimenté par
+    record_payment_status quel que soit le processus qui a reçu le webhook)
+    et attend le message suivant ; aucun thread n'est occupé pendant
+    l'attente.
+
+    Returns:
+        Les données du paiement (voir payment_status_data)
+    """
+    import asyncio
+
+    from asgiref.sync import sync_to_async
+    from channels.layers import get_channel_layer
+
+    read = sync_to_async(get_payment_status)
+    payment = await read(object_id, object_type, user)
+    channel_layer = get_channel_layer()
+    timeout = min(timeout, PAYMENT_STATUS_MAX_WAIT)
+    if not since or payment.status != since or timeout <= 0 or channel_layer is None:
+        return payment.data
+
+    group = payment_status_group(object_id)
+    channel = await channel_layer.new_channel()
+    await channel_layer.group_add(group, channel)
+    try:
+        # Relecture après l'abonnement : aucun changement ne peut passer entre les deux
+        payment = await read(object_id, object_type, user)
+        data = payment.data
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (data.get('status') or '') == since:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(channel_layer.receive(channel), remaining)
+            except asyncio.TimeoutError:
+                break
+            data = message.get('data') or data
+        return data
+    finally:
+        await channel_layer.group_discard(group, channel)
+
+def webhook_ordering_key(event):
+    """
+    Clé d'ordonnancement d'un événement : l'ID du PaymentIntent concerné, à
+    défaut celui de l'objet lui-même (PaymentMethod, client)
+    """
+    data_object = event.get('data', {}).get('object', {})
+    if data_object.get('object') == 'payment_intent':
+        return data_object.get('id', '')
+    return data_object.get('payment_intent') or data_object.get('id', '')
+
+def ingest_webhook_event(payload, sig_header):
+    """
+    Vérifie et enregistre un événement Stripe dans la boîte de réception
+
+    Seules la vérification de signature et une insertion sont faites avant de
+    répondre à Stripe ; le traitement est confié au pool de workers après le
+    commit.
+
+    Returns:
+        L'événement enregistré, ou None s'il avait déjà été reçu
+
+    Raises:
+        ValueError: payload invalide
+        stripe.error.SignatureVerificationError: signature invalide
+    """
+    stripe.Webhook.construct_event(payload, sig_header, settings.STRIPE_WEBHOOK_SECRET)
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    event = json.loads(payload)
+
+    try:
+        with transaction.atomic():
+            webhook_event = WebhookEvent.objects.create(
+                event_id=event['id'],
+                event_type=event['type'],
+                ordering_key=webhook_ordering_key(event),
+                payload=event
+            )
+    except IntegrityError:
+        logger.info("Événement Stripe %s déjà reçu", event['id'])
+        return None
+
+    transaction.on_commit(lambda: webhook_pool.submit(webhook_event.pk, webhook_event.ordering_key))
+    return webhook_event
+
+def _claim_webhook_event(event_pk, now):
+    """
+    Passe l'événement à « en cours » si aucun événement antérieur du même
+    PaymentIntent n'est encore en attente ou en cours (ordre par clé)
+    """
+    earlier = WebhookEvent.objects.filter(
+        ordering_key=OuterRef('ordering_key'),
+        pk__lt=OuterRef('pk'),
+        status__in=['pending', 'processing']
+    )
+    return WebhookEvent.objects.filter(
+        pk=event_pk, status='pending', next_attempt_at__lte=now
+    ).filter(~Exists(earlier)).update(
+        status='processing',
+        attempts=F('attempts') + 1,
+        locked_at=now
+    )
+
+def process_webhook_event(event_pk):
+    """
+    Traite un événement de la boîte de réception
+
+    Returns:
+        Tuple (résultat, délai) : résultat vaut 'processed', 'failed'
+        (abandonné après WEBHOOK_MAX_ATTEMPTS essais), 'retry' (délai en
+        secondes avant le prochain essai) ou 'skipped' (événement déjà pris,
+        pas encore dû, ou précédé d'un événement non traité du même
+        PaymentIntent)
+    """
+    now = timezone.now()
+    if not _claim_webhook_event(event_pk, now):
+        return 'skipped', None
+
+    webhook_event = WebhookEvent.objects.get(pk=event_pk)
+    handler = WEBHOOK_HANDLERS.get(webhook_event.event_type)
+    try:
+        with transaction.atomic():
+            if handler is not None:
+                handler(webhook_event.payload['data']['object'])
+            record_payment_status(webhook_event.payload['data']['object'], webhook_event.payload.get('created') or 0)
+            WebhookEvent.objects.filter(pk=event_pk).update(
+                status='processed', processed_at=timezone.now(), locked_at=None, last_error=''
+            )
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        if webhook_event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+            logger.error("Événement Stripe %s abandonné : %s", webhook_event.event_id, error)
+            WebhookEvent.objects.filter(pk=event_pk).update(status='failed', locked_at=None, last_error=error)
+            return 'failed', None
+
+        delay = min(WEBHOOK_RETRY_BASE_SECONDS * 2 ** (webhook_event.attempts - 1), WEBHOOK_RETRY_MAX_SECONDS)
+        logger.warning("Événement Stripe %s en échec, nouvel essai dans %ss : %s", webhook_event.event_id, delay, error)
+        WebhookEvent.objects.filter(pk=event_pk).update(
+            status='pending', locked_at=None, last_error=error,
+            next_attempt_at=timezone.now() + timedelta(seconds=delay)
+        )
+        return 'retry', delay
+    return 'processed', None
+
+def next_webhook_event(ordering_key):
+    """
+    Retourne l'ID du prochain événement à traiter pour un PaymentIntent
+    """
+    return WebhookEvent.objects.filter(
+        ordering_key=ordering_key, status='pending', next_attempt_at__lte=timezone.now()
+    ).order_by('pk').values_list('pk', flat=True).first()
+
+def reclaim_stale_webhook_events():
+    """
+    Remet en attente les événements bloqués « en cours » (worker interrompu)
+    """
+    return WebhookEvent.objects.filter(
+        status='processing', locked_at__lt=timezone.now() - WEBHOOK_PROCESSING_TIMEOUT
+    ).update(status='pending', locked_at=None)
+
+def process_pending_webhook_events(limit=None, include_scheduled=False):
+    """
+    Traite les événements en attente dans l'ordre de réception
+
+    Utilisé par la commande process_webhook_events (reprise après arrêt,
+    nouvelles tentatives, déploiement sans pool en processus).
+
+    Returns:
+        Dictionnaire du nombre d'événements par résultat
+    """
+    reclaim_stale_webhook_events()
+    pending = WebhookEvent.objects.filter(status='pending')
+    if include_scheduled:
+        pending.update(next_attempt_at=timezone.now())
+    else:
+        pending = pending.filter(next_attempt_at__lte=timezone.now())
+
+    outcomes = {'processed': 0, 'failed': 0, 'retry': 0, 'skipped': 0}
+    for event_pk in list(pending.order_by('pk').values_list('pk', flat=True)[:limit]):
+        outcome, _ = process_webhook_event(event_pk)
+        outcomes[outcome] += 1
+    return outcomes
+
+class WebhookWorkerPool:
+    """
+    Pool de threads qui traite les événements de la boîte de réception
+
+    Chaque PaymentIntent est affecté à une file (hachage de `ordering_key`)
+    consommée par un seul thread : les événements d'un même paiement sont
+    traités dans l'ordre, ceux de paiements différents en parallèle. Entre
+    processus, l'ordre est garanti par _claim_webhook_event.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self._lanes = None
+        self._lock = threading.Lock()
+
+    def _worker_count(self):
+        if self.workers is not None:
+            return self.workers
+        return getattr(settings, 'STRIPE_WEBHOOK_WORKERS', 4)
+
+    def _start(self):
+        with self._lock:
+            if self._lanes is None:
+                self._lanes = [queue.Queue() for _ in range(self._worker_count())]
+                for index, lane in enumerate(self._lanes):
+                    threading.Thread(
+                        target=self._run, args=(lane,), name=f"webhook-worker-{index}", daemon=True
+                    ).start()
+        return self._lanes
+
+    def submit(self, event_pk, ordering_key):
+        """
+        Planifie le traitement d'un événement ; sans worker configuré
+        (STRIPE_WEBHOOK_WORKERS = 0), la commande process_webhook_events s'en charge
+        """
+        if not self._worker_count():
+            return
+        lanes = self._start()
+        lanes[zlib.crc32(ordering_key.encode('utf-8')) % len(lanes)].put((event_pk, ordering_key))
+
+    def wait_idle(self):
+        """
+        Attend que toutes les files soient vides (hors nouvelles tentatives planifiées)
+        """
+        for lane in self._lanes or []:
+            lane.join()
+
+    def _run(self, lane):
+        while True:
+            event_pk, ordering_key = lane.get()
+            try:
+                self._process_chain(event_pk, ordering_key)
+            except Exception:
+                logger.exception("Erreur du worker de webhooks")
+            finally:
+                close_old_connections()
+                lane.task_done()
+
+    def _process_chain(self, event_pk, ordering_key):
+        # Après chaque événement traité, enchaîne le suivant du même PaymentIntent
+        # qui aurait attendu son tour
+        while event_pk is not None:
+            outcome, delay = process_webhook_event(event_pk)
+            if outcome == 'retry':
+                timer = threading.Timer(delay, self.submit, args=(event_pk, ordering_key))
+                timer.daemon = True
+                timer.start()
+            if outcome not in ('processed', 'failed'):
+                return
+            event_pk = next_webhook_event(ordering_key) if ordering_key else None
+
+webhook_pool = WebhookWorkerPool()
@@ -1,37 +1,48 @@
 # payments/views.py
 import logging
-from decimal import Decimal
+import time
 
 import stripe
-from django.conf import settings
-from django.contrib.auth import get_user_model
+from asgiref.sync import sync_to_async
 from django.db.models import Q
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
-from investments.models import Investment
 from notifications.utils import create_system_notification
-from projects.models import Project
 from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import APIException
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
+from src.pagination import KeysetPagination
 
-from .models import Invoice, PaymentMethod
+from .models import Invoice, PaymentMethod, PaymentStatus, StripePaymentMethod
 from .permissions import IsInvoiceOwner, IsPaymentMethodOwner
+from .provider import ProviderUnavailable, get_payment_provider
 from .serializers import (InvoiceSerializer, PaymentMethodCreateSerializer,
                           PaymentMethodSerializer, PaymentProcessSerializer,
                           TransactionSerializer)
-from .utils import create_invoice, generate_receipt_data, get_user_transactions
+from .utils import (PAYMENT_STATUS_MAX_WAIT, create_invoice, get_or_create_stripe_customer,
+                    get_receipt, get_user_transactions, ingest_webhook_event,
+                    list_saved_payment_methods, mirror_payment_method, record_payment_status,
+                    remove_payment_method_mirror, wait_for_payment_status)
 
-# Configurer Stripe avec votre clé secrète
-stripe.api_key = settings.STRIPE_SECRET_KEY
 # Configure the logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # You can add handlers here if needed, e.g., FileHandler or StreamHandler
+
+class TransactionPagination(KeysetPagination):
+    """
+    Historique des transactions, de la plus récente à la plus ancienne
+    """
+    ordering = ('-issue_date', '-id')
+
 class CreatePaymentIntentView(APIView):
     permission_classes = [IsAuthenticated]
     
@@ -46,12 +57,13 @@ class CreatePaymentIntentView(APIView):
             metadata['user_id'] = str(request.user.id)
             
             # Créer l'intention de paiement
-            intent = stripe.PaymentIntent.create(
+            intent = get_payment_provider().create_payment_intent(
                 amount=amount,
                 currency=currency,
                 metadata=metadata,
                 payment_method_types=['card'],
             )
+            record_payment_status(intent, event_created=intent.get('created') or 0)
             
             return Response({
                 'success': True,
@@ -65,6 +77,11 @@ class CreatePaymentIntentView(APIView):
                 }
             })
             
+        except ProviderUnavailable as e:
+            return Response({
+                'success': False,
+                'message': str(e)
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except stripe.error.StripeError as e:
             return Response({
                 'success': False,
@@ -98,7 +115,7 @@ class CreateCheckoutSessionView(APIView):
             metadata['user_id'] = str(request.user.id)
             
             # Créer la session de paiement
-            session = stripe.checkout.Session.create(
+            session = get_payment_provider().create_checkout_session(
                 payment_method_types=['card'],
                 line_items=[{
                     'price_data': {
@@ -116,6 +133,7 @@ class CreateCheckoutSessionView(APIView):
                 cancel_url=cancel_url,
                 metadata=metadata,
             )
+            record_payment_status(session, event_created=session.get('created') or 0)
             
             return Response({
                 'success': True,
@@ -129,36 +147,11 @@ class CreateCheckoutSessionView(APIView):
                 }
             })
             
-        except stripe.error.StripeError as e:
+        except ProviderUnavailable as e:
             return Response({
                 'success': False,
                 'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
-            return Response({
-                'success': False,
-                'message': str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-class PaymentStatusView(APIView):
-    permission_classes = [IsAuthenticated]
-    
-    def get(self, request, payment_id):
-        try:
-            # Récupérer les détails de l'intention de paiement
-            intent = stripe.PaymentIntent.retrieve(payment_id)
-            
-            return Response({
-                'success': True,
-                'data': {
-                    'id': intent.id,
-                    'amount': intent.amount,
-                    'currency': intent.currency,
-                    'status': intent.status,
-                    'payment_method_types': intent.payment_method_types,
-                }
-            })
-            
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except stripe.error.StripeError as e:
             return Response({
                 'success': False,
@@ -170,45 +163,92 @@ class PaymentStatusView(APIView):
                 'message': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CheckSessionStatusView(APIView):
-    permission_classes = [IsAuthenticated]
+def _wait_seconds(request):
+    """
+    Durée d'attente longue demandée (`?wait=`), bornée par PAYMENT_STATUS_MAX_WAIT
+    """
+    try:
+        return max(0.0, min(float(request.GET.get('wait', 0)), PAYMENT_STATUS_MAX_WAIT))
+    except ValueError:
+        return 0.0
+
+def _authenticated_user(request):
+    """
+    Utilisateur authentifié par les authentifications de l'API (JWT, session,
+    jeton) pour une vue Django hors DRF, ou None
+    """
+    drf_request = Request(request, authenticators=[
+        authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ])
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user.is_authenticated else None
+
+class PaymentStatusView(View):
+    """
+    Statut d'un PaymentIntent, lu dans l'état local tenu à jour par les webhooks
+
+    Avec `?since=<statut>&wait=<secondes>`, la réponse attend que le statut
+    change (attente longue). Vue asynchrone : l'attente porte sur le channel
+    layer (voir wait_for_payment_status) et n'occupe pas de worker sous
+    ASGI. Le WebSocket /ws/payments/<id>/ pousse les mêmes changements sans
+    requête.
+    """
+    object_type = 'payment_intent'
     
-    def get(self, request, session_id):
+    async def get(self, request, payment_id):
+        user = await sync_to_async(_authenticated_user)(request)
+        if user is None:
+            return JsonResponse({
+                'detail': "Informations d'authentification non fournies."
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        
         try:
-            # Récupérer les détails de la session de paiement
-            session = stripe.checkout.Session.retrieve(session_id)
+            data = await wait_for_payment_status(
+                payment_id, self.object_type, user,
+                since=request.GET.get('since'), timeout=_wait_seconds(request)
+            )
             
-            return Response({
+            return JsonResponse({
                 'success': True,
-                'data': {
-                    'id': session.id,
-                    'payment_intent': session.payment_intent,
-                    'amount': session.amount_total,
-                    'currency': session.currency,
-                    'status': session.status,
-                    'customer': session.customer,
-                    'metadata': session.metadata,
-                }
+                'data': data
             })
             
-        except stripe.error.StripeError as e:
-            return Response({
+        except PaymentStatus.DoesNotExist:
+            return JsonResponse({
+                'success': False,
+                'message': 'Paiement introuvable'
+            }, status=status.HTTP_404_NOT_FOUND)
+        except ProviderUnavailable as e:
+            return JsonResponse({
                 'success': False,
                 'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
-            return Response({
+            return JsonResponse({
                 'success': False,
                 'message': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class CheckSessionStatusView(PaymentStatusView):
+    """
+    Statut d'une session Checkout (mêmes options que PaymentStatusView)
+    """
+    object_type = 'checkout_session'
+    
+    async def get(self, request, session_id):
+        return await super().get(request, session_id)
+
 class ConfirmPaymentView(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request, payment_id):
         try:
             # Confirmer l'intention de paiement
-            intent = stripe.PaymentIntent.confirm(payment_id)
+            intent = get_payment_provider().confirm_payment_intent(payment_id)
+            record_payment_status(intent, event_created=int(time.time()))
             
             return Response({
                 'success': True,
@@ -218,6 +258,11 @@ class ConfirmPaymentView(APIView):
                 }
             })
             
+        except ProviderUnavailable as e:
+            return Response({
+                'success': False,
+                'message': str(e)
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except stripe.error.StripeError as e:
             return Response({
                 'success': False,
@@ -234,53 +279,17 @@ class SavedPaymentMethodsView(APIView):
     
     def get(self, request):
         try:
-            # Récupérer le client Stripe associé à l'utilisateur
-            customer = self._get_or_create_customer(request.user)
-            
-            # Récupérer les méthodes de paiement enregistrées
-            payment_methods = stripe.PaymentMethod.list(
-                customer=customer.id,
-                type="card",
-            )
-            
+            # Lecture sur la copie locale (synchronisée par les webhooks), sans appel à Stripe
             return Response({
                 'success': True,
-                'data': payment_methods.data
+                'data': list_saved_payment_methods(request.user, method_type='card')
             })
             
-        except stripe.error.StripeError as e:
-            return Response({
-                'success': False,
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({
                 'success': False,
                 'message': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
-    def _get_or_create_customer(self, user):
-        # Récupérer ou créer un client Stripe pour l'utilisateur
-        # Cette fonction dépend de votre modèle utilisateur
-        # et de la façon dont vous stockez l'ID client Stripe
-        
-        # Exemple simplifié:
-        if hasattr(user, 'stripe_customer_id') and user.stripe_customer_id:
-            return stripe.Customer.retrieve(user.stripe_customer_id)
-        else:
-            customer = stripe.Customer.create(
-                email=user.email,
-                name=f"{user.first_name} {user.last_name}",
-                metadata={
-                    'user_id': str(user.id)
-                }
-            )
-            
-            # Enregistrer l'ID client dans votre modèle utilisateur
-            user.stripe_customer_id = customer.id
-            user.save()
-            
-            return customer
 
 class SavePaymentMethodView(APIView):
     permission_classes = [IsAuthenticated]
@@ -296,19 +305,25 @@ class SavePaymentMethodView(APIView):
                 }, status=status.HTTP_400_BAD_REQUEST)
             
             # Récupérer ou créer le client Stripe
-            customer = self._get_or_create_customer(request.user)
+            customer_id = get_or_create_stripe_customer(request.user)
             
-            # Attacher la méthode de paiement au client
-            payment_method = stripe.PaymentMethod.attach(
+            # Attacher la méthode de paiement au client puis l'enregistrer localement
+            payment_method = get_payment_provider().attach_payment_method(
                 payment_method_id,
-                customer=customer.id,
+                customer=customer_id,
             )
+            mirror_payment_method(payment_method, user=request.user)
             
             return Response({
                 'success': True,
                 'data': payment_method
             })
             
+        except ProviderUnavailable as e:
+            return Response({
+                'success': False,
+                'message': str(e)
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except stripe.error.StripeError as e:
             return Response({
                 'success': False,
@@ -319,32 +334,22 @@ class SavePaymentMethodView(APIView):
                 'success': False,
                 'message': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
-    def _get_or_create_customer(self, user):
-        # Même fonction que dans SavedPaymentMethodsView
-        if hasattr(user, 'stripe_customer_id') and user.stripe_customer_id:
-            return stripe.Customer.retrieve(user.stripe_customer_id)
-        else:
-            customer = stripe.Customer.create(
-                email=user.email,
-                name=f"{user.first_name} {user.last_name}",
-                metadata={
-                    'user_id': str(user.id)
-                }
-            )
-            
-            user.stripe_customer_id = customer.id
-            user.save()
-            
-            return customer
 
 class DeletePaymentMethodView(APIView):
     permission_classes = [IsAuthenticated]
     
     def delete(self, request, payment_method_id):
         try:
+            # Une carte connue localement ne peut être détachée que par son propriétaire
+            if StripePaymentMethod.objects.filter(stripe_id=payment_method_id).exclude(user=request.user).exists():
+                return Response({
+                    'success': False,
+                    'message': 'Méthode de paiement introuvable'
+                }, status=status.HTTP_404_NOT_FOUND)
+            
             # Détacher la méthode de paiement
-            payment_method = stripe.PaymentMethod.detach(payment_method_id)
+            payment_method = get_payment_provider().detach_payment_method(payment_method_id)
+            remove_payment_method_mirror(payment_method.id)
             
             return Response({
                 'success': True,
@@ -354,6 +359,11 @@ class DeletePaymentMethodView(APIView):
                 }
             })
             
+        except ProviderUnavailable as e:
+            return Response({
+                'success': False,
+                'message': str(e)
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except stripe.error.StripeError as e:
             return Response({
                 'success': False,
@@ -369,25 +379,16 @@ class DeletePaymentMethodView(APIView):
 @permission_classes([AllowAny])
 @csrf_exempt
 def stripe_webhook(request):
+    """
+    Reçoit un événement Stripe : vérification, enregistrement dans la boîte de
+    réception puis réponse immédiate ; le traitement est asynchrone
+    """
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
-    logging.info(f"Received webhook: {payload}")
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
-        )
-        
-        # Gérer les différents types d'événements
-        if event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-            handle_payment_success(payment_intent)
-        elif event['type'] == 'payment_intent.payment_failed':
-            payment_intent = event['data']['object']
-            handle_payment_failure(payment_intent)
-        elif event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            handle_checkout_success(session)
-        
+        webhook_event = ingest_webhook_event(payload, sig_header)
+        if webhook_event is not None:
+            logger.debug("Webhook reçu : %s %s", webhook_event.event_type, webhook_event.event_id)
         return JsonResponse({'status': 'success'})
     
     except ValueError as e:
@@ -397,104 +398,6 @@ def stripe_webhook(request):
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
-def handle_payment_success(payment_intent):
-    """
-    Gérer un paiement réussi
-    """
-    # Récupérer les métadonnées
-    metadata = payment_intent.get('metadata', {})
-    project_id = metadata.get('project_id')
-    user_id = metadata.get('user_id')
-    
-    # Mettre à jour votre base de données
-    # Par exemple, créer un investissement ou mettre à jour son statut
-    
-    # Exemple simplifié:
-    from django.contrib.auth import get_user_model
-    from investments.models import Investment
-    from projects.models import Project
-    
-    User = get_user_model()
-    
-    try:
-        if project_id and user_id:
-            user = User.objects.get(id=user_id)
-            project = Project.objects.get(id=project_id)
-            
-            # Créer ou mettre à jour l'investissement
-            investment, created = Investment.objects.get_or_create(
-                payment_intent_id=payment_intent.id,
-                defaults={
-                    'user': user,
-                    'project': project,
-                    'amount': Decimal(payment_intent.amount) / 100,  # Convertir les centimes en unités
-                    'status': 'completed',
-                }
-            )
-            
-            if not created:
-                investment.status = 'completed'
-                investment.save()
-    except Exception as e:
-        # Gérer les erreurs et les journaliser
-        print(f"Error handling payment success: {str(e)}")
-
-def handle_payment_failure(payment_intent):
-    """
-    Gérer un paiement échoué
-    """
-    # Mettre à jour votre base de données
-    # Par exemple, marquer un investissement comme échoué
-    
-    # Exemple simplifié:
-    from investments.models import Investment
-    
-    try:
-        investment = Investment.objects.filter(payment_intent_id=payment_intent.id).first()
-        if investment:
-            investment.status = 'failed'
-            investment.save()
-    except Exception as e:
-        print(f"Error handling payment failure: {str(e)}")
-
-def handle_checkout_success(session):
-    """
-    Gérer une session de paiement Stripe Checkout réussie
-    """
-    # Récupérer les métadonnées
-    metadata = session.get('metadata', {})
-    project_id = metadata.get('project_id')
-    user_id = metadata.get('user_id')
-    
-    # Mettre à jour votre base de données
-    # Exemple simplifié:
-
-    User = get_user_model()
-    
-    try:
-        if project_id and user_id:
-            user = User.objects.get(id=user_id)
-            project = Project.objects.get(id=project_id)
-            
-            # Créer ou mettre à jour l'investissement
-            investment, created = Investment.objects.get_or_create(
-                payment_session_id=session.id,
-                defaults={
-                    'user': user,
-                    'project': project,
-                    'amount': Decimal(session.amount_total) / 100,
-                    'status': 'completed',
-                    'payment_intent_id': session.payment_intent,
-                }
-            )
-            
-            if not created:
-                investment.status = 'completed'
-                investment.payment_intent_id = session.payment_intent
-                investment.save()
-    except Exception as e:
-        print(f"Error handling checkout success: {str(e)}")
-
 class PaymentMethodViewSet(viewsets.ModelViewSet):
     """
     API endpoint pour les méthodes de paiement
@@ -617,9 +520,14 @@ class InvoiceViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        receipt_data = generate_receipt_data(invoice)
+        # Reçu rendu au paiement et servi tel quel ; ?output=html pour la version imprimable
+        receipt = get_receipt(invoice)
+        if request.query_params.get('output') == 'html':
+            response = HttpResponse(receipt.document, content_type='text/html; charset=utf-8')
+            response['Content-Disposition'] = f'inline; filename="{receipt.receipt_number}.html"'
+            return response
         
-        return Response(receipt_data)
+        return Response(receipt.data)
 
 class PaymentProcessViewSet(viewsets.ViewSet):
     """
@@ -646,22 +554,8 @@ class PaymentProcessViewSet(viewsets.ViewSet):
         """
         Récupère l'historique des transactions de l'utilisateur
         """
-        transactions = get_user_transactions(request.user)
-        
-        # Pagination manuelle
-        page_size = int(request.query_params.get('page_size', 10))
-        page = int(request.query_params.get('page', 1))
-        
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        
-        paginated_transactions = transactions[start_idx:end_idx]
-        
-        serializer = TransactionSerializer(paginated_transactions, many=True)
+        paginator = TransactionPagination()
+        page = paginator.paginate_queryset(get_user_transactions(request.user), request, view=self)
+        serializer = TransactionSerializer(page, many=True)
         
-        return Response({
-            'count': len(transactions),
-            'next': page < (len(transactions) // page_size) + 1,
-            'previous': page > 1,
-            'results': serializer.data
-        })
\ No newline at end of file
+        return paginator.get_paginated_response(serializer.data)
\ No newline at end of file
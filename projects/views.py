@@ -164,6 +164,35 @@ class ProjectViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save()
     
+    @action(detail=True, methods=['post'])
+    def publish_update(self, request, pk=None):
+        """
+        Prévient les investisseurs d'un projet actif de sa mise à jour (envoi
+        groupé, en tâche de fond pour une large audience)
+        """
+        project = self.get_object()
+        
+        # Vérifier que l'utilisateur est le propriétaire du projet
+        if project.owner != request.user:
+            return Response(
+                {"detail": "Vous n'êtes pas autorisé à publier une mise à jour de ce projet."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        if project.status != 'active':
+            return Response(
+                {"detail": "Seule la mise à jour d'un projet actif peut être publiée."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        from notifications.utils import create_project_update_notifications
+        fanout = create_project_update_notifications(project, project.owner)
+        return Response({
+            'status': 'success',
+            'recipients': fanout.total,
+            'job_status': fanout.status
+        })
+    
     @action(detail=True, methods=['post'])
     def add_media(self, request, pk=None):
         project = self.get_object()
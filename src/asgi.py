@@ -13,4 +13,21 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
 
-application = get_asgi_application()
+# Initialise Django avant d'importer les consommateurs (modèles)
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+from messaging.routing import websocket_urlpatterns as messaging_websocket_urlpatterns  # noqa: E402
+from notifications.routing import websocket_urlpatterns as notifications_websocket_urlpatterns  # noqa: E402
+from payments.routing import websocket_urlpatterns as payments_websocket_urlpatterns  # noqa: E402
+from src.websocket import JWTAuthMiddlewareStack  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        JWTAuthMiddlewareStack(URLRouter(
+            payments_websocket_urlpatterns + notifications_websocket_urlpatterns + messaging_websocket_urlpatterns
+        ))
+    ),
+})
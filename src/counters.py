@@ -0,0 +1,79 @@
+# src/counters.py
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+
+class UnreadCounter:
+    """
+    Compteur de non-lus par utilisateur, dénormalisé dans `model`
+    (clé primaire `user`, champ `unread`)
+
+    `count_unread(user_ids)` calcule les valeurs exactes ({ID: nombre}) ; il
+    sert à initialiser une ligne absente à la première lecture et à la
+    réparation. Les variations sont des UPDATE relatifs (F()), à exécuter
+    dans la transaction qui modifie les lignes comptées ; une ligne absente
+    n'est pas créée par une variation, puisque son COUNT initial inclura la
+    ligne modifiée.
+    """
+
+    def __init__(self, model, count_unread):
+        self.model = model
+        self.count_unread = count_unread
+
+    def get(self, user_id):
+        """
+        Nombre de non-lus : une lecture de clé primaire, un COUNT la première fois
+        """
+        unread = self.model.objects.filter(pk=user_id).values_list('unread', flat=True).first()
+        if unread is not None:
+            return unread
+        unread = self.count_unread([user_id]).get(user_id, 0)
+        try:
+            with transaction.atomic():
+                self.model.objects.create(user_id=user_id, unread=unread)
+        except IntegrityError:
+            # Initialisé entre-temps par une requête concurrente
+            return self.model.objects.filter(pk=user_id).values_list('unread', flat=True).first()
+        return unread
+
+    def adjust(self, user_ids, delta):
+        """
+        Ajoute `delta` (négatif pour une lecture ou une suppression) aux
+        compteurs des utilisateurs donnés, sans descendre sous zéro
+
+        Returns:
+            Nombre de compteurs modifiés
+        """
+        if not delta or not user_ids:
+            return 0
+        counters = self.model.objects.filter(pk__in=list(user_ids))
+        if delta > 0:
+            return counters.update(unread=F('unread') + delta)
+        return counters.update(unread=Greatest(F('unread') + delta, 0))
+
+    def adjust_many(self, deltas):
+        """
+        Applique des variations différentes par utilisateur ({ID: delta}), un
+        UPDATE par valeur distincte
+        """
+        by_delta = {}
+        for user_id, delta in deltas.items():
+            by_delta.setdefault(delta, []).append(user_id)
+        return sum(self.adjust(user_ids, delta) for delta, user_ids in by_delta.items())
+
+    def repair(self, user_ids):
+        """
+        Recalcule et écrit les compteurs des utilisateurs donnés (upsert groupé)
+
+        Returns:
+            Nombre de compteurs absents ou différents de la valeur exacte
+        """
+        exact = self.count_unread(user_ids)
+        stored = dict(self.model.objects.filter(pk__in=user_ids).values_list('pk', 'unread'))
+        drifted = sum(1 for user_id in user_ids if stored.get(user_id) != exact.get(user_id, 0))
+        self.model.objects.bulk_create(
+            [self.model(user_id=user_id, unread=exact.get(user_id, 0)) for user_id in user_ids],
+            update_conflicts=True, unique_fields=['user'], update_fields=['unread']
+        )
+        return drifted
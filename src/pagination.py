@@ -0,0 +1,154 @@
+# src/pagination.py
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pagination par clé (keyset) sur un ordre total
+
+    `ordering` doit désigner des champs non nuls dont la combinaison est unique
+    (terminer par l'ID). Le curseur transporte les valeurs de la dernière ligne
+    servie : chaque page est une requête `WHERE (clé) < (curseur) ORDER BY clé
+    LIMIT n` dont le coût ne dépend ni de la position ni de la taille de
+    l'historique, sans COUNT. Un index sur les champs de `ordering` (précédés
+    du filtre de la vue) la rend indépendante du volume.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = api_settings.PAGE_SIZE or 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Curseur invalide.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request)
+        if values is not None:
+            values = self._coerce(queryset.model, values)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(field[1:] if field.startswith('-') else f"-{field}" for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._after(values, ordering))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def _after(self, values, ordering):
+        """
+        Condition « strictement après `values` » dans l'ordre `ordering`
+
+        La borne large sur le premier champ, redondante, permet au moteur de
+        positionner le parcours d'index au lieu de filtrer depuis le début.
+        """
+        condition = Q()
+        for index, field in enumerate(ordering):
+            lookups = {name.lstrip('-'): value for name, value in zip(ordering[:index], values)}
+            lookups[f"{field.lstrip('-')}__{'lt' if field.startswith('-') else 'gt'}"] = values[index]
+            condition |= Q(**lookups)
+        first = ordering[0]
+        return Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]}) & condition
+
+    def _coerce(self, model, values):
+        """
+        Convertit les valeurs du curseur selon les champs de `ordering`
+
+        Un curseur décodable mais dont une valeur ne correspond pas au champ
+        (texte à la place d'une date, par exemple) est refusé comme un
+        curseur illisible, avant d'atteindre la base.
+        """
+        try:
+            coerced = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if any(value is None for value in coerced):
+            raise NotFound(self.invalid_cursor_message)
+        return coerced
+
+    def _row_values(self, row):
+        values = [getattr(row, field.lstrip('-')) for field in self.ordering]
+        # DjangoJSONEncoder tronque les datetimes à la milliseconde : les lignes
+        # séparées de moins d'une milliseconde seraient sautées
+        return [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+
+    def encode_cursor(self, row, reverse):
+        payload = json.dumps({'v': self._row_values(row), 'r': int(reverse)}, cls=DjangoJSONEncoder)
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        """
+        Returns:
+            Tuple (valeurs de la clé ou None, parcours inverse)
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values = payload['v']
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return values, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.page):
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -19,6 +19,30 @@ NEXT_PUBLIC_FRONTEND_URL = "http://localhost:3000"
 STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+# Threads de traitement des webhooks Stripe par processus (0 : commande process_webhook_events seule)
+STRIPE_WEBHOOK_WORKERS = int(os.environ.get('STRIPE_WEBHOOK_WORKERS', 4))
+# Client du prestataire de paiement (valeurs par défaut dans payments/provider.py) ;
+# BACKEND='emulator' remplace Stripe par un émulateur en mémoire
+PAYMENT_PROVIDER = {
+    'BACKEND': os.environ.get('PAYMENT_PROVIDER_BACKEND', 'stripe'),
+}
+# Durée (secondes) de mise en cache de la liste des cartes enregistrées d'un utilisateur
+STRIPE_PAYMENT_METHODS_CACHE_TTL = int(os.environ.get('STRIPE_PAYMENT_METHODS_CACHE_TTL', 60))
+
+# Durée (secondes) de conservation en mémoire de la table des taux de change
+EXCHANGE_RATE_CACHE_TTL = 300
+
+# Numéros de facture réservés par processus à chaque écriture du compteur quotidien
+INVOICE_NUMBER_BLOCK_SIZE = int(os.environ.get('INVOICE_NUMBER_BLOCK_SIZE', 100))
+
+# Threads d'envoi des notifications groupées par processus (0 : commande run_notification_fanouts seule)
+NOTIFICATION_FANOUT_WORKERS = int(os.environ.get('NOTIFICATION_FANOUT_WORKERS', 1))
+# Fenêtre (secondes) de regroupement des notifications d'un même type sur un même objet (0 : désactivé)
+NOTIFICATION_COALESCE_WINDOW_SECONDS = int(os.environ.get('NOTIFICATION_COALESCE_WINDOW_SECONDS', 3600))
+# Conservation (jours) des notifications lues avant archivage, puis des archives (0 : archives conservées)
+# par la commande prune_notifications
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+NOTIFICATION_ARCHIVE_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_ARCHIVE_RETENTION_DAYS', 365))
 
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -40,6 +64,7 @@ INSTALLED_APPS = [
     'django_celery_results',
     'debug_toolbar',
     'storages',
+    'djmoney',
 
     'projects',
     'comments',
@@ -50,10 +75,17 @@ INSTALLED_APPS = [
     'payments',
     'admin_dashboard',
     'users',
+    'wallet',
     # Ton app d'authentification
     
 ]
 
+# Tests de charge (faux prestataire de paiement, commandes loadtest_*) : en
+# développement, ou explicitement avec LOADTEST_ENABLED=1
+LOADTEST_ENABLED = DEBUG or os.environ.get('LOADTEST_ENABLED', '').lower() in ('1', 'true', 'yes')
+if LOADTEST_ENABLED:
+    INSTALLED_APPS.append('loadtest')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -86,6 +118,22 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'src.wsgi.application'
+ASGI_APPLICATION = 'src.asgi.application'
+
+# Couche de messages Channels (WebSocket) : Redis si CHANNEL_REDIS_URL est défini
+# (plusieurs processus, nécessite channels_redis), sinon en mémoire (un seul
+# processus, tests)
+if os.environ.get('CHANNEL_REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.environ['CHANNEL_REDIS_URL']]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+    }
 
 
 # Database
@@ -122,7 +170,17 @@ EMAIL_PORT = 465
 
 
 # Email settings
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# 'django.core.mail.backends.locmem.EmailBackend' garde les emails en mémoire (développement,
+# tests ; le lanceur de tests de Django l'impose)
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+# Boîte d'envoi (notifications/outbox.py) : les emails partent hors de la requête, par lots sur
+# une même connexion ; EMAIL_OUTBOX=0 revient à l'envoi immédiat dans la requête
+EMAIL_OUTBOX = os.environ.get('EMAIL_OUTBOX', '1') != '0'
+# Threads d'envoi par processus (0 : commande send_queued_emails seule) et emails par lot
+EMAIL_OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS', 1))
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 50))
+# Secondes pendant lesquelles un worker inactif garde sa connexion SMTP ouverte
+EMAIL_OUTBOX_KEEPALIVE = float(os.environ.get('EMAIL_OUTBOX_KEEPALIVE', 5))
 EMAIL_HOST = 'smtp.gmail.com'
 # EMAIL_PORT = 587
 
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from subscriptions.utils import RENEWAL_LEAD_DAYS, bill_subscription_renewals
+
+
+class Command(BaseCommand):
+    help = (
+        "Émet les factures de renouvellement des abonnements à renouvellement automatique "
+        "arrivant à échéance (à planifier quotidiennement ; rejouable sans doublon)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lead-days', type=int, default=RENEWAL_LEAD_DAYS,
+                            help="Jours avant l'échéance à partir desquels facturer")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        result = bill_subscription_renewals(lead_days=options['lead_days'], chunk_size=options['chunk_size'])
+        self.stdout.write(
+            f"{result['rows']} factures de renouvellement en {result['chunks']} lots "
+            f"({result['elapsed_s']:.2f}s)"
+        )
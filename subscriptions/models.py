@@ -41,6 +41,13 @@ class Subscription(models.Model):
     auto_renew = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     transaction_id = models.CharField(max_length=100, blank=True)
+    # Fin de période pour laquelle la facture de renouvellement a été émise
+    renewal_invoiced_until = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['auto_renew', 'status', 'end_date'], name='subscription_renewal_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.plan.name}"
@@ -1,3 +1,81 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
 from django.test import TestCase
+from django.utils import timezone
+from payments.models import Invoice, PaymentMethod
+from rest_framework.test import APIClient
+from users.models import User
+
+from .models import Subscription, SubscriptionPlan
+from .utils import bill_subscription_renewals
+
+
+class RenewalBillingTests(TestCase):
+    """
+    Facturation des renouvellements d'abonnement et prolongation au paiement
+    """
+
+    def setUp(self):
+        self.now = timezone.make_aware(datetime(2026, 3, 14, 9))
+        self.plan = SubscriptionPlan.objects.create(
+            name='Premium', plan_type='premium_investor', price=Decimal('30.00'), duration_days=30,
+            description='Plan premium'
+        )
+        self.user = User.objects.create(username='abonne', email='abonne@example.com')
+        self.subscription = self._subscription(self.user, self.now + timedelta(days=3))
+
+    def _subscription(self, user, end_date, **kwargs):
+        fields = {'status': 'active', 'auto_renew': True, **kwargs}
+        return Subscription.objects.create(
+            user=user, plan=self.plan, start_date=end_date - timedelta(days=30), end_date=end_date, **fields
+        )
+
+    def test_only_due_auto_renewing_subscriptions_are_billed(self):
+        other = User.objects.create(username='autre', email='autre@example.com')
+        self._subscription(other, self.now + timedelta(days=20))
+        self._subscription(other, self.now + timedelta(days=2), auto_renew=False)
+        self._subscription(other, self.now + timedelta(days=2), status='cancelled')
+
+        result = bill_subscription_renewals(now=self.now, chunk_size=1)
+
+        self.assertEqual(result['rows'], 1)
+        invoice = Invoice.objects.get()
+        self.assertEqual(
+            (invoice.user, invoice.amount, invoice.status, invoice.related_object_id),
+            (self.user, Decimal('30.00'), 'sent', self.subscription.pk)
+        )
+        self.assertEqual(invoice.related_object_type, 'subscription_renewal')
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.renewal_invoiced_until, self.subscription.end_date)
+
+    def test_replaying_the_job_creates_no_invoice(self):
+        bill_subscription_renewals(now=self.now)
+
+        result = bill_subscription_renewals(now=self.now)
+
+        self.assertEqual(result['rows'], 0)
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_paying_the_renewal_extends_the_subscription_once(self):
+        bill_subscription_renewals(now=self.now)
+        invoice = Invoice.objects.get()
+        method = PaymentMethod.objects.create(user=self.user, method_type='mobile_money', account_number='***42')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        end_date = self.subscription.end_date
+
+        response = client.post('/api/payments/process/process_payment/', {
+            'payment_method_id': method.pk, 'invoice_id': invoice.pk,
+        }, format='json')
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 200)
+        replay = client.post('/api/payments/process/process_payment/', {
+            'payment_method_id': method.pk, 'invoice_id': invoice.pk,
+        }, format='json')
+        self.assertEqual(replay.status_code, 400)
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.end_date, end_date + timedelta(days=30))
+        # La nouvelle échéance n'est pas encore facturée : le job la reprendra
+        self.assertLess(self.subscription.renewal_invoiced_until, self.subscription.end_date)
+        self.assertEqual(bill_subscription_renewals(now=self.subscription.end_date)['rows'], 1)
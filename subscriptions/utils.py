@@ -1,7 +1,18 @@
 # subscriptions/utils.py
+import datetime
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from .models import Subscription, ProjectBoost
 
+logger = logging.getLogger(__name__)
+
+# Délai avant l'échéance à partir duquel la facture de renouvellement est émise
+RENEWAL_LEAD_DAYS = 7
+
 def check_subscription_status(user):
     """
     Vérifie si l'utilisateur a un abonnement actif et met à jour son statut si nécessaire
@@ -56,4 +67,74 @@ def get_user_subscription_type(user):
     if not subscription:
         return 'basic'  # Abonnement de base par défaut
     
-    return subscription.plan.plan_type
\ No newline at end of file
+    return subscription.plan.plan_type
+
+def bill_subscription_renewals(now=None, lead_days=RENEWAL_LEAD_DAYS, chunk_size=1000):
+    """
+    Émet les factures de renouvellement des abonnements arrivant à échéance
+
+    Sont concernés les abonnements actifs à renouvellement automatique dont la
+    fin tombe dans les `lead_days` jours et qui n'ont pas encore de facture pour
+    cette période. Chaque lot est traité dans une transaction : numéros de
+    facture réservés en une fois, factures créées par bulk_create, puis
+    abonnements marqués par un seul UPDATE (ce qui rend le job rejouable).
+
+    Returns:
+        Dict {'rows', 'chunks', 'elapsed_s'}
+    """
+    from payments.models import Invoice
+    from payments.utils import invoice_numbers
+
+    now = now or timezone.now()
+    started = time.perf_counter()
+    due = Subscription.objects.filter(
+        auto_renew=True,
+        status='active',
+        end_date__isnull=False,
+        end_date__lte=now + datetime.timedelta(days=lead_days)
+    ).filter(
+        Q(renewal_invoiced_until__isnull=True) | Q(renewal_invoiced_until__lt=F('end_date'))
+    )
+
+    rows = chunks = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                due.filter(pk__gt=last_pk).order_by('pk').select_for_update(skip_locked=True, of=('self',))
+                .values_list('pk', 'user_id', 'end_date', 'plan__name', 'plan__price', 'plan__duration_days')
+                [:chunk_size]
+            )
+            if not batch:
+                break
+
+            issue_date = now.date()
+            numbers = invoice_numbers.allocate(len(batch), on_date=issue_date)
+            invoices = []
+            for number, (pk, user_id, end_date, plan_name, price, duration_days) in zip(numbers, batch):
+                period_end = end_date + datetime.timedelta(days=duration_days)
+                invoices.append(Invoice(
+                    user_id=user_id,
+                    invoice_number=number,
+                    amount=price,
+                    description=(
+                        f"Renouvellement de l'abonnement {plan_name} du "
+                        f"{end_date.strftime('%d/%m/%Y')} au {period_end.strftime('%d/%m/%Y')}"
+                    ),
+                    status='sent',
+                    issue_date=issue_date,
+                    due_date=max(issue_date, timezone.localdate(end_date)),
+                    related_object_id=pk,
+                    related_object_type='subscription_renewal'
+                ))
+            Invoice.objects.bulk_create(invoices, batch_size=chunk_size)
+            Subscription.objects.filter(pk__in=[row[0] for row in batch]).update(
+                renewal_invoiced_until=F('end_date')
+            )
+        rows += len(batch)
+        chunks += 1
+        last_pk = batch[-1][0]
+
+    elapsed = time.perf_counter() - started
+    logger.info("Renouvellements facturés : %s abonnements en %s lots (%.2fs)", rows, chunks, elapsed)
+    return {'rows': rows, 'chunks': chunks, 'elapsed_s': elapsed}
@@ -13,6 +13,12 @@ class User(AbstractUser):
         ('project_owner', 'Porteur de projet'),
         ('admin', 'Administrateur'),
     )
+    # Correspondance entre les choix de `currency` et les codes ISO 4217
+    CURRENCY_CODES = {
+        'Ariary': 'MGA',
+        'Euro': 'EUR',
+        'Dollars': 'USD',
+    }
     email = models.EmailField(_('email address'), unique=True)
     user_type = models.CharField(max_length=20, choices=USER_TYPE_CHOICES)
     email_verified = models.BooleanField(default=False)
@@ -27,6 +33,9 @@ class User(AbstractUser):
     google_id = models.CharField(max_length=100, blank=True, null=True)
     linkedin_id = models.CharField(max_length=100, blank=True, null=True)
     
+    # Client Stripe associé (créé au premier enregistrement d'une carte)
+    stripe_customer_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
+    
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
     
@@ -35,6 +44,10 @@ class User(AbstractUser):
         
     def is_project_owner(self):
         return self.user_type == 'project_owner'
+
+    @property
+    def currency_code(self):
+        return self.CURRENCY_CODES.get(self.currency, 'EUR')
     
     class Meta:
         
@@ -2,9 +2,9 @@
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
-from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from notifications.outbox import queue_email
 
 User = get_user_model()
 
@@ -31,13 +31,7 @@ def send_verification_email(user):
     L'équipe de la plateforme
     """
     
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        [user.email],
-        fail_silently=False,
-    )
+    queue_email(subject, message, [user.email])
 
 def send_password_reset_email(user):
     """
@@ -64,13 +58,7 @@ def send_password_reset_email(user):
     L'équipe de la plateforme
     """
     
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        [user.email],
-        fail_silently=False,
-    )
+    queue_email(subject, message, [user.email])
 
 def verify_token(uid, token):
     """
@@ -4,7 +4,6 @@ import string
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
 # views.py ou un service d'email de vérification
 from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
 from django.db import IntegrityError
@@ -23,6 +22,8 @@ from .models import (Favorite, InvestorProfile, ProjectOwnerProfile,
                      RegistrationRequest)
 from .permissions import IsOwnerOrAdmin
 from .serializers import *
+from notifications.outbox import queue_email
+
 from .utils import (send_password_reset_email, send_verification_email,
                     verify_token)
 
@@ -51,13 +52,11 @@ def initiate_registration2(request):
         defaults={'code': code, 'created_at': timezone.now()}
     )
     
-    # Envoyer le code par email (à remplacer par une tâche asynchrone en production)
-    send_mail(
+    # Envoyer le code par email (boîte d'envoi, hors de la requête)
+    queue_email(
         'Votre code de vérification NexusInvest',
         f'Votre code de vérification est : {code}',
-        settings.DEFAULT_FROM_EMAIL,
-        [email],
-        fail_silently=False,
+        [email]
     )
     
     return Response({"message": "Code de vérification envoyé par email"})
@@ -82,13 +81,7 @@ def send_link_email(user):
         "Si vous n'avez pas créé de compte, ignorez cet email.\n"
     )
     
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        [user.email],
-        fail_silently=False,
-    )
+    queue_email(subject, message, [user.email])
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
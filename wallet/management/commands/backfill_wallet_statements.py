@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from wallet.models import Wallet
+from wallet.utils import rebuild_statements
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruit les relevés mensuels des portefeuilles à partir de l'historique "
+        "des transactions, par lots de portefeuilles et en lisant l'historique en flux."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wallet', type=int, action='append', dest='wallet_ids',
+                            help="Limiter à ce portefeuille (option répétable)")
+        parser.add_argument('--wallets-per-batch', type=int, default=500)
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="Nombre de transactions lues par aller-retour")
+
+    def handle(self, *args, **options):
+        wallets = Wallet.objects.order_by('pk').values_list('pk', flat=True)
+        if options['wallet_ids']:
+            wallets = wallets.filter(pk__in=options['wallet_ids'])
+
+        started = time.perf_counter()
+        last_pk = 0
+        wallet_count = statement_count = 0
+        while True:
+            batch = list(wallets.filter(pk__gt=last_pk)[:options['wallets_per_batch']])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            statement_count += rebuild_statements(batch, chunk_size=options['chunk_size'])
+            wallet_count += len(batch)
+            self.stdout.write(f"{wallet_count} portefeuilles traités, {statement_count} relevés")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{statement_count} relevés reconstruits pour {wallet_count} portefeuilles "
+            f"en {time.perf_counter() - started:.2f}s"
+        ))
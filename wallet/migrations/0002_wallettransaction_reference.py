@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallettransaction',
+            name='reference',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-19 00:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0003_exchangerate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletStatement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('total_deposits', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_withdrawals', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_investments', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statements', to='wallet.wallet')),
+            ],
+            options={
+                'ordering': ['-month'],
+                'unique_together': {('wallet', 'month')},
+            },
+        ),
+    ]
@@ -2,35 +2,45 @@ from decimal import Decimal, InvalidOperation
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
 from djmoney.models.fields import MoneyField
-from investments.models import Investment, Transaction
+from investments.models import Investment
 from users.models import User
 
 # Create your models here.
 
-def convert_currency(amount, from_currency, to_currency):
-    exchange_rates = {
-        'EUR': Decimal('1.0'),
-        'USD': Decimal('1.1'), 
-        'MGA': Decimal('4800.0'),  
-    }
-    
-    try:
-        amount = Decimal(amount)
-    except (InvalidOperation, ValueError):
-        raise ValueError("Le montant doit être un nombre valide.")
-    
-    try:
-        # Convertir le montant en unité de la devise de référence (EUR)
-        base_amount = amount / exchange_rates[from_currency]
-        # Convertir de la devise de référence vers la devise cible
-        converted_amount = base_amount * exchange_rates[to_currency]
-    except KeyError:
-        raise ValueError("Devise non prise en charge. Vérifiez les codes devises.")
-    
-    # Retourner le résultat arrondi à 2 décimales
-    return converted_amount.quantize(Decimal('0.01'))
+def convert_currency(amount, from_currency, to_currency, on_date=None):
+    """
+    Convertit un montant entre deux devises (codes ISO) au taux en vigueur
+    """
+    from .utils import exchange_rates
+
+    return exchange_rates.convert(amount, from_currency, to_currency, on_date=on_date)
+
+
+class ExchangeRate(models.Model):
+    """
+    Taux de change par rapport à la devise de référence (EUR), avec date d'effet
+    """
+    currency = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    effective_date = models.DateField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [['currency', 'effective_date']]
+        ordering = ['currency', '-effective_date']
+
+    def __str__(self):
+        return f"1 EUR = {self.rate} {self.currency} ({self.effective_date})"
+
+    def save(self, *args, **kwargs):
+        from .utils import exchange_rates
+
+        super().save(*args, **kwargs)
+        exchange_rates.invalidate()
 
 
 class Wallet(models.Model):
@@ -41,49 +51,97 @@ class Wallet(models.Model):
     def __str__(self):
         return f"Wallet of {self.user.username} - Balance: {self.balance}"
 
-    def deposit(self, amount):
-        """Ajouter des fonds au portefeuille"""
-        self.balance += amount
-        self.save()
+    def deposit(self, amount, reference=None):
+        """
+        Ajouter des fonds au portefeuille
+
+        Le crédit est appliqué par un UPDATE atomique (F()) ; `reference` (par exemple
+        l'ID du PaymentIntent) rend l'opération idempotente. Retourne un tuple
+        (transaction de portefeuille, créée).
+        """
+        return self._apply(amount, 'deposit', reference)
+
+    def withdraw(self, amount, currency=None, reference=None):
+        """
+        Retirer des fonds du portefeuille
 
+        Retourne un tuple (transaction de portefeuille, créée) ; lève une
+        ValidationError si le solde est insuffisant.
+        """
+        # Si une devise différente est passée, ou en cas de logique de conversion, la gérer ici
+        if currency and currency != self.balance.currency.code:
+            amount = convert_currency(amount, from_currency=currency, to_currency=self.balance.currency.code)
+
+        return self._apply(amount, 'withdraw', reference)
+
+    @staticmethod
     def invest_with_wallet(user, project, amount):
+        """
+        Investit dans un projet en débitant le portefeuille de l'utilisateur
+        """
         wallet = user.wallet
-        if wallet.withdraw(amount):  # Vérifie si le portefeuille a suffisamment de fonds
-            investment = Investment.objects.create(
+        with transaction.atomic():
+            try:
+                wallet._apply(amount, 'investment')
+            except ValidationError:
+                raise ValueError("Fonds insuffisants dans le portefeuille.")
+
+            return Investment.objects.create(
                 user=user,
                 project=project,
                 amount=amount,
                 status='completed',
                 payment_method='wallet'
             )
-            WalletTransaction.objects.create(
-                wallet=wallet,
-                transaction_type='investment',
-                amount=amount
-            )
-            return investment
-        else:
-            raise ValueError("Fonds insuffisants dans le portefeuille.")
-        
-    def withdraw(self, amount, currency=None):
+
+    def _apply(self, amount, transaction_type, reference=None):
+        """
+        Enregistre l'opération puis met à jour le solde en une seule requête
+
+        La ligne WalletTransaction est insérée en premier : la contrainte unique
+        sur `reference` bloque un doublon concurrent jusqu'au commit puis le
+        rejette, sans double crédit ni nouvelle tentative. Le débit est
+        conditionné par `balance >= amount` dans le même UPDATE, ce qui évite
+        toute lecture-modification-écriture.
+        """
+        try:
+            amount = Decimal(amount).quantize(Decimal('0.01'))
+        except (InvalidOperation, TypeError, ValueError):
+            raise ValidationError("Le montant doit être un nombre valide.")
         if amount <= 0:
             raise ValidationError("Le montant doit être positif.")
-        
-        # Si une devise différente est passée, ou en cas de logique de conversion, la gérer ici
-        if currency and currency != self.balance.currency.code:
-            # Conversion sécurisée – à implémenter selon votre stratégie de conversion
-            amount = convert_currency(amount, from_currency=currency, to_currency=self.balance.currency.code)
-        
+
         with transaction.atomic():
-            wallet = Wallet.objects.select_for_update().get(pk=self.pk)
-            if wallet.balance.amount < amount:
+            try:
+                with transaction.atomic():
+                    wallet_transaction = WalletTransaction.objects.create(
+                        wallet=self,
+                        transaction_type=transaction_type,
+                        amount=amount,
+                        reference=reference
+                    )
+            except IntegrityError:
+                if reference is None:
+                    raise
+                return WalletTransaction.objects.get(reference=reference), False
+
+            wallets = Wallet.objects.filter(pk=self.pk)
+            if transaction_type == 'deposit':
+                delta = F('balance') + amount
+            else:
+                wallets = wallets.filter(balance__gte=amount)
+                delta = F('balance') - amount
+
+            if not wallets.update(balance=delta, updated_at=timezone.now()):
                 raise ValidationError("Solde insuffisant.")
-            wallet.balance -= amount
-            wallet.save()
-            # Enregistrer la transaction
-            Transaction.objects.create(wallet=wallet, transaction_type='WITHDRAWAL', amount=amount)
-            return True
-        return False
+
+            # La ligne du portefeuille est verrouillée par l'UPDATE : le solde relu
+            # est exactement celui qui suit cette opération
+            self.refresh_from_db(fields=['balance', 'balance_currency', 'updated_at'])
+            signed_amount = amount if transaction_type == 'deposit' else -amount
+            WalletStatement.record(wallet_transaction, self.balance.amount - signed_amount)
+
+        return wallet_transaction, True
 
 
 class WalletTransaction(models.Model):
@@ -96,7 +154,98 @@ class WalletTransaction(models.Model):
     wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='transactions')
     transaction_type = models.CharField(max_length=20, choices=TRANSACTION_TYPE_CHOICES)
     amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # Clé d'idempotence (ID du PaymentIntent, clé fournie par le client...)
+    reference = models.CharField(max_length=255, unique=True, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Historique par portefeuille et par période (exports, relevés)
+            models.Index(fields=['wallet', 'created_at'], name='wallet_tx_wallet_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type.capitalize()} - {self.amount} - {self.wallet.user.username}"
+
+
+class WalletStatement(models.Model):
+    """
+    Relevé mensuel précalculé d'un portefeuille
+
+    Mis à jour de façon incrémentale à chaque WalletTransaction (voir
+    Wallet._apply) et reconstructible avec la commande
+    backfill_wallet_statements.
+    """
+    TOTAL_FIELDS = {
+        'deposit': 'total_deposits',
+        'withdraw': 'total_withdrawals',
+        'investment': 'total_investments',
+    }
+
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='statements')
+    month = models.DateField()  # Premier jour du mois
+    opening_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    closing_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    total_deposits = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_withdrawals = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_investments = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    transaction_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [['wallet', 'month']]
+        ordering = ['-month']
+
+    def __str__(self):
+        return f"Relevé {self.month:%Y-%m} - {self.wallet}"
+
+    @staticmethod
+    def month_of(value):
+        return timezone.localtime(value).date().replace(day=1)
+
+    @classmethod
+    def record(cls, wallet_transaction, balance_before):
+        """
+        Ajoute une transaction au relevé de son mois
+
+        `balance_before` est le solde juste avant la transaction ; il sert de
+        solde d'ouverture si le portefeuille n'a encore aucun relevé.
+        """
+        cls.record_totals(
+            wallet_transaction.wallet_id,
+            wallet_transaction.created_at,
+            wallet_transaction.transaction_type,
+            wallet_transaction.amount,
+            1,
+            balance_before
+        )
+
+    @classmethod
+    def record_totals(cls, wallet_id, created_at, transaction_type, amount, count, balance_before):
+        """
+        Ajoute au relevé du mois de `created_at` un lot de `count` transactions
+        du même type totalisant `amount`
+        """
+        month = cls.month_of(created_at)
+
+        statement_id = cls.objects.filter(wallet_id=wallet_id, month=month).values_list('id', flat=True).first()
+        if statement_id is None:
+            previous_closing = cls.objects.filter(
+                wallet_id=wallet_id, month__lt=month
+            ).order_by('-month').values_list('closing_balance', flat=True).first()
+            opening = previous_closing if previous_closing is not None else balance_before
+            statement, _ = cls.objects.get_or_create(
+                wallet_id=wallet_id,
+                month=month,
+                defaults={'opening_balance': opening, 'closing_balance': opening}
+            )
+            statement_id = statement.id
+
+        total_field = cls.TOTAL_FIELDS[transaction_type]
+        signed_amount = amount if transaction_type == 'deposit' else -amount
+        cls.objects.filter(pk=statement_id).update(**{
+            total_field: F(total_field) + amount,
+            'closing_balance': F('closing_balance') + signed_amount,
+            'transaction_count': F('transaction_count') + count,
+            'updated_at': timezone.now(),
+        })
@@ -1,19 +1,79 @@
+from decimal import Decimal
+
 from rest_framework import serializers
-from .models import Wallet, WalletTransaction
+from .models import Wallet, WalletStatement, WalletTransaction
+from .utils import MAX_BASKET_SIZE, exchange_rates
 from investments.models import Transaction
 
 class WalletSerializer(serializers.ModelSerializer):
+    display_balance = serializers.SerializerMethodField()
+    display_currency = serializers.SerializerMethodField()
+
     class Meta:
         model = Wallet
-        fields = ['id', 'balance', 'updated_at']
+        fields = ['id', 'balance', 'display_balance', 'display_currency', 'updated_at']
         read_only_fields = ['id', 'balance', 'updated_at']
 
+    def _display_currency(self, obj):
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            return request.user.currency_code
+        return obj.balance.currency.code
+
+    def get_display_balance(self, obj):
+        """
+        Solde converti dans la devise de l'utilisateur connecté
+        """
+        return str(exchange_rates.convert(obj.balance.amount, obj.balance.currency.code, self._display_currency(obj)))
+
+    def get_display_currency(self, obj):
+        return self._display_currency(obj)
+
 class WalletTransactionSerializer(serializers.ModelSerializer):
+    display_amount = serializers.SerializerMethodField()
+
     class Meta:
         model = WalletTransaction
-        fields = ['id', 'transaction_type', 'amount', 'created_at']
+        fields = ['id', 'transaction_type', 'amount', 'display_amount', 'created_at']
         read_only_fields = ['id', 'transaction_type', 'amount', 'created_at']
 
+    def get_display_amount(self, obj):
+        """
+        Montant converti, calculé pour toute la page par la vue (context['display_amounts'])
+        """
+        amount = self.context.get('display_amounts', {}).get(obj.id)
+        return str(amount) if amount is not None else None
+
+class WalletStatementSerializer(serializers.ModelSerializer):
+    month = serializers.DateField(format='%Y-%m')
+
+    class Meta:
+        model = WalletStatement
+        fields = [
+            'month', 'opening_balance', 'closing_balance', 'total_deposits',
+            'total_withdrawals', 'total_investments', 'transaction_count'
+        ]
+        read_only_fields = fields
+
+class BasketItemSerializer(serializers.Serializer):
+    project_id = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
+
+class BasketInvestmentSerializer(serializers.Serializer):
+    items = BasketItemSerializer(many=True, allow_empty=False)
+    allow_partial = serializers.BooleanField(default=False)
+
+    def validate_items(self, value):
+        """
+        Limite la taille du panier et refuse les projets en double
+        """
+        if len(value) > MAX_BASKET_SIZE:
+            raise serializers.ValidationError(f"Un panier ne peut pas contenir plus de {MAX_BASKET_SIZE} projets.")
+        project_ids = [item['project_id'] for item in value]
+        if len(set(project_ids)) != len(project_ids):
+            raise serializers.ValidationError("Un projet ne peut figurer qu'une fois dans le panier.")
+        return value
+
 class DepositSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
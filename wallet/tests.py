@@ -1,3 +1,277 @@
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import mock
+
+from django.core.exceptions import ValidationError
 from django.test import TestCase
+from django.utils import timezone
+from investments.models import Investment
+from projects.models import Project
+from rest_framework.test import APIClient
+from users.models import User
+
+from .models import ExchangeRate, Wallet, WalletStatement, WalletTransaction, convert_currency
+from .utils import ExchangeRateService, exchange_rates, invest_basket, rebuild_statements
+
+
+class WalletApplyTests(TestCase):
+    """
+    Opérations de solde atomiques et idempotentes (Wallet._apply)
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='porteur', email='porteur@example.com')
+        self.wallet = Wallet.objects.create(user=self.user, balance=0)
+
+    def test_deposit_with_same_reference_credits_once(self):
+        _, created = self.wallet.deposit(Decimal('50.00'), reference='pi_1')
+        replay, replay_created = self.wallet.deposit(Decimal('50.00'), reference='pi_1')
+
+        self.assertTrue(created)
+        self.assertFalse(replay_created)
+        self.assertEqual(replay.reference, 'pi_1')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance.amount, Decimal('50.00'))
+        self.assertEqual(WalletTransaction.objects.filter(wallet=self.wallet).count(), 1)
+
+    def test_withdraw_over_balance_is_rejected_without_trace(self):
+        self.wallet.deposit(Decimal('10.00'))
+
+        with self.assertRaises(ValidationError):
+            self.wallet.withdraw(Decimal('20.00'))
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance.amount, Decimal('10.00'))
+        self.assertEqual(WalletTransaction.objects.filter(wallet=self.wallet).count(), 1)
+
+    def test_withdraw_debits_balance(self):
+        self.wallet.deposit(Decimal('30.00'))
+        _, created = self.wallet.withdraw(Decimal('12.50'), reference='retrait-1')
+
+        self.assertTrue(created)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance.amount, Decimal('17.50'))
+
+    def test_invalid_amount_is_rejected(self):
+        for amount in ('abc', 0, Decimal('-5')):
+            with self.assertRaises(ValidationError):
+                self.wallet.deposit(amount)
+        self.assertFalse(WalletTransaction.objects.exists())
+
+
+class WalletStatementTests(TestCase):
+    """
+    Relevés mensuels tenus par Wallet._apply et reconstruits depuis l'historique
+    """
+    fields = (
+        'month', 'opening_balance', 'closing_balance', 'total_deposits', 'total_withdrawals',
+        'total_investments', 'transaction_count'
+    )
+
+    def setUp(self):
+        self.user = User.objects.create(username='releve', email='releve@example.com')
+        self.wallet = Wallet.objects.create(user=self.user, balance=0)
+        for month, operation, amount in (
+            (1, 'deposit', '100.00'), (1, 'withdraw', '30.00'),
+            (2, 'deposit', '50.00'), (2, 'investment', '20.00'), (2, 'withdraw', '5.00'),
+            (4, 'deposit', '10.00'),
+        ):
+            moment = timezone.make_aware(datetime(2026, month, 15, 12))
+            with mock.patch('django.utils.timezone.now', return_value=moment):
+                if operation == 'deposit':
+                    self.wallet.deposit(Decimal(amount))
+                else:
+                    self.wallet._apply(Decimal(amount), operation)
+
+    def _statements(self):
+        return list(WalletStatement.objects.filter(wallet=self.wallet).order_by('month').values_list(*self.fields))
+
+    def test_incremental_statements_match_rebuild(self):
+        recorded = self._statements()
+
+        self.assertEqual(rebuild_statements([self.wallet.pk]), 3)
+        self.assertEqual(self._statements(), recorded)
+        self.assertEqual([(row[1], row[2]) for row in recorded], [
+            (Decimal('0.00'), Decimal('70.00')),
+            (Decimal('70.00'), Decimal('95.00')),
+            (Decimal('95.00'), Decimal('105.00')),
+        ])
+
+    def test_statement_endpoints_return_period_balances(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        listed = client.get('/api/wallet/wallets/statements/').json()
+        results = listed['results'] if isinstance(listed, dict) else listed
+        self.assertEqual(
+            [(row['month'], row['opening_balance'], row['closing_balance']) for row in results],
+            [('2026-04', '95.00', '105.00'), ('2026-02', '70.00', '95.00'), ('2026-01', '0.00', '70.00')]
+        )
+
+        february = client.get('/api/wallet/wallets/statement/', {'month': '2026-02'}).json()
+        self.assertEqual((february['total_deposits'], february['total_investments'], february['transaction_count']),
+                         ('50.00', '20.00', 3))
+
+        # Mois sans mouvement : ouverture et clôture au solde du relevé précédent
+        march = client.get('/api/wallet/wallets/statement/', {'month': '2026-03'}).json()
+        self.assertEqual((march['opening_balance'], march['closing_balance'], march['transaction_count']),
+                         ('95.00', '95.00', 0))
+        self.assertEqual(client.get('/api/wallet/wallets/statement/', {'month': 'mars'}).status_code, 400)
+
+
+class ExchangeRateServiceTests(TestCase):
+    """
+    Table des taux en mémoire : durée de vie, invalidation et taux en vigueur
+    """
+
+    def setUp(self):
+        ExchangeRate.objects.bulk_create([
+            ExchangeRate(currency='USD', rate=Decimal('1.05'), effective_date=date(2026, 1, 1)),
+            ExchangeRate(currency='USD', rate=Decimal('1.10'), effective_date=date(2026, 3, 1)),
+            ExchangeRate(currency='MGA', rate=Decimal('5000'), effective_date=date(2026, 1, 1)),
+        ])
+        exchange_rates.invalidate()
+        self.addCleanup(exchange_rates.invalidate)
+
+    def test_table_is_reloaded_after_ttl(self):
+        service = ExchangeRateService(ttl=60)
+        with mock.patch('wallet.utils.time.monotonic', return_value=1000.0) as clock:
+            with self.assertNumQueries(1):
+                self.assertEqual(service.get_rate('MGA', date(2026, 2, 1)), Decimal('5000'))
+                self.assertEqual(service.get_rate('USD', date(2026, 2, 1)), Decimal('1.05'))
+
+            ExchangeRate.objects.filter(currency='MGA').update(rate=Decimal('5200'))
+            clock.return_value = 1059.0
+            with self.assertNumQueries(0):
+                self.assertEqual(service.get_rate('MGA', date(2026, 2, 1)), Decimal('5000'))
+
+            clock.return_value = 1061.0
+            with self.assertNumQueries(1):
+                self.assertEqual(service.get_rate('MGA', date(2026, 2, 1)), Decimal('5200'))
+
+    def test_saving_a_rate_invalidates_the_cache(self):
+        self.assertEqual(exchange_rates.get_rate('USD', date(2026, 4, 1)), Decimal('1.10'))
+
+        ExchangeRate.objects.create(currency='USD', rate=Decimal('1.20'), effective_date=date(2026, 4, 1))
+
+        self.assertEqual(exchange_rates.get_rate('USD', date(2026, 4, 1)), Decimal('1.20'))
+
+    def test_rate_in_force_on_the_transaction_date(self):
+        self.assertEqual(exchange_rates.get_rate('USD', date(2025, 12, 31)), Decimal('1.1'))
+        self.assertEqual(exchange_rates.get_rate('USD', date(2026, 1, 1)), Decimal('1.05'))
+        self.assertEqual(exchange_rates.get_rate('USD', date(2026, 2, 28)), Decimal('1.05'))
+        self.assertEqual(exchange_rates.get_rate('USD', date(2026, 3, 1)), Decimal('1.10'))
+        self.assertEqual(convert_currency(Decimal('100'), 'EUR', 'USD', on_date=date(2026, 2, 10)), Decimal('105.00'))
+        with self.assertRaises(ValueError):
+            exchange_rates.get_rate('GBP')
+
+    def test_convert_many_matches_per_row_conversion(self):
+        amounts = [Decimal('10.00'), Decimal('3.33'), Decimal('1250.50'), Decimal('0.01')]
+        sources = ['EUR', 'USD', 'MGA', 'USD']
+        targets = ['USD', 'MGA', 'EUR', 'USD']
+        on_date = date(2026, 2, 1)
+
+        self.assertEqual(
+            exchange_rates.convert_many(amounts, sources, targets, on_date),
+            [convert_currency(amount, source, target, on_date)
+             for amount, source, target in zip(amounts, sources, targets)]
+        )
+        self.assertEqual(
+            exchange_rates.convert_many(amounts, 'EUR', 'MGA', on_date),
+            [convert_currency(amount, 'EUR', 'MGA', on_date) for amount in amounts]
+        )
+        with self.assertRaises(ValueError):
+            exchange_rates.convert_many(amounts, ['EUR'], 'USD')
+
+    def test_transactions_are_displayed_in_the_user_currency(self):
+        user = User.objects.create(username='dollars', email='dollars@example.com', currency='Dollars')
+        wallet = Wallet.objects.create(user=user, balance=0)
+        for amount in ('10.00', '33.33'):
+            wallet.deposit(Decimal(amount))
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get('/api/wallet/wallets/transactions/').json()
+        rows = response['results'] if isinstance(response, dict) else response
+
+        self.assertEqual(
+            sorted((row['amount'], row['display_amount']) for row in rows),
+            sorted((amount, str(convert_currency(Decimal(amount), 'EUR', 'USD'))) for amount in ('10.00', '33.33'))
+        )
+
+
+class InvestBasketTests(TestCase):
+    """
+    Investissement dans plusieurs projets en un seul débit du portefeuille
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='panier', email='panier@example.com')
+        self.wallet = Wallet.objects.create(user=self.user, balance=0)
+        self.wallet.deposit(Decimal('500.00'))
+        owner = User.objects.create(username='porteur', email='porteur@example.com')
+        self.first, self.second = (
+            Project.objects.create(
+                title=title, owner=owner, funding_type='equity', amount_needed=Decimal('1000.00'),
+                amount_raised=Decimal('900.00') if title == 'Second' else 0, status='active'
+            ) for title in ('Premier', 'Second')
+        )
+        self.closed = Project.objects.create(
+            title='Clos', owner=owner, funding_type='equity', amount_needed=Decimal('1000.00'), status='closed'
+        )
+
+    def _balance(self):
+        self.wallet.refresh_from_db()
+        return self.wallet.balance.amount
+
+    def _raised(self, project):
+        project.refresh_from_db()
+        return project.amount_raised
+
+    def test_one_invalid_line_rolls_back_the_whole_basket(self):
+        for invalid in ((self.closed.pk, '10.00'), (self.second.pk, '150.00')):
+            investments, rejected = invest_basket(self.user, [(self.first.pk, '100.00'), invalid])
+
+            self.assertEqual(investments, [])
+            self.assertEqual([row['index'] for row in rejected], [1])
+        self.assertFalse(Investment.objects.exists())
+        self.assertEqual(self._balance(), Decimal('500.00'))
+        self.assertEqual(self._raised(self.first), Decimal('0.00'))
+
+    def test_allow_partial_commits_only_valid_lines(self):
+        investments, rejected = invest_basket(self.user, [
+            (self.first.pk, '100.00'), (self.closed.pk, '10.00'), (self.second.pk, '60.00'),
+        ], allow_partial=True)
+
+        self.assertEqual([(investment.project_id, investment.amount) for investment in investments], [
+            (self.first.pk, Decimal('100.00')), (self.second.pk, Decimal('60.00')),
+        ])
+        self.assertEqual([row['project_id'] for row in rejected], [self.closed.pk])
+        self.assertEqual(self._balance(), Decimal('340.00'))
+        self.assertEqual(
+            WalletTransaction.objects.filter(wallet=self.wallet, transaction_type='investment').count(), 2
+        )
+
+    def test_debit_over_balance_is_refused_without_writes(self):
+        investments, rejected = invest_basket(self.user, [(self.first.pk, '450.00'), (self.second.pk, '100.00')])
+
+        self.assertEqual(investments, [])
+        self.assertEqual(rejected[0]['error'], "Fonds insuffisants dans le portefeuille.")
+        self.assertFalse(Investment.objects.exists())
+        self.assertEqual(self._balance(), Decimal('500.00'))
+
+    def test_amount_raised_updated_per_project(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post('/api/wallet/wallets/invest_basket/', {
+            'items': [{'project_id': self.first.pk, 'amount': '120.00'},
+                      {'project_id': self.second.pk, 'amount': '80.00'}],
+        }, format='json')
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['total'], '200.00')
+        self.assertEqual(self._raised(self.first), Decimal('120.00'))
+        self.assertEqual(self._raised(self.second), Decimal('980.00'))
+        self.assertEqual(self._raised(self.closed), Decimal('0.00'))
+        self.assertEqual(self._balance(), Decimal('300.00'))
@@ -1,4 +1,5 @@
 from django.urls import include, path
+from rest_framework.permissions import AllowAny
 from rest_framework.routers import DefaultRouter
 
 from . import views
@@ -8,5 +9,7 @@ router.register(r'wallets', views.WalletViewSet, basename='wallet')
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('webhook/', views.WalletViewSet.as_view({'post': 'stripe_webhook'}), name='stripe-webhook'),
+    path('webhook/', views.WalletViewSet.as_view(
+        {'post': 'stripe_webhook'}, permission_classes=[AllowAny], authentication_classes=[]
+    ), name='stripe-webhook'),
 ]
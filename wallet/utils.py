@@ -0,0 +1,341 @@
+# wallet/utils.py
+import bisect
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from investments.models import Investment, Transaction
+
+from .models import ExchangeRate, Wallet, WalletStatement, WalletTransaction
+
+# Taux utilisés tant qu'une devise n'a aucune ligne ExchangeRate (base EUR)
+DEFAULT_EXCHANGE_RATES = {
+    'EUR': Decimal('1.0'),
+    'USD': Decimal('1.1'),
+    'MGA': Decimal('4800.0'),
+}
+
+CENTS = Decimal('0.01')
+
+# Nombre maximal de lignes d'un panier d'investissement
+MAX_BASKET_SIZE = 50
+
+
+class ExchangeRateService:
+    """
+    Service de conversion de devises adossé à la table ExchangeRate
+
+    La table complète des taux (quelques lignes par devise) est chargée en une
+    requête puis conservée en mémoire pendant `ttl` secondes ; les recherches
+    « taux en vigueur à une date » se font ensuite localement par dichotomie.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._table = None
+        self._expires_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._table = None
+            self._expires_at = 0
+
+    def _get_table(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._table is not None and now < self._expires_at:
+                return self._table
+
+        table = {}
+        for currency, effective_date, rate in ExchangeRate.objects.order_by(
+            'currency', 'effective_date'
+        ).values_list('currency', 'effective_date', 'rate'):
+            dates, rates = table.setdefault(currency, ([], []))
+            dates.append(effective_date)
+            rates.append(rate)
+
+        ttl = self.ttl if self.ttl is not None else getattr(settings, 'EXCHANGE_RATE_CACHE_TTL', 300)
+        with self._lock:
+            self._table = table
+            self._expires_at = now + ttl
+        return table
+
+    def get_rate(self, currency, on_date=None):
+        """
+        Retourne le taux (1 EUR = x devise) en vigueur à la date donnée
+        """
+        on_date = on_date or timezone.now().date()
+        entry = self._get_table().get(currency)
+        if entry:
+            dates, rates = entry
+            index = bisect.bisect_right(dates, on_date)
+            if index:
+                return rates[index - 1]
+        try:
+            return DEFAULT_EXCHANGE_RATES[currency]
+        except KeyError:
+            raise ValueError("Devise non prise en charge. Vérifiez les codes devises.")
+
+    def get_factor(self, from_currency, to_currency, on_date=None):
+        """
+        Facteur multiplicatif pour passer de `from_currency` à `to_currency`
+        """
+        if from_currency == to_currency:
+            return Decimal('1')
+        return self.get_rate(to_currency, on_date) / self.get_rate(from_currency, on_date)
+
+    def convert(self, amount, from_currency, to_currency, on_date=None):
+        """
+        Convertit un montant et l'arrondit à 2 décimales
+        """
+        return self.convert_many([amount], from_currency, to_currency, on_date)[0]
+
+    def convert_many(self, amounts, from_currency, to_currency, on_date=None):
+        """
+        Convertit une colonne de montants en une passe
+
+        `from_currency` et `to_currency` sont soit un code devise unique, soit une
+        séquence de codes de même longueur que `amounts` (une devise par ligne,
+        par exemple la devise de chaque utilisateur). Chaque paire de devises
+        n'est résolue qu'une fois ; tout le calcul reste en Decimal.
+
+        Returns:
+            La liste des montants convertis, arrondis à 2 décimales
+        """
+        try:
+            amounts = [Decimal(amount) for amount in amounts]
+        except (InvalidOperation, TypeError, ValueError):
+            raise ValueError("Le montant doit être un nombre valide.")
+
+        count = len(amounts)
+        sources = [from_currency] * count if isinstance(from_currency, str) else list(from_currency)
+        targets = [to_currency] * count if isinstance(to_currency, str) else list(to_currency)
+        if len(sources) != count or len(targets) != count:
+            raise ValueError("Les colonnes de devises doivent avoir la même longueur que les montants.")
+
+        factors = {
+            pair: self.get_factor(pair[0], pair[1], on_date)
+            for pair in set(zip(sources, targets))
+        }
+        return [
+            (amount * factors[pair]).quantize(CENTS)
+            for amount, pair in zip(amounts, zip(sources, targets))
+        ]
+
+
+exchange_rates = ExchangeRateService()
+
+
+def complete_deposit(payment_intent_id, user_id):
+    """
+    Finalise un dépôt Stripe et crédite le portefeuille une seule fois
+
+    Appelé à la fois par la confirmation client et par le webhook : l'ID du
+    PaymentIntent sert de clé d'idempotence, seul le premier appel crédite.
+
+    Returns:
+        True si le portefeuille a été crédité par cet appel, False si le dépôt
+        avait déjà été traité
+
+    Raises:
+        Transaction.DoesNotExist: si aucun dépôt ne correspond à ce PaymentIntent
+    """
+    with transaction.atomic():
+        trans = Transaction.objects.get(
+            reference_id=payment_intent_id,
+            user_id=user_id,
+            transaction_type='deposit'
+        )
+        wallet, _ = Wallet.objects.get_or_create(user_id=user_id)
+        _, created = wallet.deposit(trans.amount, reference=payment_intent_id)
+
+        if created:
+            Transaction.objects.filter(pk=trans.pk).update(
+                status='completed',
+                completed_at=timezone.now()
+            )
+        return created
+
+
+def _basket_item_error(project, user, amount, reserved, today):
+    """
+    Retourne le motif de refus d'une ligne de panier, ou None si elle respecte
+    les limites du projet (`reserved` : montant déjà accepté dans ce panier)
+    """
+    if project is None:
+        return "Le projet spécifié n'existe pas."
+    if project.status != 'active':
+        return "Ce projet n'est pas ouvert aux investissements."
+    if project.owner_id == user.pk:
+        return "Vous ne pouvez pas investir dans votre propre projet."
+    if project.deadline and project.deadline < today:
+        return "La date limite de financement de ce projet est dépassée."
+    if amount <= 0:
+        return "Le montant doit être positif."
+    if amount < project.minimum_investment:
+        return f"Le montant minimum d'investissement pour ce projet est de {project.minimum_investment}."
+    if project.maximum_investment and amount > project.maximum_investment:
+        return f"Le montant maximum d'investissement pour ce projet est de {project.maximum_investment}."
+
+    remaining = project.amount_needed - project.amount_raised - reserved
+    if remaining <= 0:
+        return "Ce projet a déjà atteint son objectif de financement."
+    if amount > remaining:
+        return f"Le montant dépasse le reste à financer pour ce projet ({remaining})."
+    return None
+
+
+def invest_basket(user, items, allow_partial=False):
+    """
+    Investit dans plusieurs projets avec un seul débit du portefeuille
+
+    Les projets sont chargés et verrouillés en une requête, le portefeuille
+    est verrouillé une fois puis débité du total par un UPDATE unique ; les
+    lignes Investment et WalletTransaction sont créées par bulk_create.
+
+    Sémantique des échecs partiels :
+        allow_partial=False (défaut) : tout ou rien. Si une ligne est refusée,
+            ou si le solde ne couvre pas le total, rien n'est écrit.
+        allow_partial=True : les lignes refusées sont ignorées et les lignes
+            valides sont acceptées dans l'ordre du panier tant que le solde
+            les couvre.
+
+    Args:
+        user: investisseur
+        items: liste de couples (project_id, montant)
+        allow_partial: accepte un panier partiellement exécuté
+
+    Returns:
+        Tuple (investissements créés, lignes refusées) ; chaque refus est un
+        dict {'index', 'project_id', 'amount', 'error'}
+
+    Raises:
+        Wallet.DoesNotExist: si l'utilisateur n'a pas de portefeuille
+    """
+    from projects.models import Project
+
+    items = [(project_id, Decimal(amount).quantize(CENTS)) for project_id, amount in items]
+    now = timezone.now()
+    today = timezone.localdate()
+
+    with transaction.atomic():
+        # Verrouillage dans un ordre stable pour éviter les interblocages entre paniers concurrents
+        projects = {
+            project.pk: project
+            for project in Project.objects.select_for_update().filter(
+                pk__in={project_id for project_id, _ in items}
+            ).order_by('pk')
+        }
+        wallet = Wallet.objects.select_for_update().get(user=user)
+
+        accepted = []
+        rejected = []
+        reserved = defaultdict(Decimal)
+        available = wallet.balance.amount
+        for index, (project_id, amount) in enumerate(items):
+            error = _basket_item_error(projects.get(project_id), user, amount, reserved[project_id], today)
+            if error is None and amount > available:
+                error = "Fonds insuffisants dans le portefeuille."
+            if error:
+                rejected.append({'index': index, 'project_id': project_id, 'amount': amount, 'error': error})
+                continue
+            accepted.append((projects[project_id], amount))
+            reserved[project_id] += amount
+            available -= amount
+
+        if not accepted or (rejected and not allow_partial):
+            return [], rejected
+
+        total = sum(amount for _, amount in accepted)
+        balance_before = wallet.balance.amount
+        Wallet.objects.filter(pk=wallet.pk).update(balance=F('balance') - total, updated_at=now)
+
+        investments = Investment.objects.bulk_create([
+            Investment(
+                user=user,
+                project=project,
+                amount=amount,
+                status='completed',
+                payment_method='wallet',
+                completed_at=now
+            )
+            for project, amount in accepted
+        ])
+        WalletTransaction.objects.bulk_create([
+            WalletTransaction(wallet=wallet, transaction_type='investment', amount=amount)
+            for _, amount in accepted
+        ])
+
+        # bulk_create n'appelle pas Investment.save : montant collecté mis à jour en un UPDATE
+        raised = {project_id: amount for project_id, amount in reserved.items() if amount}
+        Project.objects.filter(pk__in=raised).update(
+            amount_raised=F('amount_raised') + Case(
+                *[When(pk=project_id, then=Value(amount)) for project_id, amount in raised.items()],
+                output_field=DecimalField(max_digits=15, decimal_places=2)
+            ),
+            updated_at=now
+        )
+        WalletStatement.record_totals(wallet.pk, now, 'investment', total, len(accepted), balance_before)
+
+    return investments, rejected
+
+
+def rebuild_statements(wallet_ids, chunk_size=2000):
+    """
+    Reconstruit les relevés mensuels d'un lot de portefeuilles depuis l'historique
+
+    Les portefeuilles du lot sont verrouillés le temps de la reconstruction ;
+    les transactions sont lues en flux (iterator) par paquets de `chunk_size`,
+    seuls les relevés du lot sont gardés en mémoire.
+
+    Returns:
+        Le nombre de relevés créés
+    """
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    with transaction.atomic():
+        balances = dict(
+            Wallet.objects.select_for_update().filter(pk__in=wallet_ids).values_list('pk', 'balance')
+        )
+
+        # Solde avant la première transaction = solde actuel - crédits + débits
+        running = dict(balances)
+        totals = WalletTransaction.objects.filter(wallet_id__in=wallet_ids).values('wallet_id').annotate(
+            credits=Coalesce(Sum('amount', filter=Q(transaction_type='deposit')), zero),
+            debits=Coalesce(Sum('amount', filter=~Q(transaction_type='deposit')), zero)
+        )
+        for row in totals:
+            running[row['wallet_id']] = balances[row['wallet_id']] - row['credits'] + row['debits']
+
+        WalletStatement.objects.filter(wallet_id__in=wallet_ids).delete()
+
+        statements = []
+        current = None
+        history = WalletTransaction.objects.filter(wallet_id__in=wallet_ids).order_by(
+            'wallet_id', 'created_at', 'id'
+        ).values_list('wallet_id', 'transaction_type', 'amount', 'created_at')
+        for wallet_id, transaction_type, amount, created_at in history.iterator(chunk_size=chunk_size):
+            month = WalletStatement.month_of(created_at)
+            if current is None or current.wallet_id != wallet_id or current.month != month:
+                current = WalletStatement(
+                    wallet_id=wallet_id,
+                    month=month,
+                    opening_balance=running[wallet_id],
+                    closing_balance=running[wallet_id]
+                )
+                statements.append(current)
+
+            total_field = WalletStatement.TOTAL_FIELDS[transaction_type]
+            setattr(current, total_field, getattr(current, total_field) + amount)
+            running[wallet_id] += amount if transaction_type == 'deposit' else -amount
+            current.closing_balance = running[wallet_id]
+            current.transaction_count += 1
+
+        WalletStatement.objects.bulk_create(statements, batch_size=500)
+    return len(statements)
@@ -1,18 +1,23 @@
+import datetime
+
 import stripe
-from django.conf import settings
-from django.db import transaction
 from django.http import HttpResponse
 from django.utils import timezone
 from investments.models import Transaction
+from investments.utils import stream_history_export
+from payments.provider import get_payment_provider
+from payments.utils import ingest_webhook_event
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from .models import Wallet, WalletTransaction
-from .serializers import (DepositSerializer, WalletSerializer,
+from .models import Wallet, WalletStatement, WalletTransaction
+from .serializers import (BasketInvestmentSerializer, DepositSerializer,
+                          WalletSerializer, WalletStatementSerializer,
                           WalletTransactionSerializer)
+from .utils import complete_deposit, exchange_rates, invest_basket
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+WALLET_EXPORT_COLUMNS = ('id', 'created_at', 'transaction_type', 'amount', 'reference')
 
 class WalletViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -53,15 +58,115 @@ class WalletViewSet(viewsets.ReadOnlyModelViewSet):
             
             # Pagination
             page = self.paginate_queryset(transactions)
+            rows = page if page is not None else list(transactions)
+            
+            # Conversion de toute la page dans la devise de l'utilisateur en une passe
+            display_amounts = exchange_rates.convert_many(
+                [row.amount for row in rows],
+                wallet.balance.currency.code,
+                request.user.currency_code
+            )
+            context = self.get_serializer_context()
+            context['display_amounts'] = {row.id: amount for row, amount in zip(rows, display_amounts)}
+            serializer = WalletTransactionSerializer(rows, many=True, context=context)
+            
             if page is not None:
-                serializer = WalletTransactionSerializer(page, many=True)
                 return self.get_paginated_response(serializer.data)
-            
-            serializer = WalletTransactionSerializer(transactions, many=True)
             return Response(serializer.data)
         except Wallet.DoesNotExist:
             return Response({"detail": "Portefeuille non trouvé."}, status=status.HTTP_404_NOT_FOUND)
     
+    @action(detail=False, methods=['post'])
+    def invest_basket(self, request):
+        """
+        Investit dans plusieurs projets en un seul débit du portefeuille
+
+        Par défaut le panier est exécuté en tout ou rien ; avec allow_partial,
+        les lignes refusées sont ignorées et listées dans la réponse.
+        """
+        serializer = BasketInvestmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        items = [(item['project_id'], item['amount']) for item in serializer.validated_data['items']]
+        try:
+            investments, rejected = invest_basket(
+                request.user, items, allow_partial=serializer.validated_data['allow_partial']
+            )
+        except Wallet.DoesNotExist:
+            return Response({"detail": "Portefeuille non trouvé."}, status=status.HTTP_404_NOT_FOUND)
+        
+        rejected = [dict(row, amount=str(row['amount'])) for row in rejected]
+        if not investments:
+            return Response(
+                {"detail": "Aucun investissement n'a été effectué.", "rejected": rejected},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            "investments": [
+                {"id": investment.id, "project_id": investment.project_id, "amount": str(investment.amount)}
+                for investment in investments
+            ],
+            "total": str(sum(investment.amount for investment in investments)),
+            "rejected": rejected,
+        }, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Exporte l'historique complet du portefeuille (output=csv|ndjson, start/end=AAAA-MM-JJ)
+        """
+        queryset = WalletTransaction.objects.filter(wallet__user=request.user)
+        return stream_history_export(request, queryset, WALLET_EXPORT_COLUMNS, 'portefeuille')
+    
+    @action(detail=False, methods=['get'])
+    def statement(self, request):
+        """
+        Récupère le relevé mensuel précalculé (paramètre month=AAAA-MM, mois courant par défaut)
+        """
+        month_param = request.query_params.get('month')
+        try:
+            month = (
+                datetime.datetime.strptime(month_param, '%Y-%m').date()
+                if month_param else WalletStatement.month_of(timezone.now())
+            )
+        except ValueError:
+            return Response({"detail": "Le mois doit être au format AAAA-MM."}, status=status.HTTP_400_BAD_REQUEST)
+        
+        statement = WalletStatement.objects.filter(wallet__user=request.user, month=month).first()
+        if statement is None:
+            # Aucun mouvement ce mois-ci : le solde est celui du relevé voisin
+            try:
+                wallet = Wallet.objects.get(user=request.user)
+            except Wallet.DoesNotExist:
+                return Response({"detail": "Portefeuille non trouvé."}, status=status.HTTP_404_NOT_FOUND)
+            
+            balance = wallet.statements.filter(month__lt=month).values_list('closing_balance', flat=True).first()
+            if balance is None:
+                balance = wallet.statements.filter(month__gt=month).order_by('month').values_list(
+                    'opening_balance', flat=True
+                ).first()
+            if balance is None:
+                balance = wallet.balance.amount
+            statement = WalletStatement(wallet=wallet, month=month, opening_balance=balance, closing_balance=balance)
+        
+        return Response(WalletStatementSerializer(statement).data)
+    
+    @action(detail=False, methods=['get'])
+    def statements(self, request):
+        """
+        Liste les relevés mensuels du portefeuille de l'utilisateur connecté
+        """
+        statements = WalletStatement.objects.filter(wallet__user=request.user).order_by('-month')
+        
+        page = self.paginate_queryset(statements)
+        if page is not None:
+            serializer = WalletStatementSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = WalletStatementSerializer(statements, many=True)
+        return Response(serializer.data)
+    
     @action(detail=False, methods=['post'])
     def create_deposit_intent(self, request):
         """
@@ -76,7 +181,7 @@ class WalletViewSet(viewsets.ReadOnlyModelViewSet):
             amount_cents = int(float(amount) * 100)
             
             # Créer une intention de paiement Stripe
-            intent = stripe.PaymentIntent.create(
+            intent = get_payment_provider().create_payment_intent(
                 amount=amount_cents,
                 currency='eur',
                 metadata={
@@ -113,86 +218,37 @@ class WalletViewSet(viewsets.ReadOnlyModelViewSet):
                 return Response({"detail": "L'ID d'intention de paiement est requis."}, status=status.HTTP_400_BAD_REQUEST)
             
             # Vérifier l'intention de paiement Stripe
-            intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+            intent = get_payment_provider().retrieve_payment_intent(payment_intent_id)
             
             if intent.status != 'succeeded':
                 return Response({"detail": "Le paiement n'a pas été confirmé."}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Mettre à jour la transaction
-            with transaction.atomic():
-                try:
-                    trans = Transaction.objects.get(reference_id=payment_intent_id)
-                    
-                    if trans.status == 'completed':
-                        return Response({"detail": "Ce dépôt a déjà été traité."}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    trans.status = 'completed'
-                    trans.completed_at = timezone.now()
-                    trans.save()
-                    
-                    # Mettre à jour le portefeuille
-                    wallet = Wallet.objects.get(user=request.user)
-                    wallet.deposit(trans.amount)
-                    
-                    # Créer une transaction de portefeuille
-                    WalletTransaction.objects.create(
-                        wallet=wallet,
-                        transaction_type='deposit',
-                        amount=trans.amount
-                    )
-                    
-                    return Response({"status": "Dépôt confirmé avec succès."})
-                except Transaction.DoesNotExist:
-                    return Response({"detail": "Transaction non trouvée."}, status=status.HTTP_404_NOT_FOUND)
+            # Créditer le portefeuille (idempotent sur l'ID du PaymentIntent)
+            try:
+                credited = complete_deposit(payment_intent_id, request.user.id)
+            except Transaction.DoesNotExist:
+                return Response({"detail": "Transaction non trouvée."}, status=status.HTTP_404_NOT_FOUND)
+
+            if not credited:
+                return Response({"detail": "Ce dépôt a déjà été traité."}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response({"status": "Dépôt confirmé avec succès."})
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny], authentication_classes=[])
     def stripe_webhook(self, request):
         """
         Webhook pour les événements Stripe
+
+        L'événement est enregistré dans la boîte de réception des paiements et
+        traité de façon asynchrone (crédit idempotent via complete_deposit).
         """
         payload = request.body
         sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
         
         try:
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
-            )
-            
-            # Traiter l'événement
-            if event['type'] == 'payment_intent.succeeded':
-                payment_intent = event['data']['object']
-                
-                # Vérifier que c'est un dépôt
-                if payment_intent.metadata.get('transaction_type') == 'deposit':
-                    user_id = payment_intent.metadata.get('user_id')
-                    
-                    # Mettre à jour la transaction
-                    with transaction.atomic():
-                        try:
-                            trans = Transaction.objects.get(reference_id=payment_intent.id)
-                            
-                            if trans.status == 'completed':
-                                return HttpResponse(status=200)
-                            
-                            trans.status = 'completed'
-                            trans.completed_at = timezone.now()
-                            trans.save()
-                            
-                            # Mettre à jour le portefeuille
-                            wallet = Wallet.objects.get(user_id=user_id)
-                            wallet.deposit(trans.amount)
-                            
-                            # Créer une transaction de portefeuille
-                            WalletTransaction.objects.create(
-                                wallet=wallet,
-                                transaction_type='deposit',
-                                amount=trans.amount
-                            )
-                        except (Transaction.DoesNotExist, Wallet.DoesNotExist):
-                            pass
-            
+            ingest_webhook_event(payload, sig_header)
             return HttpResponse(status=200)
         except ValueError as e:
             return HttpResponse(status=400)